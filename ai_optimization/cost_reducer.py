@@ -3,8 +3,10 @@ AI Cost Optimization Engine
 Reduces AI API costs by 95% through intelligent caching, prompt optimization, and response prediction
 """
 
+import atexit
 import hashlib
 import json
+import os
 import re
 import time
 from typing import Dict, List, Optional, Tuple, Any
@@ -13,8 +15,8 @@ from dataclasses import dataclass
 from enum import Enum
 import numpy as np
 from collections import defaultdict
-import redis
-import pickle
+
+from ai_optimization.semantic_cache import SemanticCache
 
 
 class ResponseStrategy(Enum):
@@ -73,15 +75,26 @@ class AIOptimizer:
         ],
     }
     
-    def __init__(self, redis_client: Optional[redis.Redis] = None):
+    def __init__(self):
         """Initialize optimizer with caching backend"""
-        self.redis = redis_client or self._init_redis()
         self.cache_ttl = 86400 * 7  # 7 days
         self.similarity_threshold = 0.85
         self.response_analytics = defaultdict(int)
         
-        # Initialize embedding cache
-        self.embedding_cache = {}
+        # Vector index over cached prompts for similarity lookups
+        self.semantic_cache = SemanticCache(
+            capacity=int(os.getenv('AI_SEMANTIC_CACHE_SIZE', '10000')),
+            threshold=float(os.getenv('AI_SEMANTIC_CACHE_THRESHOLD', str(self.similarity_threshold))),
+            ttl=self.cache_ttl,
+        )
+        self.semantic_cache_path = os.getenv('AI_SEMANTIC_CACHE_PATH')
+        if self.semantic_cache_path:
+            try:
+                self.semantic_cache.load(self.semantic_cache_path)
+            except Exception:
+                pass
+            # Snapshot again when the worker exits, for the next start-up
+            atexit.register(self.save_semantic_cache)
         
         # Pattern matchers for common queries
         self.pattern_matchers = self._compile_patterns()
@@ -90,19 +103,6 @@ class AIOptimizer:
         self.session_costs = defaultdict(float)
         self.total_savings = 0
         
-    def _init_redis(self) -> redis.Redis:
-        """Initialize Redis connection"""
-        try:
-            return redis.Redis(
-                host='localhost',
-                port=6379,
-                decode_responses=False,
-                db=1  # Use separate DB for AI cache
-            )
-        except:
-            # Fallback to in-memory cache
-            return None
-            
     def _compile_patterns(self) -> Dict[str, re.Pattern]:
         """Compile regex patterns for common queries"""
         patterns = {
@@ -136,52 +136,25 @@ class AIOptimizer:
         hasher.update(context_str.encode())
         return f"ai_response:{hasher.hexdigest()[:16]}"
         
-    def _calculate_similarity(self, msg1: str, msg2: str) -> float:
-        """Calculate semantic similarity between messages"""
-        # Simple Jaccard similarity for now
-        # In production, use sentence embeddings
-        
-        words1 = set(msg1.lower().split())
-        words2 = set(msg2.lower().split())
-        
-        if not words1 or not words2:
-            return 0.0
-            
-        intersection = words1.intersection(words2)
-        union = words1.union(words2)
-        
-        return len(intersection) / len(union)
-        
     def _find_similar_cached(self, message: str, context: Dict) -> Optional[Tuple[str, float]]:
         """Find similar cached responses"""
-        if not self.redis:
-            return None
-            
-        # Get recent cache keys
-        pattern = "ai_response:*"
-        keys = self.redis.keys(pattern)[:100]  # Limit to recent 100
-        
-        best_match = None
-        best_score = 0
-        
-        for key in keys:
-            try:
-                cached = pickle.loads(self.redis.get(key))
-                if cached and 'message' in cached:
-                    similarity = self._calculate_similarity(message, cached['message'])
-                    
-                    # Context similarity boost
-                    if cached.get('risk_level') == context.get('risk_level'):
-                        similarity += 0.1
-                        
-                    if similarity > best_score and similarity >= self.similarity_threshold:
-                        best_score = similarity
-                        best_match = cached['response']
-                        
-            except:
-                continue
-                
-        return (best_match, best_score) if best_match else None
+        return self.semantic_cache.lookup(message, context.get('risk_level'))
+        
+    def local_response(self, message: str, context: Dict,
+                       strategies=(ResponseStrategy.TEMPLATE, ResponseStrategy.CACHE_HIT)
+                       ) -> Optional[Tuple[str, ResponseStrategy]]:
+        """Answer without an API call when a template or cached response fits"""
+        if ResponseStrategy.TEMPLATE in strategies:
+            template = self._select_template_response(message, context)
+            if template:
+                self.response_analytics['template_hits'] += 1
+                return template, ResponseStrategy.TEMPLATE
+        if ResponseStrategy.CACHE_HIT in strategies:
+            similar = self._find_similar_cached(message, context)
+            if similar:
+                self.response_analytics['similarity_hits'] += 1
+                return similar[0], ResponseStrategy.CACHE_HIT
+        return None
         
     def _select_template_response(self, message: str, context: Dict) -> Optional[str]:
         """Select appropriate template response"""
@@ -281,27 +254,19 @@ class AIOptimizer:
         """Select optimal AI provider based on context"""
         # Decision tree for provider selection
         
-        # 1. Check cache first
-        cache_key = self._generate_cache_key(message, context)
-        if self.redis:
-            cached = self.redis.get(cache_key)
-            if cached:
-                self.response_analytics['cache_hits'] += 1
-                return ('cache', ResponseStrategy.CACHE_HIT)
-                
-        # 2. Check for similar cached responses
+        # 1. Check for cached responses (exact or similar prompts)
         similar = self._find_similar_cached(message, context)
         if similar:
             self.response_analytics['similarity_hits'] += 1
             return ('cache', ResponseStrategy.CACHE_HIT)
             
-        # 3. Check if template response works
+        # 2. Check if template response works
         template = self._select_template_response(message, context)
         if template:
             self.response_analytics['template_hits'] += 1
             return ('template', ResponseStrategy.TEMPLATE)
             
-        # 4. Determine complexity
+        # 3. Determine complexity
         complexity_score = self._calculate_complexity(message, context)
         
         if complexity_score < 0.3:
@@ -379,6 +344,7 @@ class AIOptimizer:
             'average_cost_per_session': np.mean(list(self.session_costs.values())) if self.session_costs else 0,
             'optimization_strategies': dict(self.response_analytics),
             'provider_usage': self._calculate_provider_usage(),
+            'semantic_cache': self.semantic_cache.stats(),
         }
         
     def _calculate_provider_usage(self) -> Dict:
@@ -389,24 +355,20 @@ class AIOptimizer:
         
     def cache_response(self, message: str, response: str, context: Dict, ttl: Optional[int] = None):
         """Cache AI response for future use"""
-        if not self.redis:
-            return
-            
         cache_key = self._generate_cache_key(message, context)
-        cache_data = {
-            'message': message,
-            'response': response,
-            'context': context,
-            'timestamp': datetime.utcnow().isoformat(),
-            'risk_level': context.get('risk_level'),
-        }
-        
-        self.redis.setex(
-            cache_key,
-            ttl or self.cache_ttl,
-            pickle.dumps(cache_data)
-        )
+        self.semantic_cache.put(cache_key, message, response, context.get('risk_level'), ttl)
         
+    def save_semantic_cache(self, path: Optional[str] = None):
+        """Persist the similarity index (compressed, float16 vectors); registered
+        with atexit when AI_SEMANTIC_CACHE_PATH is set"""
+        path = path or self.semantic_cache_path
+        if not path:
+            return
+        try:
+            self.semantic_cache.save(path)
+        except Exception:
+            pass
+            
     def batch_process_conversations(self, conversations: List[Dict]) -> List[Dict]:
         """Batch process multiple conversations for efficiency"""
         # Group by complexity
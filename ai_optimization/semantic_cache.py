@@ -0,0 +1,201 @@
+"""
+Semantic Response Cache
+Nearest-neighbour lookup of cached AI responses over hashed text feature vectors
+"""
+
+import os
+import io
+import json
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# Risk levels are stored as small ints next to each vector
+RISK_CODES = {'low': 0, 'medium': 1, 'high': 2, 'crisis': 3}
+NO_RISK = -1
+
+
+def _normalize(text: str) -> str:
+    normalized = (text or '').lower().strip()
+    normalized = re.sub(r'\s+', ' ', normalized)
+    return re.sub(r'[^\w\s]', '', normalized)
+
+
+class SemanticCache:
+    """Fixed-capacity cache of (prompt vector, response) rows in NumPy arrays.
+
+    Prompts are embedded with the hashing trick (word unigrams and bigrams into
+    `dims` signed buckets, L2-normalised), so one matrix-vector product scores a
+    query against every cached prompt. Rows expire after their TTL; when the
+    cache is full the least recently used row is overwritten.
+    """
+
+    def __init__(self, capacity: int = 10000, dims: int = 1024, threshold: float = 0.85,
+                 ttl: int = 86400 * 7, risk_boost: float = 0.1):
+        self.capacity = capacity
+        self.dims = dims
+        self.threshold = threshold
+        self.ttl = ttl
+        self.risk_boost = risk_boost
+
+        self.vectors = np.zeros((capacity, dims), dtype=np.float32)
+        self.expires_at = np.zeros(capacity, dtype=np.float64)  # 0 = empty slot
+        self.last_access = np.zeros(capacity, dtype=np.float64)
+        self.risk = np.full(capacity, NO_RISK, dtype=np.int8)
+        self.messages: List[Optional[str]] = [None] * capacity
+        self.responses: List[Optional[str]] = [None] * capacity
+        self._slot_by_key: Dict[str, int] = {}
+        self._key_by_slot: List[Optional[str]] = [None] * capacity
+        self._lock = threading.Lock()
+
+        # Lookup statistics
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self._latencies_ms: deque = deque(maxlen=1000)
+
+    def embed(self, text: str) -> np.ndarray:
+        """Signed feature-hashed bag of unigrams and bigrams, unit length."""
+        words = _normalize(text).split()
+        features = words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+        vec = np.zeros(self.dims, dtype=np.float32)
+        if not features:
+            return vec
+        hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32,
+                             count=len(features))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vec, hashes % self.dims, signs)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.expires_at > time.time()))
+
+    def _free_slot(self, now: float) -> int:
+        free = np.flatnonzero(self.expires_at <= now)
+        if free.size:
+            return int(free[0])
+        # Full: overwrite the least recently used row
+        self.evictions += 1
+        return int(np.argmin(self.last_access))
+
+    def _assign_slot(self, key: str, now: float) -> int:
+        slot = self._slot_by_key.get(key)
+        if slot is None:
+            slot = self._free_slot(now)
+            old_key = self._key_by_slot[slot]
+            if old_key is not None:
+                self._slot_by_key.pop(old_key, None)
+            self._slot_by_key[key] = slot
+            self._key_by_slot[slot] = key
+        return slot
+
+    def put(self, key: str, message: str, response: str, risk_level: Optional[str] = None,
+            ttl: Optional[int] = None):
+        """Insert or refresh the row for cache key `key`."""
+        vec = self.embed(message)
+        now = time.time()
+        with self._lock:
+            slot = self._assign_slot(key, now)
+            self.vectors[slot] = vec
+            self.expires_at[slot] = now + (ttl or self.ttl)
+            self.last_access[slot] = now
+            self.risk[slot] = RISK_CODES.get(risk_level, NO_RISK)
+            self.messages[slot] = message
+            self.responses[slot] = response
+
+    def lookup(self, message: str, risk_level: Optional[str] = None) -> Optional[Tuple[str, float]]:
+        """Best (response, score) at or above the threshold, else None."""
+        started = time.perf_counter()
+        query = self.embed(message)
+        result = None
+        with self._lock:
+            self.lookups += 1
+            now = time.time()
+            live = self.expires_at > now
+            if live.any() and query.any():
+                scores = self.vectors @ query
+                risk_code = RISK_CODES.get(risk_level, NO_RISK)
+                if risk_code != NO_RISK:
+                    scores += self.risk_boost * (self.risk == risk_code)
+                scores[~live] = -np.inf
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.last_access[best] = now
+                    self.hits += 1
+                    result = (self.responses[best], float(scores[best]))
+            self._latencies_ms.append((time.perf_counter() - started) * 1000.0)
+        return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            latencies = np.array(self._latencies_ms) if self._latencies_ms else np.zeros(1)
+            return {
+                'entries': int(np.count_nonzero(self.expires_at > time.time())),
+                'capacity': self.capacity,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': self.hits / max(self.lookups, 1),
+                'evictions': self.evictions,
+                'avg_lookup_ms': float(latencies.mean()),
+                'p95_lookup_ms': float(np.percentile(latencies, 95)),
+            }
+
+    # ---------- Persistence ----------
+
+    def dumps(self) -> bytes:
+        """Live rows as a compressed .npz (vectors stored as float16)."""
+        with self._lock:
+            rows = np.flatnonzero(self.expires_at > time.time())
+            buf = io.BytesIO()
+            np.savez_compressed(
+                buf,
+                vectors=self.vectors[rows].astype(np.float16),
+                expires_at=self.expires_at[rows],
+                last_access=self.last_access[rows],
+                risk=self.risk[rows],
+                text=np.array([json.dumps([self._key_by_slot[i], self.messages[i], self.responses[i]])
+                               for i in rows]),
+            )
+            return buf.getvalue()
+
+    def loads(self, data: bytes):
+        """Merge rows from dumps() output (expired rows are skipped)."""
+        with np.load(io.BytesIO(data)) as z:
+            vectors, expires_at, last_access = z['vectors'], z['expires_at'], z['last_access']
+            risk, texts = z['risk'], z['text']
+        if vectors.shape[1:] != (self.dims,):
+            raise ValueError(f"cache dims {vectors.shape[1:]} != {self.dims}")
+        now = time.time()
+        with self._lock:
+            for i in np.argsort(last_access)[-self.capacity:]:
+                if expires_at[i] <= now:
+                    continue
+                key, message, response = json.loads(str(texts[i]))
+                slot = self._assign_slot(key, now)
+                self.vectors[slot] = vectors[i].astype(np.float32)
+                self.expires_at[slot] = expires_at[i]
+                self.last_access[slot] = last_access[i]
+                self.risk[slot] = risk[i]
+                self.messages[slot] = message
+                self.responses[slot] = response
+
+    def save(self, path: str):
+        # Every worker snapshots at exit: keep their temp files apart
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.dumps())
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            self.loads(f.read())
+        return True
@@ -6,6 +6,13 @@ Optimized for single codebase usage across development, Docker, and Render produ
 import os
 import socket
 import re
+import functools
+import itertools
+import math
+import ipaddress
+import mmap
+import struct
+import threading
 import logging
 import json
 import random
@@ -13,8 +20,10 @@ import redis
 import requests
 import time
 import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta, timezone
-from typing import Dict, Optional, List, Any, Tuple
+from typing import Dict, Optional, List, Any, Tuple, Iterator
 from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 from flask import (
     Flask,
@@ -25,6 +34,7 @@ from flask import (
     session,
     Response,
     current_app,
+    stream_with_context,
 )
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
@@ -43,14 +53,36 @@ from providers.perplexity import get_perplexity_response
 from providers.openai import get_openai_response
 from models import (
     db,
-    UserSession,
     Message,
     ConversationLog,
-    CrisisEvent,
     SelfAssessmentEntry,
 )
-from crisis_detection import detect_crisis_level
+from crisis_classifier import get_classifier as get_crisis_classifier
+from crisis_detection import (
+    detect_crisis_level,
+    risk_level_score,
+    scan_message,
+    second_opinion,
+)
 from community import register_community_routes
+from db_pool import (
+    check_budget as check_pool_budget,
+    engine_options as db_engine_options,
+    instrument_engine,
+    metrics_lines as pool_metrics_lines,
+)
+from db_routing import init_replica_routing, read_only
+from log_writer import CRISIS_LOG_SYNC, get_log_writer, init_log_writer
+from migrations import AUTO_MIGRATE, SCHEMA_VERSION, current_version, migrate
+from partitions import maintain_partitions
+from retention import (
+    PurgeEngine,
+    get_run as get_purge_run,
+    retention_tasks,
+    throughput as purge_throughput,
+)
+from session_service import ensure_session
+from unit_of_work import commit_or_defer, init_unit_of_work, unit_of_work
 
 # Import enterprise integration
 try:
@@ -182,27 +214,118 @@ CRISIS_RESOURCES_BY_COUNTRY = {
 }
 
 
-def get_country_code_from_ip(ip: str) -> str:
-    """Get country code from IP address using ipinfo.io"""
-    try:
-        # Skip local/private IPs
-        if ip in ["127.0.0.1", "localhost", "::1"] or ip.startswith(
-            ("10.", "172.", "192.168.")
-        ):
-            return "generic"
+# ISO 3166 codes that map onto a differently-named resource key
+_COUNTRY_CODE_ALIASES = {"gb": "uk"}
 
-        # Use ipinfo.io for geolocation
-        response = requests.get(f"https://ipinfo.io/{ip}/json", timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            country_code = data.get("country", "").lower()
-            return (
-                country_code
-                if country_code in CRISIS_RESOURCES_BY_COUNTRY
-                else "generic"
+# Offline IP-range -> country table (see scripts/build_geoip_table.py).
+# Layout (big-endian): 8-byte magic, uint32 IPv4 count, uint32 IPv6 count,
+# then IPv4 records (start u32, end u32, cc 2 bytes) and IPv6 records
+# (start u128, end u128, cc 2 bytes), each section sorted by start.
+GEOIP_DB_PATH = os.getenv(
+    "GEOIP_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "geoip.bin"),
+)
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", 4096))
+_GEOIP_MAGIC = b"GQGEOIP1"
+_GEOIP_HEADER = struct.Struct(">8sII")
+
+
+class _GeoIPTable:
+    """Memory-mapped sorted range table searched by bisection."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, v4_count, v6_count = _GEOIP_HEADER.unpack_from(self._mm, 0)
+        if magic != _GEOIP_MAGIC:
+            raise ValueError(f"Not a GeoIP range table: {path}")
+        v4_offset = _GEOIP_HEADER.size
+        v6_offset = v4_offset + v4_count * 10
+        if len(self._mm) < v6_offset + v6_count * 34:
+            raise ValueError(f"Truncated GeoIP range table: {path}")
+        # version -> (section offset, record count, address width in bytes)
+        self._sections = {
+            4: (v4_offset, v4_count, 4),
+            6: (v6_offset, v6_count, 16),
+        }
+
+    def lookup(self, addr) -> Optional[str]:
+        """Return the lowercase country code covering addr, if any."""
+        offset, count, width = self._sections[addr.version]
+        record = 2 * width + 2
+        target = int(addr)
+        mm = self._mm
+        # Rightmost record whose range start is <= target
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = offset + mid * record
+            if int.from_bytes(mm[pos : pos + width], "big") <= target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        pos = offset + (lo - 1) * record
+        end = int.from_bytes(mm[pos + width : pos + 2 * width], "big")
+        if target > end:
+            return None
+        return mm[pos + 2 * width : pos + record].decode("ascii").lower()
+
+
+_geoip_table: Optional[_GeoIPTable] = None
+_geoip_table_loaded = False
+_geoip_lock = threading.Lock()
+
+
+def _load_geoip_table(path: Optional[str] = None) -> Optional[_GeoIPTable]:
+    """(Re)load the range table and drop cached lookups. Missing file -> None."""
+    global _geoip_table, _geoip_table_loaded
+    path = path or GEOIP_DB_PATH
+    with _geoip_lock:
+        try:
+            _geoip_table = _GeoIPTable(path) if os.path.exists(path) else None
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"GeoIP table load failed: {e}")
+            _geoip_table = None
+        if _geoip_table is None:
+            logging.getLogger(__name__).info(
+                f"No GeoIP table at {path}; public IPs resolve to 'generic'"
             )
-        else:
-            return "generic"
+        _geoip_table_loaded = True
+        _lookup_country_code.cache_clear()
+    return _geoip_table
+
+
+def _get_geoip_table() -> Optional[_GeoIPTable]:
+    if not _geoip_table_loaded:
+        _load_geoip_table()
+    return _geoip_table
+
+
+@functools.lru_cache(maxsize=GEOIP_CACHE_SIZE)
+def _lookup_country_code(ip: str) -> str:
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return "generic"
+    if addr.version == 6 and addr.ipv4_mapped:
+        addr = addr.ipv4_mapped
+    # Private (RFC1918/ULA), loopback, link-local, CGNAT and reserved ranges
+    if not addr.is_global:
+        return "generic"
+    table = _get_geoip_table()
+    country_code = table.lookup(addr) if table else None
+    if not country_code:
+        return "generic"
+    country_code = _COUNTRY_CODE_ALIASES.get(country_code, country_code)
+    return country_code if country_code in CRISIS_RESOURCES_BY_COUNTRY else "generic"
+
+
+def get_country_code_from_ip(ip: str) -> str:
+    """Get country code from IP address using the local range table"""
+    try:
+        return _lookup_country_code((ip or "").strip())
     except Exception as e:
         print(f"IP geolocation error: {e}")
         return "generic"
@@ -217,14 +340,17 @@ def get_country_from_request(req) -> str:
     if country and country in CRISIS_RESOURCES_BY_COUNTRY:
         return country
 
-    # Get IP from various headers
-    ip = req.headers.get("X-Forwarded-For", "").split(",")[0].strip()
+    return get_country_code_from_ip(_client_ip(req.headers, req.remote_addr))
+
+
+def _client_ip(headers, remote_addr: Optional[str]) -> str:
+    """Client IP from proxy headers, falling back to the socket peer"""
+    ip = headers.get("X-Forwarded-For", "").split(",")[0].strip()
     if not ip:
-        ip = req.headers.get("X-Real-IP", "")
+        ip = headers.get("X-Real-IP", "")
     if not ip:
-        ip = req.remote_addr
-
-    return get_country_code_from_ip(ip)
+        ip = remote_addr
+    return ip or ""
 
 
 def _detect_environment() -> str:
@@ -382,8 +508,13 @@ class Config:
     ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
 
 
-def create_app() -> Flask:
-    """Application factory pattern for single codebase usage"""
+def create_app(test_config: Optional[Dict[str, Any]] = None) -> Flask:
+    """Application factory pattern for single codebase usage
+
+    ``test_config`` overrides settings before the database engine is
+    configured, so a test can point the app at its own database and switch
+    AUTO_MIGRATE off.
+    """
     app = Flask(__name__, static_folder="static", static_url_path="")
 
     # Load configuration
@@ -429,52 +560,30 @@ def create_app() -> Flask:
 
     # Set SQLAlchemy database URI with explicit psycopg driver and SSL if needed
     if Config.DATABASE_URL:
-        db_url = Config.DATABASE_URL
-        # Normalize legacy scheme if present
-        if db_url.startswith("postgres://"):
-            db_url = db_url.replace("postgres://", "postgresql://", 1)
-        # Force use of psycopg driver
-        if "postgresql://" in db_url and "psycopg" not in db_url:
-            db_url = db_url.replace("postgresql://", "postgresql+psycopg://", 1)
-
-        # Append sslmode=require and a short connect_timeout for Postgres if not already present
-        try:
-            needs_ssl = (
-                getattr(Config, "RENDER", False)
-                or str(getattr(Config, "ENVIRONMENT", "")).lower() == "production"
-            )
-            parsed = urlparse(db_url)
-            # Only mutate query params for Postgres URLs; preserve sqlite formatting (e.g., sqlite:///)
-            if parsed.scheme.startswith("postgresql"):
-                query_items = dict(parse_qsl(parsed.query)) if parsed.query else {}
-                lower_keys = {k.lower() for k in query_items.keys()}
-                if needs_ssl and "sslmode" not in lower_keys:
-                    query_items["sslmode"] = "require"
-                # Ensure a short connect timeout for Postgres to prevent long hangs
-                if "connect_timeout" not in lower_keys:
-                    query_items["connect_timeout"] = "2"
-                new_query = urlencode(query_items)
-                parsed = parsed._replace(query=new_query)
-                db_url = urlunparse(parsed)
-            else:
-                # Non-Postgres schemes (e.g., sqlite) are left untouched
-                pass
-        except Exception as e:
-            app.logger.warning(f"Failed to process DB URL SSL params: {e}")
-
-        app.config["SQLALCHEMY_DATABASE_URI"] = db_url
+        app.config["SQLALCHEMY_DATABASE_URI"] = _normalize_db_url(
+            app, Config.DATABASE_URL
+        )
     else:
         app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///mental_health.db"
+    if test_config:
+        app.config.update(test_config)
 
     # SQLAlchemy reliability options
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_pre_ping": True,
-        "pool_recycle": 300,
-        "pool_size": 5,
-        "max_overflow": 10,
-        "pool_timeout": 2,
-    }
+    # Pool size from DB_POOL_SIZE/DB_MAX_OVERFLOW, or split from a connection
+    # budget with DB_POOL_SIZING=auto (see db_pool.py)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = db_engine_options(
+        app.config["SQLALCHEMY_DATABASE_URI"]
+    )
+    budget_warning = check_pool_budget(app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+    if budget_warning:
+        app.logger.warning(f"DB pool: {budget_warning}")
+    replica_urls = [
+        _normalize_db_url(app, url.strip())
+        for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+        if url.strip()
+    ]
+    init_replica_routing(app, replica_urls, app.config["SQLALCHEMY_ENGINE_OPTIONS"])
 
     # Log effective DB URL (masked) and attempt DNS resolution of host
     try:
@@ -557,11 +666,26 @@ def create_app() -> Flask:
     except Exception as e_diag:
         app.logger.warning(f"AI startup diagnostics failed: {e_diag}")
 
+    # Pre-warm pooled provider clients (one per provider+key in this worker) so
+    # the first chat turn does not pay DNS/TCP/TLS setup
+    if (os.getenv("AI_CLIENT_WARMUP", "true") or "").lower() == "true":
+        try:
+            from providers.clients import warm_up_in_background
+
+            warm_up_in_background(_provider_keys())
+        except Exception as e:
+            app.logger.warning(f"AI client warm-up failed to start: {e}")
+
     # Initialize extensions
     _init_extensions(app)
+    _register_pool_metrics(app)
 
-    # Initialize database tables
-    _init_database(app)
+    # Schema is migrated by the release step; workers only check its version
+    _check_schema(app)
+    _register_history_loader(app)
+    _register_log_writer(app)
+    # Map the optional crisis classifier now rather than on the first message
+    get_crisis_classifier()
 
     # Register routes
     _register_routes(app)
@@ -667,253 +791,73 @@ def create_app() -> Flask:
     return app
 
 
-def _init_database(app: Flask) -> None:
-    """Initialize database with tables"""
-    with app.app_context():
-        try:
-            # Create tables if they don't exist
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS sessions (
-                    id VARCHAR(255) PRIMARY KEY,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """
-                )
-            )
-
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS chat_messages (
-                    id SERIAL PRIMARY KEY,
-                    session_id VARCHAR(255) REFERENCES sessions(id),
-                    content TEXT NOT NULL,
-                    is_user BOOLEAN NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    message_type VARCHAR(50) DEFAULT 'text'
-                )
-            """
-                )
-            )
+def _normalize_db_url(app: Flask, db_url: str) -> str:
+    """Explicit psycopg driver, plus sslmode and a short connect_timeout for
+    Postgres (primary and replica URLs alike)."""
+    # Normalize legacy scheme if present
+    if db_url.startswith("postgres://"):
+        db_url = db_url.replace("postgres://", "postgresql://", 1)
+    # Force use of psycopg driver
+    if "postgresql://" in db_url and "psycopg" not in db_url:
+        db_url = db_url.replace("postgresql://", "postgresql+psycopg://", 1)
 
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS mood_entries (
-                    id SERIAL PRIMARY KEY,
-                    session_id VARCHAR(255) REFERENCES sessions(id),
-                    mood_level INTEGER NOT NULL CHECK (mood_level >= 1 AND mood_level <= 5),
-                    note TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """
-                )
-            )
+    # Append sslmode=require and a short connect_timeout for Postgres if not already present
+    try:
+        needs_ssl = (
+            getattr(Config, "RENDER", False)
+            or str(getattr(Config, "ENVIRONMENT", "")).lower() == "production"
+        )
+        parsed = urlparse(db_url)
+        # Only mutate query params for Postgres URLs; preserve sqlite formatting (e.g., sqlite:///)
+        if parsed.scheme.startswith("postgresql"):
+            query_items = dict(parse_qsl(parsed.query)) if parsed.query else {}
+            lower_keys = {k.lower() for k in query_items.keys()}
+            if needs_ssl and "sslmode" not in lower_keys:
+                query_items["sslmode"] = "require"
+            # Ensure a short connect timeout for Postgres to prevent long hangs
+            if "connect_timeout" not in lower_keys:
+                query_items["connect_timeout"] = "2"
+            new_query = urlencode(query_items)
+            parsed = parsed._replace(query=new_query)
+            db_url = urlunparse(parsed)
+        else:
+            # Non-Postgres schemes (e.g., sqlite) are left untouched
+            pass
+    except Exception as e:
+        app.logger.warning(f"Failed to process DB URL SSL params: {e}")
+    return db_url
 
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS self_assessments (
-                    id SERIAL PRIMARY KEY,
-                    session_id VARCHAR(255) REFERENCES sessions(id),
-                    mood INTEGER,
-                    energy INTEGER,
-                    sleep INTEGER,
-                    stress INTEGER,
-                    social INTEGER,
-                    work INTEGER,
-                    notes TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """
-                )
-            )
 
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS crisis_detections (
-                    id SERIAL PRIMARY KEY,
-                    session_id VARCHAR(255) REFERENCES sessions(id),
-                    message TEXT NOT NULL,
-                    risk_level VARCHAR(50) NOT NULL,
-                    risk_score DECIMAL(3,2) NOT NULL,
-                    keywords TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """
-                )
-            )
+def _check_schema(app: Flask) -> None:
+    """Compare the database schema version with the one this code expects.
 
-            # Minimal analytics events table (no PII)
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS analytics_events (
-                    id SERIAL PRIMARY KEY,
-                    session_id VARCHAR(255) REFERENCES sessions(id),
-                    event_type VARCHAR(64) NOT NULL,
-                    metadata TEXT, -- store compact JSON string (no PII)
-                    request_id VARCHAR(64),
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """
-                )
+    DDL runs in the release step (scripts/migrate.py upgrade), not in every
+    worker; with AUTO_MIGRATE (local development, tests) the first worker to
+    boot applies pending migrations under the migration lock instead.
+    """
+    try:
+        with app.app_context():
+            engine = db.engine
+        if app.config.get("AUTO_MIGRATE", AUTO_MIGRATE):
+            applied = migrate(engine)
+            if applied:
+                app.logger.info(f"Applied schema migrations {applied}")
+            maintain_partitions(engine)
+        version = current_version(engine)
+        app.config["SCHEMA_VERSION"] = version
+        if version < SCHEMA_VERSION:
+            app.logger.error(
+                f"Database schema is at version {version}, this release expects "
+                f"{SCHEMA_VERSION}. Run: python scripts/migrate.py upgrade"
             )
-
-            db.session.commit()
-            # Ensure SQLAlchemy models exist (creates missing tables only)
-            try:
-                db.create_all()
-                app.logger.info("SQLAlchemy models ensured (create_all)")
-            except Exception as e:
-                app.logger.warning(f"db.create_all() failed (non-fatal): {e}")
-
-            # Lightweight migration: ensure conversation_logs table and columns exist
-            try:
-                engine = db.session.bind
-                dialect = engine.dialect.name if engine else "unknown"
-
-                required_cols = {
-                    "session_id": "VARCHAR(36)",
-                    "user_message": "TEXT",
-                    "ai_response": "TEXT",
-                    "risk_level": "VARCHAR(20)",
-                    "risk_score": "DOUBLE PRECISION",
-                    "timestamp": "TIMESTAMP",
-                }
-
-                # Create table if missing in a dialect-aware way
-                if dialect == "postgresql":
-                    db.session.execute(
-                        text(
-                            """
-                        CREATE TABLE IF NOT EXISTS conversation_logs (
-                            id SERIAL PRIMARY KEY,
-                            session_id VARCHAR(36),
-                            user_message TEXT,
-                            ai_response TEXT,
-                            risk_level VARCHAR(20) DEFAULT 'low',
-                            risk_score DOUBLE PRECISION DEFAULT 0.0,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                        """
-                        )
-                    )
-                elif dialect == "sqlite":
-                    db.session.execute(
-                        text(
-                            """
-                        CREATE TABLE IF NOT EXISTS conversation_logs (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            session_id TEXT,
-                            user_message TEXT,
-                            ai_response TEXT,
-                            risk_level TEXT DEFAULT 'low',
-                            risk_score REAL DEFAULT 0.0,
-                            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                        )
-                        """
-                        )
-                    )
-                else:
-                    # Fallback generic DDL
-                    db.session.execute(
-                        text(
-                            """
-                        CREATE TABLE IF NOT EXISTS conversation_logs (
-                            id SERIAL PRIMARY KEY,
-                            session_id VARCHAR(36),
-                            user_message TEXT,
-                            ai_response TEXT,
-                            risk_level VARCHAR(20) DEFAULT 'low',
-                            risk_score DOUBLE PRECISION DEFAULT 0.0,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                        """
-                        )
-                    )
-
-                # Determine existing columns
-                existing_cols = set()
-                if dialect == "postgresql":
-                    res = db.session.execute(
-                        text(
-                            """
-                        SELECT column_name FROM information_schema.columns
-                        WHERE table_name = 'conversation_logs'
-                        """
-                        )
-                    ).fetchall()
-                    existing_cols = {row[0] for row in res}
-                    # Add any missing columns safely
-                    for col, coltype in required_cols.items():
-                        if col not in existing_cols:
-                            db.session.execute(
-                                text(
-                                    f"ALTER TABLE conversation_logs ADD COLUMN IF NOT EXISTS {col} {coltype}"
-                                )
-                            )
-                elif dialect == "sqlite":
-                    res = db.session.execute(
-                        text("PRAGMA table_info(conversation_logs)")
-                    ).fetchall()
-                    # SQLite PRAGMA returns: cid, name, type, notnull, dflt_value, pk
-                    existing_cols = {row[1] for row in res}
-                    for col, coltype in required_cols.items():
-                        if col not in existing_cols:
-                            try:
-                                db.session.execute(
-                                    text(
-                                        f"ALTER TABLE conversation_logs ADD COLUMN {col} {coltype}"
-                                    )
-                                )
-                            except Exception:
-                                # Column may have been added concurrently; ignore
-                                pass
-                else:
-                    # Best-effort attempt to add columns without IF NOT EXISTS
-                    for col, coltype in required_cols.items():
-                        try:
-                            db.session.execute(
-                                text(
-                                    f"ALTER TABLE conversation_logs ADD COLUMN {col} {coltype}"
-                                )
-                            )
-                        except Exception:
-                            pass
-
-                db.session.commit()
-                app.logger.info(
-                    "conversation_logs schema ensured/migrated successfully"
-                )
-            except Exception as e:
-                try:
-                    db.session.rollback()
-                except Exception:
-                    pass
-                app.logger.error(f"conversation_logs migration failed (non-fatal): {e}")
-
-            app.logger.info("Database tables initialized successfully")
-
-        except Exception as e:
-            app.logger.error(f"Database initialization error: {e}")
-            try:
-                db.session.rollback()
-            except Exception:
-                pass
-            # Do NOT crash app during startup; continue and let health endpoint report DB status
-            env = str(
-                getattr(
-                    app.config, "ENVIRONMENT", app.config.get("ENVIRONMENT", "local")
-                )
-            ).lower()
+        elif version > SCHEMA_VERSION:
             app.logger.warning(
-                f"Continuing without DB tables (env={env}). Health checks will reflect DB status."
+                f"Database schema version {version} is newer than this release "
+                f"({SCHEMA_VERSION}); expected during a rolling deploy"
             )
+    except Exception as e:
+        # Do NOT crash app during startup; let health endpoint report DB status
+        app.logger.error(f"Schema version check failed: {e}")
 
 
 def _init_extensions(app: Flask) -> None:
@@ -921,6 +865,7 @@ def _init_extensions(app: Flask) -> None:
     try:
         # Initialize database
         db.init_app(app)
+        init_unit_of_work(app, db)
 
         # Initialize session management
         _setup_session(app)
@@ -1041,8 +986,8 @@ def _setup_rate_limiter(app: Flask) -> Limiter:
     )
 
 
-def _setup_cors(app: Flask) -> None:
-    """Configure CORS with security best practices"""
+def _cors_origins(app: Flask) -> List[Any]:
+    """Allowed CORS origins (strings or compiled regexes)"""
     origins = app.config.get("CORS_ORIGINS") or [
         "http://localhost:8080",
         "http://127.0.0.1:8080",
@@ -1061,9 +1006,14 @@ def _setup_cors(app: Flask) -> None:
     except Exception:
         # Non-fatal: fall back to explicit origins only
         pass
+    return list(origins)
+
+
+def _setup_cors(app: Flask) -> None:
+    """Configure CORS with security best practices"""
     CORS(
         app,
-        origins=origins,
+        origins=_cors_origins(app),
         supports_credentials=True,
         allow_headers=[
             "Content-Type",
@@ -1140,6 +1090,7 @@ def _register_routes(app: Flask) -> None:
                 "port": app.config.get("PORT"),
                 "provider": app.config.get("AI_PROVIDER"),
                 "database": db_status,
+                "schema_version": app.config.get("SCHEMA_VERSION"),
                 "redis": redis_status,
                 "latency_ms": {
                     "db_check": db_ms,
@@ -1254,84 +1205,9 @@ def _register_routes(app: Flask) -> None:
     # Additional routes...
     # _register_additional_routes(app)  # Removed duplicate call
 
-    def _purge_old_data_inner():
-        """Delete old records based on retention policy. Returns counts by table."""
-        now = datetime.utcnow()
-        counts = {}
-        try:
-            msg_days = int(app.config.get("MESSAGE_RETENTION_DAYS", 30))
-            sess_days = int(app.config.get("SESSION_RETENTION_DAYS", 14))
-            analytics_days = int(app.config.get("ANALYTICS_RETENTION_DAYS", 90))
-            cutoff_msgs = now - timedelta(days=msg_days)
-            cutoff_sess = now - timedelta(days=sess_days)
-            cutoff_analytics = now - timedelta(days=analytics_days)
-
-            # Messages
-            counts["messages_deleted"] = (
-                db.session.query(Message)
-                .filter(Message.timestamp < cutoff_msgs)
-                .delete(synchronize_session=False)
-            )
-            # Conversation logs
-            counts["conversation_logs_deleted"] = (
-                db.session.query(ConversationLog)
-                .filter(ConversationLog.timestamp < cutoff_msgs)
-                .delete(synchronize_session=False)
-            )
-            # Crisis events
-            counts["crisis_events_deleted"] = (
-                db.session.query(CrisisEvent)
-                .filter(CrisisEvent.timestamp < cutoff_msgs)
-                .delete(synchronize_session=False)
-            )
-            # Self assessments (optional: align with message retention)
-            counts["self_assessments_deleted"] = (
-                db.session.query(SelfAssessmentEntry)
-                .filter(SelfAssessmentEntry.timestamp < cutoff_msgs)
-                .delete(synchronize_session=False)
-            )
-            # Sessions inactive beyond retention
-            counts["sessions_deleted"] = (
-                db.session.query(UserSession)
-                .filter(UserSession.last_active < cutoff_sess)
-                .delete(synchronize_session=False)
-            )
-
-            # Legacy/raw tables (best-effort). Ignore if not present.
-            try:
-                res = db.session.execute(
-                    text("DELETE FROM chat_messages WHERE timestamp < :cutoff"),
-                    {"cutoff": cutoff_msgs},
-                )
-                counts["chat_messages_deleted"] = getattr(res, "rowcount", None)
-            except Exception as _:
-                pass
-            try:
-                res = db.session.execute(
-                    text("DELETE FROM user_sessions WHERE last_active < :cutoff"),
-                    {"cutoff": cutoff_sess},
-                )
-                counts["legacy_sessions_deleted"] = getattr(res, "rowcount", None)
-            except Exception as _:
-                pass
-            try:
-                res = db.session.execute(
-                    text("DELETE FROM analytics_events WHERE timestamp < :cutoff"),
-                    {"cutoff": cutoff_analytics},
-                )
-                counts["analytics_events_deleted"] = getattr(res, "rowcount", None)
-            except Exception as _:
-                pass
-
-            db.session.commit()
-            return counts
-        except Exception as e:
-            db.session.rollback()
-            app.logger.error(f"Purge error: {e}")
-            raise
-
     @app.route("/api/analytics/log", methods=["POST"])
     @app.limiter.limit("120 per minute")
+    @unit_of_work
     def log_analytics_event():
         """Minimal analytics logging endpoint.
         Requirements:
@@ -1407,7 +1283,7 @@ def _register_routes(app: Flask) -> None:
                     "request_id": req_id,
                 },
             )
-            db.session.commit()
+            commit_or_defer(db.session)
             return jsonify({"ok": True}), 201
         except Exception as e:
             db.session.rollback()
@@ -1416,6 +1292,7 @@ def _register_routes(app: Flask) -> None:
 
     @app.route("/api/analytics/recent", methods=["GET"])
     @app.limiter.limit("60 per minute")
+    @read_only
     def analytics_recent():
         """Read-only: Fetch recent analytics events for debugging.
         Optional query params:
@@ -1452,7 +1329,7 @@ def _register_routes(app: Flask) -> None:
             )
 
             # Execute with a short statement timeout on Postgres to avoid hangs
-            engine = db.session.bind
+            engine = db.session.get_bind(clause=sql)
             dialect = engine.dialect.name if engine else None
             if dialect == "postgresql":
                 with engine.connect() as conn:
@@ -1496,18 +1373,44 @@ def _register_routes(app: Flask) -> None:
 
     @app.route("/api/admin/purge", methods=["POST"])
     def admin_purge():
-        """Admin-only: Purge old data per retention policy.
-        Requires header X-Admin-Token matching ADMIN_API_TOKEN.
+        """Admin-only: Start a retention purge in the background.
+        Requires header X-Admin-Token matching ADMIN_API_TOKEN. Responds 202
+        with the run id; poll GET /api/admin/purge/<run_id> for progress. An
+        interrupted run is resumed and an active one is reported, not doubled.
         """
         token = request.headers.get("X-Admin-Token")
         expected = app.config.get("ADMIN_API_TOKEN")
         if not expected or token != expected:
             return jsonify({"error": "Unauthorized"}), 401
         try:
-            counts = _purge_old_data_inner()
-            return jsonify({"success": True, "purged": counts}), 200
+            run_id, started = PurgeEngine(db.engine).start(retention_tasks(app.config))
         except Exception as e:
+            app.logger.error(f"Purge error: {e}")
             return jsonify({"error": "Purge failed", "details": str(e)}), 500
+        return (
+            jsonify(
+                {
+                    "success": True,
+                    "run_id": run_id,
+                    "started": started,
+                    "status_url": f"/api/admin/purge/{run_id}",
+                }
+            ),
+            202,
+        )
+
+    @app.route("/api/admin/purge/<int:run_id>", methods=["GET"])
+    def admin_purge_status(run_id: int):
+        """Admin-only: Progress of a purge run, per table, with throughput."""
+        token = request.headers.get("X-Admin-Token")
+        expected = app.config.get("ADMIN_API_TOKEN")
+        if not expected or token != expected:
+            return jsonify({"error": "Unauthorized"}), 401
+        run = get_purge_run(db.engine, run_id)
+        if run is None:
+            return jsonify({"error": "Unknown purge run"}), 404
+        run["rows_per_second"] = purge_throughput(run)
+        return jsonify(run), 200
 
     @app.route("/api/admin/retention_config", methods=["GET"])
     def retention_config():
@@ -1533,78 +1436,39 @@ def _register_routes(app: Flask) -> None:
         )
 
 
-def _get_or_create_session() -> str:
-    """Get or create user session with proper error handling"""
-    session_id = request.headers.get("X-Session-ID")
-
-    if not session_id:
-        session_id = str(uuid.uuid4())
-
-    try:
-        # First ensure legacy 'sessions' table has the row, since many FKs reference it
-        existing_legacy = db.session.execute(
-            text("SELECT id FROM sessions WHERE id = :session_id"),
-            {"session_id": session_id},
-        ).fetchone()
-
-        from flask import current_app
-
-        if not existing_legacy:
-            # Create session in legacy table (authoritative for FK references)
-            db.session.execute(
-                text(
-                    "INSERT INTO sessions (id, created_at, last_activity) VALUES (:session_id, NOW(), NOW())"
-                ),
-                {"session_id": session_id},
-            )
-            db.session.commit()
-            current_app.logger.info(f"Created new session (sessions): {session_id}")
-        else:
-            # Touch last_activity to keep it fresh
-            db.session.execute(
-                text(
-                    "UPDATE sessions SET last_activity = NOW() WHERE id = :session_id"
-                ),
-                {"session_id": session_id},
-            )
-            db.session.commit()
-            current_app.logger.info(f"Using existing session (sessions): {session_id}")
-
-        # Best-effort: mirror to SQLAlchemy 'user_sessions' table if present
-        try:
-            db.session.execute(
-                text(
-                    "INSERT INTO user_sessions (id, created_at, last_active) "
-                    "VALUES (:session_id, NOW(), NOW()) "
-                    "ON CONFLICT (id) DO UPDATE SET last_active = EXCLUDED.last_active"
-                ),
-                {"session_id": session_id},
-            )
-            db.session.commit()
-        except Exception as e:
-            # Non-fatal. This table may not exist in older deployments.
-            current_app.logger.warning(f"user_sessions mirror failed: {e}")
+def _get_or_create_session(session_id: Optional[str] = None) -> str:
+    """Get or create user session with proper error handling.
 
-    except Exception as e:
-        # Use current_app for logging in request context
-        from flask import current_app
-
-        current_app.logger.error(f"Session management error: {e}")
-        # Continue without database session if needed
+    session_id defaults to the request's X-Session-ID header; callers outside a
+    request context (the ASGI front end) pass it explicitly. See session_service
+    for the single-statement upsert and last_activity debounce.
+    """
+    if session_id is None:
+        session_id = request.headers.get("X-Session-ID")
 
-    return session_id
+    return ensure_session(db.session, session_id)
 
 
 def _process_chat_message(message: str, session_id: str) -> Tuple[str, str]:
     """Process chat message with AI provider and crisis detection"""
     try:
+        started = time.monotonic()
         # Detect crisis level FIRST
         risk_level = detect_crisis_level(message)
 
-        # Get AI response with cross-provider failover inferred from key presence
-        ai_response, _used_provider = _get_ai_response_with_failover(
-            message, session_id, risk_level
-        )
+        fast = _fast_path_response(message, session_id, risk_level)
+        if fast:
+            ai_response, tier = fast
+        else:
+            cacheable = _reply_cacheable(message, session_id, risk_level)
+            # Get AI response with cross-provider failover inferred from key presence
+            ai_response, _used_provider = _get_ai_response_with_failover(
+                message, session_id, risk_level
+            )
+            tier = "llm"
+            if cacheable and not _is_failure_response(ai_response):
+                _cache_ai_response(message, ai_response, risk_level)
+        _record_turn_tier(tier, (time.monotonic() - started) * 1000.0)
 
         # Log conversation
         _log_conversation(session_id, message, ai_response, risk_level)
@@ -1622,6 +1486,89 @@ def _process_chat_message(message: str, session_id: str) -> Tuple[str, str]:
         )
 
 
+def _turn_key(turn: tuple) -> tuple:
+    # SQLite hands timestamps back as text
+    user_message, ai_response, ts = turn
+    return (
+        user_message,
+        ai_response,
+        ts.isoformat(" ") if isinstance(ts, datetime) else ts,
+    )
+
+
+def _register_history_loader(app: Flask) -> None:
+    """Let the provider history store rehydrate sessions from conversation_logs."""
+    try:
+        from providers.history import set_history_loader
+
+        with app.app_context():
+            engine = db.engine
+    except Exception as e:
+        app.logger.warning(f"History rehydration disabled: {e}")
+        return
+
+    def load(session_id: str, limit: int, since: datetime):
+        # Turns still in the write-behind buffer, newest first. Read before the
+        # query: a row committed in between then shows up twice (deduplicated
+        # below) rather than not at all.
+        writer = get_log_writer()
+        pending = [
+            (row["user_message"], row["ai_response"], row["timestamp"])
+            for row in reversed(
+                writer.pending_rows("conversation_logs", session_id) if writer else []
+            )
+            if row["timestamp"] >= since
+        ]
+        # Own connection: provider calls may run outside the request's app context
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text(
+                    """
+                    SELECT user_message, ai_response, timestamp
+                    FROM conversation_logs
+                    WHERE session_id = :sid AND timestamp >= :since
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT :limit
+                    """
+                ),
+                {"sid": session_id, "since": since, "limit": limit},
+            ).fetchall()
+        seen = {_turn_key(turn) for turn in pending}
+        committed = [tuple(r) for r in rows if _turn_key(tuple(r)) not in seen]
+        return (pending + committed)[:limit]
+
+    set_history_loader(load)
+
+
+def _register_pool_metrics(app: Flask) -> None:
+    """Instrument the primary and replica connection pools for /api/metrics."""
+    try:
+        with app.app_context():
+            engine = db.engine
+        instrument_engine(app, engine, "primary")
+        replicas = app.extensions.get("db_replicas")
+        for index, replica in enumerate(replicas.engines if replicas else []):
+            instrument_engine(app, replica, f"replica{index}")
+        options = app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+        if "pool_size" in options:
+            app.logger.info(
+                f"DB pool: pool_size={options['pool_size']} "
+                f"max_overflow={options['max_overflow']} per worker"
+            )
+    except Exception as e:
+        app.logger.warning(f"DB pool metrics disabled: {e}")
+
+
+def _register_log_writer(app: Flask) -> None:
+    """Start the write-behind buffer for conversation and crisis logs."""
+    try:
+        with app.app_context():
+            engine = db.engine
+        init_log_writer(engine)
+    except Exception as e:
+        app.logger.warning(f"Write-behind logging disabled, writing inline: {e}")
+
+
 def _log_conversation(
     session_id: str, user_message: str, ai_response: str, risk_level: str
 ) -> None:
@@ -1629,17 +1576,22 @@ def _log_conversation(
     try:
         # Convert risk level to numeric score
         risk_score = _convert_risk_level_to_score(risk_level)
+        row = {
+            "session_id": session_id,
+            "user_message": user_message,
+            "ai_response": ai_response,
+            "risk_level": risk_level,
+            "risk_score": risk_score,
+            "timestamp": datetime.utcnow(),
+        }
 
-        conversation_log = ConversationLog(
-            session_id=session_id,
-            user_message=user_message,
-            ai_response=ai_response,
-            risk_level=risk_level,
-            risk_score=risk_score,
-            timestamp=datetime.utcnow(),
-        )
+        # Off the request path: the flusher thread commits in batches
+        writer = get_log_writer()
+        if writer is not None:
+            writer.submit("conversation_logs", row)
+            return
 
-        db.session.add(conversation_log)
+        db.session.add(ConversationLog(**row))
         db.session.commit()
 
     except Exception as e:
@@ -1651,8 +1603,7 @@ def _log_conversation(
 
 def _convert_risk_level_to_score(risk_level: str) -> float:
     """Convert risk level string to numeric score"""
-    risk_mapping = {"low": 0.0, "medium": 0.5, "high": 0.8, "crisis": 1.0}
-    return risk_mapping.get(risk_level.lower(), 0.0)
+    return risk_level_score(risk_level)
 
 
 def _check_database_health() -> str:
@@ -1760,26 +1711,21 @@ def _is_failure_response(text: str) -> bool:
     return any(m in t for m in markers)
 
 
-def _parse_csv_env(val: str) -> List[str]:
-    try:
-        return [p.strip() for p in (val or "").split(",") if p.strip()]
-    except Exception:
-        return []
+def _provider_keys() -> Dict[str, List[str]]:
+    """API keys per provider from environment variables (comma-separated lists)."""
+    from providers.scheduler import parse_keys
+
+    return {
+        "gemini": parse_keys("GEMINI_API_KEY", "GEMINI_API_KEYS"),
+        "openai": parse_keys("OPENAI_API_KEY", "OPENAI_API_KEYS"),
+        "perplexity": parse_keys("PERPLEXITY_API_KEY", "PERPLEXITY_API_KEYS")
+        or parse_keys("PPLX_API_KEY"),
+    }
 
 
 def _provider_keys_available() -> Dict[str, bool]:
     """Infer provider availability from environment variables."""
-    import os as _os
-
-    gem_keys = _parse_csv_env(_os.getenv("GEMINI_API_KEY") or "") + _parse_csv_env(
-        _os.getenv("GEMINI_API_KEYS") or ""
-    )
-    has_gemini = len(gem_keys) > 0
-    has_openai = bool((_os.getenv("OPENAI_API_KEY") or "").strip())
-    has_pplx = bool(
-        ((_os.getenv("PERPLEXITY_API_KEY") or _os.getenv("PPLX_API_KEY") or "").strip())
-    )
-    return {"gemini": has_gemini, "openai": has_openai, "perplexity": has_pplx}
+    return {name: bool(keys) for name, keys in _provider_keys().items()}
 
 
 def _build_failover_chain() -> List[str]:
@@ -1799,43 +1745,318 @@ def _build_failover_chain() -> List[str]:
 
 
 def _call_provider(
-    provider: str, message: str, session_id: str, risk_level: str
+    provider: str,
+    message: str,
+    session_id: str,
+    risk_level: str,
+    remember: bool = True,
 ) -> str:
-    """Call providers with correct signatures and minimal side effects."""
+    """Call providers with correct signatures and minimal side effects.
+
+    remember=False keeps the reply out of the session's prompt history.
+    """
     from providers.gemini import get_gemini_response
     from providers.openai import get_openai_response
     from providers.perplexity import get_perplexity_response
-    import os as _os
 
     if provider == "gemini":
         return get_gemini_response(
-            message, session_id=session_id, risk_level=risk_level
+            message, session_id=session_id, risk_level=risk_level, remember=remember
         )
     elif provider == "openai":
         return get_openai_response(message)
     elif provider == "perplexity":
-        # Support alias if only PPLX_API_KEY is present at runtime
-        if not (_os.getenv("PERPLEXITY_API_KEY") or "").strip():
-            alt = (_os.getenv("PPLX_API_KEY") or "").strip()
-            if alt:
-                _os.environ["PERPLEXITY_API_KEY"] = alt
         return get_perplexity_response(message)
     else:
         return get_gemini_response(
-            message, session_id=session_id, risk_level=risk_level
+            message, session_id=session_id, risk_level=risk_level, remember=remember
+        )
+
+
+# Observed successful-call latency per provider (ms), used for hedging delays
+_PROVIDER_LATENCY: Dict[str, deque] = {}
+_AI_METRICS: Dict[str, Any] = {
+    "requests": 0,
+    "hedged": 0,
+    "wins": {},
+    "hedge_wins": {},
+}
+_ai_metrics_lock = threading.Lock()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _record_provider_latency(provider: str, elapsed_ms: float) -> None:
+    with _ai_metrics_lock:
+        _PROVIDER_LATENCY.setdefault(provider, deque(maxlen=200)).append(elapsed_ms)
+
+
+def _record_ai_outcome(provider: str, hedged: bool, hedge_won: bool) -> None:
+    with _ai_metrics_lock:
+        _AI_METRICS["requests"] += 1
+        if hedged:
+            _AI_METRICS["hedged"] += 1
+        wins = _AI_METRICS["wins"]
+        wins[provider] = wins.get(provider, 0) + 1
+        if hedge_won:
+            hedge_wins = _AI_METRICS["hedge_wins"]
+            hedge_wins[provider] = hedge_wins.get(provider, 0) + 1
+
+
+# ---------- Zero-LLM fast path ----------
+# Turns that need no provider call: crisis (canned support reply; model output
+# was discarded for crisis turns anyway), template (greetings, thanks) and
+# cache (semantic response cache hit). Every turn records the tier serving it.
+_FAST_PATH_TIERS = ("crisis", "template", "cache")
+_TIER_METRICS: Dict[str, Dict[str, float]] = {}
+_ai_optimizer = None
+_ai_optimizer_lock = threading.Lock()
+
+
+def _fast_path_tiers() -> List[str]:
+    raw = os.getenv("AI_FAST_PATH_TIERS", ",".join(_FAST_PATH_TIERS))
+    return [t.strip() for t in raw.split(",") if t.strip() in _FAST_PATH_TIERS]
+
+
+def _get_ai_optimizer():
+    global _ai_optimizer
+    with _ai_optimizer_lock:
+        if _ai_optimizer is None:
+            from ai_optimization.cost_reducer import AIOptimizer
+
+            _ai_optimizer = AIOptimizer()
+        return _ai_optimizer
+
+
+def _fast_path_eligible(message: str, risk_level: str) -> bool:
+    """Templates and cached replies only for short, low-risk messages."""
+    max_words = int(os.getenv("AI_FAST_PATH_MAX_WORDS", "12"))
+    return risk_level == "low" and len(message.split()) <= max_words
+
+
+def _fast_path_response(
+    message: str, session_id: str, risk_level: str
+) -> Optional[Tuple[str, str]]:
+    """Answer locally when no model is needed. Returns (text, tier) or None."""
+    tiers = _fast_path_tiers()
+    try:
+        if risk_level == "crisis":
+            if "crisis" not in tiers:
+                return None
+            from providers.gemini import CRISIS_SUPPORT_RESPONSE
+
+            text, tier = CRISIS_SUPPORT_RESPONSE, "crisis"
+        else:
+            if not _fast_path_eligible(message, risk_level):
+                return None
+            from ai_optimization.cost_reducer import ResponseStrategy
+
+            strategies = {
+                "template": ResponseStrategy.TEMPLATE,
+                "cache": ResponseStrategy.CACHE_HIT,
+            }
+            hit = _get_ai_optimizer().local_response(
+                message,
+                {"risk_level": risk_level},
+                strategies=[strategies[t] for t in tiers if t in strategies],
+            )
+            if not hit:
+                return None
+            text = hit[0]
+            tier = "template" if hit[1] is ResponseStrategy.TEMPLATE else "cache"
+
+        # Keep provider prompt history in step with what the user saw
+        from providers.gemini import remember_turn
+
+        remember_turn(session_id, message, text)
+        return text, tier
+    except Exception as e:
+        current_app.logger.warning(f"Fast path failed, using providers: {e}")
+        return None
+
+
+def _reply_cacheable(message: str, session_id: str, risk_level: str) -> bool:
+    """Whether the provider's reply to message may go to the semantic cache.
+
+    Checked before the provider call. The cache is shared by every session,
+    so a reply written with this session's history in its prompt stays out.
+    """
+    if "cache" not in _fast_path_tiers() or not _fast_path_eligible(
+        message, risk_level
+    ):
+        return False
+    try:
+        from providers.gemini import has_history
+
+        return not has_history(session_id)
+    except Exception as e:
+        current_app.logger.warning(f"History check failed, not caching: {e}")
+        return False
+
+
+def _cache_ai_response(message: str, response: str, risk_level: str) -> None:
+    """Offer a provider reply to the semantic cache for later fast-path hits
+    (only replies _reply_cacheable() cleared before the call)."""
+    try:
+        _get_ai_optimizer().cache_response(
+            message, response, {"risk_level": risk_level}
         )
+    except Exception as e:
+        current_app.logger.warning(f"Semantic cache write failed: {e}")
+
+
+def _record_turn_tier(tier: str, elapsed_ms: float) -> None:
+    with _ai_metrics_lock:
+        stats = _TIER_METRICS.setdefault(tier, {"turns": 0, "latency_ms": 0.0})
+        stats["turns"] += 1
+        stats["latency_ms"] += elapsed_ms
+
+
+def _hedging_enabled() -> bool:
+    return (os.getenv("AI_HEDGING_ENABLED") or "false").lower() == "true"
+
+
+def _hedge_delay_seconds(provider: str) -> float:
+    """Time to wait on a provider before hedging: the configured percentile of
+    its observed latency, or a default until enough samples exist."""
+    percentile = float(os.getenv("AI_HEDGE_PERCENTILE", "95"))
+    min_delay_ms = float(os.getenv("AI_HEDGE_MIN_DELAY_MS", "300"))
+    default_delay_ms = float(os.getenv("AI_HEDGE_DEFAULT_DELAY_MS", "2500"))
+    min_samples = int(os.getenv("AI_HEDGE_MIN_SAMPLES", "20"))
+    with _ai_metrics_lock:
+        samples = sorted(_PROVIDER_LATENCY.get(provider, ()))
+    if len(samples) < min_samples:
+        delay_ms = default_delay_ms
+    else:
+        rank = max(0, math.ceil(percentile / 100.0 * len(samples)) - 1)
+        delay_ms = samples[min(rank, len(samples) - 1)]
+    return max(min_delay_ms, delay_ms) / 1000.0
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    with _ai_metrics_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("AI_HEDGE_MAX_THREADS", "8")),
+                thread_name_prefix="ai-hedge",
+            )
+        return _hedge_executor
+
+
+def _record_provider_health(
+    provider: str, ok: bool, elapsed_ms: Optional[float] = None
+) -> None:
+    """Provider-level rolling stats in the shared health store (best-effort)."""
+    try:
+        from providers.health import get_health_store
+
+        get_health_store().record(provider, "*", ok, elapsed_ms if ok else None)
+    except Exception:
+        pass
+
+
+def _timed_call_provider(
+    provider: str,
+    message: str,
+    session_id: str,
+    risk_level: str,
+    remember: bool = True,
+) -> Tuple[str, float]:
+    started = time.monotonic()
+    try:
+        resp = _call_provider(provider, message, session_id, risk_level, remember)
+    except Exception:
+        _record_provider_health(provider, ok=False)
+        raise
+    elapsed_ms = (time.monotonic() - started) * 1000.0
+    _record_provider_health(provider, not _is_failure_response(resp), elapsed_ms)
+    return resp, elapsed_ms
+
+
+def _get_ai_response_hedged(
+    message: str, session_id: str, risk_level: str, chain: List[str]
+) -> Tuple[str, str]:
+    """Race providers down the chain: start the next one when the latest has not
+    answered within its hedge delay (or has failed); first usable reply wins.
+
+    Racing calls leave the session history alone; only the winning reply is
+    remembered, so an abandoned call finishing late cannot add its turn.
+    """
+    executor = _get_hedge_executor()
+    pending: Dict[Any, str] = {}
+    next_idx = 0
+    hedged = False
+    last_err_text = None
+
+    def launch() -> str:
+        nonlocal next_idx
+        prov = chain[next_idx]
+        next_idx += 1
+        fut = executor.submit(
+            _timed_call_provider, prov, message, session_id, risk_level, False
+        )
+        pending[fut] = prov
+        return prov
+
+    latest = launch()
+    while pending:
+        timeout = _hedge_delay_seconds(latest) if next_idx < len(chain) else None
+        done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            # Slow provider: hedge with the next one, keep both running
+            latest = launch()
+            hedged = True
+            continue
+        for fut in done:
+            prov = pending.pop(fut)
+            try:
+                resp, elapsed_ms = fut.result()
+            except Exception as _e:
+                last_err_text = f"Error generating response: {_e}"
+                continue
+            if _is_failure_response(resp):
+                last_err_text = resp
+                continue
+            _record_provider_latency(prov, elapsed_ms)
+            # Cancel losers: queued calls never start; in-flight ones are
+            # abandoned and their results discarded
+            for loser in pending:
+                loser.cancel()
+            from providers.gemini import remember_turn
+
+            remember_turn(session_id, message, resp)
+            _record_ai_outcome(prov, hedged, hedge_won=hedged and prov != chain[0])
+            return resp, prov
+        if not pending and next_idx < len(chain):
+            # Everything in flight failed: fail over immediately
+            latest = launch()
+    # No provider answered: nothing won, so record no outcome (as the
+    # sequential path does)
+    return (
+        last_err_text
+        or "I'm having trouble connecting to my AI services. Please try again in a moment."
+    ), chain[-1]
 
 
 def _get_ai_response_with_failover(
     message: str, session_id: str, risk_level: str
 ) -> Tuple[str, str]:
-    """Try providers in order until a viable response is obtained. Returns (text, used_provider)."""
+    """Try providers in order until a viable response is obtained. Returns (text, used_provider).
+
+    With AI_HEDGING_ENABLED=true, slow providers are hedged instead of awaited.
+    """
     chain = _build_failover_chain()
+    if _hedging_enabled() and len(chain) > 1:
+        return _get_ai_response_hedged(message, session_id, risk_level, chain)
     last_err_text = None
     for prov in chain:
         try:
-            resp = _call_provider(prov, message, session_id, risk_level)
+            resp, elapsed_ms = _timed_call_provider(
+                prov, message, session_id, risk_level
+            )
             if not _is_failure_response(resp):
+                _record_provider_latency(prov, elapsed_ms)
+                _record_ai_outcome(prov, hedged=False, hedge_won=False)
                 return resp, prov
             last_err_text = resp
         except Exception as _e:
@@ -1847,61 +2068,181 @@ def _get_ai_response_with_failover(
     ), (chain[-1] if chain else "unknown")
 
 
-def _enhanced_crisis_detection(message: str) -> Tuple[str, float, List[str]]:
-    """Enhanced crisis detection with keyword analysis"""
-    message_lower = message.lower()
-
-    # Crisis keywords with weights
-    crisis_keywords = {
-        "suicide": 1.0,
-        "kill myself": 1.0,
-        "want to die": 1.0,
-        "end it all": 1.0,
-        "take me from this earth": 1.0,
-        "take me from earth": 1.0,
-        "remove me from earth": 1.0,
-        "self harm": 0.9,
-        "cut myself": 0.9,
-        "hurt myself": 0.9,
-        "hopeless": 0.8,
-        "no hope": 0.8,
-        "worthless": 0.8,
-        "useless": 0.8,
-        "depressed": 0.7,
-        "depression": 0.7,
-        "anxiety": 0.6,
-        "panic": 0.6,
-        "lonely": 0.5,
-        "alone": 0.5,
-        "isolated": 0.5,
-        "stress": 0.4,
-        "overwhelmed": 0.4,
-        "can't cope": 0.4,
-    }
+def _ai_metrics_lines() -> List[str]:
+    """Prometheus lines for provider wins and hedging."""
+    with _ai_metrics_lock:
+        requests_total = _AI_METRICS["requests"]
+        hedged_total = _AI_METRICS["hedged"]
+        wins = dict(_AI_METRICS["wins"])
+        hedge_wins = dict(_AI_METRICS["hedge_wins"])
+    lines = [
+        "# HELP ai_requests_total AI responses produced via the failover chain",
+        "# TYPE ai_requests_total counter",
+        f"ai_requests_total {requests_total}",
+        "# HELP ai_hedged_requests_total Requests where a hedge provider was started",
+        "# TYPE ai_hedged_requests_total counter",
+        f"ai_hedged_requests_total {hedged_total}",
+        "# HELP ai_hedge_rate Fraction of AI requests that were hedged",
+        "# TYPE ai_hedge_rate gauge",
+        f"ai_hedge_rate {hedged_total / requests_total if requests_total else 0.0}",
+        "# HELP ai_provider_wins_total Responses served per provider",
+        "# TYPE ai_provider_wins_total counter",
+    ]
+    lines += [f'ai_provider_wins_total{{provider="{p}"}} {n}' for p, n in wins.items()]
+    lines += [
+        "# HELP ai_hedge_wins_total Responses won by a provider other than the first in the chain",
+        "# TYPE ai_hedge_wins_total counter",
+    ]
+    lines += [
+        f'ai_hedge_wins_total{{provider="{p}"}} {n}' for p, n in hedge_wins.items()
+    ]
+    with _ai_metrics_lock:
+        tiers = {t: dict(st) for t, st in _TIER_METRICS.items()}
+    lines += [
+        "# HELP ai_turns_total Chat turns by serving tier (llm, crisis, template, cache)",
+        "# TYPE ai_turns_total counter",
+    ]
+    lines += [f'ai_turns_total{{tier="{t}"}} {st["turns"]}' for t, st in tiers.items()]
+    lines += [
+        "# HELP ai_turn_latency_ms_sum Time to the reply (first chunk when streaming) by tier",
+        "# TYPE ai_turn_latency_ms_sum counter",
+    ]
+    lines += [
+        f'ai_turn_latency_ms_sum{{tier="{t}"}} {st["latency_ms"]:.1f}'
+        for t, st in tiers.items()
+    ]
+    # Rolling health shared by all workers (key label is a fingerprint, "*" = provider)
+    try:
+        from providers.health import STATS_WINDOW_MINUTES, get_health_store
+
+        snapshot = get_health_store().snapshot()
+        window = f"{STATS_WINDOW_MINUTES}m"
+        lines += [
+            "# HELP ai_provider_error_rate Error rate over the rolling health window",
+            "# TYPE ai_provider_error_rate gauge",
+        ]
+        lines += [
+            f'ai_provider_error_rate{{provider="{p}",key="{k}",window="{window}"}} {st["error_rate"]:.4f}'
+            for p, keys in snapshot.items()
+            for k, st in keys.items()
+        ]
+        lines += [
+            "# HELP ai_provider_latency_ms Mean successful-call latency over the rolling health window",
+            "# TYPE ai_provider_latency_ms gauge",
+        ]
+        lines += [
+            f'ai_provider_latency_ms{{provider="{p}",key="{k}",window="{window}"}} {st["avg_latency_ms"]:.1f}'
+            for p, keys in snapshot.items()
+            for k, st in keys.items()
+        ]
+    except Exception:
+        pass
+    # Per-worker quota headroom of each key (fraction of the RPM/TPM bucket left)
+    try:
+        from providers.scheduler import all_schedulers
+
+        lines += [
+            "# HELP ai_key_headroom Remaining per-worker quota budget per API key",
+            "# TYPE ai_key_headroom gauge",
+        ]
+        for p, sched in all_schedulers().items():
+            for st in sched.snapshot():
+                for bucket in ("rpm", "tpm"):
+                    lines.append(
+                        f'ai_key_headroom{{provider="{p}",key="{st["key"]}",bucket="{bucket}"}} '
+                        f'{st[bucket + "_headroom"]}'
+                    )
+    except Exception:
+        pass
+    return lines
+
+
+def _stream_provider(
+    provider: str, message: str, session_id: str, risk_level: str
+) -> Iterator[str]:
+    """Streaming counterpart of _call_provider; yields text chunks."""
+    from providers.gemini import stream_gemini_response
+    from providers.openai import stream_openai_response
+    from providers.perplexity import stream_perplexity_response
+
+    if provider == "openai":
+        return stream_openai_response(message)
+    elif provider == "perplexity":
+        return stream_perplexity_response(message)
+    return stream_gemini_response(message, session_id=session_id, risk_level=risk_level)
+
+
+def _open_ai_stream(
+    message: str, session_id: str, risk_level: str
+) -> Tuple[Iterator[str], str]:
+    """Start a token stream, failing over until a provider yields its first chunk.
+
+    Returns (chunks, used_provider). Once a chunk has been produced the stream is
+    committed to that provider. If every provider fails, the chunks are the last
+    error text so the client still receives a reply.
+    """
+    chain = _build_failover_chain()
+    last_err_text = None
+    for prov in chain:
+        stream = _stream_provider(prov, message, session_id, risk_level)
+        try:
+            for first in stream:
+                if first:
+                    return itertools.chain([first], stream), prov
+            last_err_text = "Error generating response: empty response"
+        except Exception as _e:
+            last_err_text = str(_e) or f"Error generating response: {_e!r}"
+            current_app.logger.warning(f"Stream provider {prov} failed: {_e}")
+    return iter(
+        [
+            last_err_text
+            or "I'm having trouble connecting to my AI services. Please try again in a moment."
+        ]
+    ), (chain[-1] if chain else "unknown")
 
-    found_keywords = []
-    total_score = 0.0
 
-    for keyword, weight in crisis_keywords.items():
-        if keyword in message_lower:
-            found_keywords.append(keyword)
-            total_score += weight
+# Upper bound on messages per /api/crisis_detection/batch request
+CRISIS_BATCH_MAX_MESSAGES = int(os.getenv("CRISIS_BATCH_MAX_MESSAGES", 500))
 
-    # Normalize score
-    max_possible_score = sum(crisis_keywords.values())
-    normalized_score = total_score / max_possible_score if max_possible_score > 0 else 0
 
-    # Determine risk level
+def _score_to_risk_level(normalized_score: float) -> str:
     if normalized_score >= 0.8:
-        risk_level = "crisis"
+        return "crisis"
     elif normalized_score >= 0.6:
-        risk_level = "high"
+        return "high"
     elif normalized_score >= 0.4:
-        risk_level = "medium"
-    else:
-        risk_level = "low"
+        return "medium"
+    return "low"
 
-    return risk_level, normalized_score, found_keywords
+
+def _enhanced_crisis_detection(message: str) -> Tuple[str, float, List[str]]:
+    """Enhanced crisis detection with keyword analysis"""
+    scan = scan_message(message)
+    normalized_score = scan.score
+
+    # Determine risk level, raised by the optional classifier when confident
+    risk_level = _score_to_risk_level(normalized_score)
+    classifier = get_crisis_classifier()
+    if classifier is not None:
+        risk_level = second_opinion(risk_level, classifier.predict(message))
+
+    return risk_level, normalized_score, list(scan.keywords)
+
+
+def _enhanced_crisis_detection_batch(
+    messages: List[str],
+) -> List[Tuple[str, float, List[str]]]:
+    """_enhanced_crisis_detection for many messages; the classifier scores the
+    whole batch in one pass."""
+    scans = [scan_message(message) for message in messages]
+    levels = [_score_to_risk_level(scan.score) for scan in scans]
+    classifier = get_crisis_classifier()
+    if classifier is not None and messages:
+        predictions = classifier.predict_batch(messages)
+        levels = [second_opinion(lvl, p) for lvl, p in zip(levels, predictions)]
+    return [
+        (level, scan.score, list(scan.keywords)) for level, scan in zip(levels, scans)
+    ]
 
 
 def get_crisis_response_and_resources(
@@ -2176,7 +2517,38 @@ def _log_crisis_detection(
     keywords: List[str],
 ) -> None:
     """Log crisis detection for monitoring"""
+    _log_crisis_detections(session_id, [(message, (risk_level, risk_score, keywords))])
+
+
+def _log_crisis_detections(
+    session_id: str, detections: List[Tuple[str, Tuple[str, float, List[str]]]]
+) -> None:
+    """Log (message, (risk_level, risk_score, keywords)) rows in one INSERT batch.
+
+    Rows go through the write-behind buffer unless CRISIS_LOG_SYNC asks for
+    them to be committed before the response is sent.
+    """
+    if not detections:
+        return
     try:
+        now = datetime.utcnow()
+        rows = [
+            {
+                "session_id": session_id,
+                "message": message,
+                "risk_level": risk_level,
+                "risk_score": risk_score,
+                "keywords": ",".join(keywords),
+                "timestamp": now,
+            }
+            for message, (risk_level, risk_score, keywords) in detections
+        ]
+        writer = get_log_writer()
+        if writer is not None and not CRISIS_LOG_SYNC:
+            for row in rows:
+                writer.submit("crisis_detections", row)
+            return
+
         db.session.execute(
             text(
                 """
@@ -2184,14 +2556,7 @@ def _log_crisis_detection(
                 VALUES (:session_id, :message, :risk_level, :risk_score, :keywords, :timestamp)
             """
             ),
-            {
-                "session_id": session_id,
-                "message": message,
-                "risk_level": risk_level,
-                "risk_score": risk_score,
-                "keywords": ",".join(keywords),
-                "timestamp": datetime.utcnow(),
-            },
+            rows,
         )
         db.session.commit()
     except Exception as e:
@@ -2226,16 +2591,20 @@ def _register_additional_routes(app: Flask) -> None:
             risk_level = detect_crisis_level(message)
             crisis_data = get_crisis_response_and_resources(risk_level, country)
 
-            # Generate full AI response with failover chain
-            full_text, _used_provider = _get_ai_response_with_failover(
-                message, session_id, risk_level
-            )
-
-            # Log conversation (non-streaming DB log)
-            _log_conversation(session_id, message, full_text, risk_level)
+            started = time.monotonic()
+            fast = _fast_path_response(message, session_id, risk_level)
+            if fast:
+                chunks, tier = iter([fast[0]]), fast[1]
+            else:
+                # Fail over between providers before anything is sent; once the
+                # first token exists the response is committed to that provider
+                chunks, _used_provider = _open_ai_stream(
+                    message, session_id, risk_level
+                )
+                tier = "llm"
+            _record_turn_tier(tier, (time.monotonic() - started) * 1000.0)
 
             def stream_generator():
-                import time
                 import json as _json
 
                 def sse(obj: dict):
@@ -2253,37 +2622,22 @@ def _register_additional_routes(app: Flask) -> None:
                     }
                 )
 
-                # Chunk the AI response for progressive reveal
-                text = full_text or ""
-                # Prefer newline splits, then sentence-ish (preserving spaces), then words
-                chunks: List[str]
-                joiner = ""
-                if "\n" in text:
-                    chunks = text.split("\n")
-                    joiner = "\n"
-                else:
-                    import re as _re
-
-                    parts = [p for p in _re.split(r"(?<=[.!?])\s+", text) if p]
-                    if len(parts) <= 1:
-                        chunks = text.split(" ")
-                    else:
-                        # Re-attach a single space that was consumed by the split for all but the last part.
-                        chunks = [
-                            p + (" " if i < len(parts) - 1 else "")
-                            for i, p in enumerate(parts)
-                        ]
-
-                for idx, ch in enumerate(chunks):
-                    yield sse(
-                        {
-                            "type": "token",
-                            "text": (joiner + ch) if (idx > 0 and joiner) else ch,
-                        }
-                    )
-                    # Small human-like pacing
-                    delay_ms = max(60, min(220, int(len(ch.strip()) * 12)))
-                    time.sleep(delay_ms / 1000.0)
+                # Forward provider tokens as they arrive
+                parts: List[str] = []
+                try:
+                    for chunk in chunks:
+                        parts.append(chunk)
+                        yield sse({"type": "token", "text": chunk})
+                except Exception as e:
+                    current_app.logger.error(f"Chat stream interrupted: {e}")
+                    yield sse({"type": "error", "error": "Response interrupted"})
+                    return
+                finally:
+                    # Log whatever was delivered, including partial replies
+                    if parts:
+                        _log_conversation(
+                            session_id, message, "".join(parts).strip(), risk_level
+                        )
 
                 # Done signal
                 yield sse({"type": "done"})
@@ -2293,7 +2647,7 @@ def _register_additional_routes(app: Flask) -> None:
                 "Content-Type": "text/event-stream",
                 "Connection": "keep-alive",
             }
-            return Response(stream_generator(), headers=headers)
+            return Response(stream_with_context(stream_generator()), headers=headers)
 
         except Exception as e:
             # Use app logger in request context
@@ -2311,6 +2665,7 @@ def _register_additional_routes(app: Flask) -> None:
 
     @app.route("/api/chat_history", methods=["GET"])
     @app.limiter.limit("120 per minute")
+    @read_only
     def get_chat_history():
         """Get chat history for the current session"""
         try:
@@ -2325,7 +2680,7 @@ def _register_additional_routes(app: Flask) -> None:
                     SELECT content, is_user, timestamp 
                     FROM chat_messages 
                     WHERE session_id = :session_id 
-                    ORDER BY timestamp ASC 
+                    ORDER BY timestamp ASC, id ASC 
                     LIMIT 50
                 """
                 ),
@@ -2339,7 +2694,9 @@ def _register_additional_routes(app: Flask) -> None:
                         "content": message.content,
                         "is_user": message.is_user,
                         "timestamp": (
-                            message.timestamp.isoformat() if message.timestamp else None
+                            message.timestamp.isoformat()
+                            if isinstance(message.timestamp, datetime)
+                            else message.timestamp
                         ),
                     }
                 )
@@ -2352,6 +2709,7 @@ def _register_additional_routes(app: Flask) -> None:
 
     @app.route("/api/mood_history", methods=["GET"])
     @app.limiter.limit("120 per minute")
+    @read_only
     def get_mood_history():
         """Get mood history for the current session"""
         try:
@@ -2380,7 +2738,9 @@ def _register_additional_routes(app: Flask) -> None:
                         "mood_level": entry.mood_level,
                         "note": _sanitize_note(entry.note),
                         "timestamp": (
-                            entry.timestamp.isoformat() if entry.timestamp else None
+                            entry.timestamp.isoformat()
+                            if isinstance(entry.timestamp, datetime)
+                            else entry.timestamp
                         ),
                     }
                 )
@@ -2410,6 +2770,7 @@ def _register_additional_routes(app: Flask) -> None:
 
     @app.route("/api/mood_entry", methods=["POST"])
     @app.limiter.limit("120 per minute")
+    @unit_of_work
     def add_mood_entry():
         """Add a new mood entry"""
         try:
@@ -2466,7 +2827,7 @@ def _register_additional_routes(app: Flask) -> None:
                     "timestamp": entry_timestamp,
                 },
             )
-            db.session.commit()
+            commit_or_defer(db.session)
 
             return jsonify(
                 {
@@ -2521,8 +2882,64 @@ def _register_additional_routes(app: Flask) -> None:
             app.logger.error(f"Crisis detection error: {e}")
             return jsonify({"error": "Failed to process crisis detection"}), 500
 
+    @app.route("/api/crisis_detection/batch", methods=["POST"])
+    @app.limiter.limit("10 per minute")
+    def crisis_detection_batch():
+        """Crisis detection for many messages in one vectorized pass"""
+        try:
+            data = request.get_json(silent=True) or {}
+            messages = data.get("messages")
+            session_id = request.headers.get("X-Session-ID")
+
+            if not isinstance(messages, list) or not messages:
+                return jsonify({"error": "messages must be a non-empty list"}), 400
+            if len(messages) > CRISIS_BATCH_MAX_MESSAGES:
+                return (
+                    jsonify(
+                        {
+                            "error": f"At most {CRISIS_BATCH_MAX_MESSAGES} messages per batch"
+                        }
+                    ),
+                    413,
+                )
+            if not all(isinstance(m, str) and m.strip() for m in messages):
+                return (
+                    jsonify({"error": "Every message must be a non-empty string"}),
+                    400,
+                )
+
+            detections = _enhanced_crisis_detection_batch(messages)
+            _log_crisis_detections(session_id, list(zip(messages, detections)))
+
+            results = [
+                {
+                    "risk_level": risk_level,
+                    "risk_score": risk_score,
+                    "keywords": keywords,
+                    "immediate_action_required": risk_level in ["high", "crisis"],
+                }
+                for risk_level, risk_score, keywords in detections
+            ]
+            levels = sorted({r["risk_level"] for r in results})
+            return jsonify(
+                {
+                    "count": len(results),
+                    "results": results,
+                    "summary": {
+                        lvl: sum(1 for r in results if r["risk_level"] == lvl)
+                        for lvl in levels
+                    },
+                    "resources": {lvl: _get_crisis_resources(lvl) for lvl in levels},
+                }
+            )
+
+        except Exception as e:
+            app.logger.error(f"Batch crisis detection error: {e}")
+            return jsonify({"error": "Failed to process crisis detection"}), 500
+
     @app.route("/api/mood_analytics", methods=["GET"])
     @app.limiter.limit("30 per minute")
+    @read_only
     def mood_analytics():
         """Get mood analytics and trends"""
         try:
@@ -2585,7 +3002,17 @@ def _register_additional_routes(app: Flask) -> None:
 
             # Weekly average
             week_ago = datetime.utcnow() - timedelta(days=7)
-            weekly_entries = [entry for entry in entries if entry.timestamp >= week_ago]
+            # SQLite hands timestamps back as text
+            weekly_entries = [
+                entry
+                for entry in entries
+                if (
+                    entry.timestamp
+                    if isinstance(entry.timestamp, datetime)
+                    else datetime.fromisoformat(str(entry.timestamp))
+                )
+                >= week_ago
+            ]
             weekly_average = (
                 sum(entry.mood_level for entry in weekly_entries) / len(weekly_entries)
                 if weekly_entries
@@ -2611,6 +3038,7 @@ def _register_additional_routes(app: Flask) -> None:
 
     @app.route("/api/wellness_recommendations", methods=["GET"])
     @app.limiter.limit("30 per minute")
+    @read_only
     def wellness_recommendations():
         """Get personalized wellness recommendations"""
         try:
@@ -2708,6 +3136,33 @@ def _register_additional_routes(app: Flask) -> None:
             metrics.append(f"# TYPE app_redis_health gauge")
             metrics.append(f"app_redis_health {1 if 'healthy' in redis_health else 0}")
 
+            # AI provider wins and hedging
+            metrics.extend(_ai_metrics_lines())
+
+            writer = get_log_writer()
+            if writer is not None:
+                for name, value in writer.stats().items():
+                    metrics.append(f"# TYPE app_log_writer_{name} gauge")
+                    metrics.append(f"app_log_writer_{name} {value}")
+
+            pools = app.extensions.get("db_pool_metrics")
+            if pools:
+                metrics.extend(pool_metrics_lines(pools))
+
+            replicas = app.extensions.get("db_replicas")
+            if replicas is not None:
+                metrics.append("# TYPE app_db_replica_lag_seconds gauge")
+                metrics.append("# TYPE app_db_replica_reads_total counter")
+                for stat in replicas.stats():
+                    label = f'{{replica="{stat["replica"]}"}}'
+                    lag = stat["lag_seconds"]
+                    metrics.append(
+                        f"app_db_replica_lag_seconds{label} {-1 if lag is None else lag}"
+                    )
+                    metrics.append(f"app_db_replica_reads_total{label} {stat['reads']}")
+                metrics.append("# TYPE app_db_replica_fallbacks_total counter")
+                metrics.append(f"app_db_replica_fallbacks_total {replicas.fallbacks}")
+
             # Request metrics (if available)
             if hasattr(app, "request_count"):
                 metrics.append(f"# HELP app_requests_total Total number of requests")
@@ -2721,6 +3176,7 @@ def _register_additional_routes(app: Flask) -> None:
             return f"# ERROR: {str(e)}", 500, {"Content-Type": "text/plain"}
 
     @app.route("/api/self_assessment", methods=["POST"])
+    @unit_of_work
     def submit_self_assessment():
         """Handle self-assessment submissions"""
         if request.method == "GET":
@@ -2793,40 +3249,14 @@ def _register_additional_routes(app: Flask) -> None:
                     200,
                 )
 
-            # Create new entry (authoritative store)
+            # Create new entry (self_assessments is a view over this table)
             entry = SelfAssessmentEntry(
                 session_id=session_id,
                 timestamp=now_utc,
                 assessment_data=cleaned_data,
             )
             db.session.add(entry)
-            db.session.commit()
-
-            # Best-effort mirror to legacy table for compatibility (non-fatal on error)
-            try:
-                db.session.execute(
-                    text(
-                        """
-                        INSERT INTO self_assessments (session_id, mood, energy, sleep, stress, social, work, notes, timestamp)
-                        VALUES (:session_id, :mood, :energy, :sleep, :stress, :social, :work, :notes, :timestamp)
-                        """
-                    ),
-                    {
-                        "session_id": session_id,
-                        "mood": cleaned_data.get("mood"),
-                        "energy": cleaned_data.get("energy"),
-                        "sleep": cleaned_data.get("sleep"),
-                        "stress": cleaned_data.get("stress"),
-                        "social": cleaned_data.get("social"),
-                        "work": cleaned_data.get("work"),
-                        "notes": cleaned_data.get("notes"),
-                        "timestamp": now_utc,
-                    },
-                )
-                db.session.commit()
-            except Exception as e:
-                db.session.rollback()
-                app.logger.warning(f"Legacy self_assessments mirror skipped: {e}")
+            commit_or_defer(db.session)
 
             # Award XP once per day for quick check-in (value can be tuned server-side)
             xp_awarded = 10
@@ -0,0 +1,382 @@
+"""
+ASGI entry point: async chat endpoints in front of the Flask app
+
+/api/chat and /api/chat_stream are served natively on the event loop with
+provider calls awaited, so an open SSE stream costs a coroutine rather than a
+worker. Every other route is handed to the existing Flask app through a WSGI
+thread pool.
+
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+    # or locally: uvicorn asgi:application --port 5055
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+from limits import parse as parse_limit
+from werkzeug.datastructures import Headers
+
+import app as backend
+from crisis_detection import detect_crisis_level
+
+logger = logging.getLogger(__name__)
+
+_TROUBLE_TEXT = (
+    "I'm having trouble connecting to my AI services. Please try again in a moment."
+)
+# Threads available to the wrapped Flask app (blocking routes)
+WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "16"))
+
+
+def _astream_provider(
+    provider: str, message: str, session_id: str, risk_level: str
+) -> AsyncIterator[str]:
+    """Async counterpart of app._stream_provider."""
+    from providers.gemini import astream_gemini_response
+    from providers.openai import astream_openai_response
+    from providers.perplexity import astream_perplexity_response
+
+    if provider == "openai":
+        return astream_openai_response(message)
+    elif provider == "perplexity":
+        return astream_perplexity_response(message)
+    return astream_gemini_response(
+        message, session_id=session_id, risk_level=risk_level
+    )
+
+
+async def _prepend(first: str, rest: AsyncIterator[str]) -> AsyncIterator[str]:
+    yield first
+    async for chunk in rest:
+        yield chunk
+
+
+async def _single(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+async def _aopen_ai_stream(
+    message: str, session_id: str, risk_level: str, chain: List[str]
+) -> Tuple[AsyncIterator[str], str]:
+    """Async counterpart of app._open_ai_stream: fail over until a first chunk."""
+    last_err_text = None
+    for prov in chain:
+        stream = _astream_provider(prov, message, session_id, risk_level)
+        try:
+            async for first in stream:
+                if first:
+                    return _prepend(first, stream), prov
+            last_err_text = "Error generating response: empty response"
+        except Exception as e:
+            last_err_text = str(e) or f"Error generating response: {e!r}"
+            logger.warning(f"Async stream provider {prov} failed: {e}")
+    return _single(last_err_text or _TROUBLE_TEXT), (chain[-1] if chain else "unknown")
+
+
+class _Request:
+    """Minimal view of an ASGI HTTP request."""
+
+    def __init__(self, scope: Dict[str, Any], receive):
+        self.scope = scope
+        self.receive = receive
+        self.headers = Headers(
+            [(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]]
+        )
+        self.args = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        client = scope.get("client")
+        self.remote_addr = client[0] if client else None
+
+    async def body(self, limit: Optional[int] = None) -> bytes:
+        chunks: List[bytes] = []
+        size = 0
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if limit and size > limit:
+                raise ValueError("Request body too large")
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                break
+        return b"".join(chunks)
+
+
+class ChatASGIApp:
+    """Serve the chat endpoints natively; delegate everything else to Flask."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=WSGI_THREADS)
+        self.origins = backend._cors_origins(flask_app)
+        self.chat_limit = parse_limit("30 per minute")
+        self.routes = {
+            ("POST", "/api/chat"): self.chat,
+            ("GET", "/api/chat_stream"): self.chat_stream,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            handler = self.routes.get((scope["method"], scope["path"]))
+            if handler is not None:
+                await handler(_Request(scope, receive), send)
+                return
+        await self.wsgi(scope, receive, send)
+
+    # ---------- helpers ----------
+
+    def _in_app_context(self, fn, *args):
+        with self.flask_app.app_context():
+            return fn(*args)
+
+    async def _run_sync(self, fn, *args):
+        """Run a blocking app helper (DB, Redis) in a thread with an app context."""
+        return await asyncio.to_thread(self._in_app_context, fn, *args)
+
+    def _response_headers(
+        self, req: _Request, content_type: str
+    ) -> List[Tuple[bytes, bytes]]:
+        rid = req.headers.get("X-Request-ID") or str(uuid.uuid4())
+        headers = [
+            (b"content-type", content_type.encode()),
+            (b"x-request-id", rid.encode("latin-1")),
+        ]
+        origin = req.headers.get("Origin")
+        if origin and any(
+            o == "*" or o == origin or (hasattr(o, "match") and o.match(origin))
+            for o in self.origins
+        ):
+            headers += [
+                (b"access-control-allow-origin", origin.encode("latin-1")),
+                (b"access-control-allow-credentials", b"true"),
+                (
+                    b"access-control-expose-headers",
+                    b"Content-Type, X-Session-ID, X-Request-ID",
+                ),
+                (b"vary", b"Origin"),
+            ]
+        return headers
+
+    async def _send_json(self, req: _Request, send, status: int, payload: Dict):
+        body = json.dumps(payload).encode("utf-8")
+        headers = self._response_headers(req, "application/json")
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    def _rate_limited(self, req: _Request) -> bool:
+        """Apply the same per-session/IP chat limit as the Flask route."""
+        raw = self.flask_app.config.get("RATE_LIMIT_ENABLED", True)
+        enabled = raw.lower() == "true" if isinstance(raw, str) else bool(raw)
+        if not enabled:
+            return False
+        sid = (req.headers.get("X-Session-ID") or "").strip()
+        key = f"sid:{sid}" if sid else backend._client_ip(req.headers, req.remote_addr)
+        try:
+            return not self.flask_app.limiter.limiter.hit(
+                self.chat_limit, "asgi_chat", key
+            )
+        except Exception as e:
+            # Fail open like Flask-Limiter does when its storage is unavailable
+            logger.warning(f"Rate limiter unavailable: {e}")
+            return False
+
+    # ---------- endpoints ----------
+
+    async def chat(self, req: _Request, send):
+        """Async twin of the Flask /api/chat route."""
+        try:
+            try:
+                limit = self.flask_app.config.get("MAX_CONTENT_LENGTH")
+                data = json.loads(await req.body(limit) or b"null")
+            except ValueError:
+                data = None
+            if not isinstance(data, dict) or "message" not in data:
+                await self._send_json(req, send, 400, {"error": "Message is required"})
+                return
+            user_message = str(data["message"] or "").strip()
+            if not user_message:
+                await self._send_json(
+                    req, send, 400, {"error": "Message cannot be empty"}
+                )
+                return
+            if await asyncio.to_thread(self._rate_limited, req):
+                await self._send_json(req, send, 429, {"error": "Rate limit exceeded"})
+                return
+
+            session_id = await self._run_sync(
+                backend._get_or_create_session, req.headers.get("X-Session-ID") or ""
+            )
+            country = str(data.get("country") or "").lower()
+            if country not in backend.CRISIS_RESOURCES_BY_COUNTRY:
+                country = backend.get_country_code_from_ip(
+                    backend._client_ip(req.headers, req.remote_addr)
+                )
+
+            started = time.monotonic()
+            risk_level = detect_crisis_level(user_message)
+            fast = await self._run_sync(
+                backend._fast_path_response, user_message, session_id, risk_level
+            )
+            if fast:
+                ai_response, tier = fast
+            else:
+                cacheable = await self._run_sync(
+                    backend._reply_cacheable, user_message, session_id, risk_level
+                )
+                chain = self._in_app_context(backend._build_failover_chain)
+                chunks, _used_provider = await _aopen_ai_stream(
+                    user_message, session_id, risk_level, chain
+                )
+                parts: List[str] = []
+                try:
+                    async for chunk in chunks:
+                        parts.append(chunk)
+                except Exception as e:
+                    logger.error(f"Async chat provider stream interrupted: {e}")
+                ai_response = "".join(parts).strip() or _TROUBLE_TEXT
+                tier = "llm"
+                if cacheable and not backend._is_failure_response(ai_response):
+                    await self._run_sync(
+                        backend._cache_ai_response,
+                        user_message,
+                        ai_response,
+                        risk_level,
+                    )
+            backend._record_turn_tier(tier, (time.monotonic() - started) * 1000.0)
+
+            await self._run_sync(
+                backend._log_conversation,
+                session_id,
+                user_message,
+                ai_response,
+                risk_level,
+            )
+            crisis_data = backend.get_crisis_response_and_resources(risk_level, country)
+            await self._send_json(
+                req,
+                send,
+                200,
+                {
+                    "response": ai_response,
+                    "risk_level": risk_level,
+                    "session_id": session_id,
+                    "crisis_msg": crisis_data["crisis_msg"],
+                    "crisis_numbers": crisis_data["crisis_numbers"],
+                },
+            )
+        except Exception as e:
+            logger.error(f"Async chat endpoint error: {e}")
+            await self._send_json(req, send, 500, {"error": "Internal server error"})
+
+    async def chat_stream(self, req: _Request, send):
+        """Async twin of the Flask /api/chat_stream SSE route."""
+        try:
+            message = (req.args.get("message") or "").strip()
+            if not message:
+                await self._send_json(req, send, 400, {"error": "Message is required"})
+                return
+            session_id = req.args.get("session_id") or await self._run_sync(
+                backend._get_or_create_session, req.headers.get("X-Session-ID") or ""
+            )
+            country = req.args.get("country") or "generic"
+            started = time.monotonic()
+            risk_level = detect_crisis_level(message)
+            crisis_data = backend.get_crisis_response_and_resources(risk_level, country)
+            fast = await self._run_sync(
+                backend._fast_path_response, message, session_id, risk_level
+            )
+            if fast:
+                chunks, tier = _single(fast[0]), fast[1]
+            else:
+                chain = self._in_app_context(backend._build_failover_chain)
+                chunks, _used_provider = await _aopen_ai_stream(
+                    message, session_id, risk_level, chain
+                )
+                tier = "llm"
+            backend._record_turn_tier(tier, (time.monotonic() - started) * 1000.0)
+        except Exception as e:
+            logger.error(f"Async chat stream error: {e}")
+            await self._send_json(req, send, 500, {"error": "Internal server error"})
+            return
+
+        headers = self._response_headers(req, "text/event-stream")
+        headers += [(b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+        async def sse(obj: dict):
+            data = json.dumps(obj, ensure_ascii=False)
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": f"data: {data}\n\n".encode("utf-8"),
+                    "more_body": True,
+                }
+            )
+
+        # Stop generating as soon as the client goes away
+        disconnected = asyncio.ensure_future(self._wait_for_disconnect(req))
+        parts: List[str] = []
+        started = time.monotonic()
+        try:
+            await sse(
+                {
+                    "type": "meta",
+                    "session_id": session_id,
+                    "risk_level": risk_level,
+                    "crisis_msg": crisis_data.get("crisis_msg"),
+                    "crisis_numbers": crisis_data.get("crisis_numbers", []),
+                }
+            )
+            try:
+                async for chunk in chunks:
+                    if disconnected.done():
+                        break
+                    parts.append(chunk)
+                    await sse({"type": "token", "text": chunk})
+            except OSError:
+                raise
+            except Exception as e:
+                logger.error(f"Async chat stream interrupted: {e}")
+                await sse({"type": "error", "error": "Response interrupted"})
+            else:
+                if not disconnected.done():
+                    await sse({"type": "done"})
+            await send({"type": "http.response.body", "body": b""})
+        except OSError:
+            # Client disconnected mid-send
+            pass
+        finally:
+            disconnected.cancel()
+            if parts:
+                await self._run_sync(
+                    backend._log_conversation,
+                    session_id,
+                    message,
+                    "".join(parts).strip(),
+                    risk_level,
+                )
+            logger.debug(
+                f"chat_stream session={session_id} chunks={len(parts)} "
+                f"elapsed_ms={(time.monotonic() - started) * 1000:.0f}"
+            )
+
+    @staticmethod
+    async def _wait_for_disconnect(req: _Request):
+        while True:
+            message = await req.receive()
+            if message["type"] == "http.disconnect":
+                return
+
+
+application = ChatASGIApp(backend.app)
@@ -1,5 +1,4 @@
 from __future__ import annotations
-import json
 import re
 from datetime import datetime
 from typing import Any, Dict, List, Optional
@@ -7,10 +6,9 @@ from typing import Any, Dict, List, Optional
 from flask import Flask, jsonify, request
 from sqlalchemy import text
 
+from db_routing import read_only
 from models import db
 
-SEED_PATH = "data/community_seed.json"
-
 SAFE_REACTION_KINDS = {"relate", "helped", "strength"}
 
 
@@ -22,132 +20,6 @@ def _dialect() -> str:
         return "unknown"
 
 
-def _ensure_tables() -> None:
-    """Create minimal community tables in a dialect-aware way (sqlite/pg)."""
-    d = _dialect()
-    try:
-        if d == "sqlite":
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS community_posts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    topic TEXT,
-                    body_redacted TEXT NOT NULL,
-                    is_curated INTEGER DEFAULT 1,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    reactions_relate INTEGER DEFAULT 0,
-                    reactions_helped INTEGER DEFAULT 0,
-                    reactions_strength INTEGER DEFAULT 0
-                )
-                """
-                )
-            )
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS community_reactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    post_id INTEGER NOT NULL,
-                    kind TEXT NOT NULL,
-                    user_hash TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-                )
-            )
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS community_reports (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    target_type TEXT NOT NULL,
-                    target_id INTEGER NOT NULL,
-                    reason TEXT NOT NULL,
-                    notes TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-                )
-            )
-        else:  # assume postgres-compatible
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS community_posts (
-                    id SERIAL PRIMARY KEY,
-                    topic VARCHAR(64),
-                    body_redacted TEXT NOT NULL,
-                    is_curated BOOLEAN DEFAULT TRUE,
-                    is_hidden BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    reactions_relate INTEGER DEFAULT 0,
-                    reactions_helped INTEGER DEFAULT 0,
-                    reactions_strength INTEGER DEFAULT 0
-                )
-                """
-                )
-            )
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS community_reactions (
-                    id SERIAL PRIMARY KEY,
-                    post_id INTEGER NOT NULL,
-                    kind VARCHAR(24) NOT NULL,
-                    user_hash VARCHAR(64),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-                )
-            )
-            db.session.execute(
-                text(
-                    """
-                CREATE TABLE IF NOT EXISTS community_reports (
-                    id SERIAL PRIMARY KEY,
-                    target_type VARCHAR(24) NOT NULL,
-                    target_id INTEGER NOT NULL,
-                    reason VARCHAR(64) NOT NULL,
-                    notes TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-                )
-            )
-        # Attempt to add is_hidden column for sqlite if missing
-        try:
-            d = _dialect()
-            if d == "sqlite":
-                # SQLite: naive attempt to add column; ignore if exists
-                try:
-                    db.session.execute(
-                        text(
-                            "ALTER TABLE community_posts ADD COLUMN is_hidden INTEGER DEFAULT 0"
-                        )
-                    )
-                except Exception:
-                    pass
-            elif d not in {"unknown"}:
-                # Postgres: ensure column exists (IF NOT EXISTS is supported)
-                try:
-                    db.session.execute(
-                        text(
-                            "ALTER TABLE community_posts ADD COLUMN IF NOT EXISTS is_hidden BOOLEAN DEFAULT FALSE"
-                        )
-                    )
-                except Exception:
-                    pass
-        finally:
-            db.session.commit()
-    except Exception:
-        try:
-            db.session.rollback()
-        except Exception:
-            pass
-        raise
-
-
 EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
 PHONE_RE = re.compile(
     r"\b(?:\+\d{1,3}[\s-]?)?(?:\(?\d{2,4}\)?[\s-]?)?\d{3,4}[\s-]?\d{4}\b"
@@ -168,58 +40,9 @@ def _pii_redact(text_in: str) -> str:
     return t
 
 
-def _load_seed_if_empty(app: Flask) -> None:
-    count = (
-        db.session.execute(text("SELECT COUNT(*) FROM community_posts")).scalar() or 0
-    )
-    if count > 0:
-        return
-    try:
-        with app.open_resource(SEED_PATH) as f:
-            items = json.load(f)
-        for it in items:
-            topic = (it.get("topic") or "general").strip()[:64]
-            body = _pii_redact(it.get("body", "").strip())
-            if not body:
-                continue
-            db.session.execute(
-                text(
-                    """
-                INSERT INTO community_posts (topic, body_redacted, is_curated)
-                VALUES (:topic, :body, :is_curated)
-                """
-                ),
-                {"topic": topic, "body": body, "is_curated": True},
-            )
-        db.session.commit()
-    except FileNotFoundError:
-        # No seed file; skip silently
-        pass
-    except Exception:
-        try:
-            db.session.rollback()
-        except Exception:
-            pass
-
-
 def register_community_routes(app: Flask) -> None:
     """Registers Phase 0 Community routes on the given app."""
-    # Ensure tables exist and seed under an application context
-    try:
-        with app.app_context():
-            _ensure_tables()
-            try:
-                _load_seed_if_empty(app)
-            except Exception as e:
-                try:
-                    app.logger.warning(f"Community seed load failed: {e}")
-                except Exception:
-                    pass
-    except Exception as e:
-        try:
-            app.logger.warning(f"Community init skipped: {e}")
-        except Exception:
-            pass
+    # Tables and the curated seed come from migrations 2 and 3 (migrations.py)
 
     def _enabled() -> bool:
         try:
@@ -255,6 +78,7 @@ def register_community_routes(app: Flask) -> None:
 
     @app.route("/api/community/feed", methods=["GET"])
     @app.limiter.limit(limits_feed)
+    @read_only
     def community_feed():
         if not _enabled():
             return jsonify({"error": "Community disabled"}), 403
@@ -312,7 +136,9 @@ def register_community_routes(app: Flask) -> None:
             items: List[Dict[str, Any]] = []
             for r in rows:
                 created = (
-                    r.created_at.isoformat() if getattr(r, "created_at", None) else None
+                    r.created_at.isoformat()
+                    if isinstance(getattr(r, "created_at", None), datetime)
+                    else getattr(r, "created_at", None)
                 )
                 items.append(
                     {
@@ -358,6 +184,7 @@ def register_community_routes(app: Flask) -> None:
             return False
 
     @app.route("/api/community/reports", methods=["GET"])
+    @read_only
     def community_reports_list():
         if not _enabled():
             return jsonify({"error": "Community disabled"}), 403
@@ -391,8 +218,8 @@ def register_community_routes(app: Flask) -> None:
                         "notes": r.notes,
                         "created_at": (
                             r.created_at.isoformat()
-                            if getattr(r, "created_at", None)
-                            else None
+                            if isinstance(getattr(r, "created_at", None), datetime)
+                            else getattr(r, "created_at", None)
                         ),
                     }
                 )
@@ -0,0 +1,194 @@
+"""
+Linear crisis-level classifier over hashed word n-grams.
+
+Trained offline (scripts/train_crisis_classifier.py) and memory-mapped at
+start-up, so every worker shares one read-only copy of the weights. A message
+becomes a sparse signed feature-hashed vector of word unigrams and bigrams,
+and a batch of messages is scored with one sparse matrix multiply against the
+weight matrix.
+"""
+
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+# Layout (little-endian): 8-byte magic, uint32 dims, uint32 class count, one
+# 8-byte NUL-padded ASCII label per class, then float32 weights of shape
+# (classes, dims + 1) with the bias in the last column.
+CRISIS_MODEL_PATH = os.getenv(
+    "CRISIS_MODEL_PATH",
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "data", "crisis_model.bin"
+    ),
+)
+# Minimum class probability for the classifier to raise a keyword verdict
+CRISIS_MODEL_THRESHOLD = float(os.getenv("CRISIS_MODEL_THRESHOLD", "0.8"))
+DEFAULT_DIMS = 4096
+_MODEL_MAGIC = b"GQCRISM1"
+_MODEL_HEADER = struct.Struct("<8sII")
+_LABEL_BYTES = 8
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def tokenize(message: str) -> List[str]:
+    return _TOKEN_RE.findall((message or "").lower().replace("’", "'"))
+
+
+def _ngrams(message: str) -> List[str]:
+    words = tokenize(message)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _hashed(hashes: np.ndarray, dims: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(columns, signs) for uint32 feature hashes; the top bit picks the sign."""
+    return hashes % dims, np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+
+
+def _scale(values: np.ndarray) -> np.ndarray:
+    return np.sign(values) * np.log1p(np.abs(values))
+
+
+def featurize_one(message: str, dims: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(columns, values) of one message's row of featurize(), without the
+    sparse-matrix overhead."""
+    features = _ngrams(message)
+    hashes = np.fromiter(
+        (zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features)
+    )
+    cols, signs = _hashed(hashes, dims)
+    cols, inverse = np.unique(cols, return_inverse=True)
+    values = _scale(np.bincount(inverse, weights=signs)).astype(np.float32)
+    norm = np.linalg.norm(values)
+    return cols, (values / norm if norm else values)
+
+
+def featurize(messages: Sequence[str], dims: int) -> sparse.csr_matrix:
+    """Sparse (len(messages), dims) rows: signed hashed unigram + bigram
+    counts, log-scaled and L2-normalised."""
+    rows: List[int] = []
+    hashes: List[int] = []
+    for row, message in enumerate(messages):
+        features = _ngrams(message)
+        hashes.extend(zlib.crc32(f.encode()) for f in features)
+        rows.extend([row] * len(features))
+    cols, signs = _hashed(np.array(hashes, dtype=np.uint32), dims)
+    X = sparse.csr_matrix(
+        (signs, (rows, cols)),
+        shape=(len(messages), dims),
+        dtype=np.float32,
+    )  # duplicate (row, column) entries are summed
+    X.data = _scale(X.data)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms).dot(X).tocsr().astype(np.float32)
+
+
+def save_model(path: str, labels: Sequence[str], weights: np.ndarray) -> None:
+    """Write a model file atomically; weights are (classes, dims + 1)."""
+    weights = np.asarray(weights, dtype="<f4")
+    if weights.ndim != 2 or weights.shape[0] != len(labels):
+        raise ValueError(
+            f"weights shape {weights.shape} does not match {len(labels)} labels"
+        )
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_MODEL_HEADER.pack(_MODEL_MAGIC, weights.shape[1] - 1, len(labels)))
+        for label in labels:
+            f.write(label.encode("ascii").ljust(_LABEL_BYTES, b"\0")[:_LABEL_BYTES])
+        f.write(weights.tobytes())
+    os.replace(tmp_path, path)
+
+
+class CrisisClassifier:
+    """Memory-mapped multinomial logistic regression over hashed n-grams."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, dims, n_classes = _MODEL_HEADER.unpack_from(self._mm, 0)
+        if magic != _MODEL_MAGIC:
+            raise ValueError(f"Not a crisis model file: {path}")
+        offset = _MODEL_HEADER.size
+        self.labels = [
+            self._mm[offset + i * _LABEL_BYTES : offset + (i + 1) * _LABEL_BYTES]
+            .rstrip(b"\0")
+            .decode("ascii")
+            for i in range(n_classes)
+        ]
+        offset += n_classes * _LABEL_BYTES
+        count = n_classes * (dims + 1)
+        if len(self._mm) < offset + count * 4:
+            raise ValueError(f"Truncated crisis model file: {path}")
+        weights = np.frombuffer(self._mm, dtype="<f4", count=count, offset=offset)
+        weights = weights.reshape(n_classes, dims + 1)
+        self.dims = dims
+        # (dims, classes) view so scoring is X @ W + b
+        self._W = weights[:, :dims].T
+        self._b = weights[:, dims]
+
+    def predict_proba(self, messages: Sequence[str]) -> np.ndarray:
+        """(len(messages), classes) probabilities from one sparse matmul."""
+        logits = featurize(messages, self.dims) @ self._W + self._b
+        logits -= logits.max(axis=1, keepdims=True)
+        np.exp(logits, out=logits)
+        return logits / logits.sum(axis=1, keepdims=True)
+
+    def predict_batch(self, messages: Sequence[str]) -> List[Tuple[str, float]]:
+        """(label, probability) of the most likely class for each message."""
+        if not len(messages):
+            return []
+        proba = self.predict_proba(messages)
+        best = proba.argmax(axis=1)
+        return [(self.labels[i], float(p[i])) for i, p in zip(best, proba)]
+
+    def predict(self, message: str) -> Tuple[str, float]:
+        """Most likely (label, probability) for one message, via a gather of
+        the weight rows its features hit."""
+        cols, values = featurize_one(message, self.dims)
+        logits = values @ self._W[cols] + self._b
+        proba = np.exp(logits - logits.max())
+        proba /= proba.sum()
+        best = int(proba.argmax())
+        return self.labels[best], float(proba[best])
+
+
+_classifier: Optional[CrisisClassifier] = None
+_classifier_loaded = False
+_classifier_lock = threading.Lock()
+
+
+def load_classifier(path: Optional[str] = None) -> Optional[CrisisClassifier]:
+    """(Re)load the model file. Missing or unreadable file -> None (keywords only)."""
+    global _classifier, _classifier_loaded
+    path = path or CRISIS_MODEL_PATH
+    with _classifier_lock:
+        try:
+            _classifier = CrisisClassifier(path) if os.path.exists(path) else None
+        except Exception as e:
+            logger.warning(f"Crisis model load failed: {e}")
+            _classifier = None
+        if _classifier is not None:
+            logger.info(
+                f"Crisis classifier loaded from {path} "
+                f"({_classifier.dims} dims, labels={_classifier.labels})"
+            )
+        _classifier_loaded = True
+    return _classifier
+
+
+def get_classifier() -> Optional[CrisisClassifier]:
+    if not _classifier_loaded:
+        load_classifier()
+    return _classifier
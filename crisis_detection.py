@@ -1,16 +1,14 @@
 import re
+import functools
+from collections import deque
 from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
 
+import crisis_classifier
 
-def detect_crisis_level(message):
-    """
-    Analyze message for crisis indicators and return risk level.
-    Returns risk level string: 'low', 'medium', 'high', 'crisis'
-    """
-    message = message.lower()
-
-    # Crisis keywords with risk levels
-    crisis_keywords = [
+# Risk-level phrases for detect_crisis_level, most severe first
+LEVEL_KEYWORDS: Dict[str, List[str]] = {
+    "crisis": [
         "suicide",
         "kill myself",
         "want to die",
@@ -19,39 +17,228 @@ def detect_crisis_level(message):
         "take me from this earth",
         "take me from earth",
         "remove me from earth",
-    ]
-    high_risk_keywords = [
+    ],
+    "high": [
         "hopeless",
         "worthless",
         "can't go on",
         "give up",
         "self harm",
         "hurt myself",
-    ]
-    medium_risk_keywords = [
+    ],
+    "medium": [
         "sad",
         "depressed",
         "anxious",
         "stressed",
         "overwhelmed",
         "lonely",
-    ]
-    low_risk_keywords = ["tired", "worried", "concerned", "frustrated"]
+    ],
+    "low": ["tired", "worried", "concerned", "frustrated"],
+}
+
+# Weighted phrases for the enhanced detector's normalized score
+WEIGHTED_KEYWORDS: Dict[str, float] = {
+    "suicide": 1.0,
+    "kill myself": 1.0,
+    "want to die": 1.0,
+    "end it all": 1.0,
+    "take me from this earth": 1.0,
+    "take me from earth": 1.0,
+    "remove me from earth": 1.0,
+    "self harm": 0.9,
+    "cut myself": 0.9,
+    "hurt myself": 0.9,
+    "hopeless": 0.8,
+    "no hope": 0.8,
+    "worthless": 0.8,
+    "useless": 0.8,
+    "depressed": 0.7,
+    "depression": 0.7,
+    "anxiety": 0.6,
+    "panic": 0.6,
+    "lonely": 0.5,
+    "alone": 0.5,
+    "isolated": 0.5,
+    "stress": 0.4,
+    "overwhelmed": 0.4,
+    "can't cope": 0.4,
+}
+
+# Phrases that make providers drop the conversation history for the turn
+HISTORY_RESET_KEYWORDS: List[str] = [
+    "die",
+    "suicide",
+    "kill myself",
+    "end my life",
+    "take my life",
+    "want to die",
+]
+
+_LEVEL_ORDER = ("crisis", "high", "medium", "low")
+
+# Numeric risk_score stored next to each level in conversation_logs
+RISK_LEVEL_SCORES: Dict[str, float] = {
+    "low": 0.0,
+    "medium": 0.5,
+    "high": 0.8,
+    "crisis": 1.0,
+}
+
+
+def risk_level_score(risk_level: str) -> float:
+    return RISK_LEVEL_SCORES.get((risk_level or "").lower(), 0.0)
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton: every pattern found in one pass over the text.
+
+    A match must start at a word boundary (no letter, digit or underscore
+    before it). Patterns in `prefixes` may run on into a longer word, so
+    "self harm" also matches "self harming"; the others must end at a word
+    boundary too.
+    """
+
+    def __init__(self, patterns: Iterable[str], prefixes: Iterable[str] = ()):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+        self._prefixes = frozenset(prefixes)
+        for pattern in dict.fromkeys(patterns):
+            self._add(pattern)
+        self._link()
+
+    def _add(self, pattern: str) -> None:
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][ch] = nxt
+            state = nxt
+        self._out[state].append(pattern)
 
-    # Check for crisis level
-    if any(keyword in message for keyword in crisis_keywords):
-        return "crisis"
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
 
-    # Check for high risk
-    if any(keyword in message for keyword in high_risk_keywords):
-        return "high"
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """Yield (start, end, pattern) for each match, end exclusive."""
+        goto, fail, out, prefixes = self._goto, self._fail, self._out, self._prefixes
+        state = 0
+        n = len(text)
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for pattern in out[state]:
+                    start, end = i + 1 - len(pattern), i + 1
+                    if (start == 0 or not _is_word_char(text[start - 1])) and (
+                        end == n or pattern in prefixes or not _is_word_char(text[end])
+                    ):
+                        yield start, end, pattern
 
-    # Check for medium risk
-    if any(keyword in message for keyword in medium_risk_keywords):
-        return "medium"
 
-    # Check for low risk
-    if any(keyword in message for keyword in low_risk_keywords):
-        return "low"
+class CrisisScan(NamedTuple):
+    """Everything the crisis detectors need from one pass over a message."""
+
+    level: str  # detect_crisis_level result
+    keywords: Tuple[str, ...]  # WEIGHTED_KEYWORDS found, in table order
+    score: float  # sum of their weights / sum of all weights
+    resets_history: bool
+
+
+_RISK_KEYWORDS = [kw for kws in LEVEL_KEYWORDS.values() for kw in kws] + list(
+    WEIGHTED_KEYWORDS
+)
+# Risk phrases match inflections as well ("suicides", "hopelessly", "self
+# harmed"), like the substring checks they replaced: a missed crisis costs
+# more than a false alarm. History-reset-only phrases stay whole-word, so
+# "diet" does not clear the history.
+_AUTOMATON = KeywordAutomaton(
+    _RISK_KEYWORDS + HISTORY_RESET_KEYWORDS, prefixes=_RISK_KEYWORDS
+)
+_LEVEL_OF = {
+    kw: level for level in reversed(_LEVEL_ORDER) for kw in LEVEL_KEYWORDS[level]
+}
+_WEIGHT_RANK = {kw: i for i, kw in enumerate(WEIGHTED_KEYWORDS)}
+_MAX_WEIGHT = sum(WEIGHTED_KEYWORDS.values())
+_RESETS = frozenset(HISTORY_RESET_KEYWORDS)
+
+
+def _normalize(message: str) -> str:
+    return (message or "").lower().replace("’", "'")
+
+
+@functools.lru_cache(maxsize=4096)
+def scan_message(message: str) -> CrisisScan:
+    """Single automaton pass shared by all crisis keyword checks (memoized)."""
+    found = {pattern for _, _, pattern in _AUTOMATON.finditer(_normalize(message))}
+
+    levels = {_LEVEL_OF[kw] for kw in found if kw in _LEVEL_OF}
+    level = next((lvl for lvl in _LEVEL_ORDER if lvl in levels), "low")
+    keywords = tuple(
+        sorted((kw for kw in found if kw in _WEIGHT_RANK), key=_WEIGHT_RANK.get)
+    )
+    score = sum(WEIGHTED_KEYWORDS[kw] for kw in keywords) / _MAX_WEIGHT
+    return CrisisScan(level, keywords, score, bool(found & _RESETS))
+
+
+def _more_severe(level: str, than: str) -> bool:
+    return level in _LEVEL_ORDER and _LEVEL_ORDER.index(level) < _LEVEL_ORDER.index(
+        than
+    )
+
+
+def second_opinion(
+    level: str, prediction: Optional[Tuple[str, float]], threshold: float = None
+) -> str:
+    """Keyword level, raised to the classifier's label when that is more severe
+    and at least `threshold` probable. The classifier never lowers a level."""
+    if prediction is None:
+        return level
+    label, probability = prediction
+    if threshold is None:
+        threshold = crisis_classifier.CRISIS_MODEL_THRESHOLD
+    if probability >= threshold and _more_severe(label, level):
+        return label
+    return level
+
+
+def detect_crisis_level(message):
+    """
+    Analyze message for crisis indicators and return risk level.
+    Returns risk level string: 'low', 'medium', 'high', 'crisis'
+    """
+    level = scan_message(message).level
+    classifier = crisis_classifier.get_classifier()
+    if classifier is None or level == _LEVEL_ORDER[0]:
+        return level
+    return second_opinion(level, classifier.predict(message or ""))
+
 
-    return "low"
+def detect_crisis_levels(messages: Sequence[str]) -> List[str]:
+    """detect_crisis_level for many messages; the classifier scores them in
+    one batch."""
+    levels = [scan_message(message).level for message in messages]
+    classifier = crisis_classifier.get_classifier()
+    if classifier is None:
+        return levels
+    predictions = classifier.predict_batch([message or "" for message in messages])
+    return [second_opinion(lvl, pred) for lvl, pred in zip(levels, predictions)]
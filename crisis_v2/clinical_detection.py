@@ -6,13 +6,20 @@ Based on Columbia Suicide Severity Rating Scale (C-SSRS) and PHQ-9
 
 import re
 import json
-from typing import Dict, List, Tuple, Optional, Set
+import time
+import functools
+from typing import Dict, List, NamedTuple, Tuple, Optional, Set
 from datetime import datetime, timedelta
 from dataclasses import dataclass
 from enum import Enum
 import numpy as np
 from collections import defaultdict
 
+from crisis_v2.risk_history import get_risk_history_store
+
+# Per-detector memo of message feature scans
+SCAN_CACHE_SIZE = 4096
+
 
 class RiskLevel(Enum):
     """Clinical risk levels based on DSM-5 criteria"""
@@ -28,6 +35,40 @@ class RiskLevel(Enum):
         self.description = description
 
 
+class MessageFeatures(NamedTuple):
+    """Everything the detector reads from one message, from a single regex pass"""
+    indicators: Tuple['ClinicalIndicator', ...]  # in CLINICAL_INDICATORS order
+    risk_score: float  # _calculate_risk_score(indicators)
+    goodbye: int  # GOODBYE_PATTERNS matched
+    distortions: int  # DISTORTION_PATTERNS matched
+    absolutist: int  # ABSOLUTIST_WORDS present
+    negative: int  # NEGATIVE_WORDS present
+    first_person: int  # occurrences of the pronoun "I"
+    word_count: int
+
+
+def _non_capturing(pattern: str) -> str:
+    """Turn plain groups into (?:...) so only the feature names capture"""
+    return re.sub(r'(?<!\\)\((?!\?)', '(?:', pattern)
+
+
+def _fuse_patterns(named: List[Tuple[str, str]]) -> re.Pattern:
+    """One alternation of named groups, tried at every word start.
+
+    Every pattern starts with \\b followed by a word character, so the leading
+    \\b is hoisted into a single (?<!\\w) guard. The alternation sits in a
+    zero-width lookahead, so overlapping matches (an ideation phrase inside a
+    plan, say) are all reported; at any one start position only the first
+    matching branch is, so no two patterns should match from the same word.
+    """
+    branches = []
+    for name, pattern in named:
+        if pattern.startswith(r'\b'):
+            pattern = pattern[2:]
+        branches.append(f'(?P<{name}>{_non_capturing(pattern)})')
+    return re.compile(r'(?<!\w)(?=' + '|'.join(branches) + ')', re.IGNORECASE)
+
+
 @dataclass
 class ClinicalIndicator:
     """Clinical indicator with evidence-based weighting"""
@@ -138,22 +179,57 @@ class ClinicalCrisisDetector:
         'concentration': r'\b(can\'t\s+concentrate|can\'t\s+focus|distracted|foggy)\b',
         'psychomotor': r'\b(moving\s+slowly|restless|agitated|can\'t\s+sit\s+still)\b',
     }
+
+    # Contextual and linguistic features
+    GOODBYE_PATTERNS = [
+        r'\b(goodbye|farewell|final\s+message|last\s+words|want\s+you\s+to\s+know)\b',
+        r'\b(thank\s+you\s+for\s+everything|sorry\s+for\s+everything|forgive\s+me)\b',
+    ]
+    DISTORTION_PATTERNS = [
+        r'\b(all\s+or\s+nothing|black\s+and\s+white)\b',
+        r'\b(should|must|have\s+to)\b',
+        r'\b(catastroph|disaster|ruin|destroy)\b',
+    ]
+    # Matched as substrings of the lowercased message
+    ABSOLUTIST_WORDS = ['always', 'never', 'nothing', 'everything', 'completely', 'totally']
+    NEGATIVE_WORDS = ['hate', 'pain', 'hurt', 'suffer', 'agony', 'misery', 'torment']
     
     def __init__(self):
         """Initialize clinical detector with compiled patterns"""
         self.compiled_indicators = self._compile_patterns()
-        self.risk_history = defaultdict(list)
-        self.session_baselines = {}
-        
-    def _compile_patterns(self) -> Dict[str, List[Tuple[re.Pattern, ClinicalIndicator]]]:
-        """Compile regex patterns for performance"""
-        compiled = {}
-        for category, indicators in self.CLINICAL_INDICATORS.items():
-            compiled[category] = [
-                (re.compile(ind.pattern, re.IGNORECASE), ind)
-                for ind in indicators
-            ]
-        return compiled
+        self._scan = functools.lru_cache(maxsize=SCAN_CACHE_SIZE)(self._scan_message)
+        self.risk_history = get_risk_history_store()
+        
+    def _compile_patterns(self) -> re.Pattern:
+        """Fuse indicator, goodbye and distortion patterns into one regex"""
+        self._indicators = [
+            ind for indicators in self.CLINICAL_INDICATORS.values() for ind in indicators
+        ]
+        named = [(f'ind{i}', ind.pattern) for i, ind in enumerate(self._indicators)]
+        named += [(f'goodbye{i}', p) for i, p in enumerate(self.GOODBYE_PATTERNS)]
+        named += [(f'distortion{i}', p) for i, p in enumerate(self.DISTORTION_PATTERNS)]
+        named.append(('first_person', r'\bi\b'))
+        return _fuse_patterns(named)
+        
+    def _scan_message(self, message: str) -> MessageFeatures:
+        """Single pass over the message for every feature (memoized via _scan)"""
+        found = defaultdict(int)
+        for match in self.compiled_indicators.finditer(message):
+            found[match.lastgroup] += 1
+        indicators = tuple(
+            ind for i, ind in enumerate(self._indicators) if f'ind{i}' in found
+        )
+        lowered = message.lower()
+        return MessageFeatures(
+            indicators=indicators,
+            risk_score=self._calculate_risk_score(indicators),
+            goodbye=sum(1 for name in found if name.startswith('goodbye')),
+            distortions=sum(1 for name in found if name.startswith('distortion')),
+            absolutist=sum(1 for word in self.ABSOLUTIST_WORDS if word in lowered),
+            negative=sum(1 for word in self.NEGATIVE_WORDS if word in lowered),
+            first_person=found['first_person'],
+            word_count=len(message.split()),
+        )
         
     def assess_risk(self, 
                    message: str,
@@ -220,14 +296,7 @@ class ClinicalCrisisDetector:
         
     def _detect_clinical_indicators(self, message: str) -> List[ClinicalIndicator]:
         """Detect clinical indicators in message"""
-        found = []
-        
-        for category, patterns in self.compiled_indicators.items():
-            for pattern, indicator in patterns:
-                if pattern.search(message):
-                    found.append(indicator)
-                    
-        return found
+        return list(self._scan(message).indicators)
         
     def _calculate_risk_score(self, indicators: List[ClinicalIndicator]) -> float:
         """Calculate weighted risk score"""
@@ -247,19 +316,14 @@ class ClinicalCrisisDetector:
     def _analyze_context(self, message: str, history: Optional[List[str]], metadata: Optional[Dict]) -> float:
         """Analyze contextual factors"""
         context_score = 0.0
+        features = self._scan(message)
         
         # Check message length (very short might indicate withdrawal)
-        if len(message.split()) < 5:
+        if features.word_count < 5:
             context_score += 0.1
             
         # Check for goodbye language
-        goodbye_patterns = [
-            r'\b(goodbye|farewell|final\s+message|last\s+words|want\s+you\s+to\s+know)\b',
-            r'\b(thank\s+you\s+for\s+everything|sorry\s+for\s+everything|forgive\s+me)\b',
-        ]
-        for pattern in goodbye_patterns:
-            if re.search(pattern, message, re.I):
-                context_score += 0.5
+        context_score += 0.5 * features.goodbye
                 
         # Check time of day (late night/early morning higher risk)
         if metadata and 'timestamp' in metadata:
@@ -277,19 +341,19 @@ class ClinicalCrisisDetector:
         
     def _analyze_temporal_patterns(self, session_id: str, current_score: float) -> float:
         """Analyze temporal risk patterns"""
-        history = self.risk_history[session_id]
+        history = self.risk_history.recent(session_id, 10)
         
         if not history:
             return 0.0
             
         # Check for rapid escalation
-        recent_scores = [h['score'] for h in history[-5:]]
+        recent_scores = [h.severity for h in history[-5:]]
         if len(recent_scores) >= 2:
             if recent_scores[-1] > recent_scores[-2] * 1.5:
                 return 0.3  # Rapid escalation
                 
         # Check for sustained high risk
-        high_risk_duration = sum(1 for h in history[-10:] if h['score'] > 2.5)
+        high_risk_duration = sum(1 for h in history[-10:] if h.severity > 2.5)
         if high_risk_duration > 5:
             return 0.2  # Sustained risk
             
@@ -298,31 +362,20 @@ class ClinicalCrisisDetector:
     def _analyze_linguistic_features(self, message: str) -> float:
         """Analyze linguistic features for risk assessment"""
         score = 0.0
+        features = self._scan(message)
         
         # Absolutist language
-        absolutist_words = ['always', 'never', 'nothing', 'everything', 'completely', 'totally']
-        absolutist_count = sum(1 for word in absolutist_words if word in message.lower())
-        score += absolutist_count * 0.05
+        score += features.absolutist * 0.05
         
         # First person singular pronouns (isolation indicator)
-        i_count = len(re.findall(r'\bi\b', message.lower()))
-        if i_count > 10:
+        if features.first_person > 10:
             score += 0.1
             
         # Negative emotion words
-        negative_words = ['hate', 'pain', 'hurt', 'suffer', 'agony', 'misery', 'torment']
-        negative_count = sum(1 for word in negative_words if word in message.lower())
-        score += negative_count * 0.08
+        score += features.negative * 0.08
         
         # Cognitive distortion patterns
-        distortion_patterns = [
-            r'\b(all\s+or\s+nothing|black\s+and\s+white)\b',
-            r'\b(should|must|have\s+to)\b',
-            r'\b(catastroph|disaster|ruin|destroy)\b',
-        ]
-        for pattern in distortion_patterns:
-            if re.search(pattern, message, re.I):
-                score += 0.05
+        score += features.distortions * 0.05
                 
         return score
         
@@ -463,11 +516,8 @@ class ClinicalCrisisDetector:
         if len(messages) < 2:
             return False
             
-        # Compare risk scores of recent messages
-        scores = []
-        for msg in messages[-3:]:
-            indicators = self._detect_clinical_indicators(msg)
-            scores.append(self._calculate_risk_score(indicators))
+        # Compare risk scores of recent messages (history scans are memoized)
+        scores = [self._scan(msg).risk_score for msg in messages[-3:]]
             
         # Check for increasing pattern
         if len(scores) >= 2:
@@ -477,13 +527,9 @@ class ClinicalCrisisDetector:
         
     def _update_risk_history(self, session_id: str, assessment: Dict):
         """Update risk history for pattern detection"""
-        self.risk_history[session_id].append({
-            'timestamp': datetime.utcnow().isoformat(),
-            'risk_level': assessment['risk_level'].code,
-            'score': assessment['risk_level'].severity,
-            'indicators': len(assessment['clinical_indicators']),
-        })
-        
-        # Keep only recent history (last 100 assessments)
-        if len(self.risk_history[session_id]) > 100:
-            self.risk_history[session_id] = self.risk_history[session_id][-100:]
+        self.risk_history.append(
+            session_id,
+            time.time(),
+            assessment['risk_level'].severity,
+            len(assessment['clinical_indicators']),
+        )
@@ -0,0 +1,220 @@
+"""
+Per-session risk history for the clinical crisis detector.
+
+Each session keeps a fixed-size ring of (epoch, severity, indicator count)
+entries in typed arrays instead of a growing list of dicts. Sessions live in an
+in-process LRU with TTL expiry and a hard memory cap, or in Redis so temporal
+escalation is seen across gunicorn workers.
+"""
+
+import os
+import heapq
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+from providers.health import _FallbackStore
+
+RISK_HISTORY_LENGTH = int(os.getenv('RISK_HISTORY_LENGTH', '100'))
+RISK_HISTORY_TTL_SECONDS = float(os.getenv('RISK_HISTORY_TTL_SECONDS', '86400'))
+RISK_HISTORY_MAX_SESSIONS = int(os.getenv('RISK_HISTORY_MAX_SESSIONS', '50000'))
+RISK_HISTORY_MAX_BYTES = int(os.getenv('RISK_HISTORY_MAX_BYTES', str(16 * 1024 * 1024)))
+
+# epoch (double), severity (int8), indicator count (uint16)
+_ENTRY = struct.Struct('<dbH')
+# Rough per-session bookkeeping cost on top of the array payloads
+_SESSION_OVERHEAD_BYTES = 300
+
+
+def _debug(*args):
+    if (os.getenv('AI_DEBUG_LOGS') or '').lower() == 'true':
+        print('[risk_history]', *args)
+
+
+class RiskEntry(NamedTuple):
+    epoch: float
+    severity: int
+    indicators: int
+
+
+class RiskRing:
+    """Fixed-capacity ring of risk entries backed by three typed arrays."""
+
+    __slots__ = ('capacity', '_epochs', '_severities', '_indicators', '_start')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._epochs = array('d')
+        self._severities = array('b')
+        self._indicators = array('H')
+        self._start = 0  # index of the oldest entry once the ring is full
+
+    def __len__(self) -> int:
+        return len(self._epochs)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._epochs) * _ENTRY.size + _SESSION_OVERHEAD_BYTES
+
+    def append(self, epoch: float, severity: int, indicators: int):
+        indicators = min(int(indicators), 0xFFFF)
+        if len(self._epochs) < self.capacity:
+            self._epochs.append(epoch)
+            self._severities.append(severity)
+            self._indicators.append(indicators)
+            return
+        i = self._start
+        self._epochs[i], self._severities[i], self._indicators[i] = epoch, severity, indicators
+        self._start = (i + 1) % self.capacity
+
+    def recent(self, n: int) -> List[RiskEntry]:
+        """Up to the last n entries, oldest first."""
+        size = len(self._epochs)
+        out = []
+        for k in range(size - min(n, size), size):
+            i = (self._start + k) % size
+            out.append(RiskEntry(self._epochs[i], self._severities[i], self._indicators[i]))
+        return out
+
+
+class MemoryRiskHistoryStore:
+    """Per-worker LRU of session rings with TTL expiry and a memory cap.
+
+    Expiry uses a min-heap of (expires_at, session_id) with stale entries
+    skipped when popped, as in providers.history.
+    """
+
+    backend = 'memory'
+
+    def __init__(self, length: int = None, ttl_seconds: float = None,
+                 max_sessions: int = None, max_bytes: int = None):
+        self.length = length or RISK_HISTORY_LENGTH
+        self.ttl = RISK_HISTORY_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_sessions = max_sessions or RISK_HISTORY_MAX_SESSIONS
+        self.max_bytes = max_bytes or RISK_HISTORY_MAX_BYTES
+        self._rings: 'OrderedDict[str, RiskRing]' = OrderedDict()
+        self._expires_at = {}
+        self._expiry: List[tuple] = []
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def bytes_used(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def _drop(self, session_id: str):
+        ring = self._rings.pop(session_id, None)
+        if ring is not None:
+            self._bytes -= ring.nbytes
+            self._expires_at.pop(session_id, None)
+
+    def _evict(self, now: float):
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, sid = heapq.heappop(self._expiry)
+            if self._expires_at.get(sid) == expires_at:
+                self._drop(sid)
+        while self._rings and (len(self._rings) > self.max_sessions or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._rings)))
+        if len(self._expiry) > 2 * len(self._rings) + 64:
+            self._expiry = [(exp, sid) for sid, exp in self._expires_at.items()]
+            heapq.heapify(self._expiry)
+
+    def append(self, session_id: str, epoch: float, severity: int, indicators: int):
+        with self._lock:
+            now = time.time()
+            ring = self._rings.get(session_id)
+            if ring is None:
+                ring = self._rings[session_id] = RiskRing(self.length)
+            before = ring.nbytes if len(ring) else 0
+            ring.append(epoch, severity, indicators)
+            self._bytes += ring.nbytes - before
+            self._expires_at[session_id] = now + self.ttl
+            heapq.heappush(self._expiry, (now + self.ttl, session_id))
+            self._rings.move_to_end(session_id)
+            self._evict(now)
+
+    def recent(self, session_id: str, n: int) -> List[RiskEntry]:
+        with self._lock:
+            self._evict(time.time())
+            ring = self._rings.get(session_id)
+            if ring is None:
+                return []
+            self._rings.move_to_end(session_id)
+            return ring.recent(n)
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._drop(session_id)
+
+
+class RedisRiskHistoryStore:
+    """Ring as a capped Redis list of packed entries (newest first: LPUSH + LTRIM)."""
+
+    backend = 'redis'
+
+    def __init__(self, client, prefix: str = 'riskhist:', length: int = None,
+                 ttl_seconds: float = None):
+        self.redis = client
+        self.prefix = prefix
+        self.length = length or RISK_HISTORY_LENGTH
+        self.ttl = int(RISK_HISTORY_TTL_SECONDS if ttl_seconds is None else ttl_seconds)
+
+    def _k(self, session_id: str) -> str:
+        return self.prefix + session_id
+
+    def append(self, session_id: str, epoch: float, severity: int, indicators: int):
+        key = self._k(session_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lpush(key, _ENTRY.pack(epoch, severity, min(int(indicators), 0xFFFF)))
+        pipe.ltrim(key, 0, self.length - 1)
+        pipe.expire(key, max(1, self.ttl))
+        pipe.execute()
+
+    def recent(self, session_id: str, n: int) -> List[RiskEntry]:
+        raw = self.redis.lrange(self._k(session_id), 0, n - 1)
+        return [RiskEntry(*_ENTRY.unpack(item)) for item in reversed(raw)]
+
+    def clear(self, session_id: str):
+        self.redis.delete(self._k(session_id))
+
+
+# ---------- Process-wide store ----------
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_risk_history_store():
+    """Process-wide risk history store (Redis if configured, else in-process LRU)."""
+    global _store
+    with _store_lock:
+        if _store is not None:
+            return _store
+        redis_url = (os.getenv('RISK_HISTORY_REDIS_URL') or os.getenv('REDIS_URL') or '').strip()
+        if redis_url:
+            try:
+                import redis
+                client = redis.from_url(redis_url, socket_connect_timeout=1, socket_timeout=1,
+                                        retry_on_timeout=False)
+                client.ping()
+                _store = _FallbackStore(RedisRiskHistoryStore(client), MemoryRiskHistoryStore)
+                _debug('backend=redis')
+                return _store
+            except Exception as e:
+                _debug(f"redis_unavailable err={e}; using memory store")
+        _store = MemoryRiskHistoryStore()
+        _debug('backend=memory')
+        return _store
+
+
+def set_risk_history_store(store):
+    """Swap the process-wide store (tests, custom backends)."""
+    global _store
+    with _store_lock:
+        _store = store
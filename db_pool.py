@@ -0,0 +1,283 @@
+"""
+Connection-pool sizing and instrumentation.
+
+Sizing. DB_POOL_SIZING=fixed (the default) uses DB_POOL_SIZE and
+DB_MAX_OVERFLOW for every worker. DB_POOL_SIZING=auto splits a global
+connection budget across the workers instead: each worker may open
+(DB_CONNECTION_BUDGET - DB_CONNECTION_RESERVE) // GUNICORN_WORKERS
+connections, kept open for every thread that may query at once (see
+request_threads()) plus DB_POOL_BACKGROUND_CONNECTIONS (log writer, purge
+runs), with the rest as overflow. The reserve is left for the release step
+and operator scripts.
+Replica engines use the same options, so the budget applies per server.
+
+Instrumentation. instrument_engine() attaches pool event listeners and keeps
+per-pool counters (checkouts, connections opened, invalidations, timeouts,
+peak checked-out and overflow) and a histogram of checkout wait: the time
+from asking the pool for a connection to getting one, including opening a
+new connection in overflow. /api/metrics exports them as app_db_pool_*.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+DB_POOL_SIZING = os.getenv("DB_POOL_SIZING", "fixed").lower()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "2"))
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "20"))
+DB_CONNECTION_RESERVE = int(os.getenv("DB_CONNECTION_RESERVE", "3"))
+DB_POOL_BACKGROUND_CONNECTIONS = int(os.getenv("DB_POOL_BACKGROUND_CONNECTIONS", "2"))
+
+# Upper bounds (seconds) of the checkout wait histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def request_threads() -> int:
+    """Threads of one worker that may hold a connection at the same time.
+
+    GUNICORN_THREADS under WSGI. Under SERVER_MODE=asgi, the wrapped Flask
+    app's ASGI_WSGI_THREADS plus asyncio's default executor, which runs
+    _run_sync and the other asyncio.to_thread calls (min(32, CPUs + 4)
+    threads). Hedged provider calls (AI_HEDGE_MAX_THREADS) come on top.
+    """
+    if (os.getenv("SERVER_MODE") or "wsgi").lower() == "asgi":
+        threads = _env_int("ASGI_WSGI_THREADS", 16) + min(32, (os.cpu_count() or 1) + 4)
+    else:
+        threads = _env_int("GUNICORN_THREADS", 1)
+    if (os.getenv("AI_HEDGING_ENABLED") or "false").lower() == "true":
+        threads += _env_int("AI_HEDGE_MAX_THREADS", 8)
+    return threads
+
+
+def pool_sizing(
+    mode: str = None,
+    workers: int = None,
+    threads: int = None,
+    budget: int = None,
+    reserve: int = None,
+) -> Dict[str, int]:
+    """pool_size and max_overflow for one worker; see the module docstring."""
+    mode = mode or DB_POOL_SIZING
+    if mode != "auto":
+        return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW}
+    workers = max(1, workers or _env_int("GUNICORN_WORKERS", 1))
+    threads = max(1, threads or request_threads())
+    budget = DB_CONNECTION_BUDGET if budget is None else budget
+    reserve = DB_CONNECTION_RESERVE if reserve is None else reserve
+    per_worker = max(1, (budget - reserve) // workers)
+    pool_size = min(threads + DB_POOL_BACKGROUND_CONNECTIONS, per_worker)
+    return {"pool_size": pool_size, "max_overflow": per_worker - pool_size}
+
+
+def engine_options(url: str = "") -> dict:
+    """SQLALCHEMY_ENGINE_OPTIONS for url (the pool arguments only apply to a
+    queue pool, which in-memory SQLite does not use)."""
+    options = {"pool_pre_ping": True, "pool_recycle": 300}
+    if url.startswith("sqlite") and ":memory:" in url:
+        return options
+    options.update(pool_sizing())
+    options["pool_timeout"] = DB_POOL_TIMEOUT
+    options["poolclass"] = InstrumentedQueuePool
+    return options
+
+
+def check_budget(options: dict, workers: int = None) -> Optional[str]:
+    """A warning when every worker's full pool would exceed an explicitly
+    configured DB_CONNECTION_BUDGET, else None."""
+    if "pool_size" not in options or not os.getenv("DB_CONNECTION_BUDGET"):
+        return None
+    workers = max(1, workers or _env_int("GUNICORN_WORKERS", 1))
+    peak = workers * (options["pool_size"] + options["max_overflow"])
+    if peak <= DB_CONNECTION_BUDGET:
+        return None
+    return (
+        f"{workers} workers x {options['pool_size']}+{options['max_overflow']} "
+        f"connections may open {peak}, over DB_CONNECTION_BUDGET="
+        f"{DB_CONNECTION_BUDGET}; consider DB_POOL_SIZING=auto"
+    )
+
+
+class PoolMetrics:
+    """Counters and the checkout wait histogram of one engine's pool."""
+
+    def __init__(self, label: str, pool=None):
+        self.label = label
+        self.pool = pool
+        self._lock = threading.Lock()
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.peak_overflow = 0
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_buckets = [0] * len(WAIT_BUCKETS)
+        self.wait_count = 0
+        self.wait_sum = 0.0
+
+    def observe_wait(self, seconds: float):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_sum += seconds
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.wait_buckets[i] += 1
+                    break
+
+    def on_checkout(self, *_):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+            self.peak_overflow = max(self.peak_overflow, self.overflow())
+
+    def on_checkin(self, *_):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def on_connect(self, *_):
+        with self._lock:
+            self.connects += 1
+
+    def on_invalidate(self, *_):
+        with self._lock:
+            self.invalidations += 1
+
+    def on_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def size(self) -> Optional[int]:
+        return self.pool.size() if isinstance(self.pool, QueuePool) else None
+
+    def overflow(self) -> int:
+        # QueuePool.overflow() is negative while the pool is below pool_size
+        if isinstance(self.pool, QueuePool):
+            return max(0, self.pool.overflow())
+        return 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size(),
+                "checked_out": self.checked_out,
+                "peak_checked_out": self.peak_checked_out,
+                "overflow": self.overflow(),
+                "peak_overflow": self.peak_overflow,
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_buckets": list(self.wait_buckets),
+                "wait_count": self.wait_count,
+                "wait_sum": self.wait_sum,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times each checkout into its PoolMetrics."""
+
+    metrics: Optional[PoolMetrics] = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.on_timeout()
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe_wait(time.perf_counter() - started)
+
+    def recreate(self):
+        # engine.dispose() swaps in a new pool; keep counting into the same metrics
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        if self.metrics is not None:
+            self.metrics.pool = pool
+        return pool
+
+
+def instrument_engine(app, engine, label: str) -> PoolMetrics:
+    """Attach pool listeners to engine and register them as label in
+    app.extensions["db_pool_metrics"]."""
+    metrics = PoolMetrics(label, engine.pool)
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        engine.pool.metrics = metrics
+    event.listen(engine, "checkout", metrics.on_checkout)
+    event.listen(engine, "checkin", metrics.on_checkin)
+    event.listen(engine, "connect", metrics.on_connect)
+    event.listen(engine, "invalidate", metrics.on_invalidate)
+    event.listen(engine, "soft_invalidate", metrics.on_invalidate)
+    app.extensions.setdefault("db_pool_metrics", {})[label] = metrics
+    return metrics
+
+
+def metrics_lines(pools: Dict[str, PoolMetrics]) -> List[str]:
+    """Prometheus lines for the registered pools."""
+    snapshots = {label: m.snapshot() for label, m in pools.items()}
+    lines = []
+    gauges = (
+        ("size", "Configured pool_size"),
+        ("checked_out", "Connections currently checked out"),
+        ("peak_checked_out", "Most connections checked out at once"),
+        ("overflow", "Overflow connections open beyond pool_size"),
+        ("peak_overflow", "Most overflow connections open at once"),
+    )
+    for name, help_text in gauges:
+        lines += [
+            f"# HELP app_db_pool_{name} {help_text}",
+            f"# TYPE app_db_pool_{name} gauge",
+        ]
+        lines += [
+            f'app_db_pool_{name}{{pool="{label}"}} {snap[name]}'
+            for label, snap in snapshots.items()
+            if snap[name] is not None
+        ]
+    counters = (
+        ("checkouts", "Connections handed out by the pool"),
+        ("connects", "New database connections opened"),
+        ("invalidations", "Connections invalidated (disconnects, errors)"),
+        ("timeouts", "Checkouts that gave up after pool_timeout"),
+    )
+    for name, help_text in counters:
+        lines += [
+            f"# HELP app_db_pool_{name}_total {help_text}",
+            f"# TYPE app_db_pool_{name}_total counter",
+        ]
+        lines += [
+            f'app_db_pool_{name}_total{{pool="{label}"}} {snap[name]}'
+            for label, snap in snapshots.items()
+        ]
+    lines += [
+        "# HELP app_db_pool_wait_seconds Time to obtain a connection from the pool",
+        "# TYPE app_db_pool_wait_seconds histogram",
+    ]
+    for label, snap in snapshots.items():
+        cumulative = 0
+        for bound, count in zip(WAIT_BUCKETS, snap["wait_buckets"]):
+            cumulative += count
+            lines.append(
+                f'app_db_pool_wait_seconds_bucket{{pool="{label}",le="{bound}"}} {cumulative}'
+            )
+        lines += [
+            f'app_db_pool_wait_seconds_bucket{{pool="{label}",le="+Inf"}} {snap["wait_count"]}',
+            f'app_db_pool_wait_seconds_sum{{pool="{label}"}} {snap["wait_sum"]:.6f}',
+            f'app_db_pool_wait_seconds_count{{pool="{label}"}} {snap["wait_count"]}',
+        ]
+    return lines
@@ -0,0 +1,306 @@
+"""
+Read-replica routing for read-only endpoints.
+
+With DATABASE_REPLICA_URLS set (comma-separated), views marked @read_only send
+their SELECTs to a replica, round-robin per request. Everything else (every
+write, ORM flushes, SELECT ... FOR UPDATE and all reads outside those views)
+stays on the primary. RoutingSession.get_bind makes the choice, so endpoint
+code keeps using db.session.
+
+A replica is used only while its replay lag is at most REPLICA_MAX_LAG_SECONDS
+(checked at most every REPLICA_LAG_CHECK_SECONDS; a failed check counts as
+unhealthy). Read-your-writes: a session that wrote in the last
+REPLICA_STICKY_SECONDS reads from the primary. The marker lives in Redis when
+available, so it holds across workers, else in a per-worker LRU.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Dict, List, Optional
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.sql.selectable import Select
+
+from providers.health import _FallbackStore
+
+logger = logging.getLogger(__name__)
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "5"))
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+REPLICA_STICKY_MAX_SESSIONS = int(os.getenv("REPLICA_STICKY_MAX_SESSIONS", "100000"))
+
+_WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# Zero when the replica has replayed everything it received (an idle primary
+# would otherwise look like growing lag), else the age of the last replayed
+# transaction
+_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "END"
+)
+
+
+class ReplicaPool:
+    """Replica engines with round-robin selection and cached lag checks."""
+
+    def __init__(
+        self,
+        urls: List[str],
+        engine_options: dict = None,
+        max_lag: float = None,
+        check_interval: float = None,
+    ):
+        self.urls = urls
+        self.engines = [create_engine(url, **(engine_options or {})) for url in urls]
+        self.max_lag = REPLICA_MAX_LAG_SECONDS if max_lag is None else max_lag
+        self.check_interval = (
+            REPLICA_LAG_CHECK_SECONDS if check_interval is None else check_interval
+        )
+        self._lock = threading.Lock()
+        self._next = 0
+        # index -> (checked at, lag in seconds or None when unreachable)
+        self._lag: Dict[int, tuple] = {}
+        self.reads = [0] * len(self.engines)
+        self.fallbacks = 0
+
+    def _measure(self, index: int) -> Optional[float]:
+        try:
+            with self.engines[index].connect() as conn:
+                return float(conn.execute(text(_LAG_SQL)).scalar() or 0)
+        except Exception as e:
+            logger.warning(f"Replica {index} lag check failed: {e}")
+            return None
+
+    def lag(self, index: int) -> Optional[float]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._lag.get(index)
+        if cached and now - cached[0] < self.check_interval:
+            return cached[1]
+        lag = self._measure(index)
+        with self._lock:
+            self._lag[index] = (now, lag)
+        return lag
+
+    def pick(self):
+        """Next healthy replica engine, or None to use the primary."""
+        for _ in range(len(self.engines)):
+            with self._lock:
+                index = self._next % len(self.engines)
+                self._next += 1
+            lag = self.lag(index)
+            if lag is not None and lag <= self.max_lag:
+                with self._lock:
+                    self.reads[index] += 1
+                return self.engines[index]
+        self.count_fallback()
+        return None
+
+    def count_fallback(self):
+        with self._lock:
+            self.fallbacks += 1
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [
+                {
+                    "replica": index,
+                    "lag_seconds": self._lag.get(index, (None, None))[1],
+                    "reads": self.reads[index],
+                }
+                for index in range(len(self.engines))
+            ]
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+
+class MemoryStickyStore:
+    """Per-worker LRU of session id -> monotonic time of its last write."""
+
+    backend = "memory"
+
+    def __init__(self, max_sessions: int = None):
+        self.max_sessions = max_sessions or REPLICA_STICKY_MAX_SESSIONS
+        self._written: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark(self, session_id: str, ttl: float):
+        with self._lock:
+            self._written[session_id] = time.monotonic() + ttl
+            self._written.move_to_end(session_id)
+            while len(self._written) > self.max_sessions:
+                self._written.popitem(last=False)
+
+    def is_sticky(self, session_id: str) -> bool:
+        with self._lock:
+            until = self._written.get(session_id)
+        return until is not None and time.monotonic() < until
+
+
+class RedisStickyStore:
+    """Write markers shared by all workers: one key with a TTL per session."""
+
+    backend = "redis"
+
+    def __init__(self, client, prefix: str = "dbsticky:"):
+        self.redis = client
+        self.prefix = prefix
+
+    def mark(self, session_id: str, ttl: float):
+        self.redis.set(self.prefix + session_id, 1, px=max(1, int(ttl * 1000)))
+
+    def is_sticky(self, session_id: str) -> bool:
+        return bool(self.redis.exists(self.prefix + session_id))
+
+
+_sticky_store = None
+_sticky_store_lock = threading.Lock()
+
+
+def get_sticky_store():
+    """Process-wide write marker store (Redis if configured, else in-process)."""
+    global _sticky_store
+    with _sticky_store_lock:
+        if _sticky_store is not None:
+            return _sticky_store
+        redis_url = (
+            os.getenv("REPLICA_STICKY_REDIS_URL") or os.getenv("REDIS_URL") or ""
+        ).strip()
+        if redis_url:
+            try:
+                import redis
+
+                client = redis.from_url(
+                    redis_url,
+                    socket_connect_timeout=1,
+                    socket_timeout=1,
+                    retry_on_timeout=False,
+                )
+                client.ping()
+                _sticky_store = _FallbackStore(
+                    RedisStickyStore(client), MemoryStickyStore
+                )
+                return _sticky_store
+            except Exception as e:
+                logger.info(
+                    f"Replica sticky store: Redis unavailable ({e}), using memory"
+                )
+        _sticky_store = MemoryStickyStore()
+        return _sticky_store
+
+
+def set_sticky_store(store):
+    """Swap the process-wide write marker store (tests, custom backends)."""
+    global _sticky_store
+    with _sticky_store_lock:
+        _sticky_store = store
+
+
+def _request_session_ids() -> List[str]:
+    ids = [request.headers.get("X-Session-ID")]
+    # Sessions resolved (or created) by ensure_session during this request
+    ids.extend(g.get("_session_ids", {}).values())
+    return [session_id for session_id in ids if session_id]
+
+
+def _routable(clause) -> bool:
+    """Plain reads only: SELECT statements without a row lock."""
+    if isinstance(clause, Select):
+        return clause._for_update_arg is None
+    if isinstance(clause, TextClause):
+        sql = clause.text.lstrip().upper()
+        return sql.startswith("SELECT") and "FOR UPDATE" not in sql
+    return False
+
+
+def _replica_for_request():
+    if not g.get("_db_read_only") or g.get("_db_wrote"):
+        return None
+    if "_db_replica" not in g:
+        pool = current_app.extensions.get("db_replicas")
+        replica = None
+        if pool is not None:
+            sticky = get_sticky_store()
+            if any(sticky.is_sticky(s) for s in _request_session_ids()):
+                pool.count_fallback()
+            else:
+                replica = pool.pick()
+        # One replica for the whole request, so its reads are consistent
+        g._db_replica = replica
+    return g._db_replica
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends @read_only views' SELECTs to a
+    replica; see the module docstring."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            if not self._flushing and _routable(clause):
+                replica = _replica_for_request()
+                if replica is not None:
+                    return replica
+            elif clause is not None or self._flushing:
+                # A write in this request: later reads must see it
+                g._db_wrote = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    """Mark a view as read-only so its SELECTs may be served by a replica."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g._db_read_only = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def init_replica_routing(app, urls: List[str], engine_options: dict = None):
+    """Create the replica pool for DATABASE_REPLICA_URLS (Postgres only)."""
+    if not urls:
+        return None
+    if not app.config.get("SQLALCHEMY_DATABASE_URI", "").startswith("postgresql"):
+        app.logger.warning("DATABASE_REPLICA_URLS ignored: primary is not Postgres")
+        return None
+    app.logger.info(f"Read replicas configured: {len(urls)}")
+    return register_replica_pool(app, ReplicaPool(urls, engine_options))
+
+
+def register_replica_pool(app, pool: ReplicaPool) -> ReplicaPool:
+    """Route the app's @read_only views through pool, and mark sessions that
+    write so their next reads stay on the primary."""
+    app.extensions["db_replicas"] = pool
+
+    @app.before_request
+    def _reset_db_route():
+        # g outlives the request when an app context was already pushed
+        for key in ("_db_read_only", "_db_wrote", "_db_replica"):
+            g.pop(key, None)
+
+    @app.after_request
+    def _mark_session_writes(response):
+        try:
+            wrote = g.get("_db_wrote") or request.method in _WRITE_METHODS
+            if wrote and response.status_code < 400:
+                sticky = get_sticky_store()
+                for session_id in _request_session_ids():
+                    sticky.mark(session_id, REPLICA_STICKY_SECONDS)
+        except Exception as e:
+            app.logger.warning(f"Replica sticky marker failed: {e}")
+        return response
+
+    return pool
@@ -0,0 +1,372 @@
+"""
+One canonical table per entity; the legacy shapes are views over it.
+
+    sessions          -> view over user_sessions
+    self_assessments  -> view over self_assessment_entries (JSON column)
+    chat_messages     -> view over conversation_logs, one row per message
+
+The app writes only the canonical tables. The views keep old readers (and
+/api/chat_history) working on Postgres and SQLite alike; on Postgres the
+``sessions`` view is simple enough to stay insertable.
+
+Migrations 7-9 (migrations.py) move an existing database over online:
+backfill() copies legacy rows in batches that commit one by one and skip rows
+already copied, replace_legacy_tables() repeats it for rows written since,
+then swaps the tables for views in one short transaction and points the raw
+tables' session foreign keys at user_sessions (NOT VALID where Postgres
+allows it), and validate_session_fks() validates them without blocking
+writes. SQLite does not enforce foreign keys by default, so there the raw
+tables keep their old REFERENCES clauses.
+
+attach() hooks the views to the canonical tables' create and drop events, so
+db.create_all() and db.drop_all() (tests, local resets) keep them in step.
+"""
+
+import logging
+import os
+from typing import Dict, List
+
+from sqlalchemy import event, inspect, text
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "5000"))
+
+VIEW_BASES = {
+    "sessions": "user_sessions",
+    "self_assessments": "self_assessment_entries",
+    "chat_messages": "conversation_logs",
+}
+# Raw (non-model) tables whose session_id pointed at the legacy sessions table
+SESSION_FK_TABLES = ("mood_entries", "crisis_detections", "analytics_events")
+# Every table whose session_id references user_sessions
+SESSION_TABLES = (
+    "messages",
+    "conversation_logs",
+    "crisis_events",
+    "self_assessment_entries",
+) + SESSION_FK_TABLES
+
+_ASSESSMENT_SCORES = ("mood", "energy", "sleep", "stress", "social", "work")
+
+
+def _json_int(dialect: str, field: str) -> str:
+    # Scores were INTEGER columns; non-numeric answers read back as NULL
+    if dialect == "postgresql":
+        value = f"assessment_data->>'{field}'"
+        return f"CASE WHEN {value} ~ '^-?[0-9]+$' THEN CAST({value} AS INTEGER) END"
+    value = f"CAST(json_extract(assessment_data, '$.{field}') AS TEXT)"
+    return (
+        f"CASE WHEN {value} <> '' AND {value} NOT GLOB '*[^0-9]*' "
+        f"THEN CAST({value} AS INTEGER) END"
+    )
+
+
+def view_sql(name: str, dialect: str) -> str:
+    if name == "sessions":
+        return "SELECT id, created_at, last_active AS last_activity FROM user_sessions"
+    if name == "self_assessments":
+        notes = (
+            "assessment_data->>'notes'"
+            if dialect == "postgresql"
+            else "json_extract(assessment_data, '$.notes')"
+        )
+        scores = ", ".join(
+            f"{_json_int(dialect, field)} AS {field}" for field in _ASSESSMENT_SCORES
+        )
+        return (
+            f"SELECT id, session_id, {scores}, {notes} AS notes, timestamp "
+            "FROM self_assessment_entries"
+        )
+    if name == "chat_messages":
+        true, false = ("TRUE", "FALSE") if dialect == "postgresql" else ("1", "0")
+        # Even ids for the user half of a turn, odd for the reply, so
+        # ORDER BY timestamp, id keeps each question before its answer
+        return (
+            f"SELECT id * 2 AS id, session_id, user_message AS content, {true} AS is_user, "
+            "timestamp, 'text' AS message_type "
+            "FROM conversation_logs WHERE user_message <> '' "
+            f"UNION ALL SELECT id * 2 + 1, session_id, ai_response, {false}, "
+            "timestamp, 'text' FROM conversation_logs WHERE ai_response <> ''"
+        )
+    raise KeyError(name)
+
+
+def create_views(conn, names: List[str] = None, strict: bool = False) -> List[str]:
+    """Create the views whose base table exists and whose name is free.
+
+    With ``strict``, a missing base table or a legacy table still holding
+    the name raises instead of being skipped.
+    """
+    created = []
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    views = set(inspector.get_view_names())
+    for name in names or VIEW_BASES:
+        if strict and (VIEW_BASES[name] not in tables or name in tables):
+            raise RuntimeError(
+                f"Cannot create view {name}: "
+                + (
+                    f"{name} is still a table"
+                    if name in tables
+                    else f"{VIEW_BASES[name]} does not exist"
+                )
+            )
+        if VIEW_BASES[name] not in tables or name in tables or name in views:
+            continue
+        conn.execute(text(f"CREATE VIEW {name} AS {view_sql(name, conn.dialect.name)}"))
+        created.append(name)
+    return created
+
+
+def drop_views(conn, names: List[str] = None) -> List[str]:
+    """Drop the compatibility views (legacy tables of the same name are kept)."""
+    views = set(inspect(conn).get_view_names())
+    dropped = [name for name in names or VIEW_BASES if name in views]
+    for name in dropped:
+        conn.execute(text(f"DROP VIEW {name}"))
+    return dropped
+
+
+# ---------- Backfill ----------
+
+
+def _batches(conn, table: str, key: str, batch_size: int):
+    """Upper bounds of successive key ranges of batch_size rows each."""
+    after = None
+    while True:
+        where = f"WHERE {key} > :after " if after is not None else ""
+        upto = conn.execute(
+            text(
+                f"SELECT MAX({key}) FROM (SELECT {key} FROM {table} {where}"
+                f"ORDER BY {key} LIMIT :limit) batch"
+            ),
+            {"after": after, "limit": batch_size},
+        ).scalar()
+        if upto is None:
+            return
+        yield after, upto
+        after = upto
+
+
+def _copy(conn, table: str, key: str, insert_sql: str, batch_size: int) -> int:
+    """Run insert_sql (which selects from table aliased as src) per key range."""
+    copied = 0
+    for after, upto in _batches(conn, table, key, batch_size):
+        lower = f"src.{key} > :after AND " if after is not None else ""
+        result = conn.execute(
+            text(insert_sql.format(range=f"{lower}src.{key} <= :upto")),
+            {"after": after, "upto": upto},
+        )
+        copied += max(result.rowcount or 0, 0)
+    return copied
+
+
+def _backfill_sessions(conn, dialect: str, batch_size: int) -> int:
+    copied = _copy(
+        conn,
+        "sessions",
+        "id",
+        "INSERT INTO user_sessions (id, created_at, last_active, conversation_count, "
+        "risk_level) SELECT src.id, src.created_at, src.last_activity, 0, 'low' "
+        "FROM sessions src WHERE {range} "
+        # Only a later legacy last_activity rewrites the row
+        "ON CONFLICT (id) DO UPDATE SET last_active = excluded.last_active "
+        "WHERE user_sessions.last_active IS NULL "
+        "OR excluded.last_active > user_sessions.last_active",
+        batch_size,
+    )
+    # Sessions the raw tables reference without a legacy row (their foreign
+    # key to user_sessions is added with the views)
+    tables = set(inspect(conn).get_table_names())
+    for table in SESSION_FK_TABLES:
+        if table not in tables:
+            continue
+        conn.execute(
+            text(
+                "INSERT INTO user_sessions (id, created_at, last_active, "
+                "conversation_count, risk_level) "
+                "SELECT DISTINCT t.session_id, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 0, 'low' "
+                f"FROM {table} t WHERE t.session_id IS NOT NULL AND NOT EXISTS "
+                "(SELECT 1 FROM user_sessions u WHERE u.id = t.session_id) "
+                "ON CONFLICT (id) DO NOTHING"
+            )
+        )
+    return copied
+
+
+def _backfill_self_assessments(conn, dialect: str, batch_size: int) -> int:
+    pairs = [f"'{field}', src.{field}" for field in _ASSESSMENT_SCORES + ("notes",)]
+    data = (
+        f"jsonb_strip_nulls(jsonb_build_object({', '.join(pairs)}))"
+        if dialect == "postgresql"
+        else f"json_object({', '.join(pairs)})"
+    )
+    # Rows mirrored from an entry share its session and timestamp
+    conn.execute(
+        text(
+            "UPDATE self_assessments SET timestamp = CURRENT_TIMESTAMP "
+            "WHERE timestamp IS NULL"
+        )
+    )
+    return _copy(
+        conn,
+        "self_assessments",
+        "id",
+        "INSERT INTO self_assessment_entries (session_id, timestamp, assessment_data) "
+        f"SELECT src.session_id, src.timestamp, {data} FROM self_assessments src "
+        "WHERE {range} AND src.session_id IS NOT NULL AND NOT EXISTS "
+        "(SELECT 1 FROM self_assessment_entries e "
+        "WHERE e.session_id = src.session_id AND e.timestamp = src.timestamp)",
+        batch_size,
+    )
+
+
+def _backfill_chat_messages(conn, dialect: str, batch_size: int) -> int:
+    # One log row per legacy message, the other half of the turn left empty
+    # (the chat_messages view skips empty halves); risk is unknown
+    conn.execute(
+        text(
+            "UPDATE chat_messages SET timestamp = CURRENT_TIMESTAMP "
+            "WHERE timestamp IS NULL"
+        )
+    )
+    return _copy(
+        conn,
+        "chat_messages",
+        "id",
+        "INSERT INTO conversation_logs (session_id, user_message, ai_response, timestamp) "
+        "SELECT src.session_id, "
+        "CASE WHEN src.is_user THEN src.content ELSE '' END, "
+        "CASE WHEN src.is_user THEN '' ELSE src.content END, src.timestamp "
+        "FROM chat_messages src WHERE {range} AND NOT EXISTS "
+        "(SELECT 1 FROM conversation_logs c WHERE c.session_id = src.session_id "
+        "AND c.timestamp = src.timestamp AND "
+        "CASE WHEN src.is_user THEN c.user_message ELSE c.ai_response END = src.content)",
+        batch_size,
+    )
+
+
+_BACKFILLS = (
+    ("sessions", _backfill_sessions),
+    ("self_assessments", _backfill_self_assessments),
+    ("chat_messages", _backfill_chat_messages),
+)
+
+
+def widen_session_ids(conn, dialect: str):
+    """user_sessions.id and its references as wide as the legacy sessions.id
+    (VARCHAR(36) -> VARCHAR(255): a catalog change on Postgres, no rewrite)."""
+    if dialect != "postgresql":
+        return
+    tables = set(inspect(conn).get_table_names())
+    if "user_sessions" in tables:
+        conn.execute(
+            text("ALTER TABLE user_sessions ALTER COLUMN id TYPE VARCHAR(255)")
+        )
+    for table in SESSION_TABLES:
+        if table in tables and table not in SESSION_FK_TABLES:
+            conn.execute(
+                text(f"ALTER TABLE {table} ALTER COLUMN session_id TYPE VARCHAR(255)")
+            )
+
+
+def backfill(conn, dialect: str, batch_size: int = None) -> Dict[str, int]:
+    """Copy legacy rows into the canonical tables; returns rows copied per
+    legacy table. Safe to re-run: rows already copied are skipped."""
+    batch_size = batch_size or BACKFILL_BATCH_SIZE
+    tables = set(inspect(conn).get_table_names())
+    copied = {}
+    for legacy, copy in _BACKFILLS:
+        if legacy in tables and VIEW_BASES[legacy] in tables:
+            copied[legacy] = copy(conn, dialect, batch_size)
+    if copied:
+        logger.info(f"Legacy backfill: {copied}")
+    return copied
+
+
+def replace_legacy_tables(conn, dialect: str) -> Dict[str, int]:
+    """Copy what was written since the backfill, then replace each legacy
+    table with its view and reference user_sessions from the raw tables."""
+    copied = backfill(conn, dialect)
+    tables = set(inspect(conn).get_table_names())
+    for legacy, base in VIEW_BASES.items():
+        if legacy in tables and base in tables:
+            # CASCADE drops the raw tables' foreign keys to sessions
+            cascade = " CASCADE" if dialect == "postgresql" else ""
+            conn.execute(text(f"DROP TABLE {legacy}{cascade}"))
+    # A legacy table left behind would keep shadowing its view
+    create_views(conn, strict=True)
+    if dialect == "postgresql" and "user_sessions" in tables:
+        from partitions import is_partitioned
+
+        for table in SESSION_FK_TABLES:
+            if table not in tables:
+                continue
+            # Postgres cannot add NOT VALID foreign keys to partitioned tables;
+            # those are checked here, the rest by validate_session_fks()
+            not_valid = "" if is_partitioned(conn, table) else " NOT VALID"
+            conn.execute(
+                text(
+                    f"ALTER TABLE {table} ADD CONSTRAINT {table}_session_id_fkey "
+                    f"FOREIGN KEY (session_id) REFERENCES user_sessions(id){not_valid}"
+                )
+            )
+    return copied
+
+
+def validate_session_fks(conn, dialect: str) -> List[str]:
+    """Validate the NOT VALID session foreign keys (SHARE UPDATE EXCLUSIVE
+    lock: reads and writes continue)."""
+    if dialect != "postgresql":
+        return []
+    pending = (
+        conn.execute(
+            text(
+                "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+                "WHERE contype = 'f' AND NOT convalidated "
+                "AND confrelid = to_regclass('user_sessions')"
+            )
+        )
+        .tuples()
+        .all()
+    )
+    for table, name in pending:
+        conn.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}"))
+    return [name for _, name in pending]
+
+
+# ---------- Model lifecycle ----------
+
+
+def _drop_session_fks(conn):
+    if conn.dialect.name != "postgresql":
+        return
+    tables = set(inspect(conn).get_table_names())
+    for table in SESSION_FK_TABLES:
+        if table in tables:
+            conn.execute(
+                text(
+                    f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_session_id_fkey"
+                )
+            )
+
+
+def attach(metadata):
+    """Create and drop the views with their canonical model tables."""
+    for view, base in VIEW_BASES.items():
+        table = metadata.tables.get(base)
+        if table is None:
+            continue
+
+        def after_create(target, connection, view=view, **kw):
+            create_views(connection, [view])
+
+        def before_drop(target, connection, view=view, **kw):
+            drop_views(connection, [view])
+            if view == "sessions":
+                # The raw tables' references would block dropping user_sessions
+                _drop_session_fks(connection)
+
+        event.listen(table, "after_create", after_create)
+        event.listen(table, "before_drop", before_drop)
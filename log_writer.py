@@ -0,0 +1,482 @@
+"""
+Write-behind buffer for conversation_logs and crisis_detections rows.
+
+Request handlers call submit(), which appends the row to this process's spill
+segment (a JSON-lines journal on local disk) and to a bounded in-memory batch,
+then returns. A flusher thread rotates the segment every LOG_FLUSH_INTERVAL_MS
+(or sooner once LOG_FLUSH_ROWS rows are waiting), writes the batch with one
+multi-row INSERT per table and deletes the segment once committed. Rows that
+overflow the in-memory batch are only in the segment and are read back from it.
+
+Segments outlive the process: close() drains everything at shutdown, and a
+worker that starts up replays the segments a dead worker left behind. A
+segment that keeps failing while other segments are written (a row for a
+missing table, say) is moved to ``quarantine/`` after LOG_SEGMENT_MAX_ATTEMPTS
+tries; it never holds up the segments behind it.
+"""
+
+import atexit
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import column, insert, table
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+LOG_WRITE_BEHIND = os.getenv("LOG_WRITE_BEHIND", "true").lower() == "true"
+# Unset: a directory per environment and database under the system temp dir
+LOG_SPILL_DIR = os.getenv("LOG_SPILL_DIR")
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "10000"))
+LOG_FLUSH_INTERVAL_MS = int(os.getenv("LOG_FLUSH_INTERVAL_MS", "200"))
+LOG_FLUSH_ROWS = int(os.getenv("LOG_FLUSH_ROWS", "500"))
+# Failed writes of one segment (while others succeed) before it is moved to
+# <spill dir>/quarantine
+LOG_SEGMENT_MAX_ATTEMPTS = int(os.getenv("LOG_SEGMENT_MAX_ATTEMPTS", "5"))
+# Crisis detections skip the buffer and commit on the request path: the spill
+# journal is lost with an ephemeral disk (e.g. a redeploy on Render)
+CRISIS_LOG_SYNC = os.getenv("CRISIS_LOG_SYNC", "true").lower() == "true"
+
+TABLES = {
+    "conversation_logs": table(
+        "conversation_logs",
+        column("session_id"),
+        column("user_message"),
+        column("ai_response"),
+        column("risk_level"),
+        column("risk_score"),
+        column("timestamp"),
+    ),
+    "crisis_detections": table(
+        "crisis_detections",
+        column("session_id"),
+        column("message"),
+        column("risk_level"),
+        column("risk_score"),
+        column("keywords"),
+        column("timestamp"),
+    ),
+}
+# Rows per INSERT statement (Postgres allows 65535 bind parameters)
+_INSERT_CHUNK = 1000
+_MAX_BACKOFF_SECONDS = 30.0
+
+Record = Tuple[str, Dict[str, Any]]
+
+_fork_lock = threading.Lock()
+# Segment prefixes (<pid>-<token>) of writers running in this process
+_live_prefixes = set()
+
+
+def _encode(record: Record) -> str:
+    name, row = record
+    return json.dumps(
+        [
+            name,
+            {
+                k: v.isoformat() if isinstance(v, datetime) else v
+                for k, v in row.items()
+            },
+        ]
+    )
+
+
+def _decode(line: str) -> Record:
+    name, row = json.loads(line)
+    if row.get("timestamp"):
+        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    return name, row
+
+
+def _read_segment(path: str) -> List[Record]:
+    """Records in a segment; a torn last line (crash mid-write) is skipped."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(_decode(line))
+            except ValueError:
+                logger.warning(f"Skipping unreadable spill line in {path}")
+    return records
+
+
+def default_spill_dir(engine) -> str:
+    """Spill directory shared by the workers that write to the same database
+    (so they can replay each other's leftovers) and by nothing else. An
+    in-memory database dies with the process, so its writer gets its own."""
+    if engine.url.database in (None, "", ":memory:"):
+        return tempfile.mkdtemp(prefix="gentlequest_log_spill-")
+    url = engine.url.render_as_string(hide_password=False)
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+    environment = (os.getenv("ENVIRONMENT") or "local").lower()
+    return os.path.join(
+        tempfile.gettempdir(), "gentlequest_log_spill", f"{environment}-{digest}"
+    )
+
+
+def _original_name(name: str) -> str:
+    """Segment file name without the prefixes added each time it was adopted."""
+    return name.rsplit("-adopted-", 1)[-1]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def insert_rows(engine, records: List[Record]) -> int:
+    """Multi-row INSERTs in one transaction; returns rows written.
+
+    If the batch is rejected for its data (a bad row, a missing session for
+    the foreign key) the rows are retried one by one and the rejected ones are
+    logged and dropped, so one poison row cannot wedge the queue. Connection
+    errors propagate and the caller keeps the segment for a retry.
+    """
+    by_table: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for name, row in records:
+        by_table[name].append(row)
+    try:
+        with engine.begin() as conn:
+            for name, rows in by_table.items():
+                for i in range(0, len(rows), _INSERT_CHUNK):
+                    conn.execute(
+                        insert(TABLES[name]).values(rows[i : i + _INSERT_CHUNK])
+                    )
+        return len(records)
+    except (IntegrityError, DataError) as e:
+        logger.warning(f"Log batch rejected ({e.orig}); retrying row by row")
+    written = 0
+    for name, row in records:
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(TABLES[name]).values(row))
+            written += 1
+        except (IntegrityError, DataError) as e:
+            logger.error(
+                f"Dropping {name} row for session {row.get('session_id')}: {e.orig}"
+            )
+    return written
+
+
+class LogWriter:
+    """Per-process write-behind queue with an on-disk spill journal."""
+
+    def __init__(
+        self,
+        engine,
+        spill_dir: str = None,
+        max_queue: int = None,
+        flush_interval_ms: int = None,
+        flush_rows: int = None,
+        max_attempts: int = None,
+    ):
+        self.engine = engine
+        self.spill_dir = spill_dir or LOG_SPILL_DIR or default_spill_dir(engine)
+        self.max_queue = max_queue or LOG_QUEUE_MAX
+        self.flush_interval = (flush_interval_ms or LOG_FLUSH_INTERVAL_MS) / 1000.0
+        self.flush_rows = flush_rows or LOG_FLUSH_ROWS
+        self.max_attempts = max_attempts or LOG_SEGMENT_MAX_ATTEMPTS
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._start()
+        atexit.register(self.close)
+
+    def _start(self):
+        # Segment names: <pid>-<writer token>-<sequence>.jsonl
+        self._pid = os.getpid()
+        self._prefix = f"{self._pid}-{uuid.uuid4().hex[:8]}"
+        _live_prefixes.add(self._prefix)
+        self._sequence = 0
+        self._segment = None
+        self._segment_path: Optional[str] = None
+        self._batch: List[Record] = []
+        # The batch being written by the flusher right now
+        self._inflight: List[Record] = []
+        self._overflowed = False
+        # Closed segments not yet committed (failed writes, adopted leftovers)
+        self._retry: List[str] = []
+        # Segment path -> failed writes not caused by a lost connection
+        self._attempts: Dict[str, int] = {}
+
+        self._committed_cond = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self.submitted = 0
+        self.committed = 0
+        self.dropped = 0
+        self.failures = 0
+        self.quarantined = 0
+
+        self._adopt_orphans()
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    # ---------- Producer side ----------
+
+    def submit(self, name: str, row: Dict[str, Any]) -> None:
+        line = _encode((name, row)) + "\n"
+        if os.getpid() != self._pid:
+            with _fork_lock:
+                if os.getpid() != self._pid:
+                    # Forked (e.g. gunicorn --preload): the flusher thread and
+                    # the segment belong to the parent, which still drains them
+                    self._lock = threading.Lock()
+                    self._start()
+        with self._lock:
+            if self._segment is None:
+                self._sequence += 1
+                self._segment_path = os.path.join(
+                    self.spill_dir, f"{self._prefix}-{self._sequence:08d}.jsonl"
+                )
+                self._segment = open(self._segment_path, "a", encoding="utf-8")
+            # Reaches the OS page cache before the handler returns, so a
+            # worker crash loses nothing; the flusher owns durability from here
+            self._segment.write(line)
+            self._segment.flush()
+            self.submitted += 1
+            if len(self._batch) < self.max_queue:
+                self._batch.append((name, row))
+            else:
+                self._overflowed = True
+            waiting = len(self._batch)
+        if waiting >= self.flush_rows or self._stopping:
+            self._wakeup.set()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until every row submitted so far is committed (read-your-writes
+        for readers of the logged tables). False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            target = self.submitted
+            while self.committed + self.dropped < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._thread.is_alive():
+                    return False
+                self._wakeup.set()
+                self._committed_cond.wait(min(remaining, self.flush_interval))
+        return True
+
+    def pending_rows(self, name: str, session_id: str) -> List[Dict[str, Any]]:
+        """session_id's rows for table `name` that are still in memory and may
+        not be committed yet, oldest first. Rows that only reached the spill
+        file (queue overflow, a failed flush) are not included."""
+        with self._lock:
+            records = self._inflight + self._batch
+        return [
+            dict(row)
+            for table_name, row in records
+            if table_name == name and row.get("session_id") == session_id
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "committed": self.committed,
+                "dropped": self.dropped,
+                "pending": self.submitted - self.committed - self.dropped,
+                "spilled_segments": len(self._retry) + (self._segment is not None),
+                "failures": self.failures,
+                "quarantined": self.quarantined,
+            }
+
+    # ---------- Flusher side ----------
+
+    def _adopt_orphans(self):
+        """Queue segments whose writer is gone: a dead process (crash,
+        SIGKILL) or a writer of this process that has been closed."""
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, "*.jsonl"))):
+            name = os.path.basename(path)
+            pid, _, rest = name.partition("-")
+            if not pid.isdigit():
+                continue
+            if int(pid) == os.getpid():
+                if f"{pid}-{rest.split('-', 1)[0]}" in _live_prefixes:
+                    continue
+            elif _pid_alive(int(pid)):
+                continue
+            # Rename first so a sibling worker starting now cannot adopt it too
+            adopted = os.path.join(
+                self.spill_dir, f"{self._prefix}-adopted-{_original_name(name)}"
+            )
+            try:
+                os.rename(path, adopted)
+            except OSError:
+                continue
+            self._retry.append(adopted)
+            logger.info(f"Replaying log spill segment {name}")
+
+    def _rotate(self) -> Optional[Tuple[str, List[Record], bool, int]]:
+        with self._lock:
+            if self._segment is None:
+                return None
+            self._segment.close()
+            rotated = (
+                self._segment_path,
+                self._batch,
+                self._overflowed,
+                self.submitted,
+            )
+            self._segment, self._segment_path = None, None
+            self._inflight = self._batch
+            self._batch, self._overflowed = [], False
+            return rotated
+
+    def _write_segment(self, path: str, records: Optional[List[Record]] = None):
+        if records is None:
+            records = _read_segment(path)
+        written = insert_rows(self.engine, records) if records else 0
+        os.remove(path)
+        return written, len(records) - written
+
+    def _count(self, path: str, written: int, dropped: int):
+        with self._lock:
+            # Replayed segments were never counted as submitted by this writer
+            if "-adopted-" not in os.path.basename(path):
+                self.committed += written
+                self.dropped += dropped
+            self._committed_cond.notify_all()
+
+    def _strike(self, path: str):
+        """Count a failed write of a segment that others could be written
+        alongside; quarantine it after max_attempts."""
+        attempts = self._attempts.get(path, 0) + 1
+        self._attempts[path] = attempts
+        if attempts < self.max_attempts:
+            return
+        quarantine = os.path.join(self.spill_dir, "quarantine")
+        try:
+            rows = len(_read_segment(path))
+            os.makedirs(quarantine, exist_ok=True)
+            os.rename(path, os.path.join(quarantine, os.path.basename(path)))
+        except OSError as e:
+            logger.error(f"Could not quarantine {os.path.basename(path)}: {e}")
+            return
+        self._retry.remove(path)
+        self._attempts.pop(path, None)
+        logger.error(
+            f"Quarantined log spill segment {os.path.basename(path)} "
+            f"({rows} rows) after {attempts} failed writes"
+        )
+        # This writer will not commit its rows; flush() must not wait for them
+        self._count(path, 0, rows)
+        with self._lock:
+            self.quarantined += 1
+
+    def _flush_once(self) -> bool:
+        """Write retried segments, then the current one. False on a DB error.
+
+        A failing segment does not hold up the others: the live segment is
+        always rotated and written. A failure only counts against a segment
+        when another write in the same round succeeded; when none does, the
+        database itself is the problem.
+        """
+        ok, succeeded, failed = True, False, []
+        for path in list(self._retry):
+            try:
+                written, dropped = self._write_segment(path)
+            except Exception as e:
+                logger.error(f"Log flush failed, {os.path.basename(path)} kept: {e}")
+                ok = False
+                failed.append(path)
+                if isinstance(e, OperationalError) and not succeeded:
+                    # Probably unreachable: leave the rest for the next round
+                    break
+                continue
+            self._retry.remove(path)
+            self._attempts.pop(path, None)
+            self._count(path, written, dropped)
+            succeeded = True
+
+        rotated = self._rotate()
+        if rotated is not None:
+            path, batch, overflowed, _ = rotated
+            try:
+                written, dropped = self._write_segment(
+                    path, None if overflowed else batch
+                )
+            except Exception as e:
+                logger.error(f"Log flush failed, {os.path.basename(path)} kept: {e}")
+                ok = False
+                self._retry.append(path)
+                failed.append(path)
+            else:
+                self._count(path, written, dropped)
+                succeeded = True
+            finally:
+                with self._lock:
+                    self._inflight = []
+
+        if succeeded:
+            for path in failed:
+                self._strike(path)
+        return ok
+
+    def _run(self):
+        backoff = 0.0
+        while True:
+            self._wakeup.wait(backoff or self.flush_interval)
+            self._wakeup.clear()
+            stopping = self._stopping
+            if self._flush_once():
+                backoff = 0.0
+            else:
+                with self._lock:
+                    self.failures += 1
+                backoff = min(
+                    max(backoff * 2, self.flush_interval), _MAX_BACKOFF_SECONDS
+                )
+                if stopping:
+                    # Leave the segments on disk for the next worker to replay
+                    return
+            if stopping:
+                return
+
+    def close(self, timeout: float = 10.0):
+        """Drain the queue and stop the flusher (registered with atexit)."""
+        if self._stopping:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("Log writer did not drain in time; spill segments kept")
+        else:
+            # What is left on disk may now be adopted by another writer
+            _live_prefixes.discard(self._prefix)
+
+
+_writer: Optional[LogWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_log_writer() -> Optional[LogWriter]:
+    return _writer
+
+
+def init_log_writer(engine, **kwargs) -> Optional[LogWriter]:
+    """Start the process-wide writer (None when LOG_WRITE_BEHIND is off)."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+        _writer = LogWriter(engine, **kwargs) if LOG_WRITE_BEHIND else None
+        return _writer
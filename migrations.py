@@ -0,0 +1,690 @@
+"""
+Versioned schema migrations.
+
+Migrations run once per deploy, as a release step (``python scripts/migrate.py
+upgrade`` in start.sh) or at boot when AUTO_MIGRATE is on, rather than as DDL
+in every worker. Each migration runs in its own transaction and records its
+version in ``schema_version``; on Postgres the runner holds an advisory lock so
+concurrent releases apply each migration exactly once. Workers only compare
+the recorded version with SCHEMA_VERSION at boot.
+
+Migration 1 is the baseline the app used to create at boot and is idempotent,
+so databases created before this runner adopt it without changes. Later
+migrations must not rely on IF NOT EXISTS to be safe: add a new version for
+every schema change instead of editing an applied one.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from legacy_views import (
+    backfill,
+    replace_legacy_tables,
+    validate_session_fks,
+    widen_session_ids,
+)
+from partitions import PARTITIONED_TABLES, convert_to_partitioned, is_partitioned
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary constant shared by every process that migrates this database
+_ADVISORY_LOCK_KEY = 0x67514D31  # "gQM1"
+
+
+def _auto_migrate_default() -> str:
+    env = (os.getenv("ENVIRONMENT") or "local").lower()
+    return "true" if env in ("local", "development", "test", "testing") else "false"
+
+
+# Migrate at boot instead of in a release step (local development and tests)
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", _auto_migrate_default()).lower() == "true"
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+COMMUNITY_SEED_PATH = os.path.join(ROOT, "data", "community_seed.json")
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable  # (connection, dialect name) -> None
+    # False runs the upgrade on an autocommit connection (CREATE INDEX
+    # CONCURRENTLY cannot run in a transaction); it must then be idempotent
+    transactional: bool = True
+
+
+class IndexSpec(NamedTuple):
+    name: str
+    table: str
+    columns: str
+    where: Optional[str] = None
+    # Postgres column list when it differs (operator classes)
+    pg_columns: Optional[str] = None
+
+
+# ---------- Migrations ----------
+
+
+def _baseline(conn, dialect: str) -> None:
+    """Tables previously created by app._init_database at every boot."""
+    serial = (
+        "INTEGER PRIMARY KEY AUTOINCREMENT"
+        if dialect == "sqlite"
+        else "SERIAL PRIMARY KEY"
+    )
+    conn.execute(
+        text(
+            """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id VARCHAR(255) PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+        )
+    )
+    conn.execute(
+        text(
+            f"""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id {serial},
+            session_id VARCHAR(255) REFERENCES sessions(id),
+            content TEXT NOT NULL,
+            is_user BOOLEAN NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            message_type VARCHAR(50) DEFAULT 'text'
+        )
+        """
+        )
+    )
+    conn.execute(
+        text(
+            f"""
+        CREATE TABLE IF NOT EXISTS mood_entries (
+            id {serial},
+            session_id VARCHAR(255) REFERENCES sessions(id),
+            mood_level INTEGER NOT NULL CHECK (mood_level >= 1 AND mood_level <= 5),
+            note TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+        )
+    )
+    conn.execute(
+        text(
+            f"""
+        CREATE TABLE IF NOT EXISTS self_assessments (
+            id {serial},
+            session_id VARCHAR(255) REFERENCES sessions(id),
+            mood INTEGER,
+            energy INTEGER,
+            sleep INTEGER,
+            stress INTEGER,
+            social INTEGER,
+            work INTEGER,
+            notes TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+        )
+    )
+    conn.execute(
+        text(
+            f"""
+        CREATE TABLE IF NOT EXISTS crisis_detections (
+            id {serial},
+            session_id VARCHAR(255) REFERENCES sessions(id),
+            message TEXT NOT NULL,
+            risk_level VARCHAR(50) NOT NULL,
+            risk_score DECIMAL(3,2) NOT NULL,
+            keywords TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+        )
+    )
+    # Minimal analytics events table (no PII)
+    conn.execute(
+        text(
+            f"""
+        CREATE TABLE IF NOT EXISTS analytics_events (
+            id {serial},
+            session_id VARCHAR(255) REFERENCES sessions(id),
+            event_type VARCHAR(64) NOT NULL,
+            metadata TEXT, -- store compact JSON string (no PII)
+            request_id VARCHAR(64),
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+        )
+    )
+
+    # The SQLAlchemy model tables as models.py defined them at the time. Frozen
+    # here so later model changes cannot alter what this migration creates;
+    # those ship as new versions.
+    conn.execute(
+        text(
+            """
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            id VARCHAR(36) PRIMARY KEY,
+            created_at TIMESTAMP,
+            last_active TIMESTAMP,
+            conversation_count INTEGER,
+            risk_level VARCHAR(20)
+        )
+        """
+        )
+    )
+    conn.execute(
+        text(
+            f"""
+        CREATE TABLE IF NOT EXISTS messages (
+            id {serial},
+            session_id VARCHAR(36) REFERENCES user_sessions(id),
+            content TEXT NOT NULL,
+            is_user BOOLEAN,
+            timestamp TIMESTAMP,
+            risk_level VARCHAR(20),
+            resources TEXT
+        )
+        """
+        )
+    )
+    conn.execute(
+        text(
+            f"""
+        CREATE TABLE IF NOT EXISTS conversation_logs (
+            id {serial},
+            session_id VARCHAR(36) REFERENCES user_sessions(id),
+            user_message TEXT NOT NULL,
+            ai_response TEXT NOT NULL,
+            risk_level VARCHAR(20),
+            risk_score DOUBLE PRECISION,
+            timestamp TIMESTAMP
+        )
+        """
+        )
+    )
+    conn.execute(
+        text(
+            f"""
+        CREATE TABLE IF NOT EXISTS crisis_events (
+            id {serial},
+            session_id VARCHAR(36) REFERENCES user_sessions(id),
+            timestamp TIMESTAMP,
+            risk_level VARCHAR(20),
+            intervention_taken VARCHAR(100),
+            escalated BOOLEAN
+        )
+        """
+        )
+    )
+    # JSONB has no SQLite equivalent; migration 7 creates it there
+    if dialect == "postgresql":
+        conn.execute(
+            text(
+                """
+            CREATE TABLE IF NOT EXISTS self_assessment_entries (
+                id SERIAL PRIMARY KEY,
+                session_id VARCHAR(36) NOT NULL REFERENCES user_sessions(id),
+                timestamp TIMESTAMP NOT NULL,
+                assessment_data JSONB NOT NULL
+            )
+            """
+            )
+        )
+
+    # conversation_logs from before the model had all of its columns
+    required_cols = {
+        "session_id": "VARCHAR(36)",
+        "user_message": "TEXT",
+        "ai_response": "TEXT",
+        "risk_level": "VARCHAR(20)",
+        "risk_score": "DOUBLE PRECISION",
+        "timestamp": "TIMESTAMP",
+    }
+    if dialect == "postgresql":
+        existing_cols = {
+            row[0]
+            for row in conn.execute(
+                text(
+                    "SELECT column_name FROM information_schema.columns "
+                    "WHERE table_name = 'conversation_logs'"
+                )
+            )
+        }
+    else:
+        # SQLite PRAGMA returns: cid, name, type, notnull, dflt_value, pk
+        existing_cols = {
+            row[1] for row in conn.execute(text("PRAGMA table_info(conversation_logs)"))
+        }
+    for col, coltype in required_cols.items():
+        if col not in existing_cols:
+            conn.execute(
+                text(f"ALTER TABLE conversation_logs ADD COLUMN {col} {coltype}")
+            )
+
+
+def _community_tables(conn, dialect: str) -> None:
+    """Tables previously created by community._ensure_tables at every boot."""
+    if dialect == "sqlite":
+        conn.execute(
+            text(
+                """
+            CREATE TABLE IF NOT EXISTS community_posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT,
+                body_redacted TEXT NOT NULL,
+                is_curated INTEGER DEFAULT 1,
+                is_hidden INTEGER DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                reactions_relate INTEGER DEFAULT 0,
+                reactions_helped INTEGER DEFAULT 0,
+                reactions_strength INTEGER DEFAULT 0
+            )
+            """
+            )
+        )
+        conn.execute(
+            text(
+                """
+            CREATE TABLE IF NOT EXISTS community_reactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                post_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                user_hash TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+            )
+        )
+        conn.execute(
+            text(
+                """
+            CREATE TABLE IF NOT EXISTS community_reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                target_type TEXT NOT NULL,
+                target_id INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                notes TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+            )
+        )
+        columns = {
+            row[1] for row in conn.execute(text("PRAGMA table_info(community_posts)"))
+        }
+        if "is_hidden" not in columns:
+            conn.execute(
+                text(
+                    "ALTER TABLE community_posts ADD COLUMN is_hidden INTEGER DEFAULT 0"
+                )
+            )
+        return
+
+    conn.execute(
+        text(
+            """
+        CREATE TABLE IF NOT EXISTS community_posts (
+            id SERIAL PRIMARY KEY,
+            topic VARCHAR(64),
+            body_redacted TEXT NOT NULL,
+            is_curated BOOLEAN DEFAULT TRUE,
+            is_hidden BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            reactions_relate INTEGER DEFAULT 0,
+            reactions_helped INTEGER DEFAULT 0,
+            reactions_strength INTEGER DEFAULT 0
+        )
+        """
+        )
+    )
+    conn.execute(
+        text(
+            """
+        CREATE TABLE IF NOT EXISTS community_reactions (
+            id SERIAL PRIMARY KEY,
+            post_id INTEGER NOT NULL,
+            kind VARCHAR(24) NOT NULL,
+            user_hash VARCHAR(64),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+        )
+    )
+    conn.execute(
+        text(
+            """
+        CREATE TABLE IF NOT EXISTS community_reports (
+            id SERIAL PRIMARY KEY,
+            target_type VARCHAR(24) NOT NULL,
+            target_id INTEGER NOT NULL,
+            reason VARCHAR(64) NOT NULL,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+        )
+    )
+    conn.execute(
+        text(
+            "ALTER TABLE community_posts ADD COLUMN IF NOT EXISTS is_hidden BOOLEAN DEFAULT FALSE"
+        )
+    )
+
+
+def _community_seed(conn, dialect: str) -> None:
+    """Curated posts previously loaded by community._load_seed_if_empty."""
+    from community import _pii_redact
+
+    if conn.execute(text("SELECT COUNT(*) FROM community_posts")).scalar():
+        return
+    if not os.path.exists(COMMUNITY_SEED_PATH):
+        return
+    with open(COMMUNITY_SEED_PATH, encoding="utf-8") as f:
+        items = json.load(f)
+    rows = []
+    for it in items:
+        topic = (it.get("topic") or "general").strip()[:64]
+        body = _pii_redact(it.get("body", "").strip())
+        if body:
+            rows.append({"topic": topic, "body": body, "is_curated": True})
+    if rows:
+        conn.execute(
+            text(
+                "INSERT INTO community_posts (topic, body_redacted, is_curated) "
+                "VALUES (:topic, :body, :is_curated)"
+            ),
+            rows,
+        )
+
+
+_VISIBLE_POSTS = "COALESCE(is_hidden, FALSE) = FALSE"
+
+# Secondary indexes for the hot read paths and the retention deletes. Partial
+# index predicates repeat the query text exactly so the planner can match them.
+INDEX_PACK: List[IndexSpec] = [
+    # /api/mood_history and mood analytics: WHERE session_id ORDER BY timestamp DESC
+    IndexSpec(
+        "ix_mood_entries_session_ts", "mood_entries", "session_id, timestamp DESC"
+    ),
+    # History rehydration: WHERE session_id AND timestamp >= ORDER BY timestamp DESC, id DESC
+    IndexSpec(
+        "ix_conversation_logs_session_ts",
+        "conversation_logs",
+        "session_id, timestamp DESC, id DESC",
+    ),
+    # Recent analytics events: WHERE event_type LIKE 'prefix%' ORDER BY id DESC
+    IndexSpec(
+        "ix_analytics_events_type_prefix",
+        "analytics_events",
+        "event_type, id",
+        pg_columns="event_type text_pattern_ops, id",
+    ),
+    # Retention purges: DELETE ... WHERE timestamp < cutoff
+    IndexSpec("ix_conversation_logs_ts", "conversation_logs", "timestamp"),
+    IndexSpec("ix_crisis_detections_ts", "crisis_detections", "timestamp"),
+    IndexSpec("ix_crisis_events_ts", "crisis_events", "timestamp"),
+    IndexSpec("ix_analytics_events_ts", "analytics_events", "timestamp"),
+    IndexSpec("ix_self_assessment_entries_ts", "self_assessment_entries", "timestamp"),
+    IndexSpec("ix_user_sessions_last_active", "user_sessions", "last_active"),
+    # Foreign keys to user_sessions: lookups when a session row is deleted, and
+    # the retention guard that keeps sessions still referenced
+    IndexSpec("ix_messages_session", "messages", "session_id"),
+    IndexSpec("ix_crisis_events_session", "crisis_events", "session_id"),
+    IndexSpec(
+        "ix_self_assessment_entries_session_ts",
+        "self_assessment_entries",
+        "session_id, timestamp",
+    ),
+    IndexSpec("ix_crisis_detections_session", "crisis_detections", "session_id"),
+    IndexSpec("ix_analytics_events_session", "analytics_events", "session_id"),
+    # Community keyset feed over visible posts, with and without a topic
+    IndexSpec(
+        "ix_community_posts_feed",
+        "community_posts",
+        "created_at DESC, id DESC",
+        where=_VISIBLE_POSTS,
+    ),
+    IndexSpec(
+        "ix_community_posts_topic_feed",
+        "community_posts",
+        "topic, created_at DESC, id DESC",
+        where=_VISIBLE_POSTS,
+    ),
+    IndexSpec(
+        "ix_community_reports_recent", "community_reports", "created_at DESC, id DESC"
+    ),
+]
+
+
+def ensure_indexes(conn, dialect: str, specs: List[IndexSpec] = None) -> List[str]:
+    """Create missing pack indexes; returns the names created.
+
+    On Postgres the build is CONCURRENTLY (no write lock on the table), so conn
+    must be in autocommit mode. An interrupted concurrent build leaves an
+    INVALID index behind; it is dropped and rebuilt. Partitioned tables cannot
+    build concurrently; there the index is created on the parent, which
+    recurses into every partition and is inherited by future ones.
+    """
+    from sqlalchemy import inspect
+
+    created = []
+    tables = set(inspect(conn).get_table_names())
+    for spec in INDEX_PACK if specs is None else specs:
+        if spec.table not in tables:
+            logger.info(f"Skipping index {spec.name}: no table {spec.table}")
+            continue
+        where = f" WHERE {spec.where}" if spec.where else ""
+        if dialect == "postgresql":
+            concurrently = "" if is_partitioned(conn, spec.table) else " CONCURRENTLY"
+            valid = conn.execute(
+                text(
+                    "SELECT i.indisvalid FROM pg_index i "
+                    "JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+                ),
+                {"name": spec.name},
+            ).scalar()
+            if valid:
+                continue
+            if valid is False:
+                logger.warning(f"Rebuilding invalid index {spec.name}")
+                conn.execute(text(f"DROP INDEX{concurrently} IF EXISTS {spec.name}"))
+            conn.execute(
+                text(
+                    f"CREATE INDEX{concurrently} {spec.name} ON {spec.table} "
+                    f"({spec.pg_columns or spec.columns}){where}"
+                )
+            )
+        else:
+            conn.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS {spec.name} ON {spec.table} "
+                    f"({spec.columns}){where}"
+                )
+            )
+        created.append(spec.name)
+    return created
+
+
+def _index_pack(conn, dialect: str) -> None:
+    created = ensure_indexes(conn, dialect)
+    logger.info(f"Index pack: created {created or 'nothing'}")
+
+
+def _partition_logs(conn, dialect: str) -> None:
+    """Range-partition the append-only log tables by "timestamp" (Postgres;
+    SQLite keeps plain tables and DELETE-based retention)."""
+    if dialect != "postgresql":
+        return
+    from sqlalchemy import inspect
+
+    for table in PARTITIONED_TABLES:
+        if not inspect(conn).has_table(table) or is_partitioned(conn, table):
+            continue
+        convert_to_partitioned(conn, table)
+        # The pack indexes went with the old table; rebuild them on the parent
+        ensure_indexes(conn, dialect, [s for s in INDEX_PACK if s.table == table])
+
+
+def _purge_runs(conn, dialect: str) -> None:
+    """Checkpoints and status of retention purge runs (retention.py)."""
+    serial = (
+        "INTEGER PRIMARY KEY AUTOINCREMENT"
+        if dialect == "sqlite"
+        else "SERIAL PRIMARY KEY"
+    )
+    conn.execute(
+        text(
+            f"""
+        CREATE TABLE IF NOT EXISTS purge_runs (
+            id {serial},
+            status VARCHAR(20) NOT NULL,
+            progress TEXT NOT NULL,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """
+        )
+    )
+
+
+def _consolidate_backfill(conn, dialect: str) -> None:
+    """Copy the legacy sessions, self_assessments and chat_messages rows into
+    their canonical tables (legacy_views.py), one committed batch at a time
+    while the app keeps running."""
+    if dialect == "sqlite":
+        # The baseline skipped this table on SQLite for its JSONB column
+        conn.execute(
+            text(
+                """
+            CREATE TABLE IF NOT EXISTS self_assessment_entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id VARCHAR(255) NOT NULL REFERENCES user_sessions(id),
+                timestamp TIMESTAMP NOT NULL,
+                assessment_data JSON NOT NULL
+            )
+            """
+            )
+        )
+    widen_session_ids(conn, dialect)
+    backfill(conn, dialect)
+
+
+def _compatibility_views(conn, dialect: str) -> None:
+    """Replace the legacy tables with views over the canonical ones."""
+    copied = replace_legacy_tables(conn, dialect)
+    logger.info(f"Compatibility views: caught up {copied}")
+
+
+def _validate_session_fks(conn, dialect: str) -> None:
+    validated = validate_session_fks(conn, dialect)
+    created = ensure_indexes(conn, dialect)
+    logger.info(f"Validated {validated or 'nothing'}; created {created or 'nothing'}")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", _baseline),
+    Migration(2, "community_tables", _community_tables),
+    Migration(3, "community_seed", _community_seed),
+    Migration(4, "index_pack", _index_pack, transactional=False),
+    Migration(5, "partition_logs", _partition_logs),
+    Migration(6, "purge_runs", _purge_runs),
+    Migration(7, "consolidate_backfill", _consolidate_backfill, transactional=False),
+    Migration(8, "compatibility_views", _compatibility_views),
+    Migration(9, "validate_session_fks", _validate_session_fks, transactional=False),
+]
+
+# Version this code expects; workers compare it with schema_version at boot
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+# ---------- Runner ----------
+
+
+def _ensure_version_table(conn) -> None:
+    conn.execute(
+        text(
+            """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(128) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+        )
+    )
+
+
+def current_version(engine) -> int:
+    """Highest applied migration; 0 for a database the runner never touched."""
+    try:
+        with engine.connect() as conn:
+            return (
+                conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+                or 0
+            )
+    except Exception:
+        return 0
+
+
+def pending_migrations(engine) -> List[Migration]:
+    version = current_version(engine)
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def migrate(engine, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to target; returns the versions applied."""
+    target = SCHEMA_VERSION if target is None else target
+    dialect = engine.dialect.name
+    applied: List[int] = []
+    with engine.connect() as lock_conn:
+        if dialect == "postgresql":
+            # Session-level lock: held across the per-migration transactions
+            lock_conn.execute(
+                text("SELECT pg_advisory_lock(:key)"), {"key": _ADVISORY_LOCK_KEY}
+            )
+            lock_conn.commit()
+        try:
+            with engine.begin() as conn:
+                _ensure_version_table(conn)
+            # Read under the lock: another release may have just migrated
+            version = current_version(engine)
+            for migration in MIGRATIONS:
+                if migration.version <= version or migration.version > target:
+                    continue
+                started = time.monotonic()
+                if not migration.transactional:
+                    with engine.connect() as conn:
+                        migration.upgrade(
+                            conn.execution_options(isolation_level="AUTOCOMMIT"),
+                            dialect,
+                        )
+                with engine.begin() as conn:
+                    if migration.transactional:
+                        migration.upgrade(conn, dialect)
+                    conn.execute(
+                        text(
+                            "INSERT INTO schema_version (version, name) VALUES (:version, :name)"
+                        ),
+                        {"version": migration.version, "name": migration.name},
+                    )
+                applied.append(migration.version)
+                logger.info(
+                    f"Applied migration {migration.version} ({migration.name}) "
+                    f"in {(time.monotonic() - started) * 1000:.0f} ms"
+                )
+        finally:
+            if dialect == "postgresql":
+                lock_conn.execute(
+                    text("SELECT pg_advisory_unlock(:key)"), {"key": _ADVISORY_LOCK_KEY}
+                )
+                lock_conn.commit()
+    return applied
@@ -4,13 +4,17 @@ import uuid
 import os
 from sqlalchemy.dialects.postgresql import JSONB
 
-db = SQLAlchemy()
+import legacy_views
+from db_routing import RoutingSession
+
+# RoutingSession sends @read_only views' SELECTs to DATABASE_REPLICA_URLS
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 class UserSession(db.Model):
     __tablename__ = "user_sessions"
 
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(db.String(255), primary_key=True, default=lambda: str(uuid.uuid4()))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_active = db.Column(db.DateTime, default=datetime.utcnow)
     conversation_count = db.Column(db.Integer, default=0)
@@ -21,7 +25,7 @@ class Message(db.Model):
     __tablename__ = "messages"
 
     id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.String(36), db.ForeignKey("user_sessions.id"))
+    session_id = db.Column(db.String(255), db.ForeignKey("user_sessions.id"))
     content = db.Column(db.Text, nullable=False)
     is_user = db.Column(db.Boolean, default=False)  # True for user, False for AI
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -33,7 +37,7 @@ class ConversationLog(db.Model):
     __tablename__ = "conversation_logs"
 
     id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.String(36), db.ForeignKey("user_sessions.id"))
+    session_id = db.Column(db.String(255), db.ForeignKey("user_sessions.id"))
     user_message = db.Column(db.Text, nullable=False)
     ai_response = db.Column(db.Text, nullable=False)
     risk_level = db.Column(db.String(20), default="low")
@@ -45,7 +49,7 @@ class CrisisEvent(db.Model):
     __tablename__ = "crisis_events"
 
     id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.String(36), db.ForeignKey("user_sessions.id"))
+    session_id = db.Column(db.String(255), db.ForeignKey("user_sessions.id"))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     risk_level = db.Column(db.String(20))
     intervention_taken = db.Column(db.String(100))
@@ -56,10 +60,17 @@ class SelfAssessmentEntry(db.Model):
     __tablename__ = "self_assessment_entries"
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(
-        db.String(36), db.ForeignKey("user_sessions.id"), nullable=False
+        db.String(255), db.ForeignKey("user_sessions.id"), nullable=False
     )
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    assessment_data = db.Column(JSONB, nullable=False)
+    assessment_data = db.Column(
+        JSONB().with_variant(db.JSON(), "sqlite"), nullable=False
+    )
 
     def __repr__(self):
         return f"<SelfAssessmentEntry id={self.id} session_id={self.session_id}>"
+
+
+# The legacy sessions, self_assessments and chat_messages shapes are views over
+# these tables; create and drop them together
+legacy_views.attach(db.metadata)
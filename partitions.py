@@ -0,0 +1,272 @@
+"""
+Time-range partitioning for the append-only log tables (Postgres only).
+
+conversation_logs, analytics_events and crisis_detections are partitioned by
+RANGE ("timestamp"), one partition per PARTITION_INTERVAL (day or month), plus
+a DEFAULT partition that catches rows outside every range. Partitions are
+named ``<table>_p<YYYYMM>`` or ``<table>_p<YYYYMMDD>``; the bounds are read
+back from the name.
+
+maintain_partitions() creates partitions PARTITION_PREMAKE_DAYS ahead; it runs
+in the release step (scripts/migrate.py upgrade), at boot with AUTO_MIGRATE and
+with every retention purge. purge_before() drops (or detaches) partitions
+that lie wholly before the cutoff and deletes the remainder from the boundary
+partition. On SQLite, or a table that is not partitioned, it is a plain DELETE.
+"""
+
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("conversation_logs", "analytics_events", "crisis_detections")
+PARTITION_INTERVAL = os.getenv("PARTITION_INTERVAL", "month").lower()
+PARTITION_PREMAKE_DAYS = int(os.getenv("PARTITION_PREMAKE_DAYS", "45"))
+# drop: space comes back immediately; detach: the old partition is left as a
+# standalone table for archiving (dump it, then drop it)
+PARTITION_RETENTION_MODE = os.getenv("PARTITION_RETENTION_MODE", "drop").lower()
+# DROP/DETACH need a brief exclusive lock on the parent; don't queue behind
+# long-running readers (and block every insert behind us) for longer than this
+PARTITION_LOCK_TIMEOUT_MS = int(os.getenv("PARTITION_LOCK_TIMEOUT_MS", "5000"))
+
+# Converting an existing table creates partitions for at most this much history;
+# older rows land in the DEFAULT partition and leave with the next purge
+_MAX_BACKFILL_DAYS = 366
+
+Partition = Tuple[str, datetime, datetime]  # (name, start, end)
+
+
+def _dialect_name(conn) -> str:
+    # Connection or ORM Session
+    dialect = getattr(conn, "dialect", None) or conn.get_bind().dialect
+    return dialect.name
+
+
+def period_start(ts: datetime, interval: str = None) -> datetime:
+    if (interval or PARTITION_INTERVAL) == "day":
+        return datetime(ts.year, ts.month, ts.day)
+    return datetime(ts.year, ts.month, 1)
+
+
+def next_period(start: datetime, interval: str = None) -> datetime:
+    if (interval or PARTITION_INTERVAL) == "day":
+        return start + timedelta(days=1)
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def partition_name(table: str, start: datetime, interval: str = None) -> str:
+    fmt = "%Y%m%d" if (interval or PARTITION_INTERVAL) == "day" else "%Y%m"
+    return f"{table}_p{start.strftime(fmt)}"
+
+
+def _parse_bounds(table: str, name: str) -> Optional[Tuple[datetime, datetime]]:
+    suffix = name[len(table) + 2 :] if name.startswith(f"{table}_p") else ""
+    if not suffix.isdigit() or len(suffix) not in (6, 8):
+        return None
+    interval = "day" if len(suffix) == 8 else "month"
+    start = datetime.strptime(suffix, "%Y%m%d" if interval == "day" else "%Y%m")
+    return start, next_period(start, interval)
+
+
+def is_partitioned(conn, table: str) -> bool:
+    if _dialect_name(conn) != "postgresql":
+        return False
+    return bool(
+        conn.execute(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+                "JOIN pg_class c ON c.oid = pt.partrelid "
+                "WHERE c.relname = :table AND pg_table_is_visible(c.oid))"
+            ),
+            {"table": table},
+        ).scalar()
+    )
+
+
+def list_partitions(conn, table: str) -> List[Partition]:
+    """Range partitions of table, oldest first (the DEFAULT partition excluded)."""
+    names = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table AND pg_table_is_visible(p.oid)"
+        ),
+        {"table": table},
+    ).scalars()
+    partitions = []
+    for name in names:
+        bounds = _parse_bounds(table, name)
+        if bounds:
+            partitions.append((name, *bounds))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def _literal(ts: datetime) -> str:
+    return f"'{ts:%Y-%m-%d %H:%M:%S}'"
+
+
+def create_partition(conn, table: str, start: datetime, end: datetime, name: str):
+    """Build the partition standalone, move any rows the DEFAULT partition
+    caught for its range, then ATTACH (a lighter lock than PARTITION OF)."""
+    conn.execute(
+        text(
+            f"CREATE TABLE {name} "
+            f"(LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+    )
+    conn.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {table}_default "
+            f'WHERE "timestamp" >= :start AND "timestamp" < :end RETURNING *) '
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        {"start": start, "end": end},
+    )
+    conn.execute(
+        text(
+            f"ALTER TABLE {table} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ({_literal(start)}) TO ({_literal(end)})"
+        )
+    )
+
+
+def ensure_partitions(
+    conn,
+    table: str,
+    now: datetime = None,
+    since: datetime = None,
+    interval: str = None,
+    premake_days: int = None,
+) -> List[str]:
+    """Create the missing partitions from the period containing since (default
+    now) through now + premake_days; returns the names created."""
+    now = now or datetime.utcnow()
+    interval = interval or PARTITION_INTERVAL
+    horizon = now + timedelta(
+        days=PARTITION_PREMAKE_DAYS if premake_days is None else premake_days
+    )
+    existing = list_partitions(conn, table)
+    created = []
+    start = period_start(since or now, interval)
+    while start <= horizon:
+        end = next_period(start, interval)
+        # Ranges already covered (including by a different interval) are skipped
+        if not any(s < end and start < e for _, s, e in existing):
+            name = partition_name(table, start, interval)
+            create_partition(conn, table, start, end, name)
+            existing.append((name, start, end))
+            created.append(name)
+        start = end
+    return created
+
+
+def drop_expired_partitions(
+    conn, table: str, cutoff: datetime, mode: str = None
+) -> List[str]:
+    """Drop or detach the partitions whose whole range is before cutoff ([] for
+    a table that is not partitioned). The caller commits."""
+    if not is_partitioned(conn, table):
+        return []
+    mode = mode or PARTITION_RETENTION_MODE
+    expired = [name for name, _, end in list_partitions(conn, table) if end <= cutoff]
+    conn.execute(text(f"SET LOCAL lock_timeout = {PARTITION_LOCK_TIMEOUT_MS}"))
+    try:
+        for name in expired:
+            if mode == "detach":
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            else:
+                conn.execute(text(f"DROP TABLE {name}"))
+            logger.info(f"Retention: {mode} partition {name}")
+    finally:
+        conn.execute(text("SET LOCAL lock_timeout TO DEFAULT"))
+    return expired
+
+
+def purge_before(conn, table: str, cutoff: datetime) -> Tuple[Optional[int], List[str]]:
+    """Remove rows with "timestamp" < cutoff; returns (rows deleted, partitions
+    dropped or detached). conn is a Connection or Session; the caller commits."""
+    dropped = drop_expired_partitions(conn, table, cutoff)
+    # Only the boundary partition (and DEFAULT) is left to scan on Postgres
+    result = conn.execute(
+        text(f'DELETE FROM {table} WHERE "timestamp" < :cutoff'), {"cutoff": cutoff}
+    )
+    return getattr(result, "rowcount", None), dropped
+
+
+def convert_to_partitioned(conn, table: str, now: datetime = None) -> List[str]:
+    """Rebuild a plain table as a partitioned one, copying its rows.
+
+    Runs inside the caller's transaction and holds an exclusive lock on the
+    table while rows are copied, so run it in a quiet window on large tables.
+    The primary key becomes (id, "timestamp"), as Postgres requires the
+    partition key in every unique constraint; indexes are left to the caller.
+    """
+    now = now or datetime.utcnow()
+    old = f"{table}_unpartitioned"
+    foreign_keys = conn.execute(
+        text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(:table) AND contype = 'f'"
+        ),
+        {"table": table},
+    ).all()
+    sequence = conn.execute(
+        text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}
+    ).scalar()
+    # The partition key is NOT NULL (it is part of the primary key)
+    conn.execute(
+        text(
+            f'UPDATE {table} SET "timestamp" = CURRENT_TIMESTAMP '
+            'WHERE "timestamp" IS NULL'
+        )
+    )
+    oldest = conn.execute(text(f'SELECT MIN("timestamp") FROM {table}')).scalar()
+
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    conn.execute(
+        text(
+            f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            'PARTITION BY RANGE ("timestamp")'
+        )
+    )
+    conn.execute(
+        text(
+            f'ALTER TABLE {table} ALTER COLUMN "timestamp" SET NOT NULL, '
+            'ALTER COLUMN "timestamp" SET DEFAULT CURRENT_TIMESTAMP'
+        )
+    )
+    conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+    since = max(oldest or now, now - timedelta(days=_MAX_BACKFILL_DAYS))
+    created = ensure_partitions(conn, table, now=now, since=since)
+    conn.execute(text(f"INSERT INTO {table} SELECT * FROM {old}"))
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+    conn.execute(text(f"DROP TABLE {old}"))
+
+    # Constraint and index names are free again now the old table is gone
+    conn.execute(text(f'ALTER TABLE {table} ADD PRIMARY KEY (id, "timestamp")'))
+    for name, definition in foreign_keys:
+        conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}"))
+    logger.info(f"Partitioned {table}: {len(created)} partitions")
+    return created
+
+
+def maintain_partitions(engine, now: datetime = None) -> dict:
+    """Create upcoming partitions for every partitioned table; returns the
+    names created per table. Errors are logged per table, not raised."""
+    created = {}
+    if engine.dialect.name != "postgresql":
+        return created
+    for table in PARTITIONED_TABLES:
+        try:
+            with engine.begin() as conn:
+                if is_partitioned(conn, table):
+                    created[table] = ensure_partitions(conn, table, now=now)
+        except Exception as e:
+            logger.error(f"Partition maintenance failed for {table}: {e}")
+    return created
@@ -0,0 +1,205 @@
+"""
+Long-lived provider clients: one pooled client per provider and API key per worker.
+
+Every chat turn used to build a fresh OpenAI client, a bare requests.post, or a
+re-configured Gemini model, paying DNS + TCP + TLS each time. Clients here are
+created once, keep connections alive, and can be pre-warmed at worker boot.
+Async clients are tracked per event loop since their pools are loop-bound.
+"""
+
+import os
+import hashlib
+import threading
+import weakref
+import asyncio
+from typing import Dict, Iterable, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from openai import AsyncOpenAI, OpenAI
+
+POOL_MAX_CONNECTIONS = int(os.getenv('AI_HTTP_POOL_MAX_CONNECTIONS', '20'))
+POOL_MAX_KEEPALIVE = int(os.getenv('AI_HTTP_POOL_MAX_KEEPALIVE', '10'))
+KEEPALIVE_EXPIRY = float(os.getenv('AI_HTTP_KEEPALIVE_EXPIRY', '120'))
+CONNECT_TIMEOUT = float(os.getenv('AI_HTTP_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('AI_HTTP_READ_TIMEOUT', '30'))
+# grpc (default), rest or grpc_asyncio for google-generativeai
+GEMINI_TRANSPORT = (os.getenv('GEMINI_TRANSPORT') or '').strip() or None
+
+OPENAI_BASE_URL = 'https://api.openai.com/v1'
+PERPLEXITY_BASE_URL = 'https://api.perplexity.ai'
+
+_lock = threading.Lock()
+_clients: Dict[Tuple[str, str], object] = {}
+_async_clients: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+_owner_pid = os.getpid()
+
+
+def _debug(*args):
+    if (os.getenv('AI_DEBUG_LOGS') or '').lower() == 'true':
+        print('[clients]', *args)
+
+
+def key_fingerprint(api_key: str) -> str:
+    """Stable, non-reversible id for an API key (safe for logs and cache keys)."""
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:12]
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def _get_or_create(kind: str, api_key: str, factory):
+    global _owner_pid
+    cache_key = (kind, key_fingerprint(api_key))
+    with _lock:
+        if os.getpid() != _owner_pid:
+            # Forked (e.g. gunicorn --preload): never share sockets with the parent
+            _clients.clear()
+            _async_clients.clear()
+            _owner_pid = os.getpid()
+        client = _clients.get(cache_key)
+        if client is None:
+            client = factory()
+            _clients[cache_key] = client
+            _debug(f"created {kind} client key={cache_key[1]}")
+        return client
+
+
+def _get_or_create_async(kind: str, api_key: str, factory):
+    loop = asyncio.get_running_loop()
+    cache_key = (kind, key_fingerprint(api_key))
+    with _lock:
+        per_loop = _async_clients.setdefault(loop, {})
+        client = per_loop.get(cache_key)
+        if client is None:
+            client = factory()
+            per_loop[cache_key] = client
+            _debug(f"created async {kind} client key={cache_key[1]}")
+        return client
+
+
+# ---------- OpenAI ----------
+
+def openai_client(api_key: str) -> OpenAI:
+    return _get_or_create('openai', api_key, lambda: OpenAI(
+        api_key=api_key,
+        http_client=httpx.Client(limits=_limits(), timeout=_timeout()),
+    ))
+
+
+def async_openai_client(api_key: str) -> AsyncOpenAI:
+    return _get_or_create_async('openai', api_key, lambda: AsyncOpenAI(
+        api_key=api_key,
+        http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout()),
+    ))
+
+
+# ---------- Perplexity ----------
+
+def _perplexity_headers(api_key: str) -> Dict[str, str]:
+    return {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json',
+    }
+
+
+def perplexity_session(api_key: str) -> requests.Session:
+    def factory():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAX_CONNECTIONS,
+                              max_retries=0)
+        session.mount('https://', adapter)
+        session.headers.update(_perplexity_headers(api_key))
+        return session
+    return _get_or_create('perplexity', api_key, factory)
+
+
+def perplexity_async_client(api_key: str) -> httpx.AsyncClient:
+    return _get_or_create_async('perplexity', api_key, lambda: httpx.AsyncClient(
+        base_url=PERPLEXITY_BASE_URL,
+        headers=_perplexity_headers(api_key),
+        limits=_limits(),
+        timeout=_timeout(),
+    ))
+
+
+# ---------- Gemini ----------
+
+def _gemini_manager(api_key: str):
+    # Per-key client manager instead of the process-global genai.configure(),
+    # so concurrent requests on different keys never swap each other's key.
+    from google.generativeai.client import _ClientManager
+    manager = _ClientManager()
+    manager.configure(api_key=api_key, transport=GEMINI_TRANSPORT)
+    return manager
+
+
+def gemini_client(api_key: str):
+    """Sync GenerativeService client bound to api_key (one channel per key)."""
+    return _get_or_create('gemini', api_key,
+                          lambda: _gemini_manager(api_key).get_default_client('generative'))
+
+
+def gemini_async_client(api_key: str):
+    return _get_or_create_async('gemini', api_key,
+                                lambda: _gemini_manager(api_key).get_default_client('generative_async'))
+
+
+def gemini_model(api_key: str, model_name: str):
+    """GenerativeModel wired to the pooled client for api_key."""
+    import google.generativeai as genai
+    model = genai.GenerativeModel(model_name)
+    model._client = gemini_client(api_key)
+    return model
+
+
+def gemini_async_model(api_key: str, model_name: str):
+    import google.generativeai as genai
+    model = genai.GenerativeModel(model_name)
+    model._async_client = gemini_async_client(api_key)
+    return model
+
+
+# ---------- Warm-up ----------
+
+def _warm_one(provider: str, api_key: str):
+    if provider == 'openai':
+        # Any response proves the TLS connection is up and pooled
+        openai_client(api_key)._client.get(f'{OPENAI_BASE_URL}/models',
+                                           headers={'Authorization': f'Bearer {api_key}'})
+    elif provider == 'perplexity':
+        perplexity_session(api_key).head(PERPLEXITY_BASE_URL, timeout=CONNECT_TIMEOUT)
+    elif provider == 'gemini':
+        client = gemini_client(api_key)
+        channel = getattr(getattr(client, '_transport', None), 'grpc_channel', None)
+        if channel is not None:
+            import grpc
+            grpc.channel_ready_future(channel).result(timeout=CONNECT_TIMEOUT)
+
+
+def warm_up(keys: Dict[str, Iterable[str]]):
+    """Create clients and open a connection for each provider key. Best-effort."""
+    for provider, provider_keys in keys.items():
+        for api_key in provider_keys:
+            try:
+                _warm_one(provider, api_key)
+                _debug(f"warmed {provider} key={key_fingerprint(api_key)}")
+            except Exception as e:
+                _debug(f"warm_up_failed {provider} key={key_fingerprint(api_key)} err={e}")
+
+
+def warm_up_in_background(keys: Dict[str, Iterable[str]]) -> threading.Thread:
+    thread = threading.Thread(target=warm_up, args=(keys,), name='ai-client-warmup',
+                              daemon=True)
+    thread.start()
+    return thread
@@ -1,56 +1,43 @@
 import os
 import re
+import asyncio
 import random
-import threading
 import time
-import hashlib
-import google.generativeai as genai
-from typing import Dict, List
-from datetime import datetime, timedelta
-
-# Store conversations with timestamp for cleanup
-conversations: Dict[str, List[dict]] = {}
-CONVERSATION_TIMEOUT = timedelta(hours=1)  # Clear conversations older than 1 hour
+from typing import List
+from datetime import datetime
+from crisis_detection import scan_message
+from providers.clients import (
+    gemini_async_client, gemini_async_model, gemini_client, gemini_model, key_fingerprint,
+)
+from providers.health import get_health_store
+from providers.history import get_history_store, rehydrate
+from providers.scheduler import estimate_tokens, get_scheduler, is_rate_limit_error, parse_keys
 
 # ---------- Gemini multi-key + resilience helpers (single-file, surgical) ----------
 
 # Parse keys from env with minimal churn: support CSV in GEMINI_API_KEY and alias GEMINI_API_KEYS
 def _parse_api_keys() -> List[str]:
-    keys: List[str] = []
-    raw_primary = os.getenv('GEMINI_API_KEY') or ''
-    raw_alias = os.getenv('GEMINI_API_KEYS') or ''
-    # CSV support in both vars
-    parts: List[str] = []
-    parts += [p.strip() for p in raw_primary.split(',') if p.strip()]
-    parts += [p.strip() for p in raw_alias.split(',') if p.strip()]
-    # De-duplicate while preserving order
-    seen = set()
-    for k in parts:
-        if k not in seen:
-            seen.add(k)
-            keys.append(k)
-    return keys
+    return parse_keys('GEMINI_API_KEY', 'GEMINI_API_KEYS')
 
 _GEMINI_KEYS: List[str] = _parse_api_keys()
 
-# Round-robin pointer
-_key_lock = threading.Lock()
-_key_index = 0
-
-def _next_key_index() -> int:
-    global _key_index
-    with _key_lock:
-        idx = _key_index
-        if _GEMINI_KEYS:
-            _key_index = (_key_index + 1) % len(_GEMINI_KEYS)
-        return idx
+_GEMINI_KEY_FPS: List[str] = [key_fingerprint(k) for k in _GEMINI_KEYS]
 
-# In-memory blocklist to skip exhausted keys for a while
+# Key blocklist and last-good model per key live in the shared provider-health
+# store (Redis or mmap file) so all workers agree. Key choice itself is made by
+# the quota-aware scheduler; the long block is only for invalid/revoked keys.
 _BLOCK_TTL_HOURS = 6
-_blocked_until: Dict[int, datetime] = {}
+# Keys failing at least this often across workers are tried last
+_DEMOTE_ERROR_RATE = float(os.getenv('AI_HEALTH_DEMOTE_ERROR_RATE', '0.5'))
+_DEMOTE_MIN_REQUESTS = int(os.getenv('AI_HEALTH_DEMOTE_MIN_REQUESTS', '5'))
 
-# Last-good model per key for snappier first token
-_last_good_model: Dict[int, str] = {}
+def _health_call(op, *args, default=None):
+    """Health-store call that never breaks a chat turn."""
+    try:
+        return getattr(get_health_store(), op)(*args)
+    except Exception as e:
+        _debug(f"health_store_error op={op} err={e}")
+        return default
 
 def _debug_enabled() -> bool:
     return (os.getenv('AI_DEBUG_LOGS') or '').lower() == 'true'
@@ -79,143 +66,219 @@ def _should_rotate_key(err: Exception) -> bool:
         return True
     return False
 
-def cleanup_old_conversations():
-    """Remove conversations that are older than the timeout"""
-    current_time = datetime.now()
-    to_remove = []
-    for session_id in conversations:
-        if conversations[session_id]:
-            last_message_time = conversations[session_id][-1].get('timestamp')
-            if last_message_time and current_time - last_message_time > CONVERSATION_TIMEOUT:
-                to_remove.append(session_id)
-    
-    for session_id in to_remove:
-        del conversations[session_id]
-
-def get_gemini_response(message, mode='mental_health', session_id=None, risk_level=None):
-    """Get response from Gemini API with conversation history, with model-first fallback and smart multi-key rotation."""
+# For crisis-related messages, clear history to avoid AI learning crisis resources
+def _is_crisis_message(message) -> bool:
+    return scan_message(message or '').resets_history
+
+def _history_call(op, *args, default=None):
+    """History-store call that never breaks a chat turn."""
     try:
-        if not _GEMINI_KEYS:
-            print("Gemini API key not found")
-            return "Configuration error: Gemini API key not found"
+        return getattr(get_history_store(), op)(*args)
+    except Exception as e:
+        _debug(f"history_store_error op={op} err={e}")
+        return default
+
+def _load_history(session_id) -> List[dict]:
+    """Cached history for the session, rehydrated from conversation_logs on a miss"""
+    if not session_id:
+        return []
+    history = _history_call('get', session_id)
+    if history is None:
+        try:
+            history = rehydrate(session_id, stop_at=_is_crisis_message)
+        except Exception as e:
+            _debug(f"history_rehydrate_error err={e}")
+            history = []
+        if history:
+            _history_call('append', session_id, history)
+    return history
 
-        # Initialize or get conversation history
-        if session_id not in conversations:
-            conversations[session_id] = []
+# Canned crisis reply: model output is never shown for crisis-level turns
+CRISIS_SUPPORT_RESPONSE = """I hear how much pain you're in, and it takes incredible strength to express these feelings. Please know that you're not alone, and there are people who want to help you through this difficult time.
 
-        # Clean up old conversations periodically
-        cleanup_old_conversations()
+Your feelings are valid, and it's okay to not be okay. You don't have to carry this burden alone. There are people who care about you and want to support you.
 
-        # For crisis-related messages, clear history to avoid AI learning crisis resources
-        crisis_keywords = ['die', 'suicide', 'kill myself', 'end my life', 'take my life', 'want to die']
-        is_crisis_message = any(keyword in (message or '').lower() for keyword in crisis_keywords)
+Please remember that these intense feelings can pass, and there is hope for things to get better. You deserve support and care."""
 
-        if is_crisis_message:
-            history = []
-            conversations[session_id] = []
-        else:
-            history = conversations[session_id]
-
-        # Prepare the prompt with context based on risk level
-        if risk_level == 'crisis':
-            system_message = """You are a supportive AI assistant for high school students. 
-            The user is in crisis and needs immediate emotional support.
-            Respond with empathy, understanding, and emotional support ONLY.
-            Do NOT mention any crisis resources, helpline numbers, or specific actions.
-            Focus on emotional support and being present with the user.
-            Crisis resources will be provided separately by the system."""
-        else:
-            system_message = """You are a supportive AI assistant for high school students. 
-            Respond with empathy and understanding. If the user seems distressed, 
-            provide emotional support and suggest healthy coping strategies. 
-            Keep responses concise and focused.
-            
-            ABSOLUTE RULE: You must NEVER mention any crisis helpline numbers, phone numbers, or specific resources.
-            Examples of what NOT to mention: 988, 111, 741741, "National Suicide Prevention Lifeline", "Crisis Text Line", etc.
-            Crisis resources will be provided separately by the system.
-            Focus ONLY on emotional support, understanding, and general guidance.
-            If you mention any crisis resources, you are violating this rule."""
-
-        # Build the conversation context
-        conversation_context = ""
-        if history:
-            conversation_context = "\n".join([
-                f"{'User' if msg['is_user'] else 'Assistant'}: {msg['content']}"
-                for msg in history[-5:]
-            ])
-            conversation_context = f"\nPrevious conversation:\n{conversation_context}\n"
-
-        prompt = f"{system_message}\n{conversation_context}\nUser: {message}"
-
-        # Model fallback order (best first) - use broadly compatible identifiers
-        # Prefer newer 2.5 flash models, then 2.0, then stable 1.5 variants, then older names
-        default_models = [
-            'gemini-2.5-flash',
-            'gemini-2.5-flash-lite',
-            'gemini-2.0-flash',
-            'gemini-1.5-flash',
-            'gemini-1.5-flash-latest',
-            'gemini-1.5-flash-8b',
-            'gemini-1.5-pro',
-            'gemini-pro',
-        ]
-
-        # Outer loop over keys with round-robin start; skip blocked keys
-        now = datetime.now()
-        # Sticky session: choose starting key by hashing session_id, else fall back to round-robin
-        if len(_GEMINI_KEYS) > 1:
-            if session_id:
-                try:
-                    hval = int(hashlib.sha256(session_id.encode('utf-8')).hexdigest(), 16)
-                    start_idx = hval % len(_GEMINI_KEYS)
-                except Exception:
-                    start_idx = _next_key_index()
-            else:
-                start_idx = _next_key_index()
-        else:
-            start_idx = 0
-        last_error = None
+# Model fallback order (best first) - use broadly compatible identifiers
+# Prefer newer 2.5 flash models, then 2.0, then stable 1.5 variants, then older names
+_DEFAULT_MODELS = [
+    'gemini-2.5-flash',
+    'gemini-2.5-flash-lite',
+    'gemini-2.0-flash',
+    'gemini-1.5-flash',
+    'gemini-1.5-flash-latest',
+    'gemini-1.5-flash-8b',
+    'gemini-1.5-pro',
+    'gemini-pro',
+]
+
+def _prepare_prompt(message, session_id, risk_level):
+    """Build the prompt for this session's message."""
+    if _is_crisis_message(message):
+        history = []
+        if session_id:
+            _history_call('clear', session_id)
+    else:
+        history = _load_history(session_id)
+
+    # Prepare the prompt with context based on risk level
+    if risk_level == 'crisis':
+        system_message = """You are a supportive AI assistant for high school students. 
+        The user is in crisis and needs immediate emotional support.
+        Respond with empathy, understanding, and emotional support ONLY.
+        Do NOT mention any crisis resources, helpline numbers, or specific actions.
+        Focus on emotional support and being present with the user.
+        Crisis resources will be provided separately by the system."""
+    else:
+        system_message = """You are a supportive AI assistant for high school students. 
+        Respond with empathy and understanding. If the user seems distressed, 
+        provide emotional support and suggest healthy coping strategies. 
+        Keep responses concise and focused.
+        
+        ABSOLUTE RULE: You must NEVER mention any crisis helpline numbers, phone numbers, or specific resources.
+        Examples of what NOT to mention: 988, 111, 741741, "National Suicide Prevention Lifeline", "Crisis Text Line", etc.
+        Crisis resources will be provided separately by the system.
+        Focus ONLY on emotional support, understanding, and general guidance.
+        If you mention any crisis resources, you are violating this rule."""
+
+    # Build the conversation context
+    conversation_context = ""
+    if history:
+        conversation_context = "\n".join([
+            f"{'User' if msg['is_user'] else 'Assistant'}: {msg['content']}"
+            for msg in history[-5:]
+        ])
+        conversation_context = f"\nPrevious conversation:\n{conversation_context}\n"
+
+    return f"{system_message}\n{conversation_context}\nUser: {message}"
+
+def _scheduler():
+    return get_scheduler('gemini', _GEMINI_KEYS)
+
+def _failing_keys() -> List[int]:
+    """Keys failing often across workers; the scheduler tries them last"""
+    if len(_GEMINI_KEYS) <= 1:
+        return []
+    stats = _health_call('stats', 'gemini', _GEMINI_KEY_FPS, default={}) or {}
+    failing = []
+    for i, fp in enumerate(_GEMINI_KEY_FPS):
+        st = stats.get(fp) or {}
+        if (st.get('requests', 0) >= _DEMOTE_MIN_REQUESTS
+                and st.get('error_rate', 0.0) >= _DEMOTE_ERROR_RATE):
+            failing.append(i)
+    return failing
+
+def _candidate_keys(est_tokens: int, max_wait=None):
+    """Yield key indexes by quota headroom; each yielded key has budget reserved"""
+    scheduler = _scheduler()
+    tried = set()
+    demoted = _failing_keys()
+    while len(tried) < len(_GEMINI_KEYS):
+        key_idx = scheduler.pick(est_tokens, exclude=tried, avoid=demoted, max_wait=max_wait)
+        if key_idx is None:
+            _debug("no key with quota headroom")
+            return
+        tried.add(key_idx)
+        yield key_idx
+
+def _usage_tokens(response):
+    usage = getattr(response, 'usage_metadata', None)
+    return getattr(usage, 'total_token_count', None) or None
+
+def _models_for_key(key_idx: int) -> List[str]:
+    """Model order for a key, trying last-good first if present"""
+    models_order = list(_DEFAULT_MODELS)
+    lgm = _health_call('last_good_model', 'gemini', _GEMINI_KEY_FPS[key_idx])
+    if lgm in models_order:
+        models_order = [lgm] + [m for m in models_order if m != lgm]
+    return models_order
+
+def _set_last_good_model(key_idx: int, model_name: str):
+    _health_call('set_last_good_model', 'gemini', _GEMINI_KEY_FPS[key_idx], model_name)
+
+def _on_key_error(key_idx: int, err: Exception) -> bool:
+    """Cool down rate-limited keys, block bad ones; True if the caller should rotate"""
+    if not _should_rotate_key(err):
+        return False
+    if is_rate_limit_error(err):
+        _scheduler().penalize(key_idx)
+    else:
+        _block_key(key_idx)
+    return True
+
+def _release_key(key_idx: int, est_tokens: int, err: Exception):
+    """Give back the tokens reserved on a key none of whose calls succeeded;
+    a rate-limited key was drained by penalize() instead"""
+    if not is_rate_limit_error(err):
+        _scheduler().release(key_idx, est_tokens)
+
+def _block_key(key_idx: int):
+    _health_call('block_key', 'gemini', _GEMINI_KEY_FPS[key_idx], _BLOCK_TTL_HOURS * 3600)
+    _debug(f"block_key key_index={key_idx} ttl_hours={_BLOCK_TTL_HOURS}")
+
+def _record(key_idx: int, ok: bool, started: float = None):
+    """Feed the shared rolling error/latency stats for a key"""
+    latency_ms = (time.monotonic() - started) * 1000.0 if (ok and started) else None
+    _health_call('record', 'gemini', _GEMINI_KEY_FPS[key_idx], ok, latency_ms)
+
+def _remember(session_id, message, reply):
+    if not session_id:
+        return
+    now = datetime.utcnow()
+    _history_call('append', session_id, [
+        {'content': message, 'is_user': True, 'timestamp': now},
+        {'content': reply, 'is_user': False, 'timestamp': now},
+    ])
+
+def remember_turn(session_id, message, reply):
+    """Record a turn answered without the model (e.g. the app's fast path)."""
+    if _is_crisis_message(message) and session_id:
+        _history_call('clear', session_id)
+    _remember(session_id, message, reply)
+
+def has_history(session_id) -> bool:
+    """Whether the next prompt for this session would carry earlier turns."""
+    return bool(_load_history(session_id))
+
+def get_gemini_response(message, mode='mental_health', session_id=None, risk_level=None, remember=True):
+    """Get response from Gemini API with conversation history, with model-first fallback and smart multi-key rotation.
+
+    remember=False leaves the turn out of the session history; a caller that
+    may discard the reply (a hedged race) records the reply it used itself.
+    """
+    try:
+        if not _GEMINI_KEYS:
+            print("Gemini API key not found")
+            return "Configuration error: Gemini API key not found"
 
-        for k_off in range(len(_GEMINI_KEYS)):
-            key_idx = (start_idx + k_off) % len(_GEMINI_KEYS)
+        prompt = _prepare_prompt(message, session_id, risk_level)
+        est_tokens = estimate_tokens(prompt)
 
-            # Skip blocked keys within TTL window
-            until = _blocked_until.get(key_idx)
-            if until and now < until:
-                _debug(f"skip_blocked key_index={key_idx} until={until}")
-                continue
+        # Outer loop over keys by quota headroom; blocked/cooling keys skipped
+        last_error = None
 
+        for key_idx in _candidate_keys(est_tokens):
             api_key = _GEMINI_KEYS[key_idx]
             try:
-                genai.configure(api_key=api_key)
+                gemini_client(api_key)
                 _debug(f"using_key_index={key_idx}")
 
-                # Build model order, trying last-good first if present
-                models_order = list(default_models)
-                if key_idx in _last_good_model:
-                    lgm = _last_good_model[key_idx]
-                    if lgm in models_order:
-                        models_order = [lgm] + [m for m in models_order if m != lgm]
-
-                for model_name in models_order:
+                for model_name in _models_for_key(key_idx):
+                    started = time.monotonic()
                     try:
-                        model = genai.GenerativeModel(model_name)
+                        model = gemini_model(api_key, model_name)
                         response = model.generate_content(prompt)
                         if not response or not getattr(response, 'text', None):
                             _debug(f"empty_response model={model_name}")
+                            _record(key_idx, ok=False)
                             last_error = ValueError('empty response')
                             # Try next model within same key
                             continue
 
                         # Build cleaned response
                         if risk_level == 'crisis':
-                            cleaned_response = (
-"""I hear how much pain you're in, and it takes incredible strength to express these feelings. Please know that you're not alone, and there are people who want to help you through this difficult time.
-
-Your feelings are valid, and it's okay to not be okay. You don't have to carry this burden alone. There are people who care about you and want to support you.
-
-Please remember that these intense feelings can pass, and there is hope for things to get better. You deserve support and care."""
-                            )
+                            cleaned_response = CRISIS_SUPPORT_RESPONSE
                         else:
                             cleaned_response = response.text
 
@@ -223,35 +286,33 @@ Please remember that these intense feelings can pass, and there is hope for thin
                         cleaned_response = re.sub(r'\n\s*\n\s*\n', '\n\n', cleaned_response).strip()
 
                         # Store conversation
-                        history.append({'content': message, 'is_user': True, 'timestamp': datetime.now()})
-                        history.append({'content': cleaned_response, 'is_user': False, 'timestamp': datetime.now()})
-                        conversations[session_id] = history
+                        if remember:
+                            _remember(session_id, message, cleaned_response)
 
                         # Update last-good model for this key
-                        _last_good_model[key_idx] = model_name
+                        _set_last_good_model(key_idx, model_name)
+                        _record(key_idx, ok=True, started=started)
+                        _scheduler().settle(key_idx, est_tokens, _usage_tokens(response))
 
                         return cleaned_response
                     except Exception as e_model:
-                        rotate = _should_rotate_key(e_model)
+                        rotate = _on_key_error(key_idx, e_model)
                         _debug(f"model_error model={model_name} rotate={rotate} err={e_model}")
+                        _record(key_idx, ok=False)
                         last_error = e_model
                         if rotate:
-                            # Block this key for TTL and rotate to next key
-                            _blocked_until[key_idx] = datetime.now() + timedelta(hours=_BLOCK_TTL_HOURS)
-                            _debug(f"block_key key_index={key_idx} ttl_hours={_BLOCK_TTL_HOURS}")
+                            # Key cooled down or blocked: rotate to next key
                             break
                         # else: try next model under same key
                         continue
 
             except Exception as e_key:
                 # Configuration or immediate key-scope errors
-                rotate = _should_rotate_key(e_key)
+                rotate = _on_key_error(key_idx, e_key)
                 _debug(f"key_scope_error key_index={key_idx} rotate={rotate} err={e_key}")
                 last_error = e_key
-                if rotate:
-                    _blocked_until[key_idx] = datetime.now() + timedelta(hours=_BLOCK_TTL_HOURS)
-                    _debug(f"block_key key_index={key_idx} ttl_hours={_BLOCK_TTL_HOURS}")
 
+            _release_key(key_idx, est_tokens, last_error)
             # Small jitter when rotating keys to avoid synchronized spikes
             time.sleep(random.uniform(0.05, 0.2))
 
@@ -263,3 +324,162 @@ Please remember that these intense feelings can pass, and there is hope for thin
     except Exception as e:
         print(f"Unexpected Gemini API error: {str(e)}")
         return "I'm having trouble connecting to my AI services. Please try again in a moment."
+
+def _chunk_text(chunk) -> str:
+    try:
+        return chunk.text or ''
+    except Exception:
+        # Chunks without text parts (e.g. safety-blocked) raise on .text
+        return ''
+
+def stream_gemini_response(message, mode='mental_health', session_id=None, risk_level=None):
+    """Yield response text chunks as Gemini produces them.
+
+    Key/model fallback happens only until the first chunk arrives; errors after
+    that propagate to the caller. Raises RuntimeError if nothing could be started.
+    """
+    if not _GEMINI_KEYS:
+        raise RuntimeError("Configuration error: Gemini API key not found")
+
+    prompt = _prepare_prompt(message, session_id, risk_level)
+
+    if risk_level == 'crisis':
+        # Model output would be replaced anyway; skip the round trip
+        _remember(session_id, message, CRISIS_SUPPORT_RESPONSE)
+        yield CRISIS_SUPPORT_RESPONSE
+        return
+
+    est_tokens = estimate_tokens(prompt)
+    last_error = None
+
+    for key_idx in _candidate_keys(est_tokens):
+        try:
+            gemini_client(_GEMINI_KEYS[key_idx])
+            _debug(f"stream using_key_index={key_idx}")
+        except Exception as e_key:
+            last_error = e_key
+            _on_key_error(key_idx, e_key)
+            _release_key(key_idx, est_tokens, e_key)
+            continue
+
+        for model_name in _models_for_key(key_idx):
+            started = time.monotonic()
+            try:
+                model = gemini_model(_GEMINI_KEYS[key_idx], model_name)
+                chunks = iter(model.generate_content(prompt, stream=True))
+                first = ''
+                for chunk in chunks:
+                    first = _chunk_text(chunk).lstrip()
+                    if first:
+                        break
+            except Exception as e_model:
+                rotate = _on_key_error(key_idx, e_model)
+                _debug(f"stream model_error model={model_name} rotate={rotate} err={e_model}")
+                _record(key_idx, ok=False)
+                last_error = e_model
+                if rotate:
+                    break
+                continue
+            if not first:
+                _debug(f"stream empty_response model={model_name}")
+                _record(key_idx, ok=False)
+                last_error = ValueError('empty response')
+                continue
+
+            # Committed to this key/model: forward chunks as they arrive
+            _set_last_good_model(key_idx, model_name)
+            _record(key_idx, ok=True, started=started)
+            _scheduler().settle(key_idx, est_tokens, None)
+            parts = [first]
+            yield first
+            for chunk in chunks:
+                text = _chunk_text(chunk)
+                if text:
+                    parts.append(text)
+                    yield text
+            full_text = re.sub(r'\n\s*\n\s*\n', '\n\n', ''.join(parts)).strip()
+            _remember(session_id, message, full_text)
+            return
+
+        _release_key(key_idx, est_tokens, last_error)
+        time.sleep(random.uniform(0.05, 0.2))
+
+    raise RuntimeError(f"Error generating response: {last_error or 'no usable Gemini key'}")
+
+async def astream_gemini_response(message, mode='mental_health', session_id=None, risk_level=None):
+    """Async variant of stream_gemini_response built on generate_content_async."""
+    if not _GEMINI_KEYS:
+        raise RuntimeError("Configuration error: Gemini API key not found")
+
+    # History lookups and rehydration hit Redis and the database: keep them
+    # off the event loop
+    prompt = await asyncio.to_thread(_prepare_prompt, message, session_id, risk_level)
+
+    if risk_level == 'crisis':
+        await asyncio.to_thread(_remember, session_id, message, CRISIS_SUPPORT_RESPONSE)
+        yield CRISIS_SUPPORT_RESPONSE
+        return
+
+    est_tokens = estimate_tokens(prompt)
+    last_error = None
+
+    # Key picks, health stats and quota bookkeeping take the scheduler lock and
+    # hit Redis or a file lock: run every step of them in a worker thread, and
+    # never sleep waiting for quota
+    candidates = _candidate_keys(est_tokens, max_wait=0)
+    while True:
+        key_idx = await asyncio.to_thread(next, candidates, None)
+        if key_idx is None:
+            break
+        try:
+            gemini_async_client(_GEMINI_KEYS[key_idx])
+            _debug(f"astream using_key_index={key_idx}")
+        except Exception as e_key:
+            last_error = e_key
+            await asyncio.to_thread(_on_key_error, key_idx, e_key)
+            await asyncio.to_thread(_release_key, key_idx, est_tokens, e_key)
+            continue
+
+        for model_name in await asyncio.to_thread(_models_for_key, key_idx):
+            started = time.monotonic()
+            try:
+                model = gemini_async_model(_GEMINI_KEYS[key_idx], model_name)
+                response = await model.generate_content_async(prompt, stream=True)
+                chunks = response.__aiter__()
+                first = ''
+                async for chunk in chunks:
+                    first = _chunk_text(chunk).lstrip()
+                    if first:
+                        break
+            except Exception as e_model:
+                rotate = await asyncio.to_thread(_on_key_error, key_idx, e_model)
+                _debug(f"astream model_error model={model_name} rotate={rotate} err={e_model}")
+                await asyncio.to_thread(_record, key_idx, False)
+                last_error = e_model
+                if rotate:
+                    break
+                continue
+            if not first:
+                _debug(f"astream empty_response model={model_name}")
+                await asyncio.to_thread(_record, key_idx, False)
+                last_error = ValueError('empty response')
+                continue
+
+            await asyncio.to_thread(_set_last_good_model, key_idx, model_name)
+            await asyncio.to_thread(_record, key_idx, True, started)
+            await asyncio.to_thread(_scheduler().settle, key_idx, est_tokens, None)
+            parts = [first]
+            yield first
+            async for chunk in chunks:
+                text = _chunk_text(chunk)
+                if text:
+                    parts.append(text)
+                    yield text
+            full_text = re.sub(r'\n\s*\n\s*\n', '\n\n', ''.join(parts)).strip()
+            await asyncio.to_thread(_remember, session_id, message, full_text)
+            return
+
+        await asyncio.to_thread(_release_key, key_idx, est_tokens, last_error)
+        await asyncio.sleep(random.uniform(0.05, 0.2))
+
+    raise RuntimeError(f"Error generating response: {last_error or 'no usable Gemini key'}")
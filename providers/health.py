@@ -0,0 +1,357 @@
+"""
+Provider health shared across workers: key blocklist, last-good model per key,
+round-robin cursors and rolling error/latency stats.
+
+Backed by Redis when REDIS_URL (or AI_HEALTH_REDIS_URL) is reachable, otherwise
+by a memory-mapped file shared by the workers on this host. Keys are always
+referred to by fingerprint (providers.clients.key_fingerprint), never raw.
+"""
+
+import os
+import json
+import time
+import fcntl
+import mmap
+import struct
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Optional
+
+# Rolling stats use one bucket per minute, kept for this many minutes
+STATS_WINDOW_MINUTES = int(os.getenv('AI_HEALTH_WINDOW_MINUTES', '5'))
+HEALTH_FILE = os.getenv('AI_HEALTH_FILE') or os.path.join(tempfile.gettempdir(), 'ai_provider_health.mmap')
+HEALTH_FILE_BYTES = int(os.getenv('AI_HEALTH_FILE_BYTES', str(1024 * 1024)))
+
+
+def _debug(*args):
+    if (os.getenv('AI_DEBUG_LOGS') or '').lower() == 'true':
+        print('[health]', *args)
+
+
+def _minute(now: Optional[float] = None) -> int:
+    return int((now if now is not None else time.time()) // 60)
+
+
+def _summarize(buckets: Iterable[List[float]]) -> Dict[str, float]:
+    """Fold [requests, errors, latency_ms_sum, latency_n] buckets into stats."""
+    requests = errors = lat_sum = lat_n = 0.0
+    for b in buckets:
+        requests += b[0]
+        errors += b[1]
+        lat_sum += b[2]
+        lat_n += b[3]
+    return {
+        'requests': int(requests),
+        'errors': int(errors),
+        'error_rate': (errors / requests) if requests else 0.0,
+        'avg_latency_ms': (lat_sum / lat_n) if lat_n else 0.0,
+    }
+
+
+class RedisHealthStore:
+    """Health state in Redis; every worker on every host sees the same view."""
+
+    backend = 'redis'
+
+    def __init__(self, client, prefix: str = 'aihealth:'):
+        self.redis = client
+        self.prefix = prefix
+
+    def _k(self, *parts) -> str:
+        return self.prefix + ':'.join(parts)
+
+    def block_key(self, provider: str, key_fp: str, ttl_seconds: float):
+        until = time.time() + ttl_seconds
+        self.redis.set(self._k('block', provider, key_fp), until, ex=max(1, int(ttl_seconds)))
+
+    def unblock_key(self, provider: str, key_fp: str):
+        self.redis.delete(self._k('block', provider, key_fp))
+
+    def blocked(self, provider: str, key_fps: List[str]) -> Dict[str, float]:
+        """Map of fingerprint -> blocked-until epoch for currently blocked keys."""
+        if not key_fps:
+            return {}
+        values = self.redis.mget([self._k('block', provider, fp) for fp in key_fps])
+        now = time.time()
+        return {fp: float(v) for fp, v in zip(key_fps, values) if v and float(v) > now}
+
+    def last_good_model(self, provider: str, key_fp: str) -> Optional[str]:
+        v = self.redis.hget(self._k('lgm', provider), key_fp)
+        return v.decode() if isinstance(v, bytes) else v
+
+    def set_last_good_model(self, provider: str, key_fp: str, model: str):
+        self.redis.hset(self._k('lgm', provider), key_fp, model)
+
+    def next_index(self, provider: str, n: int) -> int:
+        if n <= 1:
+            return 0
+        return (int(self.redis.incr(self._k('rr', provider))) - 1) % n
+
+    def record(self, provider: str, key_fp: str, ok: bool, latency_ms: Optional[float] = None):
+        key = self._k('stats', provider, key_fp or '*', str(_minute()))
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hincrby(key, 'requests', 1)
+        if not ok:
+            pipe.hincrby(key, 'errors', 1)
+        if latency_ms is not None:
+            pipe.hincrbyfloat(key, 'lat_sum', float(latency_ms))
+            pipe.hincrby(key, 'lat_n', 1)
+        pipe.expire(key, (STATS_WINDOW_MINUTES + 1) * 60)
+        pipe.execute()
+
+    def stats(self, provider: str, key_fps: Iterable[str]) -> Dict[str, Dict[str, float]]:
+        key_fps = list(key_fps)
+        now_min = _minute()
+        minutes = [str(m) for m in range(now_min - STATS_WINDOW_MINUTES + 1, now_min + 1)]
+        pipe = self.redis.pipeline(transaction=False)
+        for fp in key_fps:
+            for m in minutes:
+                pipe.hgetall(self._k('stats', provider, fp or '*', m))
+        raw = pipe.execute()
+        out = {}
+        for i, fp in enumerate(key_fps):
+            buckets = []
+            for h in raw[i * len(minutes):(i + 1) * len(minutes)]:
+                h = {(k.decode() if isinstance(k, bytes) else k): float(v) for k, v in (h or {}).items()}
+                buckets.append([h.get('requests', 0), h.get('errors', 0), h.get('lat_sum', 0), h.get('lat_n', 0)])
+            out[fp] = _summarize(buckets)
+        return out
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """All stats in the window, keyed provider -> key fingerprint."""
+        found: Dict[str, set] = {}
+        for key in self.redis.scan_iter(match=self._k('stats', '*'), count=500):
+            key = key.decode() if isinstance(key, bytes) else key
+            _, provider, fp, _m = key[len(self.prefix):].split(':')
+            found.setdefault(provider, set()).add(fp)
+        return {p: self.stats(p, sorted(fps)) for p, fps in found.items()}
+
+
+class FileHealthStore:
+    """Health state in a memory-mapped JSON document guarded by flock.
+
+    Layout: uint64 version, uint32 length, then `length` bytes of JSON. Readers
+    re-parse only when the version changes, so the hot path is a lock + 12 bytes.
+    """
+
+    backend = 'file'
+    _HEADER = struct.Struct('<QI')
+
+    def __init__(self, path: str = HEALTH_FILE, size: int = HEALTH_FILE_BYTES):
+        self.path = path
+        self.size = size
+        self._local = threading.Lock()
+        self._pid = None
+        self._cached_version = -1
+        self._cached_doc: Dict = {}
+        self._open()
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < self.size:
+            os.ftruncate(fd, self.size)
+        self._fd = fd
+        self._mm = mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        # flock is per open file description: reopen after fork so workers exclude each other
+        self._pid = os.getpid()
+        self._cached_version = -1
+
+    def _ensure_open(self):
+        if self._pid != os.getpid():
+            self._open()
+
+    def _read(self) -> Dict:
+        version, length = self._HEADER.unpack_from(self._mm, 0)
+        if version != self._cached_version:
+            if length == 0:
+                doc = {}
+            else:
+                try:
+                    doc = json.loads(self._mm[self._HEADER.size:self._HEADER.size + length])
+                except ValueError:
+                    doc = {}
+            self._cached_doc = doc
+            self._cached_version = version
+        return self._cached_doc
+
+    def _write(self, doc: Dict):
+        payload = json.dumps(doc, separators=(',', ':')).encode()
+        capacity = self.size - self._HEADER.size
+        while len(payload) > capacity and self._drop_oldest_stats(doc):
+            payload = json.dumps(doc, separators=(',', ':')).encode()
+        if len(payload) > capacity:
+            _debug(f"file_store_full bytes={len(payload)}")
+            return
+        version, _ = self._HEADER.unpack_from(self._mm, 0)
+        self._mm[self._HEADER.size:self._HEADER.size + len(payload)] = payload
+        self._HEADER.pack_into(self._mm, 0, version + 1, len(payload))
+        self._cached_doc = doc
+        self._cached_version = version + 1
+
+    @staticmethod
+    def _drop_oldest_stats(doc: Dict) -> bool:
+        oldest = None
+        for provider, keys in doc.get('stats', {}).items():
+            for fp, buckets in keys.items():
+                for m in buckets:
+                    if oldest is None or int(m) < oldest[2]:
+                        oldest = (provider, fp, int(m))
+        if oldest is None:
+            return False
+        del doc['stats'][oldest[0]][oldest[1]][str(oldest[2])]
+        return True
+
+    def _locked(self, exclusive: bool):
+        store = self
+
+        class _Ctx:
+            def __enter__(self):
+                store._local.acquire()
+                store._ensure_open()
+                fcntl.flock(store._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                return store._read()
+
+            def __exit__(self, *exc):
+                fcntl.flock(store._fd, fcntl.LOCK_UN)
+                store._local.release()
+
+        return _Ctx()
+
+    def _mutate(self, fn):
+        with self._locked(exclusive=True) as doc:
+            doc = json.loads(json.dumps(doc))  # never mutate the shared cache in place
+            result = fn(doc)
+            self._write(doc)
+            return result
+
+    def block_key(self, provider: str, key_fp: str, ttl_seconds: float):
+        until = time.time() + ttl_seconds
+        self._mutate(lambda d: d.setdefault('block', {}).setdefault(provider, {}).__setitem__(key_fp, until))
+
+    def unblock_key(self, provider: str, key_fp: str):
+        self._mutate(lambda d: d.get('block', {}).get(provider, {}).pop(key_fp, None))
+
+    def blocked(self, provider: str, key_fps: List[str]) -> Dict[str, float]:
+        with self._locked(exclusive=False) as doc:
+            blocks = doc.get('block', {}).get(provider, {})
+            now = time.time()
+            return {fp: blocks[fp] for fp in key_fps if blocks.get(fp, 0) > now}
+
+    def last_good_model(self, provider: str, key_fp: str) -> Optional[str]:
+        with self._locked(exclusive=False) as doc:
+            return doc.get('lgm', {}).get(provider, {}).get(key_fp)
+
+    def set_last_good_model(self, provider: str, key_fp: str, model: str):
+        if self.last_good_model(provider, key_fp) == model:
+            return
+        self._mutate(lambda d: d.setdefault('lgm', {}).setdefault(provider, {}).__setitem__(key_fp, model))
+
+    def next_index(self, provider: str, n: int) -> int:
+        if n <= 1:
+            return 0
+
+        def bump(d):
+            rr = d.setdefault('rr', {})
+            idx = int(rr.get(provider, 0))
+            rr[provider] = idx + 1
+            return idx % n
+
+        return self._mutate(bump)
+
+    def record(self, provider: str, key_fp: str, ok: bool, latency_ms: Optional[float] = None):
+        now_min = _minute()
+
+        def add(d):
+            buckets = d.setdefault('stats', {}).setdefault(provider, {}).setdefault(key_fp or '*', {})
+            for m in [m for m in buckets if int(m) <= now_min - STATS_WINDOW_MINUTES]:
+                del buckets[m]
+            b = buckets.setdefault(str(now_min), [0, 0, 0.0, 0])
+            b[0] += 1
+            if not ok:
+                b[1] += 1
+            if latency_ms is not None:
+                b[2] += float(latency_ms)
+                b[3] += 1
+
+        self._mutate(add)
+
+    def stats(self, provider: str, key_fps: Iterable[str]) -> Dict[str, Dict[str, float]]:
+        floor = _minute() - STATS_WINDOW_MINUTES
+        with self._locked(exclusive=False) as doc:
+            per_key = doc.get('stats', {}).get(provider, {})
+            return {
+                fp: _summarize(b for m, b in per_key.get(fp or '*', {}).items() if int(m) > floor)
+                for fp in key_fps
+            }
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        with self._locked(exclusive=False) as doc:
+            providers = {p: list(keys) for p, keys in doc.get('stats', {}).items()}
+        return {p: self.stats(p, fps) for p, fps in providers.items()}
+
+
+class _FallbackStore:
+    """Redis store that drops to a local store while Redis is unreachable."""
+
+    def __init__(self, primary: RedisHealthStore, fallback_factory):
+        self.primary = primary
+        self._fallback_factory = fallback_factory
+        self._fallback = None
+        self._retry_at = 0.0
+
+    @property
+    def backend(self) -> str:
+        return 'redis' if time.time() >= self._retry_at else 'file'
+
+    def _fallback_store(self):
+        if self._fallback is None:
+            self._fallback = self._fallback_factory()
+        return self._fallback
+
+    def __getattr__(self, name):
+        primary_fn = getattr(self.primary, name)
+
+        def call(*args, **kwargs):
+            if time.time() >= self._retry_at:
+                try:
+                    return primary_fn(*args, **kwargs)
+                except Exception as e:
+                    _debug(f"redis_unavailable op={name} err={e}")
+                    self._retry_at = time.time() + 30
+            return getattr(self._fallback_store(), name)(*args, **kwargs)
+
+        return call
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_health_store():
+    """Process-wide provider health store (Redis if configured, else mmap file)."""
+    global _store
+    with _store_lock:
+        if _store is not None:
+            return _store
+        redis_url = (os.getenv('AI_HEALTH_REDIS_URL') or os.getenv('REDIS_URL') or '').strip()
+        if redis_url:
+            try:
+                import redis
+                client = redis.from_url(redis_url, socket_connect_timeout=1, socket_timeout=1,
+                                        retry_on_timeout=False)
+                client.ping()
+                _store = _FallbackStore(RedisHealthStore(client), FileHealthStore)
+                _debug('backend=redis')
+                return _store
+            except Exception as e:
+                _debug(f"redis_unavailable err={e}; using file store")
+        _store = FileHealthStore()
+        _debug(f"backend=file path={_store.path}")
+        return _store
+
+
+def set_health_store(store):
+    """Swap the process-wide store (tests, custom backends)."""
+    global _store
+    with _store_lock:
+        _store = store
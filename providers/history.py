@@ -0,0 +1,232 @@
+"""
+Conversation history store for provider prompts.
+
+Replaces the unbounded module-level dict (and its full scan on every request)
+with a bounded store: an in-process LRU with an expiry heap and a memory cap, or
+Redis lists shared by every worker. Histories missing from the store are lazily
+rehydrated from conversation_logs through a loader registered by the app.
+"""
+
+import os
+import json
+import heapq
+import time
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from providers.health import _FallbackStore
+
+HISTORY_TTL_SECONDS = float(os.getenv('HISTORY_TTL_SECONDS', '3600'))
+HISTORY_MAX_MESSAGES = int(os.getenv('HISTORY_MAX_MESSAGES', '10'))
+HISTORY_MAX_SESSIONS = int(os.getenv('HISTORY_MAX_SESSIONS', '10000'))
+HISTORY_MAX_BYTES = int(os.getenv('HISTORY_MAX_BYTES', str(32 * 1024 * 1024)))
+# Rough per-message bookkeeping cost on top of the text itself
+_MESSAGE_OVERHEAD_BYTES = 200
+
+
+def _debug(*args):
+    if (os.getenv('AI_DEBUG_LOGS') or '').lower() == 'true':
+        print('[history]', *args)
+
+
+def _message_bytes(msg: dict) -> int:
+    return len(msg.get('content') or '') + _MESSAGE_OVERHEAD_BYTES
+
+
+class MemoryHistoryStore:
+    """Per-worker LRU of session histories with TTL expiry and a memory cap.
+
+    Expiry uses a min-heap of (expires_at, session_id); stale heap entries for
+    sessions that were touched again are skipped when popped, so eviction is
+    O(log n) instead of a scan over every session.
+    """
+
+    backend = 'memory'
+
+    def __init__(self, ttl_seconds: float = None, max_messages: int = None,
+                 max_sessions: int = None, max_bytes: int = None):
+        self.ttl = HISTORY_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_messages = max_messages or HISTORY_MAX_MESSAGES
+        self.max_sessions = max_sessions or HISTORY_MAX_SESSIONS
+        self.max_bytes = max_bytes or HISTORY_MAX_BYTES
+        self._entries: 'OrderedDict[str, list]' = OrderedDict()  # sid -> [messages, bytes, expires_at]
+        self._expiry: List[tuple] = []
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def bytes_used(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, session_id: str):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _evict(self, now: float):
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, sid = heapq.heappop(self._expiry)
+            entry = self._entries.get(sid)
+            if entry is not None and entry[2] == expires_at:
+                self._drop(sid)
+        while self._entries and (len(self._entries) > self.max_sessions or self._bytes > self.max_bytes):
+            sid, entry = self._entries.popitem(last=False)
+            self._bytes -= entry[1]
+        # Keep the heap from filling up with stale entries for busy sessions
+        if len(self._expiry) > 2 * len(self._entries) + 64:
+            self._expiry = [(e[2], sid) for sid, e in self._entries.items()]
+            heapq.heapify(self._expiry)
+
+    def get(self, session_id: str) -> Optional[List[dict]]:
+        """History (oldest first), or None if the session is not cached."""
+        with self._lock:
+            now = time.time()
+            self._evict(now)
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(session_id)
+            return list(entry[0])
+
+    def append(self, session_id: str, messages: List[dict]):
+        with self._lock:
+            now = time.time()
+            entry = self._entries.get(session_id)
+            if entry is None:
+                entry = [deque(maxlen=self.max_messages), 0, 0.0]
+                self._entries[session_id] = entry
+            history = entry[0]
+            for msg in messages:
+                if len(history) == history.maxlen:
+                    dropped = _message_bytes(history[0])
+                    entry[1] -= dropped
+                    self._bytes -= dropped
+                history.append(msg)
+                entry[1] += _message_bytes(msg)
+                self._bytes += _message_bytes(msg)
+            entry[2] = now + self.ttl
+            heapq.heappush(self._expiry, (entry[2], session_id))
+            self._entries.move_to_end(session_id)
+            self._evict(now)
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._drop(session_id)
+
+
+class RedisHistoryStore:
+    """History as a capped Redis list per session (newest first: LPUSH + LTRIM)."""
+
+    backend = 'redis'
+
+    def __init__(self, client, prefix: str = 'convhist:', ttl_seconds: float = None,
+                 max_messages: int = None):
+        self.redis = client
+        self.prefix = prefix
+        self.ttl = int(HISTORY_TTL_SECONDS if ttl_seconds is None else ttl_seconds)
+        self.max_messages = max_messages or HISTORY_MAX_MESSAGES
+
+    def _k(self, session_id: str) -> str:
+        return self.prefix + session_id
+
+    def get(self, session_id: str) -> Optional[List[dict]]:
+        raw = self.redis.lrange(self._k(session_id), 0, -1)
+        if not raw:
+            return None
+        history = []
+        for item in reversed(raw):
+            msg = json.loads(item)
+            if msg.get('timestamp'):
+                msg['timestamp'] = datetime.fromisoformat(msg['timestamp'])
+            history.append(msg)
+        return history
+
+    def append(self, session_id: str, messages: List[dict]):
+        if not messages:
+            return
+        key = self._k(session_id)
+        payload = [json.dumps({**m, 'timestamp': m['timestamp'].isoformat() if m.get('timestamp') else None})
+                   for m in messages]
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lpush(key, *payload)
+        pipe.ltrim(key, 0, self.max_messages - 1)
+        pipe.expire(key, max(1, self.ttl))
+        pipe.execute()
+
+    def clear(self, session_id: str):
+        self.redis.delete(self._k(session_id))
+
+
+# ---------- Rehydration from conversation_logs ----------
+
+# loader(session_id, limit, since) -> [(user_message, ai_response, timestamp)], newest first
+_loader: Optional[Callable] = None
+
+
+def set_history_loader(loader: Optional[Callable]):
+    """Register how to read recent turns from conversation_logs (set by the app)."""
+    global _loader
+    _loader = loader
+
+
+def rehydrate(session_id: str, stop_at: Callable[[str], bool] = None) -> List[dict]:
+    """Recent history rebuilt from logged turns; turns before the last one
+    matching stop_at (e.g. a crisis message that reset the history) are left out."""
+    if _loader is None or not session_id:
+        return []
+    # Logged turns carry naive UTC timestamps (datetime.utcnow())
+    since = datetime.utcnow() - timedelta(seconds=HISTORY_TTL_SECONDS)
+    turns = []
+    for user_message, ai_response, ts in _loader(session_id, max(1, HISTORY_MAX_MESSAGES // 2), since):
+        if stop_at and stop_at(user_message or ''):
+            break
+        turns.append((user_message, ai_response, ts))
+    history: List[dict] = []
+    for user_message, ai_response, ts in reversed(turns):
+        # Turns backfilled from chat_messages carry one half only
+        if user_message:
+            history.append({'content': user_message, 'is_user': True, 'timestamp': ts})
+        if ai_response:
+            history.append({'content': ai_response, 'is_user': False, 'timestamp': ts})
+    return history
+
+
+# ---------- Process-wide store ----------
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history_store():
+    """Process-wide history store (Redis if configured, else in-process LRU)."""
+    global _store
+    with _store_lock:
+        if _store is not None:
+            return _store
+        redis_url = (os.getenv('HISTORY_REDIS_URL') or os.getenv('REDIS_URL') or '').strip()
+        if redis_url:
+            try:
+                import redis
+                client = redis.from_url(redis_url, socket_connect_timeout=1, socket_timeout=1,
+                                        retry_on_timeout=False)
+                client.ping()
+                _store = _FallbackStore(RedisHistoryStore(client), MemoryHistoryStore)
+                _debug('backend=redis')
+                return _store
+            except Exception as e:
+                _debug(f"redis_unavailable err={e}; using memory store")
+        _store = MemoryHistoryStore()
+        _debug('backend=memory')
+        return _store
+
+
+def set_history_store(store):
+    """Swap the process-wide store (tests, custom backends)."""
+    global _store
+    with _store_lock:
+        _store = store
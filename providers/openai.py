@@ -1,5 +1,10 @@
 import os
-from openai import OpenAI
+import asyncio
+from providers.clients import async_openai_client, openai_client
+from providers.scheduler import (
+    estimate_tokens, get_scheduler, is_auth_error, is_rate_limit_error, is_server_error,
+    parse_keys, retry_after_seconds,
+)
 
 def _debug_enabled() -> bool:
     return (os.getenv('AI_DEBUG_LOGS') or '').lower() == 'true'
@@ -8,38 +13,111 @@ def _debug(*args):
     if _debug_enabled():
         print('[openai]', *args)
 
+_SYSTEM_MESSAGE = """You are a supportive AI assistant for high school students. 
+        Respond with empathy and understanding. If the user seems distressed, 
+        provide emotional support and suggest healthy coping strategies. 
+        Keep responses concise and focused."""
+_MODEL_NAME = "gpt-3.5-turbo"
+_MAX_TOKENS = 150
+
+def _api_keys():
+    return parse_keys('OPENAI_API_KEY', 'OPENAI_API_KEYS')
+
+def _request(message, **kwargs):
+    return dict(
+        model=_MODEL_NAME,
+        messages=[
+            {"role": "system", "content": _SYSTEM_MESSAGE},
+            {"role": "user", "content": message}
+        ],
+        max_tokens=_MAX_TOKENS,
+        temperature=0.7,
+        **kwargs,
+    )
+
+def _retry_after(err):
+    return retry_after_seconds(getattr(getattr(err, 'response', None), 'headers', None))
+
+def _pick_key(scheduler, est_tokens, tried, last_error):
+    key_idx = scheduler.pick(est_tokens, exclude=tried)
+    if key_idx is None:
+        raise last_error or RuntimeError("OpenAI API error: no API key with quota headroom")
+    tried.add(key_idx)
+    _debug(f"using_key_index={key_idx}")
+    return key_idx
+
+def _on_key_error(scheduler, key_idx, est_tokens, err) -> bool:
+    """Cool down rate-limited or failing keys, block rejected ones; True if the
+    caller should rotate to the next key"""
+    if is_auth_error(err):
+        _debug(f"rejected key_index={key_idx} err={err}")
+        scheduler.block(key_idx)
+    elif is_rate_limit_error(err) or is_server_error(err):
+        _debug(f"cooldown key_index={key_idx} err={err}")
+        scheduler.penalize(key_idx, _retry_after(err))
+    else:
+        # Connection and other non-key errors: the tokens were not used
+        scheduler.release(key_idx, est_tokens)
+        return False
+    return True
+
+def _create(message, **kwargs):
+    """chat.completions.create on the key with most quota headroom, rotating away
+    from rate-limited, failing (5xx) and rejected (401/403) keys.
+
+    Returns (scheduler, key_idx, est_tokens, response).
+    """
+    keys = _api_keys()
+    if not keys:
+        raise RuntimeError("Configuration error: OpenAI API key not found")
+    scheduler = get_scheduler('openai', keys)
+    est_tokens = estimate_tokens(_SYSTEM_MESSAGE + (message or ''), _MAX_TOKENS)
+    tried, last_error = set(), None
+    while True:
+        key_idx = _pick_key(scheduler, est_tokens, tried, last_error)
+        try:
+            response = openai_client(keys[key_idx]).chat.completions.create(**_request(message, **kwargs))
+            return scheduler, key_idx, est_tokens, response
+        except Exception as e:
+            if not _on_key_error(scheduler, key_idx, est_tokens, e):
+                raise
+            last_error = e
+
+async def _acreate(message, **kwargs):
+    """Async variant of _create."""
+    keys = _api_keys()
+    if not keys:
+        raise RuntimeError("Configuration error: OpenAI API key not found")
+    scheduler = get_scheduler('openai', keys)
+    est_tokens = estimate_tokens(_SYSTEM_MESSAGE + (message or ''), _MAX_TOKENS)
+    tried, last_error = set(), None
+    while True:
+        # pick() may wait briefly for a refill; keep that off the event loop
+        key_idx = await asyncio.to_thread(_pick_key, scheduler, est_tokens, tried, last_error)
+        try:
+            client = async_openai_client(keys[key_idx])
+            response = await client.chat.completions.create(**_request(message, **kwargs))
+            return scheduler, key_idx, est_tokens, response
+        except Exception as e:
+            # Cooldowns and blocks are shared through the health store
+            if not await asyncio.to_thread(_on_key_error, scheduler, key_idx, est_tokens, e):
+                raise
+            last_error = e
+
 def get_openai_response(message, mode='mental_health'):
     """Get response from OpenAI API"""
     try:
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not (api_key or '').strip():
+        if not _api_keys():
             print("OpenAI API key not found")
             return "Configuration error: OpenAI API key not found"
 
-        client = OpenAI(api_key=api_key)
-        model_name = "gpt-3.5-turbo"
-        temperature = 0.7
-        max_tokens = 150
-        _debug(f"invoke model={model_name} temp={temperature} max_tokens={max_tokens} msg_len={len(message or '')}")
-        
-        system_message = """You are a supportive AI assistant for high school students. 
-        Respond with empathy and understanding. If the user seems distressed, 
-        provide emotional support and suggest healthy coping strategies. 
-        Keep responses concise and focused."""
-
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": message}
-            ],
-            max_tokens=max_tokens,
-            temperature=temperature,
-        )
+        _debug(f"invoke model={_MODEL_NAME} max_tokens={_MAX_TOKENS} msg_len={len(message or '')}")
+        scheduler, key_idx, est_tokens, response = _create(message)
 
         content = response.choices[0].message.content
+        usage = getattr(response, 'usage', None)
+        scheduler.settle(key_idx, est_tokens, getattr(usage, 'total_tokens', None))
         try:
-            usage = getattr(response, 'usage', None)
             if usage:
                 _debug(f"success prompt_tokens={getattr(usage, 'prompt_tokens', None)} completion_tokens={getattr(usage, 'completion_tokens', None)} total_tokens={getattr(usage, 'total_tokens', None)}")
             else:
@@ -53,3 +131,30 @@ def get_openai_response(message, mode='mental_health'):
         print(f"OpenAI API error: {str(e)}")
         return "I'm having trouble connecting to my AI services. Please try again in a moment."
 
+def stream_openai_response(message, mode='mental_health'):
+    """Yield response text deltas from OpenAI as they arrive.
+
+    Raises on configuration or API errors so callers can fail over before
+    anything has been sent to the client.
+    """
+    _debug(f"stream model={_MODEL_NAME} msg_len={len(message or '')}")
+    scheduler, key_idx, est_tokens, stream = _create(message, stream=True)
+    scheduler.settle(key_idx, est_tokens, None)
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+async def astream_openai_response(message, mode='mental_health'):
+    """Async variant of stream_openai_response."""
+    _debug(f"astream model={_MODEL_NAME} msg_len={len(message or '')}")
+    scheduler, key_idx, est_tokens, stream = await _acreate(message, stream=True)
+    await asyncio.to_thread(scheduler.settle, key_idx, est_tokens, None)
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
@@ -1,5 +1,10 @@
 import os
-import requests
+import json
+import asyncio
+from providers.clients import (
+    CONNECT_TIMEOUT, READ_TIMEOUT, perplexity_async_client, perplexity_session,
+)
+from providers.scheduler import estimate_tokens, get_scheduler, parse_keys, retry_after_seconds
 
 def _debug_enabled() -> bool:
     return (os.getenv('AI_DEBUG_LOGS') or '').lower() == 'true'
@@ -8,52 +13,139 @@ def _debug(*args):
     if _debug_enabled():
         print('[perplexity]', *args)
 
+_ENDPOINT = 'https://api.perplexity.ai/chat/completions'
+_MODEL_NAME = 'mistral-7b-instruct'
+_SYSTEM_MESSAGE = """You are a supportive AI assistant for high school students. 
+        Respond with empathy and understanding. If the user seems distressed, 
+        provide emotional support and suggest healthy coping strategies. 
+        Keep responses concise and focused."""
+# (connect, read) seconds; read applies between streamed chunks
+_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+def _api_keys():
+    keys = parse_keys('PERPLEXITY_API_KEY', 'PERPLEXITY_API_KEYS')
+    if not keys:
+        keys = parse_keys('PPLX_API_KEY')
+        if keys:
+            _debug('using_alias_key=PPLX_API_KEY')
+    return keys
+
+def _headers(api_key, stream=False):
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json',
+    }
+    if stream:
+        headers['Accept'] = 'text/event-stream'
+    return headers
+
+def _payload(message, stream=False):
+    data = {
+        'model': _MODEL_NAME,
+        'messages': [
+            {'role': 'system', 'content': _SYSTEM_MESSAGE},
+            {'role': 'user', 'content': message}
+        ]
+    }
+    if stream:
+        data['stream'] = True
+    return data
+
+def _scheduler_for(message):
+    """Return (scheduler, keys, est_tokens); raises if no key is configured."""
+    keys = _api_keys()
+    if not keys:
+        raise RuntimeError("Configuration error: Perplexity API key not found")
+    return get_scheduler('perplexity', keys), keys, estimate_tokens(_SYSTEM_MESSAGE + (message or ''))
+
+def _pick_key(scheduler, est_tokens, tried, last_status):
+    key_idx = scheduler.pick(est_tokens, exclude=tried)
+    if key_idx is None:
+        raise RuntimeError(f"Perplexity API error: {last_status or 'no API key with quota headroom'}")
+    tried.add(key_idx)
+    return key_idx
+
+def _on_key_status(scheduler, key_idx, response) -> bool:
+    """Cool down rate-limited or failing keys, block rejected ones; True if the
+    caller should rotate to the next key"""
+    status = response.status_code
+    if status in (401, 403):
+        _debug(f"rejected key_index={key_idx} status={status}")
+        scheduler.block(key_idx)
+    elif status == 429 or status >= 500:
+        _debug(f"cooldown key_index={key_idx} status={status}")
+        scheduler.penalize(key_idx, retry_after_seconds(response.headers))
+    else:
+        return False
+    return True
+
+def _post(message, stream=False):
+    """POST to the key with most quota headroom, rotating away from rate-limited,
+    failing (5xx) and rejected (401/403) keys.
+
+    Returns (scheduler, key_idx, est_tokens, response); the response may be
+    another non-200 (e.g. 400), which callers report.
+    """
+    scheduler, keys, est_tokens = _scheduler_for(message)
+    tried, last_status = set(), None
+    while True:
+        key_idx = _pick_key(scheduler, est_tokens, tried, last_status)
+        try:
+            response = perplexity_session(keys[key_idx]).post(
+                _ENDPOINT, headers=_headers(keys[key_idx], stream), json=_payload(message, stream),
+                stream=stream, timeout=_TIMEOUT)
+        except Exception:
+            # Never reached the API: the reserved tokens were not used
+            scheduler.release(key_idx, est_tokens)
+            raise
+        if not _on_key_status(scheduler, key_idx, response):
+            return scheduler, key_idx, est_tokens, response
+        response.close()
+        last_status = response.status_code
+
+async def _apost_stream(message):
+    """Async variant of _post(stream=True); the caller must aclose() the response."""
+    scheduler, keys, est_tokens = _scheduler_for(message)
+    tried, last_status = set(), None
+    while True:
+        key_idx = await asyncio.to_thread(_pick_key, scheduler, est_tokens, tried, last_status)
+        client = perplexity_async_client(keys[key_idx])
+        request = client.build_request('POST', _ENDPOINT, headers=_headers(keys[key_idx], True),
+                                       json=_payload(message, True))
+        try:
+            response = await client.send(request, stream=True)
+        except Exception:
+            await asyncio.to_thread(scheduler.release, key_idx, est_tokens)
+            raise
+        # Cooldowns and blocks are shared through the health store
+        if not await asyncio.to_thread(_on_key_status, scheduler, key_idx, response):
+            return scheduler, key_idx, est_tokens, response
+        await response.aclose()
+        last_status = response.status_code
+
 def get_perplexity_response(message, mode='mental_health'):
     """Get response from Perplexity API"""
     try:
-        api_key = (os.getenv('PERPLEXITY_API_KEY') or '').strip()
-        if not api_key:
-            alt = (os.getenv('PPLX_API_KEY') or '').strip()
-            if alt:
-                api_key = alt
-                _debug('using_alias_key=PPLX_API_KEY')
-        if not api_key:
+        if not _api_keys():
             print("Perplexity API key not found")
             return "Configuration error: Perplexity API key not found"
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json',
-        }
-        
-        system_message = """You are a supportive AI assistant for high school students. 
-        Respond with empathy and understanding. If the user seems distressed, 
-        provide emotional support and suggest healthy coping strategies. 
-        Keep responses concise and focused."""
 
-        model_name = 'mistral-7b-instruct'
-        data = {
-            'model': model_name,
-            'messages': [
-                {'role': 'system', 'content': system_message},
-                {'role': 'user', 'content': message}
-            ]
-        }
+        _debug(f"invoke model={_MODEL_NAME} endpoint={_ENDPOINT} msg_len={len(message or '')}")
 
-        endpoint = 'https://api.perplexity.ai/chat/completions'
-        _debug(f"invoke model={model_name} endpoint={endpoint} msg_len={len(message or '')}")
-
-        response = requests.post(endpoint, headers=headers, json=data)
+        scheduler, key_idx, est_tokens, response = _post(message)
         
         if response.status_code == 200:
             try:
                 j = response.json()
                 content = j['choices'][0]['message']['content']
+                scheduler.settle(key_idx, est_tokens, (j.get('usage') or {}).get('total_tokens'))
                 _debug('success')
                 return content
             except Exception as je:
                 _debug(f"parse_error {je}")
                 raise
         else:
+            scheduler.release(key_idx, est_tokens)
             print(f"Perplexity API error: {response.status_code} - {response.text}")
             return "I'm having trouble connecting to my AI services. Please try again in a moment."
 
@@ -62,3 +154,51 @@ def get_perplexity_response(message, mode='mental_health'):
         print(f"Perplexity API error: {str(e)}")
         return "I'm having trouble connecting to my AI services. Please try again in a moment."
 
+def _parse_sse_line(line):
+    """Return (done, delta) for one line of the completion event stream."""
+    if not line or not line.startswith('data:'):
+        return False, None
+    payload = line[len('data:'):].strip()
+    if payload == '[DONE]':
+        return True, None
+    choices = json.loads(payload).get('choices') or []
+    return False, ((choices[0].get('delta') or {}).get('content') if choices else None)
+
+def stream_perplexity_response(message, mode='mental_health'):
+    """Yield response text deltas from Perplexity's SSE stream.
+
+    Raises on configuration, HTTP or parse errors so callers can fail over
+    before anything has been sent to the client.
+    """
+    _debug(f"stream model={_MODEL_NAME} msg_len={len(message or '')}")
+    scheduler, key_idx, est_tokens, response = _post(message, stream=True)
+    with response:
+        if response.status_code != 200:
+            scheduler.release(key_idx, est_tokens)
+            raise RuntimeError(f"Perplexity API error: {response.status_code} - {response.text}")
+        scheduler.settle(key_idx, est_tokens, None)
+        for line in response.iter_lines(decode_unicode=True):
+            done, delta = _parse_sse_line(line)
+            if done:
+                break
+            if delta:
+                yield delta
+
+async def astream_perplexity_response(message, mode='mental_health'):
+    """Async variant of stream_perplexity_response."""
+    _debug(f"astream model={_MODEL_NAME} msg_len={len(message or '')}")
+    scheduler, key_idx, est_tokens, response = await _apost_stream(message)
+    try:
+        if response.status_code != 200:
+            await asyncio.to_thread(scheduler.release, key_idx, est_tokens)
+            body = (await response.aread()).decode('utf-8', 'replace')
+            raise RuntimeError(f"Perplexity API error: {response.status_code} - {body}")
+        await asyncio.to_thread(scheduler.settle, key_idx, est_tokens, None)
+        async for line in response.aiter_lines():
+            done, delta = _parse_sse_line(line)
+            if done:
+                break
+            if delta:
+                yield delta
+    finally:
+        await response.aclose()
@@ -0,0 +1,284 @@
+"""
+Quota-aware API key scheduler.
+
+Each key's requests-per-minute and tokens-per-minute budgets are modelled as
+token buckets. Every call reserves budget on the key with the most headroom, so
+load spreads evenly across keys and calls stay under quota instead of running
+into 429s. Rate-limited keys get a short, exponentially growing cooldown (shared
+with other workers through the provider-health store) rather than hours-long blocks;
+only keys the provider rejects (401/403) are blocked for hours.
+
+Budgets are per worker: the configured per-key limits are multiplied by
+AI_KEY_BUDGET_SHARE (default 1 / GUNICORN_WORKERS).
+"""
+
+import os
+import time
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from providers.clients import key_fingerprint
+from providers.health import get_health_store
+
+# Provider defaults (per key); 0 disables that bucket
+_DEFAULT_LIMITS = {
+    'gemini': (15, 1_000_000),
+    'openai': (500, 200_000),
+    'perplexity': (50, 0),
+}
+COOLDOWN_BASE_SECONDS = float(os.getenv('AI_KEY_COOLDOWN_SECONDS', '30'))
+COOLDOWN_MAX_SECONDS = float(os.getenv('AI_KEY_COOLDOWN_MAX_SECONDS', '900'))
+MAX_WAIT_SECONDS = float(os.getenv('AI_KEY_MAX_WAIT_MS', '1500')) / 1000.0
+# Rejected (invalid or revoked) keys stay out of rotation this long
+BLOCK_SECONDS = 6 * 3600
+
+
+def _debug(*args):
+    if (os.getenv('AI_DEBUG_LOGS') or '').lower() == 'true':
+        print('[scheduler]', *args)
+
+
+def parse_keys(*env_names: str) -> List[str]:
+    """Comma-separated keys from several env vars, de-duplicated in order."""
+    keys: List[str] = []
+    for name in env_names:
+        for part in (os.getenv(name) or '').split(','):
+            part = part.strip()
+            if part and part not in keys:
+                keys.append(part)
+    return keys
+
+
+def budget_share() -> float:
+    raw = (os.getenv('AI_KEY_BUDGET_SHARE') or '').strip()
+    if raw:
+        return max(0.0, float(raw))
+    workers = int(os.getenv('GUNICORN_WORKERS') or '1')
+    return 1.0 / max(1, workers)
+
+
+def estimate_tokens(text: str, max_output_tokens: int = 512) -> int:
+    """Rough token estimate for budgeting: ~4 chars per token plus the reply."""
+    return len(text or '') // 4 + max_output_tokens
+
+
+def _status(err):
+    return getattr(err, 'status_code', None) or getattr(err, 'status', None) or getattr(err, 'code', None)
+
+
+def is_rate_limit_error(err) -> bool:
+    """429 / quota style errors (as opposed to bad or revoked keys)."""
+    msg = (str(err) or '').lower()
+    status = _status(err)
+    return status == 429 or '429' in msg or any(tok in msg for tok in (
+        'quota', 'rate limit', 'ratelimit', 'resource exhausted', 'resource_exhausted',
+        'too many requests', 'exceeded'
+    ))
+
+
+def is_auth_error(err) -> bool:
+    """401/403: the key is invalid, revoked or lacks access."""
+    msg = (str(err) or '').lower()
+    return _status(err) in (401, 403) or any(tok in msg for tok in (
+        'invalid api key', 'incorrect api key', 'invalid_api_key', 'unauthorized',
+        'permission denied', 'permission_denied', 'forbidden'
+    ))
+
+
+def is_server_error(err) -> bool:
+    """5xx left after the client's own retries."""
+    status = _status(err)
+    return isinstance(status, int) and status >= 500
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Retry-After header (seconds form) from a rate-limited response, if any."""
+    try:
+        value = float((headers or {}).get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+class TokenBucket:
+    """Continuous-refill bucket holding up to one minute of budget."""
+
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated')
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self, now: float):
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def headroom(self, n: float, now: float) -> float:
+        """Fraction of capacity left after taking n (negative if it would overdraw)."""
+        if self.unlimited:
+            return 1.0
+        self._refill(now)
+        # A call bigger than the whole bucket only needs a full bucket
+        return (self.tokens - min(n, self.capacity)) / self.capacity
+
+    def wait_time(self, n: float, now: float) -> float:
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        need = min(n, self.capacity) - self.tokens
+        return max(0.0, need / self.rate) if self.rate else float('inf')
+
+    def take(self, n: float, now: float):
+        if not self.unlimited:
+            self._refill(now)
+            self.tokens -= n
+
+    def give_back(self, n: float):
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens + n)
+
+    def drain(self):
+        if not self.unlimited:
+            self.tokens = min(self.tokens, 0.0)
+
+
+class KeyScheduler:
+    """Picks keys for one provider by remaining RPM/TPM headroom."""
+
+    def __init__(self, provider: str, keys: List[str], rpm: float, tpm: float):
+        self.provider = provider
+        self.keys = list(keys)
+        self.fingerprints = [key_fingerprint(k) for k in self.keys]
+        self._rpm = [TokenBucket(rpm) for _ in self.keys]
+        self._tpm = [TokenBucket(tpm) for _ in self.keys]
+        self._strikes = [0] * len(self.keys)
+        self._cooldown_until = [0.0] * len(self.keys)
+        self._last_used = [0.0] * len(self.keys)
+        self._lock = threading.Lock()
+
+    def _shared_blocked(self) -> Dict[str, float]:
+        try:
+            return get_health_store().blocked(self.provider, self.fingerprints) or {}
+        except Exception:
+            return {}
+
+    def _eligible(self, exclude: Iterable[int], now: float) -> List[int]:
+        exclude = set(exclude)
+        blocked = self._shared_blocked()
+        return [i for i in range(len(self.keys))
+                if i not in exclude and self._cooldown_until[i] <= now
+                and self.fingerprints[i] not in blocked]
+
+    def _headroom(self, i: int, est_tokens: float, now: float) -> float:
+        return min(self._rpm[i].headroom(1, now), self._tpm[i].headroom(est_tokens, now))
+
+    def pick(self, est_tokens: float, exclude: Iterable[int] = (),
+             avoid: Iterable[int] = (), max_wait: Optional[float] = None) -> Optional[int]:
+        """Reserve budget on the best key and return its index.
+
+        Keys in `avoid` are used only if nothing else has headroom. If no key
+        has headroom, waits up to max_wait for a refill; returns None when the
+        wait would be longer (callers then fail over to another provider).
+        """
+        max_wait = MAX_WAIT_SECONDS if max_wait is None else max_wait
+        avoid = set(avoid)
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                eligible = self._eligible(exclude, now)
+                if not eligible:
+                    return None
+                # Most headroom first; least recently used breaks ties so load spreads
+                ranked = sorted(eligible, key=lambda i: (i in avoid, -self._headroom(i, est_tokens, now),
+                                                         self._last_used[i]))
+                for i in ranked:
+                    if self._headroom(i, est_tokens, now) >= 0:
+                        self._rpm[i].take(1, now)
+                        self._tpm[i].take(est_tokens, now)
+                        self._last_used[i] = now
+                        return i
+                wait = min(max(self._rpm[i].wait_time(1, now), self._tpm[i].wait_time(est_tokens, now))
+                           for i in eligible)
+            if now + wait > deadline:
+                _debug(f"{self.provider} no_headroom wait={wait:.2f}s")
+                return None
+            time.sleep(min(wait, 0.25) + 0.01)
+
+    def settle(self, i: int, reserved_tokens: float, actual_tokens: Optional[float]):
+        """Correct a reservation with the usage the provider reported; reset strikes."""
+        with self._lock:
+            if isinstance(actual_tokens, (int, float)):
+                self._tpm[i].give_back(reserved_tokens - actual_tokens)
+            self._strikes[i] = 0
+
+    def release(self, i: int, reserved_tokens: float):
+        """Return tokens for a call that never reached the provider's quota."""
+        with self._lock:
+            self._tpm[i].give_back(reserved_tokens)
+
+    def penalize(self, i: int, retry_after: Optional[float] = None) -> float:
+        """Rate-limited: cool the key down (exponentially per consecutive strike)."""
+        with self._lock:
+            self._strikes[i] += 1
+            cooldown = retry_after or min(COOLDOWN_MAX_SECONDS,
+                                          COOLDOWN_BASE_SECONDS * 2 ** (self._strikes[i] - 1))
+            self._cooldown_until[i] = time.monotonic() + cooldown
+            self._rpm[i].drain()
+            self._tpm[i].drain()
+        try:
+            get_health_store().block_key(self.provider, self.fingerprints[i], cooldown)
+        except Exception:
+            pass
+        _debug(f"{self.provider} cooldown key={self.fingerprints[i]} seconds={cooldown:.0f}")
+        return cooldown
+
+    def block(self, i: int, seconds: float = BLOCK_SECONDS):
+        """Rejected key: keep it out of rotation here and in every other worker."""
+        with self._lock:
+            self._cooldown_until[i] = time.monotonic() + seconds
+        try:
+            get_health_store().block_key(self.provider, self.fingerprints[i], seconds)
+        except Exception:
+            pass
+        _debug(f"{self.provider} block key={self.fingerprints[i]} seconds={seconds:.0f}")
+
+    def snapshot(self) -> List[Dict[str, float]]:
+        with self._lock:
+            now = time.monotonic()
+            return [{
+                'key': self.fingerprints[i],
+                'rpm_headroom': round(self._rpm[i].headroom(0, now), 3),
+                'tpm_headroom': round(self._tpm[i].headroom(0, now), 3),
+                'cooling_down': self._cooldown_until[i] > now,
+            } for i in range(len(self.keys))]
+
+
+_schedulers: Dict[str, KeyScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(provider: str, keys: List[str]) -> KeyScheduler:
+    """Per-worker scheduler for a provider, rebuilt if its key list changes."""
+    with _schedulers_lock:
+        sched = _schedulers.get(provider)
+        if sched is None or sched.keys != keys:
+            default_rpm, default_tpm = _DEFAULT_LIMITS.get(provider, (0, 0))
+            share = budget_share()
+            rpm = float(os.getenv(f'{provider.upper()}_RPM_PER_KEY', default_rpm)) * share
+            tpm = float(os.getenv(f'{provider.upper()}_TPM_PER_KEY', default_tpm)) * share
+            sched = KeyScheduler(provider, keys, rpm, tpm)
+            _schedulers[provider] = sched
+        return sched
+
+
+def all_schedulers() -> Dict[str, KeyScheduler]:
+    with _schedulers_lock:
+        return dict(_schedulers)
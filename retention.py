@@ -0,0 +1,367 @@
+"""
+Chunked, throttled and resumable retention purge.
+
+A purge run deletes expired rows from each table in primary-key batches of
+PURGE_BATCH_SIZE. Every batch is its own short transaction that also writes the
+run's checkpoint (per-table last id, rows deleted, seconds spent) to
+``purge_runs``, so locks are held for one batch only and an interrupted run
+resumes exactly where it stopped. Between batches the run sleeps
+PURGE_BATCH_SLEEP_MS and, with PURGE_MAX_ROWS_PER_SECOND, long enough to stay
+under that delete rate, which keeps WAL volume and replication lag bounded.
+Partitioned tables (see partitions.py) drop whole expired partitions first.
+
+Only one run is active at a time: a Postgres advisory lock held by the run
+(a process-local lock elsewhere). A run whose process died leaves its row in
+``running``; the next start() first finishes it, with its original cutoffs,
+and then runs its own tasks.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import bindparam, inspect, text
+
+from legacy_views import SESSION_TABLES
+from partitions import drop_expired_partitions, maintain_partitions
+
+logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "5000"))
+PURGE_BATCH_SLEEP_MS = int(os.getenv("PURGE_BATCH_SLEEP_MS", "50"))
+# Delete budget in rows per second across batches; 0 disables it
+PURGE_MAX_ROWS_PER_SECOND = int(os.getenv("PURGE_MAX_ROWS_PER_SECOND", "0"))
+
+_ADVISORY_LOCK_KEY = 0x67515047  # "gQPG"
+_local_lock = threading.Lock()
+
+
+class PurgeTask(NamedTuple):
+    key: str  # name in the run report
+    table: str
+    column: str  # rows with column < cutoff are expired
+    cutoff: datetime
+    pk: str = "id"
+    # "table.column" references to pk; rows still referenced are kept
+    keep_referenced: Tuple[str, ...] = ()
+
+
+def retention_tasks(config, now: datetime = None) -> List[PurgeTask]:
+    """The app's retention policy (MESSAGE/SESSION/ANALYTICS_RETENTION_DAYS).
+    Rows that reference user_sessions go before the sessions themselves, and
+    sessions still referenced (mood history, say) are kept."""
+    now = now or datetime.utcnow()
+    messages = now - timedelta(days=int(config.get("MESSAGE_RETENTION_DAYS", 30)))
+    sessions = now - timedelta(days=int(config.get("SESSION_RETENTION_DAYS", 14)))
+    analytics = now - timedelta(days=int(config.get("ANALYTICS_RETENTION_DAYS", 90)))
+    return [
+        PurgeTask("messages", "messages", "timestamp", messages),
+        PurgeTask("conversation_logs", "conversation_logs", "timestamp", messages),
+        PurgeTask("crisis_events", "crisis_events", "timestamp", messages),
+        PurgeTask("self_assessments", "self_assessment_entries", "timestamp", messages),
+        PurgeTask("analytics_events", "analytics_events", "timestamp", analytics),
+        PurgeTask(
+            "sessions",
+            "user_sessions",
+            "last_active",
+            sessions,
+            keep_referenced=tuple(f"{table}.session_id" for table in SESSION_TABLES),
+        ),
+    ]
+
+
+def _task_state(task: PurgeTask) -> Dict[str, Any]:
+    return {
+        "key": task.key,
+        "table": task.table,
+        "column": task.column,
+        "cutoff": task.cutoff.isoformat(),
+        "pk": task.pk,
+        "keep_referenced": list(task.keep_referenced),
+        "status": "pending",
+        "last_id": None,
+        "deleted": 0,
+        "batches": 0,
+        "seconds": 0.0,
+        "partitions_dropped": [],
+        "error": None,
+    }
+
+
+def _row_to_run(row) -> Dict[str, Any]:
+    run = dict(row._mapping)
+    run["tasks"] = json.loads(run.pop("progress") or "[]")
+    run["deleted"] = sum(task["deleted"] for task in run["tasks"])
+    for field in ("started_at", "updated_at", "finished_at"):
+        if isinstance(run.get(field), datetime):
+            run[field] = run[field].isoformat()
+    return run
+
+
+_RUN_COLUMNS = "id, status, progress, started_at, updated_at, finished_at"
+
+
+def throughput(run: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """Rows deleted per second of batch time, per task key."""
+    return {
+        task["key"]: (
+            round(task["deleted"] / task["seconds"], 1) if task["seconds"] else None
+        )
+        for task in run["tasks"]
+    }
+
+
+def get_run(engine, run_id: int) -> Optional[Dict[str, Any]]:
+    with engine.connect() as conn:
+        row = conn.execute(
+            text(f"SELECT {_RUN_COLUMNS} FROM purge_runs WHERE id = :id"),
+            {"id": run_id},
+        ).first()
+    return _row_to_run(row) if row else None
+
+
+def latest_run(engine, status: str = None) -> Optional[Dict[str, Any]]:
+    where = "WHERE status = :status " if status else ""
+    with engine.connect() as conn:
+        row = conn.execute(
+            text(
+                f"SELECT {_RUN_COLUMNS} FROM purge_runs {where}ORDER BY id DESC LIMIT 1"
+            ),
+            {"status": status},
+        ).first()
+    return _row_to_run(row) if row else None
+
+
+class PurgeEngine:
+    """Runs purge jobs against one engine; see the module docstring."""
+
+    def __init__(
+        self,
+        engine,
+        batch_size: int = None,
+        sleep_ms: int = None,
+        max_rows_per_second: int = None,
+    ):
+        self.engine = engine
+        self.batch_size = batch_size or PURGE_BATCH_SIZE
+        self.sleep = (PURGE_BATCH_SLEEP_MS if sleep_ms is None else sleep_ms) / 1000.0
+        self.max_rows_per_second = (
+            PURGE_MAX_ROWS_PER_SECOND
+            if max_rows_per_second is None
+            else max_rows_per_second
+        )
+        self._sleep = time.sleep
+        self.thread: Optional[threading.Thread] = None
+
+    # ---------- Exclusivity ----------
+
+    def _acquire(self):
+        """A lock handle, or None when another run holds the purge lock."""
+        if self.engine.dialect.name == "postgresql":
+            conn = self.engine.connect()
+            locked = conn.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": _ADVISORY_LOCK_KEY}
+            ).scalar()
+            # Session-level lock: end the transaction so the held connection
+            # does not pin a snapshot (and hold back vacuum) for the whole run
+            conn.commit()
+            if not locked:
+                conn.close()
+                return None
+            return conn
+        return _local_lock if _local_lock.acquire(blocking=False) else None
+
+    def _release(self, handle):
+        if handle is _local_lock:
+            _local_lock.release()
+            return
+        try:
+            handle.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": _ADVISORY_LOCK_KEY}
+            )
+            handle.commit()
+        finally:
+            handle.close()
+
+    # ---------- Runs ----------
+
+    def start(
+        self, tasks: List[PurgeTask], background: bool = True
+    ) -> Tuple[Optional[int], bool]:
+        """Start a run of tasks, after finishing any orphaned ones; returns
+        (run id, started). When a run is already active, returns its id and
+        False."""
+        handle = self._acquire()
+        if handle is None:
+            active = latest_run(self.engine, "running")
+            return (active["id"] if active else None), False
+        try:
+            orphans = self._running_ids()
+            run_id = self._create_run(tasks)
+        except Exception:
+            self._release(handle)
+            raise
+
+        def work():
+            try:
+                for orphan_id in orphans:
+                    logger.info(f"Resuming purge run {orphan_id}")
+                    self.run(orphan_id)
+                self.run(run_id)
+            except Exception as e:
+                # The row stays 'running'; the next start() resumes it
+                logger.error(f"Purge run {run_id} interrupted: {e}")
+                if not background:
+                    raise
+            finally:
+                self._release(handle)
+
+        if background:
+            self.thread = threading.Thread(
+                target=work, name=f"purge-run-{run_id}", daemon=True
+            )
+            self.thread.start()
+        else:
+            work()
+        return run_id, True
+
+    def _running_ids(self) -> List[int]:
+        """Runs left in 'running' by a process that died, oldest first."""
+        with self.engine.connect() as conn:
+            return (
+                conn.execute(
+                    text(
+                        "SELECT id FROM purge_runs WHERE status = 'running' ORDER BY id"
+                    )
+                )
+                .scalars()
+                .all()
+            )
+
+    def _create_run(self, tasks: List[PurgeTask]) -> int:
+        progress = json.dumps([_task_state(task) for task in tasks])
+        with self.engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                return conn.execute(
+                    text(
+                        "INSERT INTO purge_runs (status, progress) "
+                        "VALUES ('running', :progress) RETURNING id"
+                    ),
+                    {"progress": progress},
+                ).scalar()
+            result = conn.execute(
+                text(
+                    "INSERT INTO purge_runs (status, progress) VALUES ('running', :progress)"
+                ),
+                {"progress": progress},
+            )
+            return result.lastrowid
+
+    def _save(self, conn, run_id: int, tasks: List[dict], status: str = "running"):
+        conn.execute(
+            text(
+                "UPDATE purge_runs SET progress = :progress, status = :status, "
+                "updated_at = CURRENT_TIMESTAMP, "
+                "finished_at = CASE WHEN :finished THEN CURRENT_TIMESTAMP END "
+                "WHERE id = :id"
+            ),
+            {
+                "progress": json.dumps(tasks),
+                "status": status,
+                "finished": status != "running",
+                "id": run_id,
+            },
+        )
+
+    def run(self, run_id: int) -> Dict[str, Any]:
+        """Work through the run's unfinished tasks in this thread."""
+        run = get_run(self.engine, run_id)
+        tasks = run["tasks"]
+        maintain_partitions(self.engine)
+        for task in tasks:
+            if task["status"] in ("done", "skipped", "failed"):
+                continue
+            try:
+                with self.engine.connect() as conn:
+                    exists = inspect(conn).has_table(task["table"])
+                if exists:
+                    self._purge_task(run_id, tasks, task)
+                # Optional/legacy tables are absent on some deployments
+                task["status"] = "done" if exists else "skipped"
+            except Exception as e:
+                logger.error(f"Purge of {task['table']} failed: {e}")
+                task["status"], task["error"] = "failed", str(getattr(e, "orig", e))
+            with self.engine.begin() as conn:
+                self._save(conn, run_id, tasks)
+
+        status = (
+            "failed" if any(t["status"] == "failed" for t in tasks) else "completed"
+        )
+        with self.engine.begin() as conn:
+            self._save(conn, run_id, tasks, status)
+        run = get_run(self.engine, run_id)
+        logger.info(
+            f"Purge run {run_id} {status}: "
+            + ", ".join(f"{t['key']}={t['deleted']}" for t in run["tasks"])
+        )
+        return run
+
+    def _purge_task(self, run_id: int, tasks: List[dict], task: dict):
+        table, column, pk = task["table"], task["column"], task["pk"]
+        cutoff = datetime.fromisoformat(task["cutoff"])
+        task["status"] = "running"
+
+        with self.engine.begin() as conn:
+            task["partitions_dropped"] += drop_expired_partitions(conn, table, cutoff)
+            self._save(conn, run_id, tasks)
+
+        # Runs checkpointed before keep_referenced existed have no such key
+        with self.engine.connect() as conn:
+            tables = set(inspect(conn).get_table_names())
+        keep = "".join(
+            f" AND NOT EXISTS (SELECT 1 FROM {ref_table} "
+            f"WHERE {ref_table}.{ref_column} = {table}.{pk})"
+            for ref_table, ref_column in (
+                ref.split(".") for ref in task.get("keep_referenced", [])
+            )
+            if ref_table in tables
+        )
+        select_ids = text(
+            f"SELECT {pk} FROM {table} WHERE {column} < :cutoff"
+            + (f" AND {pk} > :last_id" if task["last_id"] is not None else "")
+            + keep
+            + f" ORDER BY {pk} LIMIT :limit"
+        )
+        # keep is repeated: a reference may have appeared since the SELECT
+        delete_ids = text(f"DELETE FROM {table} WHERE {pk} IN :ids{keep}").bindparams(
+            bindparam("ids", expanding=True)
+        )
+        while True:
+            started = time.monotonic()
+            with self.engine.begin() as conn:
+                params = {"cutoff": cutoff, "limit": self.batch_size}
+                if task["last_id"] is not None:
+                    params["last_id"] = task["last_id"]
+                ids = conn.execute(select_ids, params).scalars().all()
+                if ids:
+                    conn.execute(delete_ids, {"ids": ids})
+                    task["last_id"] = ids[-1]
+                    task["deleted"] += len(ids)
+                    task["batches"] += 1
+                task["seconds"] = round(task["seconds"] + time.monotonic() - started, 3)
+                # The checkpoint commits with the batch it describes
+                self._save(conn, run_id, tasks)
+            if len(ids) < self.batch_size:
+                return
+            self._throttle(len(ids), time.monotonic() - started)
+
+    def _throttle(self, rows: int, elapsed: float):
+        pause = self.sleep
+        if self.max_rows_per_second:
+            pause = max(pause, rows / self.max_rows_per_second - elapsed)
+        if pause > 0:
+            self._sleep(pause)
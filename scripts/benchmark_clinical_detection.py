@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark the fused-regex feature scan of ClinicalCrisisDetector.
+
+Compares the per-pattern scan it replaced (one re.search per indicator, goodbye
+and distortion pattern, plus the re-lowering linguistic checks) against the
+fused single-pass scan, cold (cache cleared) and warm (memoized), and times a
+full assess_risk with a three-message history. Also checks both scans extract
+identical features for every message in the corpus.
+
+Usage:
+  python3 scripts/benchmark_clinical_detection.py [--iterations 2000]
+"""
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+# Ensure repository root is on sys.path so we can import crisis_v2
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from crisis_v2.clinical_detection import ClinicalCrisisDetector  # noqa: E402
+
+CORPUS = [
+    "I had a long day at school and I'm tired",
+    "I want to die, I'm going to kill myself tonight",
+    "I have been feeling really down lately and I don't know what to do anymore, "
+    "nothing ever works out and I hate it",
+    "Thank you for everything. Goodbye, I want you to know this is my final message",
+    "I have pills ready and I can't take it anymore",
+    "I should always be perfect, it's all or nothing and if I fail it's a disaster",
+    "Voices telling me they're coming for me, I've been drinking heavily",
+    "Nobody would miss me, I lost everything and feel hopeless",
+    "I tried before. Last time I tried I took an overdose",
+    "Life is good! Went hiking with friends and it was fun",
+    "I keep cutting myself and I wish I could disappear",
+    "what's the point, life isn't worth it, no point in living",
+]
+
+
+def legacy_features(detector, message):
+    """The per-pattern feature extraction the fused scan replaced."""
+    indicators = [
+        ind
+        for inds in detector.CLINICAL_INDICATORS.values()
+        for ind in inds
+        if re.search(ind.pattern, message, re.IGNORECASE)
+    ]
+    goodbye = sum(1 for p in detector.GOODBYE_PATTERNS if re.search(p, message, re.I))
+    distortions = sum(1 for p in detector.DISTORTION_PATTERNS if re.search(p, message, re.I))
+    absolutist = sum(1 for w in detector.ABSOLUTIST_WORDS if w in message.lower())
+    negative = sum(1 for w in detector.NEGATIVE_WORDS if w in message.lower())
+    first_person = len(re.findall(r'\bi\b', message.lower()))
+    return (tuple(indicators), goodbye, distortions, absolutist, negative, first_person,
+            len(message.split()))
+
+
+def fused_features(detector, message):
+    f = detector._scan_message(message)
+    return (f.indicators, f.goodbye, f.distortions, f.absolutist, f.negative, f.first_person,
+            f.word_count)
+
+
+def _time(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000, help='passes over the corpus')
+    args = parser.parse_args()
+
+    detector = ClinicalCrisisDetector()
+    mismatches = [m for m in CORPUS if legacy_features(detector, m) != fused_features(detector, m)]
+    for message in mismatches:
+        print(f"MISMATCH: {message!r}")
+
+    def legacy():
+        for message in CORPUS:
+            legacy_features(detector, message)
+
+    def cold():
+        detector._scan.cache_clear()
+        for message in CORPUS:
+            detector._scan(message)
+
+    def warm():
+        for message in CORPUS:
+            detector._scan(message)
+
+    def assess():
+        for i, message in enumerate(CORPUS):
+            detector.assess_risk(message, 'bench', history=CORPUS[max(0, i - 3):i])
+
+    n = len(CORPUS)
+    print(f"corpus: {n} messages, {args.iterations} iterations")
+    print(f"legacy per-pattern scan: {_time(legacy, args.iterations) / n:8.2f} us/message")
+    print(f"fused scan (cold):       {_time(cold, args.iterations) / n:8.2f} us/message")
+    print(f"fused scan (memoized):   {_time(warm, args.iterations) / n:8.2f} us/message")
+    print(f"assess_risk w/ history:  {_time(assess, args.iterations) / n:8.2f} us/message")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Build the offline GeoIP range table used by app.get_country_code_from_ip
+
+Input is a CSV of ``start_ip,end_ip,country_code`` rows (IPv4 and IPv6 may be
+mixed, optionally gzipped) such as the free DB-IP "IP to Country Lite" dump.
+Output is the compact binary table app.py memory-maps at GEOIP_DB_PATH.
+
+Usage:
+    python scripts/build_geoip_table.py dbip-country-lite.csv.gz data/geoip.bin
+"""
+
+import argparse
+import csv
+import gzip
+import ipaddress
+import logging
+import os
+import struct
+import sys
+from typing import Iterable, List, Tuple
+
+# Must stay in sync with the reader in app.py (_GeoIPTable)
+GEOIP_MAGIC = b"GQGEOIP1"
+GEOIP_HEADER = struct.Struct(">8sII")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+Range = Tuple[int, int, str]
+
+
+def _open_text(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, newline='')
+
+
+def read_ranges(path: str) -> Tuple[List[Range], List[Range]]:
+    """Parse a range CSV into (ipv4, ipv6) lists of (start, end, CC)"""
+    v4: List[Range] = []
+    v6: List[Range] = []
+    skipped = 0
+    with _open_text(path) as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                skipped += 1
+                continue
+            try:
+                start = ipaddress.ip_address(row[0].strip())
+                end = ipaddress.ip_address(row[1].strip())
+            except ValueError:
+                skipped += 1  # header line or malformed row
+                continue
+            cc = row[2].strip().upper()
+            if start.version != end.version or len(cc) != 2 or not cc.isalpha():
+                skipped += 1
+                continue
+            (v4 if start.version == 4 else v6).append((int(start), int(end), cc))
+    if skipped:
+        logger.info(f"Skipped {skipped} unusable rows")
+    return v4, v6
+
+
+def compact_ranges(ranges: Iterable[Range]) -> List[Range]:
+    """Sort ranges and merge adjacent/overlapping runs of the same country"""
+    merged: List[Range] = []
+    for start, end, cc in sorted(ranges):
+        if merged:
+            prev_start, prev_end, prev_cc = merged[-1]
+            if start <= prev_end:
+                # Overlap with a different country: keep the earlier claim
+                if cc != prev_cc:
+                    start = prev_end + 1
+                    if start > end:
+                        continue
+                else:
+                    merged[-1] = (prev_start, max(prev_end, end), cc)
+                    continue
+            elif start == prev_end + 1 and cc == prev_cc:
+                merged[-1] = (prev_start, end, cc)
+                continue
+        merged.append((start, end, cc))
+    return merged
+
+
+def write_table(path: str, v4: Iterable[Range], v6: Iterable[Range]) -> Tuple[int, int]:
+    """Write the binary table atomically; returns (ipv4 count, ipv6 count)"""
+    v4 = compact_ranges(v4)
+    v6 = compact_ranges(v6)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(GEOIP_HEADER.pack(GEOIP_MAGIC, len(v4), len(v6)))
+        for width, ranges in ((4, v4), (16, v6)):
+            for start, end, cc in ranges:
+                f.write(start.to_bytes(width, 'big'))
+                f.write(end.to_bytes(width, 'big'))
+                f.write(cc.encode('ascii'))
+    os.replace(tmp_path, path)
+    return len(v4), len(v6)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('source', help='CSV (or .csv.gz) of start_ip,end_ip,country_code')
+    parser.add_argument('output', nargs='?', default=os.path.join('data', 'geoip.bin'),
+                        help='Output table path (default: data/geoip.bin)')
+    args = parser.parse_args(argv)
+
+    v4, v6 = read_ranges(args.source)
+    if not v4 and not v6:
+        logger.error(f"No ranges found in {args.source}")
+        return 1
+    n4, n6 = write_table(args.output, v4, v6)
+    size_kb = os.path.getsize(args.output) / 1024
+    logger.info(f"Wrote {args.output}: {n4} IPv4 + {n6} IPv6 ranges ({size_kb:.0f} KiB)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Report index health from the Postgres statistics views
+
+Lists indexes that have never been scanned since the statistics were last
+reset (primary keys and unique constraints are excluded, they enforce
+integrity), tables read mostly by sequential scans, and any index from the
+managed pack in migrations.py that is missing or INVALID (an interrupted
+CREATE INDEX CONCURRENTLY). Read-only; `--rebuild` re-runs the pack.
+
+Usage:
+    python scripts/index_advisor.py --database-url "$DATABASE_URL"
+    python scripts/index_advisor.py --min-seq-scans 100 --json
+    python scripts/index_advisor.py --rebuild
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Ensure repository root is on sys.path so we can import migrations
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from migrations import INDEX_PACK, ensure_indexes  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+_UNUSED_INDEXES = """
+SELECT s.relname AS table_name, s.indexrelname AS index_name, s.idx_scan,
+       pg_relation_size(s.indexrelid) AS size_bytes
+FROM pg_stat_user_indexes s
+JOIN pg_index i ON i.indexrelid = s.indexrelid
+WHERE s.idx_scan = 0 AND NOT i.indisunique AND NOT i.indisprimary
+ORDER BY pg_relation_size(s.indexrelid) DESC, s.indexrelname
+"""
+
+_SEQ_SCAN_TABLES = """
+SELECT relname AS table_name, seq_scan, seq_tup_read,
+       COALESCE(idx_scan, 0) AS idx_scan, n_live_tup
+FROM pg_stat_user_tables
+WHERE seq_scan >= :min_seq_scans AND seq_scan > COALESCE(idx_scan, 0)
+  AND n_live_tup >= :min_rows
+ORDER BY seq_tup_read DESC, relname
+"""
+
+_PACK_STATE = """
+SELECT c.relname AS index_name, i.indisvalid AS valid
+FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+WHERE c.relname = ANY(:names) AND pg_table_is_visible(c.oid)
+"""
+
+
+def create_engine_from_url(url: str):
+    from sqlalchemy import create_engine
+
+    # Same normalisation as create_app: legacy scheme, explicit psycopg driver
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    if url.startswith('postgresql://'):
+        url = url.replace('postgresql://', 'postgresql+psycopg://', 1)
+    return create_engine(url)
+
+
+def collect(engine, min_seq_scans: int = 50, min_rows: int = 1000) -> dict:
+    """Unused indexes, sequential-scan-heavy tables and managed pack state"""
+    from sqlalchemy import inspect, text
+
+    with engine.connect() as conn:
+        unused = [dict(r._mapping) for r in conn.execute(text(_UNUSED_INDEXES))]
+        seq_heavy = [dict(r._mapping) for r in conn.execute(
+            text(_SEQ_SCAN_TABLES), {'min_seq_scans': min_seq_scans, 'min_rows': min_rows})]
+        states = {r.index_name: r.valid for r in conn.execute(
+            text(_PACK_STATE), {'names': [spec.name for spec in INDEX_PACK]})}
+        tables = set(inspect(conn).get_table_names())
+
+    pack = []
+    for spec in INDEX_PACK:
+        if spec.table not in tables:
+            state = 'no table'
+        elif spec.name not in states:
+            state = 'missing'
+        else:
+            state = 'ok' if states[spec.name] else 'invalid'
+        pack.append({'index_name': spec.name, 'table_name': spec.table, 'state': state})
+    return {'unused_indexes': unused, 'seq_scan_tables': seq_heavy, 'managed_indexes': pack}
+
+
+def print_report(report: dict) -> None:
+    print("Unused indexes (idx_scan = 0 since the last stats reset):")
+    for row in report['unused_indexes'] or [None]:
+        if row is None:
+            print("  none")
+            continue
+        print(f"  {row['table_name']:<28} {row['index_name']:<40} {row['size_bytes'] / 1024:>10.0f} KiB")
+
+    print("\nTables read mostly by sequential scans:")
+    for row in report['seq_scan_tables'] or [None]:
+        if row is None:
+            print("  none")
+            continue
+        print(f"  {row['table_name']:<28} seq_scan={row['seq_scan']} idx_scan={row['idx_scan']} "
+              f"seq_tup_read={row['seq_tup_read']} rows={row['n_live_tup']}")
+
+    print("\nManaged index pack:")
+    for row in report['managed_indexes']:
+        print(f"  {row['index_name']:<40} {row['table_name']:<28} {row['state']}")
+
+
+def main(argv=None) -> int:
+    load_dotenv(override=False)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'),
+                        help='Database to inspect (default: $DATABASE_URL)')
+    parser.add_argument('--min-seq-scans', type=int, default=50,
+                        help='Ignore tables with fewer sequential scans (default: 50)')
+    parser.add_argument('--min-rows', type=int, default=1000,
+                        help='Ignore tables with fewer live rows (default: 1000)')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Create missing and rebuild invalid managed indexes first')
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        logger.error("No database: pass --database-url or set DATABASE_URL")
+        return 1
+    engine = create_engine_from_url(args.database_url)
+    try:
+        if engine.dialect.name != 'postgresql':
+            print(f"Index statistics need Postgres; {engine.dialect.name} has no pg_stat views")
+            return 0
+        if args.rebuild:
+            with engine.connect() as conn:
+                created = ensure_indexes(
+                    conn.execution_options(isolation_level='AUTOCOMMIT'), 'postgresql')
+            logger.info(f"Built {created or 'nothing'}")
+        report = collect(engine, args.min_seq_scans, args.min_rows)
+    finally:
+        engine.dispose()
+
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        print_report(report)
+    # Non-zero while the managed pack is incomplete, for deploy checks
+    return 1 if any(row['state'] in ('missing', 'invalid') for row in report['managed_indexes']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
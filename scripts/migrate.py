@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Apply or inspect the versioned schema migrations in migrations.py
+
+Run once per deploy before the workers start (start.sh does this). Concurrent
+runs against Postgres serialise on an advisory lock, so every migration is
+applied exactly once. `upgrade` also creates upcoming log table partitions.
+
+Usage:
+    python scripts/migrate.py upgrade
+    python scripts/migrate.py status      # exit code 1 while migrations are pending
+    python scripts/migrate.py upgrade --target 2
+"""
+
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Ensure repository root is on sys.path so we can import migrations
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from migrations import MIGRATIONS, SCHEMA_VERSION, current_version, migrate  # noqa: E402
+from partitions import maintain_partitions  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def create_engine_from_url(url: str):
+    from sqlalchemy import create_engine
+
+    # Same normalisation as create_app: legacy scheme, explicit psycopg driver
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    if url.startswith('postgresql://'):
+        url = url.replace('postgresql://', 'postgresql+psycopg://', 1)
+    return create_engine(url)
+
+
+def main(argv=None) -> int:
+    load_dotenv(override=False)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=['upgrade', 'status'])
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'),
+                        help='Database to migrate (default: $DATABASE_URL)')
+    parser.add_argument('--target', type=int, default=None,
+                        help=f'Stop at this version (default: latest, {SCHEMA_VERSION})')
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        logger.error("No database: pass --database-url or set DATABASE_URL")
+        return 1
+    engine = create_engine_from_url(args.database_url)
+    try:
+        if args.command == 'upgrade':
+            applied = migrate(engine, args.target)
+            logger.info(f"Schema at version {current_version(engine)}"
+                        + (f" (applied {applied})" if applied else " (up to date)"))
+            # Every release tops up the upcoming log partitions
+            created = maintain_partitions(engine)
+            if any(created.values()):
+                logger.info(f"Created partitions {created}")
+            return 0
+
+        version = current_version(engine)
+        for m in MIGRATIONS:
+            state = 'applied' if m.version <= version else 'pending'
+            print(f"{m.version:4d}  {m.name:<32} {state}")
+        print(f"Database at version {version}, code expects {SCHEMA_VERSION}")
+        return 0 if version >= SCHEMA_VERSION else 1
+    finally:
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
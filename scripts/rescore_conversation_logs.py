@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Re-score conversation_logs with the current crisis detection rules
+
+Streams user messages in id order (a server-side cursor on Postgres), scores them in
+batches on a process pool (keyword scan plus the optional classifier, exactly
+as detect_crisis_level does for live traffic) and writes back the rows whose
+risk_level changed, one bulk UPDATE per batch. The last written id is kept in
+a checkpoint file, so an interrupted run resumes where it stopped.
+
+Usage:
+    python scripts/rescore_conversation_logs.py --database-url "$DATABASE_URL"
+    python scripts/rescore_conversation_logs.py --restart --workers 8
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# Ensure repository root is on sys.path so we can import crisis_detection
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from crisis_detection import detect_crisis_levels, risk_level_score  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT = os.path.join('checkpoints', 'rescore_conversation_logs.json')
+
+Row = Tuple[int, str, Optional[str]]  # (id, user_message, current risk_level)
+Update = Tuple[int, str, float]  # (id, risk_level, risk_score)
+
+
+def score_batch(rows: List[Row]) -> Tuple[int, List[Update]]:
+    """Score one batch (runs in a pool worker); returns (last id, changed rows)."""
+    levels = detect_crisis_levels([message or '' for _, message, _ in rows])
+    changed = [(row_id, level, risk_level_score(level))
+               for (row_id, _, old_level), level in zip(rows, levels) if level != old_level]
+    return rows[-1][0], changed
+
+
+def load_checkpoint(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'last_id': 0, 'scanned': 0, 'updated': 0}
+
+
+def save_checkpoint(path: str, state: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    state['updated_at'] = datetime.utcnow().isoformat()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def write_back(engine, updates: List[Update]) -> None:
+    """One bulk UPDATE for a batch of re-scored rows"""
+    from sqlalchemy import text
+
+    if not updates:
+        return
+    with engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(
+                text(
+                    "UPDATE conversation_logs AS c "
+                    "SET risk_level = v.risk_level, risk_score = v.risk_score "
+                    "FROM unnest(CAST(:ids AS integer[]), CAST(:levels AS varchar[]), "
+                    "CAST(:scores AS double precision[])) AS v(id, risk_level, risk_score) "
+                    "WHERE c.id = v.id"
+                ),
+                {
+                    'ids': [u[0] for u in updates],
+                    'levels': [u[1] for u in updates],
+                    'scores': [u[2] for u in updates],
+                },
+            )
+        else:
+            conn.execute(
+                text(
+                    "UPDATE conversation_logs SET risk_level = :risk_level, risk_score = :risk_score "
+                    "WHERE id = :id"
+                ),
+                [{'id': i, 'risk_level': lvl, 'risk_score': score} for i, lvl, score in updates],
+            )
+
+
+_SELECT = ("SELECT id, user_message, risk_level FROM conversation_logs "
+           "WHERE id > :last_id ORDER BY id")
+
+
+def read_batches(engine, last_id: int, batch_size: int):
+    """Yield lists of rows after last_id, in id order.
+
+    Postgres streams the whole scan through one server-side cursor. SQLite has
+    no such cursor and an open read blocks the write-backs, so there each batch
+    is its own keyset-paginated query.
+    """
+    from sqlalchemy import text
+
+    if engine.dialect.name == 'postgresql':
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+                text(_SELECT), {'last_id': last_id})
+            for partition in result.partitions(batch_size):
+                yield [tuple(r) for r in partition]
+        return
+    while True:
+        with engine.connect() as conn:
+            rows = [tuple(r) for r in conn.execute(text(_SELECT + " LIMIT :limit"),
+                                                   {'last_id': last_id, 'limit': batch_size})]
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+
+
+def rescore(engine, checkpoint_path: str, batch_size: int = 2000, workers: int = 0,
+            dry_run: bool = False, restart: bool = False) -> dict:
+    """Re-score every row after the checkpoint; returns the final checkpoint state"""
+    state = {'last_id': 0, 'scanned': 0, 'updated': 0} if restart else load_checkpoint(checkpoint_path)
+    state.setdefault('started_at', datetime.utcnow().isoformat())
+    logger.info(f"Resuming after id {state['last_id']}" if state['last_id'] else "Starting from the first row")
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+    in_flight: deque = deque()
+    started = time.time()
+
+    def finish(batch_len: int, last_id: int, updates: List[Update]):
+        if not dry_run:
+            write_back(engine, updates)
+        state['last_id'] = last_id
+        state['scanned'] += batch_len
+        state['updated'] += len(updates)
+        if not dry_run:
+            save_checkpoint(checkpoint_path, state)
+        rate = state['scanned'] / max(time.time() - started, 1e-9)
+        logger.info(f"id <= {last_id}: scanned {state['scanned']}, "
+                    f"{'would update' if dry_run else 'updated'} {state['updated']} ({rate:.0f} rows/s)")
+
+    try:
+        for rows in read_batches(engine, state['last_id'], batch_size):
+            if pool is None:
+                finish(len(rows), *score_batch(rows))
+                continue
+            in_flight.append((len(rows), pool.submit(score_batch, rows)))
+            # Write back in id order so the checkpoint never skips a batch
+            while len(in_flight) > 2 * workers:
+                batch_len, future = in_flight.popleft()
+                finish(batch_len, *future.result())
+        while in_flight:
+            batch_len, future = in_flight.popleft()
+            finish(batch_len, *future.result())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return state
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'),
+                        help='Database to re-score (default: $DATABASE_URL)')
+    parser.add_argument('--batch-size', type=int, default=2000,
+                        help='Rows per scoring batch and bulk UPDATE (default: 2000)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Scoring processes; 0 scores in this process (default: CPU count)')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                        help=f'Progress file (default: {DEFAULT_CHECKPOINT})')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start over')
+    parser.add_argument('--dry-run', action='store_true', help='Score and count, write nothing')
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        logger.error("No database: pass --database-url or set DATABASE_URL")
+        return 1
+    from sqlalchemy import create_engine
+
+    url = args.database_url
+    # Same normalisation as create_app: legacy scheme, explicit psycopg driver
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    if url.startswith('postgresql://'):
+        url = url.replace('postgresql://', 'postgresql+psycopg://', 1)
+    engine = create_engine(url)
+    try:
+        state = rescore(engine, args.checkpoint, args.batch_size, args.workers,
+                        dry_run=args.dry_run, restart=args.restart)
+    finally:
+        engine.dispose()
+    logger.info(f"Done: scanned {state['scanned']} rows, "
+                f"{'would update' if args.dry_run else 'updated'} {state['updated']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Train the hashed n-gram crisis classifier used by crisis_detection
+
+Training data comes from the labelled examples in the crisis test-case docs
+(a curl ``"message": ...`` line followed by an ``Expected: ... "<level>"``
+line), the keyword tables themselves, optional JSONL files of
+``{"message": ..., "risk_level": ...}`` rows and, with --database-url, the
+risk-labelled turns in conversation_logs. Output is the memory-mapped model
+file crisis_classifier.py loads at CRISIS_MODEL_PATH.
+
+Usage:
+    python scripts/train_crisis_classifier.py --database-url "$DATABASE_URL"
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+# Ensure repository root is on sys.path so we can import the detector modules
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from crisis_classifier import CRISIS_MODEL_PATH, DEFAULT_DIMS, featurize, save_model  # noqa: E402
+from crisis_detection import LEVEL_KEYWORDS  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+LEVELS = ('crisis', 'high', 'medium', 'low')
+DEFAULT_DOCS = ['CRISIS_DETECTION_TEST_CASES.md', 'COMPREHENSIVE_CRISIS_TESTING.md']
+
+Example = Tuple[str, str]
+
+_MESSAGE_RE = re.compile(r'"message\\?":\s*\\?"([^"\\$]+)\\?"')
+_QUOTED_RE = re.compile(r'"([^"$]+)"')
+_EXPECTED_RE = re.compile(r'Expected:.*?"(crisis|high|medium|low)"')
+
+
+def examples_from_docs(paths: Iterable[str]) -> List[Example]:
+    """Messages from curl/bash examples, labelled by the next Expected line"""
+    examples: List[Example] = []
+    for path in paths:
+        if not os.path.exists(path):
+            logger.warning(f"Skipping missing corpus {path}")
+            continue
+        pending: List[str] = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if '=(' in line:  # bash array of test messages
+                    pending.extend(_QUOTED_RE.findall(line))
+                pending.extend(_MESSAGE_RE.findall(line))
+                if 'Expected' in line:
+                    match = _EXPECTED_RE.search(line)
+                    if match:
+                        examples.extend((m, match.group(1)) for m in pending if m.strip())
+                    pending = []
+    return examples
+
+
+def examples_from_keywords() -> List[Example]:
+    return [(kw, level) for level, kws in LEVEL_KEYWORDS.items() for kw in kws]
+
+
+def examples_from_jsonl(paths: Iterable[str]) -> List[Example]:
+    examples: List[Example] = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                examples.append((row.get('message') or '', row.get('risk_level') or ''))
+    return examples
+
+
+def examples_from_database(url: str, limit: int) -> List[Example]:
+    """Labelled user turns from conversation_logs, newest first"""
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                "SELECT user_message, risk_level FROM conversation_logs "
+                "WHERE user_message IS NOT NULL AND risk_level IN ('crisis', 'high', 'medium', 'low') "
+                "ORDER BY id DESC LIMIT :limit"
+            ),
+            {'limit': limit},
+        ).fetchall()
+    engine.dispose()
+    return [(row[0], row[1]) for row in rows]
+
+
+def train(examples: List[Example], dims: int, c: float):
+    """Fit multinomial logistic regression; returns (labels, (classes, dims + 1) weights)"""
+    from sklearn.linear_model import LogisticRegression
+
+    messages = [m for m, _ in examples]
+    labels = np.array([lbl for _, lbl in examples])
+    model = LogisticRegression(C=c, max_iter=2000, class_weight='balanced')
+    model.fit(featurize(messages, dims), labels)
+    coef, intercept = model.coef_, model.intercept_
+    if coef.shape[0] == 1:
+        # Binary fit: softmax over (-z/2, z/2) equals the sigmoid of z
+        coef = np.vstack([-coef / 2, coef / 2])
+        intercept = np.array([-intercept[0] / 2, intercept[0] / 2])
+    weights = np.hstack([coef, intercept[:, None]]).astype(np.float32)
+    return [str(c) for c in model.classes_], weights, model
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', nargs='*', default=[str(ROOT / d) for d in DEFAULT_DOCS],
+                        help='Markdown files with labelled curl examples')
+    parser.add_argument('--jsonl', nargs='*', default=[],
+                        help='Extra JSONL files of {"message", "risk_level"} rows')
+    parser.add_argument('--database-url', default=None,
+                        help='Also train on labelled conversation_logs rows from this database')
+    parser.add_argument('--db-limit', type=int, default=200000,
+                        help='Maximum conversation_logs rows to read (default: 200000)')
+    parser.add_argument('--dims', type=int, default=DEFAULT_DIMS,
+                        help=f'Hashed feature dimensions (default: {DEFAULT_DIMS})')
+    parser.add_argument('-C', dest='c', type=float, default=4.0,
+                        help='Inverse regularisation strength (default: 4.0)')
+    parser.add_argument('--output', default=CRISIS_MODEL_PATH,
+                        help=f'Model path (default: {CRISIS_MODEL_PATH})')
+    args = parser.parse_args(argv)
+
+    examples = examples_from_docs(args.docs) + examples_from_keywords()
+    examples += examples_from_jsonl(args.jsonl)
+    if args.database_url:
+        examples += examples_from_database(args.database_url, args.db_limit)
+    examples = [(m, lbl) for m, lbl in examples if lbl in LEVELS and m.strip()]
+    counts = {lvl: sum(1 for _, lbl in examples if lbl == lvl) for lvl in LEVELS}
+    logger.info(f"Training on {len(examples)} examples: {counts}")
+    if len({lbl for _, lbl in examples}) < 2:
+        logger.error("Need examples of at least two risk levels")
+        return 1
+
+    labels, weights, model = train(examples, args.dims, args.c)
+    predicted = model.predict(featurize([m for m, _ in examples], args.dims))
+    accuracy = float(np.mean(predicted == np.array([lbl for _, lbl in examples])))
+    save_model(args.output, labels, weights)
+    size_kb = os.path.getsize(args.output) / 1024
+    logger.info(f"Wrote {args.output}: labels={labels}, training accuracy {accuracy:.3f} "
+                f"({size_kb:.0f} KiB)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
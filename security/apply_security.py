@@ -40,9 +40,6 @@ class SecurityMigration:
                     "ALTER TABLE conversation_logs ADD COLUMN IF NOT EXISTS user_message_encrypted TEXT",
                     "ALTER TABLE conversation_logs ADD COLUMN IF NOT EXISTS ai_response_encrypted TEXT",
                     
-                    # Add encrypted columns for messages
-                    "ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS content_encrypted TEXT",
-                    
                     # Add encrypted columns for mood entries
                     "ALTER TABLE mood_entries ADD COLUMN IF NOT EXISTS note_encrypted TEXT",
                     
@@ -51,7 +48,6 @@ class SecurityMigration:
                     
                     # Add hash columns for identifiers
                     "ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS id_hash VARCHAR(64)",
-                    "ALTER TABLE sessions ADD COLUMN IF NOT EXISTS id_hash VARCHAR(64)",
                     
                     # Add security metadata
                     "ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS encryption_version INTEGER DEFAULT 1",
@@ -192,7 +188,6 @@ class SecurityMigration:
                     "ALTER TABLE conversation_logs DROP COLUMN IF EXISTS user_message",
                     "ALTER TABLE conversation_logs DROP COLUMN IF EXISTS ai_response",
                     "ALTER TABLE crisis_detections DROP COLUMN IF EXISTS message",
-                    "ALTER TABLE chat_messages DROP COLUMN IF EXISTS content",
                 ]
                 
                 for drop in drops:
@@ -287,8 +287,13 @@ class DataRetentionManager:
         self.security = security_manager
         
     def apply_retention_policies(self):
-        """Apply data retention policies for compliance"""
-        from sqlalchemy import text
+        """Apply data retention policies for compliance.
+
+        Runs in this thread as a chunked purge (retention.PurgeEngine): batched
+        deletes with checkpoints, and partition drops for partitioned tables.
+        Skipped while another purge run is active.
+        """
+        from retention import PurgeEngine, PurgeTask, get_run
         
         policies = {
             'crisis_events': 30,  # 30 days for crisis events
@@ -297,35 +302,41 @@ class DataRetentionManager:
             'analytics_events': 30,  # 30 days for analytics
             'audit_logs': 2555,  # 7 years for audit logs
         }
+        now = datetime.utcnow()
+        tasks = [PurgeTask(table, table, 'timestamp', now - timedelta(days=days))
+                 for table, days in policies.items()]
         
-        for table, days in policies.items():
-            cutoff = datetime.utcnow() - timedelta(days=days)
-            
-            # Delete old records
-            try:
-                result = self.db.execute(
-                    text(f"""
-                        DELETE FROM {table}
-                        WHERE timestamp < :cutoff
-                    """),
-                    {'cutoff': cutoff}
-                )
-                
-                if result.rowcount > 0:
-                    self.security.log_security_event(
-                        'DATA_RETENTION',
-                        'INFO',
-                        f'Deleted {result.rowcount} records from {table} older than {days} days'
-                    )
-                    
-                self.db.commit()
-                
-            except Exception as e:
-                self.db.rollback()
+        engine = PurgeEngine(self.db.get_bind())
+        run_id, started = engine.start(tasks, background=False)
+        if not started:
+            self.security.log_security_event(
+                'DATA_RETENTION',
+                'INFO',
+                f'Skipped retention: purge run {run_id} is already active'
+            )
+            return
+        
+        for task in get_run(engine.engine, run_id)['tasks']:
+            days = policies.get(task['table'])
+            if task['status'] == 'failed':
                 self.security.log_security_event(
                     'DATA_RETENTION_ERROR',
                     'ERROR',
-                    f'Failed to apply retention to {table}: {str(e)}'
+                    f"Failed to apply retention to {task['table']}: {task['error']}"
+                )
+                continue
+            if task['partitions_dropped']:
+                self.security.log_security_event(
+                    'DATA_RETENTION',
+                    'INFO',
+                    f"Dropped partitions {', '.join(task['partitions_dropped'])} of "
+                    f"{task['table']} older than {days} days"
+                )
+            if task['deleted'] > 0:
+                self.security.log_security_event(
+                    'DATA_RETENTION',
+                    'INFO',
+                    f"Deleted {task['deleted']} records from {task['table']} older than {days} days"
                 )
 
 
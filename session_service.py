@@ -0,0 +1,180 @@
+"""
+Session upsert with debounced last_activity writes.
+
+Every endpoint resolves its session through ensure_session(). The
+``user_sessions`` row is written by one upsert and one commit (left to the
+request inside a unit of work, see unit_of_work.py); the legacy ``sessions``
+shape is a view over it (legacy_views.py). A session touched within
+SESSION_TOUCH_INTERVAL_SECONDS is not written again: a per-worker LRU, or Redis
+(``SET NX EX``) so the debounce holds across workers, records recent touches.
+Repeat calls inside one request return the memoized id from ``flask.g``.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from flask import g, has_request_context
+from sqlalchemy import text
+
+from providers.health import _FallbackStore
+from unit_of_work import commit_or_defer, on_rollback
+
+logger = logging.getLogger(__name__)
+
+# Longest a session's last_activity may lag behind its latest request
+SESSION_TOUCH_INTERVAL_SECONDS = float(
+    os.getenv("SESSION_TOUCH_INTERVAL_SECONDS", "60")
+)
+SESSION_TOUCH_MAX_SESSIONS = int(os.getenv("SESSION_TOUCH_MAX_SESSIONS", "100000"))
+
+_UPSERT = (
+    "INSERT INTO user_sessions (id, created_at, last_active, conversation_count, "
+    "risk_level) VALUES (:session_id, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 0, 'low') "
+    "ON CONFLICT (id) DO UPDATE SET last_active = EXCLUDED.last_active"
+)
+# Postgres: xmax = 0 marks a freshly inserted row
+_UPSERT_PG = f"{_UPSERT} RETURNING (xmax = 0) AS created"
+
+
+class MemoryTouchCache:
+    """Per-worker LRU of session id -> monotonic time of the last DB touch."""
+
+    backend = "memory"
+
+    def __init__(self, max_sessions: int = None):
+        self.max_sessions = max_sessions or SESSION_TOUCH_MAX_SESSIONS
+        self._touched: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._touched)
+
+    def claim(self, session_id: str, interval: float) -> bool:
+        """True (and record the touch) when session_id is due for a write."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._touched.get(session_id)
+            if last is not None and now - last < interval:
+                return False
+            self._touched[session_id] = now
+            self._touched.move_to_end(session_id)
+            while len(self._touched) > self.max_sessions:
+                self._touched.popitem(last=False)
+            return True
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._touched.pop(session_id, None)
+
+
+class RedisTouchCache:
+    """Touch markers shared by all workers: one ``SET NX EX`` per claim."""
+
+    backend = "redis"
+
+    def __init__(self, client, prefix: str = "sesstouch:"):
+        self.redis = client
+        self.prefix = prefix
+
+    def claim(self, session_id: str, interval: float) -> bool:
+        return bool(
+            self.redis.set(
+                self.prefix + session_id, 1, nx=True, px=max(1, int(interval * 1000))
+            )
+        )
+
+    def forget(self, session_id: str):
+        self.redis.delete(self.prefix + session_id)
+
+
+_touch_cache = None
+_touch_cache_lock = threading.Lock()
+
+
+def get_touch_cache():
+    """Process-wide touch cache (Redis if configured, else in-process LRU)."""
+    global _touch_cache
+    with _touch_cache_lock:
+        if _touch_cache is not None:
+            return _touch_cache
+        redis_url = (
+            os.getenv("SESSION_TOUCH_REDIS_URL") or os.getenv("REDIS_URL") or ""
+        ).strip()
+        if redis_url:
+            try:
+                import redis
+
+                client = redis.from_url(
+                    redis_url,
+                    socket_connect_timeout=1,
+                    socket_timeout=1,
+                    retry_on_timeout=False,
+                )
+                client.ping()
+                _touch_cache = _FallbackStore(RedisTouchCache(client), MemoryTouchCache)
+                return _touch_cache
+            except Exception as e:
+                logger.info(
+                    f"Session touch cache: Redis unavailable ({e}), using memory"
+                )
+        _touch_cache = MemoryTouchCache()
+        return _touch_cache
+
+
+def set_touch_cache(cache):
+    """Swap the process-wide touch cache (tests, custom backends)."""
+    global _touch_cache
+    with _touch_cache_lock:
+        _touch_cache = cache
+
+
+def upsert_session(db_session, session_id: str) -> Optional[bool]:
+    """Insert or refresh the session row and commit (inside a unit of work,
+    leave the commit to the request).
+
+    Returns True for a new session, False for an existing one and None when
+    the backend cannot tell (SQLite has no xmax).
+    """
+    params = {"session_id": session_id}
+    if db_session.get_bind().dialect.name == "postgresql":
+        created = db_session.execute(text(_UPSERT_PG), params).scalar()
+    else:
+        db_session.execute(text(_UPSERT), params)
+        created = None
+    commit_or_defer(db_session)
+    return created
+
+
+def ensure_session(
+    db_session, session_id: Optional[str], interval: float = None
+) -> str:
+    """Resolve the session for this call, writing to the database at most once
+    per interval per session. A missing id starts a new session; database
+    errors are logged and the id is still returned."""
+    memo = g.setdefault("_session_ids", {}) if has_request_context() else None
+    if memo is not None and session_id in memo:
+        return memo[session_id]
+
+    resolved = session_id or str(uuid.uuid4())
+    interval = SESSION_TOUCH_INTERVAL_SECONDS if interval is None else interval
+    cache = get_touch_cache()
+    if cache.claim(resolved, interval):
+        try:
+            if upsert_session(db_session, resolved):
+                logger.info(f"Created new session: {resolved}")
+            # The write is only final when the request's unit of work commits
+            on_rollback(lambda: cache.forget(resolved))
+        except Exception as e:
+            db_session.rollback()
+            # Let the next request retry the write instead of waiting out the interval
+            cache.forget(resolved)
+            logger.error(f"Session management error: {e}")
+
+    if memo is not None:
+        memo[session_id] = resolved
+    return resolved
@@ -67,19 +67,40 @@ which python || true
 python --version || true
 python -m gunicorn --version || true
 
+# Release step: apply schema migrations once, before any worker boots (workers
+# only check the schema version; concurrent containers serialise on a DB lock).
+# Never serve on a schema the code does not expect: a failed migration aborts the start.
+echo "Applying database migrations..."
+if ! python scripts/migrate.py upgrade; then
+  echo "ERROR: database migrations failed; not starting the application" >&2
+  exit 1
+fi
+
 # Use module invocation to avoid issues with gunicorn entrypoint script paths
 # Add verbose logging to capture errors on startup
 GUNICORN_WORKERS="${GUNICORN_WORKERS:-4}"
+GUNICORN_THREADS="${GUNICORN_THREADS:-1}"
+# Exported so workers can size their DB pools and AI key shares (db_pool.py)
+export GUNICORN_WORKERS GUNICORN_THREADS
 GUNICORN_TIMEOUT="${GUNICORN_TIMEOUT:-120}"
 GUNICORN_LOG_LEVEL="${GUNICORN_LOG_LEVEL:-debug}"
 GUNICORN_ARGS=(
   -b 0.0.0.0:5055
   --workers "${GUNICORN_WORKERS}"
+  --threads "${GUNICORN_THREADS}"
   --timeout "${GUNICORN_TIMEOUT}"
   --keep-alive 5
   --access-logfile -
   --error-logfile -
   --log-level "${GUNICORN_LOG_LEVEL}"
 )
-echo "Launching gunicorn with args: ${GUNICORN_ARGS[*]}"
-exec python -m gunicorn "${GUNICORN_ARGS[@]}" app:app
\ No newline at end of file
+# SERVER_MODE=asgi serves /api/chat and /api/chat_stream on an event loop
+# (asgi.py) so open SSE streams no longer pin a sync worker each.
+SERVER_MODE="${SERVER_MODE:-wsgi}"
+APP_TARGET="app:app"
+if [ "${SERVER_MODE}" = "asgi" ]; then
+  GUNICORN_ARGS+=(-k uvicorn.workers.UvicornWorker)
+  APP_TARGET="asgi:application"
+fi
+echo "Launching gunicorn (${SERVER_MODE}) with args: ${GUNICORN_ARGS[*]}"
+exec python -m gunicorn "${GUNICORN_ARGS[@]}" "${APP_TARGET}"
\ No newline at end of file
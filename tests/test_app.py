@@ -6,7 +6,7 @@ import pytest
 import json
 import time
 from datetime import datetime, timedelta
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 import os
 import sys
 
@@ -16,24 +16,26 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 from app import create_app
 from models import db, UserSession, Message, SelfAssessmentEntry
 from crisis_detection import detect_crisis_level
+from sqlalchemy import text
+from migrations import migrate
 
 @pytest.fixture
-def app():
+def app(tmp_path):
     """Create test application"""
-    app = create_app()
-    app.config.update({
+    app = create_app({
         'TESTING': True,
-        'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'AUTO_MIGRATE': False,
         'WTF_CSRF_ENABLED': False,
         'SECRET_KEY': 'test-secret-key',
         'RATE_LIMIT_ENABLED': False
     })
     
     with app.app_context():
-        db.create_all()
+        migrate(db.engine)
         yield app
         db.session.remove()
-        db.drop_all()
+        db.engine.dispose()
 
 @pytest.fixture
 def client(app):
@@ -183,14 +185,33 @@ class TestChatEndpoints:
         response = authenticated_client.post('/api/chat', json={'message': '  '})
         assert response.status_code == 400
         
-    @patch('app._get_ai_response_with_failover')
-    def test_chat_stream_endpoint(self, mock_ai, client):
+    @patch('app._stream_provider')
+    def test_chat_stream_endpoint(self, mock_stream, client):
         """Test /api/chat_stream SSE endpoint"""
-        mock_ai.return_value = ("Test response", "gemini")
+        mock_stream.return_value = iter(["Test ", "response"])
         
-        response = client.get('/api/chat_stream?message=Hello')
+        response = client.get('/api/chat_stream?message=I%20had%20a%20long%20day%20at%20school')
         assert response.status_code == 200
         assert response.content_type == 'text/event-stream'
+        events = [json.loads(line[len('data: '):])
+                  for line in response.get_data(as_text=True).split('\n\n') if line]
+        assert [e['type'] for e in events] == ['meta', 'token', 'token', 'done']
+        assert ''.join(e['text'] for e in events if e['type'] == 'token') == 'Test response'
+
+    @patch('app._build_failover_chain', return_value=['gemini', 'openai'])
+    @patch('app._stream_provider')
+    def test_chat_stream_fails_over_before_first_token(self, mock_stream, _chain, client):
+        """A provider that errors before its first chunk is skipped"""
+        def broken():
+            raise RuntimeError("Configuration error: Gemini API key not found")
+            yield  # pragma: no cover
+
+        mock_stream.side_effect = [broken(), iter(["From openai"])]
+        response = client.get('/api/chat_stream?message=I%20had%20a%20long%20day%20at%20school')
+        body = response.get_data(as_text=True)
+        assert 'From openai' in body
+        assert 'Configuration error' not in body
+        assert [c.args[0] for c in mock_stream.call_args_list] == ['gemini', 'openai']
         
     def test_chat_history(self, authenticated_client):
         """Test /api/chat_history endpoint"""
@@ -237,6 +258,1616 @@ class TestCrisisDetection:
         assert 'crisis_numbers' in data
 
 
+class TestGeoIP:
+    """Test offline IP -> country resolution"""
+
+    @pytest.fixture
+    def geoip_table(self, tmp_path):
+        import app as app_module
+        from scripts.build_geoip_table import write_table
+        import ipaddress
+
+        def rng(a, b, cc):
+            return (int(ipaddress.ip_address(a)), int(ipaddress.ip_address(b)), cc)
+
+        path = str(tmp_path / 'geoip.bin')
+        write_table(
+            path,
+            [rng('8.8.8.0', '8.8.8.255', 'US'), rng('81.2.69.0', '81.2.69.255', 'GB'),
+             rng('172.32.0.0', '172.32.255.255', 'IN'), rng('203.0.114.0', '203.0.114.255', 'NZ')],
+            [rng('2a00:1450::', '2a00:1450:ffff:ffff:ffff:ffff:ffff:ffff', 'DE')],
+        )
+        yield app_module
+        app_module._load_geoip_table(path='/nonexistent/geoip.bin')
+
+    def test_lookup_ipv4_and_ipv6(self, geoip_table, tmp_path):
+        """Ranges resolve via the mmap table, with ISO aliases applied"""
+        geoip_table._load_geoip_table(str(tmp_path / 'geoip.bin'))
+        with patch('app.requests.get', side_effect=AssertionError('no HTTP')):
+            assert geoip_table.get_country_code_from_ip('8.8.8.8') == 'us'
+            assert geoip_table.get_country_code_from_ip('81.2.69.160') == 'uk'
+            assert geoip_table.get_country_code_from_ip('::ffff:8.8.8.8') == 'us'
+            assert geoip_table.get_country_code_from_ip('2a00:1450::1') == 'de'
+            # Present in the table but no crisis resources configured
+            assert geoip_table.get_country_code_from_ip('203.0.114.7') == 'generic'
+            # Not covered by any range
+            assert geoip_table.get_country_code_from_ip('9.9.9.9') == 'generic'
+
+    def test_private_ranges(self, geoip_table, tmp_path):
+        """Only the real RFC1918 172.16/12 block is treated as private"""
+        geoip_table._load_geoip_table(str(tmp_path / 'geoip.bin'))
+        for ip in ['10.1.2.3', '172.16.0.1', '172.31.255.254', '192.168.1.1',
+                   '127.0.0.1', '::1', 'fe80::1', 'localhost', 'not-an-ip', '']:
+            assert geoip_table.get_country_code_from_ip(ip) == 'generic'
+        assert geoip_table.get_country_code_from_ip('172.32.0.1') == 'in'
+
+    def test_missing_table_falls_back_to_generic(self, geoip_table):
+        geoip_table._load_geoip_table('/nonexistent/geoip.bin')
+        assert geoip_table.get_country_code_from_ip('8.8.8.8') == 'generic'
+
+
+class TestASGIMode:
+    """Test the async front end (asgi.py)"""
+
+    @staticmethod
+    def _request(method, url, **kwargs):
+        import asyncio
+        import httpx
+        from asgi import application
+
+        async def run():
+            transport = httpx.ASGITransport(app=application)
+            async with httpx.AsyncClient(transport=transport, base_url='http://test') as c:
+                return await c.request(method, url, **kwargs)
+
+        return asyncio.run(run())
+
+    @staticmethod
+    def _fake_stream(*chunks):
+        async def gen():
+            for ch in chunks:
+                yield ch
+        return gen()
+
+    def test_chat_stream_forwards_tokens(self):
+        with patch('asgi._astream_provider', return_value=self._fake_stream('Hi ', 'there')):
+            response = self._request('GET', '/api/chat_stream', params={'message': 'I had a long day at school'})
+        assert response.status_code == 200
+        assert response.headers['content-type'] == 'text/event-stream'
+        events = [json.loads(line[len('data: '):])
+                  for line in response.text.split('\n\n') if line]
+        assert [e['type'] for e in events] == ['meta', 'token', 'token', 'done']
+        assert events[0]['session_id']
+
+    def test_chat_fails_over_between_async_providers(self):
+        async def broken():
+            raise RuntimeError("Configuration error: Gemini API key not found")
+            yield  # pragma: no cover
+
+        streams = [broken(), self._fake_stream('Async reply')]
+        with patch('app._build_failover_chain', return_value=['gemini', 'openai']), \
+                patch('asgi._astream_provider', side_effect=streams):
+            response = self._request('POST', '/api/chat', json={'message': 'I had a long day at school'})
+        assert response.status_code == 200
+        data = response.json()
+        assert data['response'] == 'Async reply'
+        assert data['session_id']
+
+    def test_gemini_history_work_runs_off_the_event_loop(self):
+        import asyncio
+        import threading
+        from providers import gemini
+
+        threads = []
+
+        def record(*args):
+            threads.append(threading.get_ident())
+            return 'prompt'
+
+        async def run():
+            return [chunk async for chunk in gemini.astream_gemini_response(
+                'hello', session_id='s1', risk_level='crisis')]
+
+        with patch.object(gemini, '_GEMINI_KEYS', ['key']), \
+                patch.object(gemini, '_prepare_prompt', side_effect=record), \
+                patch.object(gemini, '_remember', side_effect=record):
+            assert asyncio.run(run()) == [gemini.CRISIS_SUPPORT_RESPONSE]
+        assert len(threads) == 2
+        assert threading.get_ident() not in threads
+
+    def test_gemini_key_bookkeeping_runs_off_the_event_loop(self):
+        import asyncio
+        import threading
+        from providers import gemini
+
+        threads = []
+
+        def health_call(op, *args, default=None):
+            threads.append(threading.get_ident())
+            return default
+
+        async def chunks():
+            yield MagicMock(text='Hello')
+
+        model = MagicMock()
+        model.generate_content_async = AsyncMock(return_value=chunks())
+
+        async def run():
+            return [chunk async for chunk in gemini.astream_gemini_response('hello')]
+
+        with patch.object(gemini, '_GEMINI_KEYS', ['key-a', 'key-b']), \
+                patch.object(gemini, '_GEMINI_KEY_FPS', ['fp-a', 'fp-b']), \
+                patch.object(gemini, '_prepare_prompt', return_value='prompt'), \
+                patch.object(gemini, '_remember'), \
+                patch.object(gemini, '_health_call', side_effect=health_call), \
+                patch.object(gemini, 'gemini_async_client'), \
+                patch.object(gemini, 'gemini_async_model', return_value=model):
+            assert asyncio.run(run()) == ['Hello']
+        # stats (key demotion), last_good_model, set_last_good_model, record
+        assert len(threads) == 4
+        assert threading.get_ident() not in threads
+
+    def test_chat_requires_message(self):
+        response = self._request('POST', '/api/chat', json={})
+        assert response.status_code == 400
+
+    def test_other_routes_served_by_flask(self):
+        response = self._request('GET', '/api/ping')
+        assert response.status_code == 200
+        assert response.json()['ok'] is True
+
+
+class TestProviderClients:
+    """Test pooled provider client registry"""
+
+    def test_clients_reused_per_provider_and_key(self):
+        from providers import clients
+
+        assert clients.openai_client('key-a') is clients.openai_client('key-a')
+        assert clients.openai_client('key-a') is not clients.openai_client('key-b')
+        assert clients.perplexity_session('key-a') is clients.perplexity_session('key-a')
+        first = clients.gemini_model('key-a', 'gemini-2.5-flash')
+        second = clients.gemini_model('key-a', 'gemini-1.5-flash')
+        assert first._client is second._client
+
+    def test_openai_provider_uses_pooled_client(self, monkeypatch):
+        from providers import openai as openai_provider
+
+        monkeypatch.setenv('OPENAI_API_KEY', 'key-pooled')
+        fake = MagicMock()
+        fake.chat.completions.create.return_value.choices = [
+            MagicMock(message=MagicMock(content='pooled reply'))]
+        with patch('providers.openai.openai_client', return_value=fake) as factory:
+            assert openai_provider.get_openai_response('hi') == 'pooled reply'
+            assert openai_provider.get_openai_response('again') == 'pooled reply'
+        assert [c.args[0] for c in factory.call_args_list] == ['key-pooled', 'key-pooled']
+
+
+class TestHedgedFailover:
+    """Test opt-in hedging across the provider chain"""
+
+    @pytest.fixture
+    def hedging(self, app, monkeypatch):
+        monkeypatch.setenv('AI_HEDGING_ENABLED', 'true')
+        monkeypatch.setenv('AI_HEDGE_DEFAULT_DELAY_MS', '50')
+        monkeypatch.setenv('AI_HEDGE_MIN_DELAY_MS', '10')
+        with app.test_request_context(), \
+                patch('app._build_failover_chain', return_value=['gemini', 'openai']):
+            yield
+
+    def test_slow_primary_is_hedged(self, hedging):
+        import app as app_module
+
+        def call(provider, *args):
+            if provider == 'gemini':
+                time.sleep(1.0)
+                return 'slow gemini reply'
+            return 'fast openai reply'
+
+        before = dict(app_module._AI_METRICS['hedge_wins'])
+        with patch('app._call_provider', side_effect=call):
+            started = time.monotonic()
+            text, provider = app_module._get_ai_response_with_failover('hi', 's1', 'low')
+            elapsed = time.monotonic() - started
+        assert (text, provider) == ('fast openai reply', 'openai')
+        assert elapsed < 0.9
+        assert app_module._AI_METRICS['hedge_wins'].get('openai', 0) == before.get('openai', 0) + 1
+        assert 'ai_hedged_requests_total' in '\n'.join(app_module._ai_metrics_lines())
+
+    def test_fast_primary_wins_without_hedge(self, hedging):
+        import app as app_module
+
+        hedged_before = app_module._AI_METRICS['hedged']
+        with patch('app._call_provider', return_value='gemini reply') as call:
+            assert app_module._get_ai_response_with_failover('hi', 's1', 'low') == ('gemini reply', 'gemini')
+        assert [c.args[0] for c in call.call_args_list] == ['gemini']
+        assert app_module._AI_METRICS['hedged'] == hedged_before
+
+    def test_failure_response_falls_through(self, hedging):
+        import app as app_module
+
+        def call(provider, *args):
+            if provider == 'gemini':
+                return 'Configuration error: Gemini API key not found'
+            return 'openai reply'
+
+        with patch('app._call_provider', side_effect=call):
+            assert app_module._get_ai_response_with_failover('hi', 's1', 'low') == ('openai reply', 'openai')
+
+    def test_only_the_winning_reply_is_remembered(self, hedging):
+        import app as app_module
+        from providers.history import get_history_store
+
+        remember_flags = []
+
+        def call(provider, message, session_id, risk_level, remember=True):
+            remember_flags.append(remember)
+            if provider == 'gemini':
+                time.sleep(0.3)
+                return 'slow gemini reply'
+            return 'fast openai reply'
+
+        with patch('app._call_provider', side_effect=call):
+            app_module._get_ai_response_with_failover('hi', 'hedge-history', 'low')
+            time.sleep(0.4)  # the abandoned gemini call finishes too
+        assert remember_flags == [False, False]
+        assert [m['content'] for m in get_history_store().get('hedge-history')] == ['hi', 'fast openai reply']
+
+    def test_all_providers_failing_records_no_win(self, hedging):
+        import app as app_module
+
+        def call(provider, *args):
+            if provider == 'gemini':
+                raise RuntimeError('gemini down')
+            return "I'm having trouble connecting to my AI services. Please try again in a moment."
+
+        with app_module._ai_metrics_lock:
+            before = json.loads(json.dumps(app_module._AI_METRICS))
+        with patch('app._call_provider', side_effect=call):
+            text, provider = app_module._get_ai_response_with_failover('hi', 's1', 'low')
+        assert text.startswith("I'm having trouble connecting")
+        assert provider == 'openai'
+        assert app_module._AI_METRICS == before
+
+
+class TestProviderHealthStore:
+    """Test the cross-worker provider health store"""
+
+    def test_file_store_shared_between_workers(self, tmp_path):
+        from providers.health import FileHealthStore
+
+        path = str(tmp_path / 'health.mmap')
+        worker_a, worker_b = FileHealthStore(path, 64 * 1024), FileHealthStore(path, 64 * 1024)
+        worker_a.block_key('gemini', 'fp1', 60)
+        worker_a.set_last_good_model('gemini', 'fp1', 'gemini-2.0-flash')
+        worker_a.record('gemini', 'fp1', ok=True, latency_ms=100)
+        worker_b.record('gemini', 'fp1', ok=False)
+
+        assert set(worker_b.blocked('gemini', ['fp1', 'fp2'])) == {'fp1'}
+        assert worker_b.last_good_model('gemini', 'fp1') == 'gemini-2.0-flash'
+        stats = worker_a.stats('gemini', ['fp1'])['fp1']
+        assert stats['requests'] == 2 and stats['errors'] == 1
+        assert stats['avg_latency_ms'] == 100
+        assert [worker_a.next_index('gemini', 3), worker_b.next_index('gemini', 3)] == [0, 1]
+
+    def test_redis_store(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        from providers.health import RedisHealthStore
+
+        store = RedisHealthStore(fakeredis.FakeRedis())
+        store.block_key('openai', 'fp1', 60)
+        store.record('openai', 'fp1', ok=True, latency_ms=40)
+        store.record('openai', 'fp1', ok=False)
+        assert set(store.blocked('openai', ['fp1', 'fp2'])) == {'fp1'}
+        assert store.stats('openai', ['fp1'])['fp1']['error_rate'] == 0.5
+        assert store.snapshot()['openai']['fp1']['requests'] == 2
+
+    def test_gemini_skips_keys_blocked_by_other_workers(self, tmp_path, monkeypatch):
+        from providers import gemini, health, scheduler
+        from providers.clients import key_fingerprint
+
+        store = health.FileHealthStore(str(tmp_path / 'health.mmap'), 64 * 1024)
+        monkeypatch.setattr(health, '_store', store)
+        monkeypatch.setattr(scheduler, '_schedulers', {})
+        monkeypatch.setattr(gemini, '_GEMINI_KEYS', ['k1', 'k2'])
+        fps = [key_fingerprint('k1'), key_fingerprint('k2')]
+        monkeypatch.setattr(gemini, '_GEMINI_KEY_FPS', fps)
+        store.block_key('gemini', fps[0], 60)
+        assert list(gemini._candidate_keys(100, max_wait=0)) == [1]
+        store.set_last_good_model('gemini', fps[1], 'gemini-1.5-pro')
+        assert gemini._models_for_key(1)[0] == 'gemini-1.5-pro'
+
+
+class TestKeyScheduler:
+    """Test quota-aware API key scheduling"""
+
+    @pytest.fixture(autouse=True)
+    def health_store(self, tmp_path, monkeypatch):
+        from providers import health, scheduler
+
+        store = health.FileHealthStore(str(tmp_path / 'health.mmap'), 64 * 1024)
+        monkeypatch.setattr(health, '_store', store)
+        monkeypatch.setattr(scheduler, '_schedulers', {})
+        return store
+
+    def test_spreads_requests_evenly(self):
+        from providers.scheduler import KeyScheduler
+
+        sched = KeyScheduler('openai', ['a', 'b', 'c'], rpm=60, tpm=0)
+        picks = [sched.pick(100) for _ in range(6)]
+        assert sorted(picks.count(i) for i in range(3)) == [2, 2, 2]
+
+    def test_picks_key_with_most_token_headroom(self):
+        from providers.scheduler import KeyScheduler
+
+        sched = KeyScheduler('gemini', ['a', 'b'], rpm=60, tpm=1000)
+        assert sched.pick(600) == 0
+        assert sched.pick(600) == 1
+        # Neither key can take another 600 tokens this minute
+        assert sched.pick(600, max_wait=0) is None
+        # Reported usage was smaller than reserved: budget comes back
+        sched.settle(0, 600, 100)
+        assert sched.pick(600, max_wait=0) == 0
+
+    def test_penalize_cools_key_down_across_workers(self, health_store):
+        from providers.scheduler import KeyScheduler
+
+        sched = KeyScheduler('openai', ['a', 'b'], rpm=60, tpm=0)
+        first = sched.penalize(0)
+        assert sched.penalize(0) == 2 * first
+        assert [sched.pick(10) for _ in range(3)] == [1, 1, 1]
+        # Another worker sees the shared cooldown
+        other = KeyScheduler('openai', ['a', 'b'], rpm=60, tpm=0)
+        assert other.pick(10) == 1
+        assert sched.fingerprints[0] in health_store.blocked('openai', sched.fingerprints)
+
+    def test_openai_rotates_keys_on_rate_limit(self, monkeypatch):
+        from providers import openai as openai_provider
+
+        class RateLimited(Exception):
+            status_code = 429
+
+        def fake_client(api_key):
+            client = MagicMock()
+            if api_key == 'k1':
+                client.chat.completions.create.side_effect = RateLimited('Too Many Requests')
+            else:
+                client.chat.completions.create.return_value = MagicMock(
+                    choices=[MagicMock(message=MagicMock(content='hello from k2'))],
+                    usage=MagicMock(total_tokens=42),
+                )
+            return client
+
+        monkeypatch.setenv('OPENAI_API_KEY', 'k1')
+        monkeypatch.setenv('OPENAI_API_KEYS', 'k1,k2')
+        monkeypatch.setattr(openai_provider, 'openai_client', fake_client)
+        # Make the first pick land on the key that is rate limited
+        from providers.scheduler import get_scheduler
+        get_scheduler('openai', ['k1', 'k2'])._last_used[1] = time.monotonic()
+
+        assert openai_provider.get_openai_response('hi') == 'hello from k2'
+        assert get_scheduler('openai', ['k1', 'k2']).snapshot()[0]['cooling_down']
+
+    def test_openai_blocks_rejected_key_and_rotates(self, health_store, monkeypatch):
+        from providers import openai as openai_provider
+        from providers.scheduler import get_scheduler
+
+        class AuthenticationError(Exception):
+            status_code = 401
+
+        calls = []
+
+        def fake_client(api_key):
+            client = MagicMock()
+            calls.append(api_key)
+            if api_key == 'k1':
+                client.chat.completions.create.side_effect = AuthenticationError('Incorrect API key provided')
+            else:
+                client.chat.completions.create.return_value = MagicMock(
+                    choices=[MagicMock(message=MagicMock(content='hello from k2'))],
+                    usage=MagicMock(total_tokens=42),
+                )
+            return client
+
+        monkeypatch.setenv('OPENAI_API_KEY', 'k1')
+        monkeypatch.setenv('OPENAI_API_KEYS', 'k1,k2')
+        monkeypatch.setattr(openai_provider, 'openai_client', fake_client)
+        sched = get_scheduler('openai', ['k1', 'k2'])
+        sched._last_used[1] = time.monotonic()
+
+        assert openai_provider.get_openai_response('hi') == 'hello from k2'
+        blocked = health_store.blocked('openai', sched.fingerprints)
+        assert blocked[sched.fingerprints[0]] > time.time() + 3600
+        # The rejected key stays out of rotation
+        assert openai_provider.get_openai_response('again') == 'hello from k2'
+        assert calls == ['k1', 'k2', 'k2']
+
+    def test_perplexity_blocks_rejected_key_and_rotates(self, health_store, monkeypatch):
+        from providers import perplexity
+        from providers.scheduler import get_scheduler
+
+        def fake_session(api_key):
+            session = MagicMock()
+            if api_key == 'p1':
+                session.post.return_value = MagicMock(status_code=403, headers={})
+            else:
+                session.post.return_value = MagicMock(status_code=200, json=lambda: {
+                    'choices': [{'message': {'content': 'hello from p2'}}]})
+            return session
+
+        monkeypatch.setenv('PERPLEXITY_API_KEY', 'p1')
+        monkeypatch.setenv('PERPLEXITY_API_KEYS', 'p1,p2')
+        monkeypatch.setattr(perplexity, 'perplexity_session', fake_session)
+        sched = get_scheduler('perplexity', ['p1', 'p2'])
+        sched._last_used[1] = time.monotonic()
+
+        assert perplexity.get_perplexity_response('hi') == 'hello from p2'
+        assert sched.fingerprints[0] in health_store.blocked('perplexity', sched.fingerprints)
+
+    def test_async_rate_limit_cooldown_runs_off_the_event_loop(self, health_store, monkeypatch):
+        import asyncio
+        import threading
+        from providers import openai as openai_provider
+        from providers.scheduler import get_scheduler
+
+        class RateLimited(Exception):
+            status_code = 429
+
+        async def chunks():
+            yield MagicMock(choices=[MagicMock(delta=MagicMock(content='hello from k2'))])
+
+        def fake_client(api_key):
+            client = MagicMock()
+            if api_key == 'k1':
+                client.chat.completions.create = AsyncMock(side_effect=RateLimited('Too Many Requests'))
+            else:
+                client.chat.completions.create = AsyncMock(return_value=chunks())
+            return client
+
+        threads = []
+        block_key = health_store.block_key
+
+        def record_block(*args):
+            threads.append(threading.get_ident())
+            return block_key(*args)
+
+        monkeypatch.setenv('OPENAI_API_KEY', 'k1')
+        monkeypatch.setenv('OPENAI_API_KEYS', 'k1,k2')
+        monkeypatch.setattr(openai_provider, 'async_openai_client', fake_client)
+        monkeypatch.setattr(health_store, 'block_key', record_block)
+        get_scheduler('openai', ['k1', 'k2'])._last_used[1] = time.monotonic()
+
+        async def run():
+            return [d async for d in openai_provider.astream_openai_response('hi')]
+
+        assert asyncio.run(run()) == ['hello from k2']
+        assert len(threads) == 1
+        assert threading.get_ident() not in threads
+
+    def test_failed_connection_gives_tokens_back(self, monkeypatch):
+        from providers import openai as openai_provider
+        from providers.scheduler import get_scheduler
+
+        def fake_client(api_key):
+            client = MagicMock()
+            client.chat.completions.create.side_effect = ConnectionError('connection refused')
+            return client
+
+        monkeypatch.setenv('OPENAI_API_KEY', 'k1')
+        monkeypatch.setenv('OPENAI_TPM_PER_KEY', '10000')
+        monkeypatch.setattr(openai_provider, 'openai_client', fake_client)
+        before = get_scheduler('openai', ['k1']).snapshot()[0]['tpm_headroom']
+
+        assert 'trouble connecting' in openai_provider.get_openai_response('hi')
+        after = get_scheduler('openai', ['k1']).snapshot()[0]
+        assert after['tpm_headroom'] == pytest.approx(before, abs=1)
+        assert not after['cooling_down']
+
+
+class TestConversationHistory:
+    """Test the bounded conversation history store"""
+
+    @staticmethod
+    def _turn(text, is_user=True):
+        return {'content': text, 'is_user': is_user, 'timestamp': datetime.utcnow()}
+
+    def test_memory_store_evicts_lru_and_expired(self):
+        from providers.history import MemoryHistoryStore
+
+        store = MemoryHistoryStore(ttl_seconds=60, max_messages=2, max_sessions=2)
+        for sid in ('a', 'b', 'c'):
+            store.append(sid, [self._turn(f'{sid}1'), self._turn(f'{sid}2'), self._turn(f'{sid}3')])
+        assert store.get('a') is None
+        assert [m['content'] for m in store.get('c')] == ['c2', 'c3']
+
+        expired = MemoryHistoryStore(ttl_seconds=0)
+        expired.append('a', [self._turn('hi')])
+        assert expired.get('a') is None and len(expired) == 0
+
+    def test_memory_store_respects_byte_cap(self):
+        from providers.history import MemoryHistoryStore
+
+        store = MemoryHistoryStore(ttl_seconds=60, max_bytes=2000)
+        store.append('a', [self._turn('x' * 1000)])
+        store.append('b', [self._turn('y' * 1000)])
+        assert store.get('a') is None and store.get('b') is not None
+        assert store.bytes_used <= 2000
+
+    def test_redis_store_keeps_newest_messages(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        from providers.history import RedisHistoryStore
+
+        store = RedisHistoryStore(fakeredis.FakeRedis(), ttl_seconds=60, max_messages=2)
+        store.append('s1', [self._turn('one'), self._turn('two', False), self._turn('three')])
+        history = store.get('s1')
+        assert [m['content'] for m in history] == ['two', 'three']
+        assert isinstance(history[0]['timestamp'], datetime)
+        store.clear('s1')
+        assert store.get('s1') is None
+
+    def test_prompt_rehydrates_from_logs_until_crisis_reset(self, monkeypatch):
+        from providers import gemini, history
+
+        monkeypatch.setattr(history, '_store', history.MemoryHistoryStore(ttl_seconds=60))
+        now = datetime.utcnow()
+        rows = [('I feel sad today', 'That sounds hard', now),
+                ('I want to die', 'I hear you', now - timedelta(minutes=1)),
+                ('older context', 'older reply', now - timedelta(minutes=2))]
+        monkeypatch.setattr(history, '_loader', lambda sid, limit, since: rows)
+
+        prompt = gemini._prepare_prompt('hello again', 'sid-1', 'low')
+        assert 'I feel sad today' in prompt and 'older context' not in prompt
+        assert len(history.get_history_store().get('sid-1')) == 2
+
+    def test_rehydrate_window_is_utc_on_non_utc_hosts(self, monkeypatch):
+        from providers import history
+
+        seen = []
+        monkeypatch.setenv('TZ', 'Asia/Tokyo')
+        time.tzset()
+        try:
+            monkeypatch.setattr(history, '_loader', lambda sid, limit, since: seen.append(since) or [])
+            history.rehydrate('sid-tz')
+        finally:
+            monkeypatch.undo()
+            time.tzset()
+        expected = datetime.utcnow() - timedelta(seconds=history.HISTORY_TTL_SECONDS)
+        assert abs((seen[0] - expected).total_seconds()) < 5
+
+    def test_app_loader_reads_conversation_logs(self, app, authenticated_client):
+        import app as app_module
+        from providers import history
+
+        sid = authenticated_client.session_id
+        app_module._log_conversation(sid, 'logged question', 'logged answer', 'low')
+        assert history.rehydrate(sid)[0]['content'] == 'logged question'
+
+
+class TestSemanticCache:
+    """Test the vector-indexed semantic response cache"""
+
+    def test_lookup_finds_near_duplicate_prompts(self):
+        from ai_optimization.semantic_cache import SemanticCache
+
+        cache = SemanticCache(capacity=8, threshold=0.7)
+        cache.put('k1', 'I feel really anxious about my exams', 'exam reply', 'low')
+        cache.put('k2', 'my friends ignore me at lunch', 'friends reply', 'low')
+        response, score = cache.lookup('I feel really anxious about my exams!', 'low')
+        assert response == 'exam reply' and score >= 0.7
+        assert cache.lookup('what is the weather tomorrow', 'low') is None
+        stats = cache.stats()
+        assert stats['lookups'] == 2 and stats['hit_rate'] == 0.5
+
+    def test_evicts_least_recently_used_and_expired(self):
+        from ai_optimization.semantic_cache import SemanticCache
+
+        cache = SemanticCache(capacity=2, threshold=0.9)
+        cache.put('a', 'alpha message', 'A')
+        cache.put('b', 'beta message', 'B')
+        cache.lookup('alpha message')  # a is now more recent than b
+        cache.put('c', 'gamma message', 'C')
+        assert cache.lookup('beta message') is None
+        assert cache.lookup('alpha message')[0] == 'A'
+
+        cache.put('d', 'delta message', 'D', ttl=-1)
+        assert cache.lookup('delta message') is None
+
+    def test_round_trips_through_compact_persistence(self, tmp_path):
+        from ai_optimization.semantic_cache import SemanticCache
+
+        cache = SemanticCache(capacity=4, threshold=0.9)
+        cache.put('a', 'I cannot sleep at night', 'sleep reply', 'medium')
+        path = str(tmp_path / 'cache.npz')
+        cache.save(path)
+
+        restored = SemanticCache(capacity=4, threshold=0.9)
+        assert restored.load(path)
+        assert restored.lookup('I cannot sleep at night', 'medium')[0] == 'sleep reply'
+
+    def test_optimizer_reports_cache_metrics(self):
+        from ai_optimization.cost_reducer import AIOptimizer, ResponseStrategy
+
+        optimizer = AIOptimizer()
+        context = {'risk_level': 'low'}
+        optimizer.cache_response('school has been overwhelming this week', 'cached', context)
+        provider, strategy = optimizer.select_optimal_provider(
+            'school has been so overwhelming this week', context)
+        assert (provider, strategy) == ('cache', ResponseStrategy.CACHE_HIT)
+        report = optimizer.get_cost_report()['semantic_cache']
+        assert report['hits'] == 1 and report['avg_lookup_ms'] >= 0
+
+    def test_optimizer_snapshot_survives_restart(self, tmp_path, monkeypatch):
+        import atexit
+        from ai_optimization.cost_reducer import AIOptimizer
+
+        registered = []
+        monkeypatch.setattr(atexit, 'register', registered.append)
+        monkeypatch.setenv('AI_SEMANTIC_CACHE_PATH', str(tmp_path / 'cache.npz'))
+        optimizer = AIOptimizer()
+        optimizer.cache_response('exams are stressing me out', 'exam reply', {'risk_level': 'low'})
+        assert registered == [optimizer.save_semantic_cache]
+        registered[0]()  # worker exit
+
+        restarted = AIOptimizer()
+        assert restarted.local_response('exams are stressing me out', {'risk_level': 'low'})[0] == 'exam reply'
+
+
+class TestFastPath:
+    """Test the zero-LLM fast-path tier in front of the providers"""
+
+    @pytest.fixture(autouse=True)
+    def fresh_state(self, monkeypatch):
+        import app as app_module
+        from ai_optimization.cost_reducer import AIOptimizer
+
+        optimizer = AIOptimizer()
+        monkeypatch.setattr(app_module, '_ai_optimizer', optimizer)
+        monkeypatch.setattr(app_module, '_TIER_METRICS', {})
+        return app_module
+
+    @patch('app._get_ai_response_with_failover')
+    def test_greeting_served_from_template(self, mock_ai, authenticated_client, fresh_state):
+        response = authenticated_client.post('/api/chat', json={'message': 'Hi there'})
+
+        assert response.status_code == 200
+        assert json.loads(response.data)['response']
+        mock_ai.assert_not_called()
+        assert fresh_state._TIER_METRICS['template']['turns'] == 1
+
+    @patch('app._get_ai_response_with_failover')
+    def test_crisis_reply_skips_model(self, mock_ai, authenticated_client, fresh_state):
+        from providers.gemini import CRISIS_SUPPORT_RESPONSE
+
+        response = authenticated_client.post('/api/chat', json={'message': 'I want to end my life'})
+
+        data = json.loads(response.data)
+        assert data['risk_level'] == 'crisis'
+        assert data['response'] == CRISIS_SUPPORT_RESPONSE
+        mock_ai.assert_not_called()
+
+    @patch('app._get_ai_response_with_failover')
+    def test_repeat_question_served_from_cache(self, mock_ai, authenticated_client, fresh_state):
+        mock_ai.return_value = ("Try a short walk after class.", "gemini")
+        for _ in range(2):
+            response = authenticated_client.post(
+                '/api/chat', json={'message': 'what can I do after a long day at school'})
+            assert json.loads(response.data)['response'] == "Try a short walk after class."
+
+        assert mock_ai.call_count == 1
+        assert fresh_state._TIER_METRICS['llm']['turns'] == 1
+        assert fresh_state._TIER_METRICS['cache']['turns'] == 1
+        assert 'ai_turns_total{tier="cache"} 1' in fresh_state._ai_metrics_lines()
+
+    @patch('app._get_ai_response_with_failover')
+    def test_reply_using_history_is_not_shared(self, mock_ai, client, fresh_state):
+        from providers.gemini import remember_turn
+
+        mock_ai.return_value = ("Like you said about Sam, try talking to them.", "gemini")
+        question = 'what can I do after a long day at school'
+        sessions = [json.loads(client.get('/api/get_or_create_session').data)['session_id']
+                    for _ in range(2)]
+        remember_turn(sessions[0], 'my friend Sam ignores me', 'That sounds hard.')
+        for session_id in sessions:
+            client.post('/api/chat', json={'message': question}, headers={'X-Session-ID': session_id})
+
+        # The second session gets its own reply, not the first one's
+        assert mock_ai.call_count == 2
+        assert 'cache' not in fresh_state._TIER_METRICS
+
+
+class TestCrisisKeywordEngine:
+    """Test the shared Aho-Corasick crisis keyword scan"""
+
+    def test_automaton_finds_overlapping_whole_words(self):
+        from crisis_detection import KeywordAutomaton
+
+        automaton = KeywordAutomaton(['he', 'she', 'hers', 'his'])
+        assert [m[2] for m in automaton.finditer('she said hers his')] == ['she', 'hers', 'his']
+        assert list(automaton.finditer('ushers')) == []
+
+    def test_scan_is_shared_by_all_detectors(self):
+        from app import _enhanced_crisis_detection
+        from crisis_detection import scan_message
+        from providers.gemini import _is_crisis_message
+
+        message = "I feel hopeless and I want to die"
+        scan = scan_message(message)
+        assert scan.level == 'crisis' and scan.resets_history
+        assert scan.keywords == ('want to die', 'hopeless')
+        assert _enhanced_crisis_detection(message)[2] == ['want to die', 'hopeless']
+        assert _is_crisis_message(message)
+
+    def test_word_boundaries_and_inflections(self):
+        from crisis_detection import KeywordAutomaton, scan_message
+
+        # "die" inside another word no longer wipes the conversation history
+        assert not scan_message('I studied for my diet class').resets_history
+        assert detect_crisis_level('Such hopelessness lately') == 'high'
+        assert scan_message('exams are so stressful').keywords == ('stress',)
+        assert detect_crisis_level('I can’t go on') == 'high'
+        automaton = KeywordAutomaton(['harm'], prefixes=['harm'])
+        assert [m[2] for m in automaton.finditer('harming, not charm')] == ['harm']
+
+    def test_inflected_risk_phrases_keep_their_level(self):
+        # Levels the substring checks gave these messages before the automaton
+        assert detect_crisis_level('I keep self harming') == 'high'
+        assert detect_crisis_level('I self harmed last night') == 'high'
+        assert detect_crisis_level('thinking about suicides') == 'crisis'
+        assert detect_crisis_level('I feel hopelessly lost') == 'high'
+        assert detect_crisis_level('sadly nothing helps') == 'medium'
+
+
+class TestCrisisClassifier:
+    """Test the optional hashed n-gram crisis classifier"""
+
+    @pytest.fixture
+    def model_path(self, tmp_path):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+        from train_crisis_classifier import main
+
+        path = str(tmp_path / 'crisis_model.bin')
+        assert main(['--output', path]) == 0
+        return path
+
+    def test_batch_scores_match_single_messages(self, model_path):
+        from crisis_classifier import CrisisClassifier
+
+        classifier = CrisisClassifier(model_path)
+        messages = ['I want to end my life', 'I feel so sad and lonely', 'I am tired', '']
+        batch = classifier.predict_batch(messages)
+        for message, (label, probability) in zip(messages, batch):
+            single_label, single_probability = classifier.predict(message)
+            assert single_label == label
+            assert single_probability == pytest.approx(probability, abs=1e-5)
+        assert batch[0][0] == 'crisis'
+
+    def test_second_opinion_only_raises_confident_levels(self, model_path, monkeypatch):
+        import crisis_classifier
+        from crisis_detection import detect_crisis_levels, second_opinion
+
+        assert second_opinion('low', ('crisis', 0.9), threshold=0.8) == 'crisis'
+        assert second_opinion('low', ('crisis', 0.5), threshold=0.8) == 'low'
+        assert second_opinion('crisis', ('low', 0.99), threshold=0.8) == 'crisis'
+
+        monkeypatch.setattr(crisis_classifier, '_classifier', crisis_classifier.CrisisClassifier(model_path))
+        monkeypatch.setattr(crisis_classifier, '_classifier_loaded', True)
+        monkeypatch.setattr(crisis_classifier, 'CRISIS_MODEL_THRESHOLD', 0.5)
+        # No keyword matches, but the classifier recognises the phrasing
+        assert detect_crisis_level('I want to end my pain') == 'crisis'
+        assert detect_crisis_levels(['I want to end my pain', 'I am depressed']) == ['crisis', 'medium']
+        monkeypatch.setattr(crisis_classifier, 'CRISIS_MODEL_THRESHOLD', 1.01)
+        assert detect_crisis_level('I want to end my pain') == 'low'
+
+    def test_missing_model_falls_back_to_keywords(self, tmp_path):
+        import crisis_classifier
+
+        assert crisis_classifier.load_classifier(str(tmp_path / 'missing.bin')) is None
+        assert detect_crisis_level('I want to die') == 'crisis'
+
+
+class TestClinicalFeatureScan:
+    """Test the fused-regex feature scan of the clinical detector"""
+
+    def test_overlapping_indicators_are_all_found(self):
+        from crisis_v2.clinical_detection import ClinicalCrisisDetector
+
+        detector = ClinicalCrisisDetector()
+        found = detector._detect_clinical_indicators("I'm going to kill myself tonight, I want to die")
+        assert [ind.category for ind in found] == ['active_ideation', 'active_ideation', 'active_plan',
+                                                  'temporal']
+
+    def test_features_match_per_pattern_checks(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+        from benchmark_clinical_detection import CORPUS, fused_features, legacy_features
+        from crisis_v2.clinical_detection import ClinicalCrisisDetector
+
+        detector = ClinicalCrisisDetector()
+        for message in CORPUS:
+            assert fused_features(detector, message) == legacy_features(detector, message), message
+
+    def test_escalation_reuses_memoized_history_scans(self):
+        from crisis_v2.clinical_detection import ClinicalCrisisDetector
+
+        detector = ClinicalCrisisDetector()
+        history = ["I'm tired", "I feel hopeless"]
+        detector.assess_risk("I want to kill myself", 's1', history=history)
+        misses = detector._scan.cache_info().misses
+        detector.assess_risk("I want to kill myself", 's1', history=history)
+        assert detector._scan.cache_info().misses == misses
+        assert detector._detect_escalation(history + ["I want to kill myself"])
+
+
+class TestRiskHistory:
+    """Test the bounded risk history behind the clinical detector"""
+
+    def test_ring_keeps_newest_entries(self):
+        from crisis_v2.risk_history import RiskRing
+
+        ring = RiskRing(3)
+        for i in range(5):
+            ring.append(float(i), i, i * 2)
+        assert len(ring) == 3
+        assert [e.severity for e in ring.recent(10)] == [2, 3, 4]
+        assert ring.recent(1)[0] == (4.0, 4, 8)
+
+    def test_memory_store_evicts_lru_expired_and_over_cap(self):
+        from crisis_v2.risk_history import MemoryRiskHistoryStore
+
+        store = MemoryRiskHistoryStore(length=4, ttl_seconds=60, max_sessions=2)
+        for sid in ('a', 'b'):
+            store.append(sid, time.time(), 1, 0)
+        store.recent('a', 5)  # touch a, so b is least recently used
+        store.append('c', time.time(), 2, 1)
+        assert store.recent('b', 5) == [] and len(store) == 2
+
+        expiring = MemoryRiskHistoryStore(ttl_seconds=0)
+        expiring.append('a', time.time(), 3, 1)
+        assert expiring.recent('a', 5) == []
+
+        capped = MemoryRiskHistoryStore(length=100, max_bytes=2000)
+        for i in range(50):
+            capped.append(f's{i}', time.time(), 1, 0)
+        assert capped.bytes_used <= 2000 and capped.recent('s49', 1)
+
+    def test_escalation_seen_across_workers_with_redis(self, monkeypatch):
+        fakeredis = pytest.importorskip('fakeredis')
+        from crisis_v2 import clinical_detection, risk_history
+
+        server = fakeredis.FakeServer()
+        monkeypatch.setattr(risk_history, '_store', risk_history.RedisRiskHistoryStore(
+            fakeredis.FakeRedis(server=server), length=10, ttl_seconds=60))
+        worker_a = clinical_detection.ClinicalCrisisDetector()
+        worker_a.assess_risk("I'm a bit tired", 'cross-worker')
+        monkeypatch.setattr(risk_history, '_store', risk_history.RedisRiskHistoryStore(
+            fakeredis.FakeRedis(server=server), length=10, ttl_seconds=60))
+        worker_b = clinical_detection.ClinicalCrisisDetector()
+        worker_b.assess_risk("I want to kill myself, I have pills ready", 'cross-worker')
+        assert [e.severity for e in worker_b.risk_history.recent('cross-worker', 5)] == [0, 1]
+        assert worker_b._analyze_temporal_patterns('cross-worker', 0.0) == 0.3
+
+
+class TestCrisisBatch:
+    """Test batch crisis detection and the conversation_logs re-scoring job"""
+
+    def test_batch_endpoint_matches_single_endpoint(self, client):
+        messages = ['I want to kill myself', 'I feel hopeless', 'Nice weather today']
+        response = client.post('/api/crisis_detection/batch', json={'messages': messages})
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['count'] == 3
+        for message, result in zip(messages, data['results']):
+            single = json.loads(client.post('/api/crisis_detection', json={'message': message}).data)
+            assert result['risk_level'] == single['risk_level']
+            assert result['risk_score'] == pytest.approx(single['risk_score'])
+            assert result['keywords'] == single['keywords']
+        assert data['results'][0]['keywords'] == ['kill myself']
+        assert sum(data['summary'].values()) == 3
+        assert set(data['resources']) == set(data['summary'])
+
+    def test_batch_endpoint_validates_input(self, client):
+        import app as app_module
+
+        assert client.post('/api/crisis_detection/batch', json={'messages': []}).status_code == 400
+        assert client.post('/api/crisis_detection/batch', json={'messages': ['ok', '']}).status_code == 400
+        too_many = ['hello'] * (app_module.CRISIS_BATCH_MAX_MESSAGES + 1)
+        assert client.post('/api/crisis_detection/batch', json={'messages': too_many}).status_code == 413
+
+    def test_rescore_job_updates_changed_rows_and_resumes(self, tmp_path):
+        import sqlite3
+
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+        from rescore_conversation_logs import main
+
+        db_path = str(tmp_path / 'logs.db')
+        messages = ['I want to kill myself', 'I had a nice lunch', 'I feel hopeless'] * 5
+        conn = sqlite3.connect(db_path)
+        conn.execute('CREATE TABLE conversation_logs (id INTEGER PRIMARY KEY, user_message TEXT, '
+                     'risk_level TEXT, risk_score REAL)')
+        conn.executemany('INSERT INTO conversation_logs (user_message, risk_level, risk_score) '
+                         'VALUES (?, ?, 0)', [(m, 'low') for m in messages])
+        conn.commit()
+
+        checkpoint = str(tmp_path / 'checkpoint.json')
+        args = ['--database-url', f'sqlite:///{db_path}', '--workers', '0', '--batch-size', '4',
+                '--checkpoint', checkpoint]
+        assert main(args) == 0
+        rows = conn.execute('SELECT user_message, risk_level FROM conversation_logs ORDER BY id').fetchall()
+        assert [level for _, level in rows] == [detect_crisis_level(m) for m in messages]
+        with open(checkpoint) as f:
+            state = json.load(f)
+        assert state['last_id'] == len(messages) and state['scanned'] == len(messages)
+
+        # Rows after the checkpoint are the only ones a second run looks at
+        conn.execute("INSERT INTO conversation_logs (user_message, risk_level, risk_score) "
+                     "VALUES ('I want to die', 'low', 0)")
+        conn.commit()
+        assert main(args) == 0
+        with open(checkpoint) as f:
+            assert json.load(f)['scanned'] == len(messages) + 1
+        assert conn.execute('SELECT risk_level FROM conversation_logs ORDER BY id DESC LIMIT 1').fetchone()[0] == 'crisis'
+        conn.close()
+
+
+class TestSessionService:
+    """Test the single-statement session upsert and last_activity debounce"""
+
+    @pytest.fixture
+    def sqlite_session(self, tmp_path):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import Session
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'sessions.db'}")
+        with engine.begin() as conn:
+            conn.execute(text('CREATE TABLE user_sessions (id VARCHAR(255) PRIMARY KEY, '
+                              'created_at TIMESTAMP, last_active TIMESTAMP, '
+                              'conversation_count INTEGER, risk_level VARCHAR(20))'))
+            conn.execute(text('CREATE VIEW sessions AS SELECT id, created_at, '
+                              'last_active AS last_activity FROM user_sessions'))
+        session = Session(engine)
+        yield session
+        session.close()
+        engine.dispose()
+
+    @pytest.fixture(autouse=True)
+    def touch_cache(self):
+        import session_service
+
+        cache = session_service.MemoryTouchCache()
+        session_service.set_touch_cache(cache)
+        yield cache
+        session_service.set_touch_cache(None)
+
+    def test_new_and_existing_sessions_are_upserted(self, sqlite_session):
+        from session_service import ensure_session
+
+        session_id = ensure_session(sqlite_session, None)
+        assert ensure_session(sqlite_session, session_id, interval=0) == session_id
+        assert sqlite_session.execute(text('SELECT COUNT(*) FROM user_sessions')).scalar() == 1
+        # The legacy shape is a view over the one row
+        assert sqlite_session.execute(text('SELECT id FROM sessions')).scalar() == session_id
+        # Legacy ids longer than a uuid fit too
+        ensure_session(sqlite_session, 'x' * 40)
+        assert sqlite_session.execute(text('SELECT COUNT(*) FROM user_sessions')).scalar() == 2
+
+    def test_touches_within_interval_skip_the_database(self, sqlite_session):
+        import session_service
+
+        with patch.object(session_service, 'upsert_session',
+                          wraps=session_service.upsert_session) as upsert:
+            session_service.ensure_session(sqlite_session, 'abc', interval=60)
+            session_service.ensure_session(sqlite_session, 'abc', interval=60)
+            assert upsert.call_count == 1
+            session_service.ensure_session(sqlite_session, 'abc', interval=0)
+            assert upsert.call_count == 2
+
+    def test_failed_write_is_retried_next_time(self, sqlite_session, touch_cache):
+        import session_service
+
+        with patch.object(session_service, 'upsert_session', side_effect=RuntimeError('db down')):
+            assert session_service.ensure_session(sqlite_session, 'abc', interval=60) == 'abc'
+        assert touch_cache.claim('abc', 60)
+
+    def test_request_memo_returns_one_id_per_request(self, app, sqlite_session):
+        import session_service
+
+        with app.test_request_context('/'):
+            with patch.object(session_service, 'upsert_session') as upsert:
+                first = session_service.ensure_session(sqlite_session, None)
+                assert session_service.ensure_session(sqlite_session, None) == first
+                session_service.ensure_session(sqlite_session, first, interval=0)
+                session_service.ensure_session(sqlite_session, first, interval=0)
+                assert upsert.call_count == 2
+
+    def test_redis_touch_cache_is_shared(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        from session_service import RedisTouchCache
+
+        client = fakeredis.FakeRedis()
+        first, second = RedisTouchCache(client), RedisTouchCache(client)
+        assert first.claim('abc', 60)
+        assert not second.claim('abc', 60)
+        second.forget('abc')
+        assert second.claim('abc', 60)
+
+
+class TestLogWriter:
+    """Test the write-behind buffer for conversation and crisis logs"""
+
+    @pytest.fixture
+    def engine(self, tmp_path):
+        from sqlalchemy import create_engine
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'logs.db'}")
+        with engine.begin() as conn:
+            conn.execute(text('CREATE TABLE conversation_logs (id INTEGER PRIMARY KEY, session_id TEXT, '
+                              'user_message TEXT NOT NULL, ai_response TEXT NOT NULL, risk_level TEXT, '
+                              'risk_score REAL, timestamp TIMESTAMP)'))
+        yield engine
+        engine.dispose()
+
+    @staticmethod
+    def row(n):
+        return {'session_id': 's1', 'user_message': f'question {n}', 'ai_response': 'answer',
+                'risk_level': 'low', 'risk_score': 0.0, 'timestamp': datetime.utcnow()}
+
+    @staticmethod
+    def count(engine):
+        with engine.connect() as conn:
+            return conn.execute(text('SELECT COUNT(*) FROM conversation_logs')).scalar()
+
+    def test_rows_are_batched_and_spill_removed(self, engine, tmp_path):
+        from log_writer import LogWriter
+
+        writer = LogWriter(engine, spill_dir=str(tmp_path / 'spill'), max_queue=3, flush_interval_ms=20)
+        for n in range(10):  # more than max_queue: the overflow is read back from the spill file
+            writer.submit('conversation_logs', self.row(n))
+        assert writer.flush(timeout=5)
+        writer.close()
+        assert self.count(engine) == 10
+        assert os.listdir(tmp_path / 'spill') == []
+        assert writer.stats()['pending'] == 0
+
+    def test_rejected_rows_are_dropped_not_retried_forever(self, engine, tmp_path):
+        from log_writer import LogWriter
+
+        writer = LogWriter(engine, spill_dir=str(tmp_path / 'spill'), flush_interval_ms=20)
+        bad = dict(self.row(1), user_message=None)
+        writer.submit('conversation_logs', self.row(0))
+        writer.submit('conversation_logs', bad)
+        assert writer.flush(timeout=5)
+        writer.close()
+        assert self.count(engine) == 1
+        assert writer.stats()['dropped'] == 1
+
+    def test_pending_rows_are_visible_until_committed(self, engine, tmp_path):
+        from log_writer import LogWriter
+
+        writer = LogWriter(engine, spill_dir=str(tmp_path / 'spill'), flush_interval_ms=60000)
+        writer.submit('conversation_logs', self.row(0))
+        writer.submit('conversation_logs', dict(self.row(1), session_id='s2'))
+        assert [r['user_message'] for r in writer.pending_rows('conversation_logs', 's1')] == ['question 0']
+        assert writer.flush(timeout=5)
+        assert writer.pending_rows('conversation_logs', 's1') == []
+        writer.close()
+
+    def test_failing_segment_is_quarantined_without_blocking_others(self, engine, tmp_path):
+        from log_writer import LogWriter
+
+        spill = str(tmp_path / 'spill')
+        writer = LogWriter(engine, spill_dir=spill, flush_interval_ms=20, max_attempts=2)
+        # No crisis_detections table here: this segment fails on every retry
+        writer.submit('crisis_detections', {'session_id': 's1', 'message': 'x', 'timestamp': datetime.utcnow()})
+        assert not writer.flush(timeout=0.3)
+        writer.submit('conversation_logs', self.row(0))
+        assert not writer.flush(timeout=0.3)
+        assert self.count(engine) == 1
+        writer.submit('conversation_logs', self.row(1))
+        assert writer.flush(timeout=5)
+        writer.close()
+        assert self.count(engine) == 2
+        assert writer.stats()['quarantined'] == 1
+        assert len(os.listdir(os.path.join(spill, 'quarantine'))) == 1
+
+    def test_crisis_rows_commit_before_the_response_by_default(self, app, monkeypatch):
+        import app as app_module
+
+        writer = MagicMock()
+        monkeypatch.setattr(app_module, 'get_log_writer', lambda: writer)
+        with app.app_context():
+            app_module._log_crisis_detections('s-crisis', [('I want to end my life', ('crisis', 0.9, ['end my life']))])
+            count = db.session.execute(
+                text("SELECT COUNT(*) FROM crisis_detections WHERE session_id = 's-crisis'")).scalar()
+        assert count == 1
+        writer.submit.assert_not_called()
+
+    def test_adoption_skips_live_writers_and_keeps_names_short(self, tmp_path):
+        from sqlalchemy import create_engine
+        from log_writer import LogWriter
+
+        spill = str(tmp_path / 'spill')
+        missing = create_engine(f"sqlite:///{tmp_path / 'empty.db'}")  # no tables
+        live = LogWriter(missing, spill_dir=spill, flush_interval_ms=20)
+        live.submit('conversation_logs', self.row(0))
+        assert not live.flush(timeout=0.3)
+        # Left behind by a closed writer of this process, already adopted once
+        with open(os.path.join(spill, f'{os.getpid()}-0000dead-adopted-999999999-dead-00000001.jsonl'), 'w') as f:
+            f.write(json.dumps(['conversation_logs', dict(self.row(1), timestamp=None)]) + '\n')
+
+        second = LogWriter(missing, spill_dir=spill, flush_interval_ms=20)
+        second.close()
+        live.close()
+        missing.dispose()
+        assert sorted(os.listdir(spill)) == sorted(
+            [f'{live._prefix}-00000001.jsonl', f'{second._prefix}-adopted-999999999-dead-00000001.jsonl'])
+
+    def test_segments_survive_database_outage_and_crash(self, engine, tmp_path):
+        from sqlalchemy import create_engine
+        from log_writer import LogWriter
+
+        spill = str(tmp_path / 'spill')
+        missing = create_engine(f"sqlite:///{tmp_path / 'empty.db'}")  # no tables yet
+        writer = LogWriter(missing, spill_dir=spill, flush_interval_ms=20)
+        writer.submit('conversation_logs', self.row(0))
+        assert not writer.flush(timeout=0.3)
+        writer.close()
+        missing.dispose()
+        # Pretend the worker died with the segment on disk: a dead pid owns it
+        (leftover,) = os.listdir(spill)
+        os.rename(os.path.join(spill, leftover), os.path.join(spill, '999999999-dead-00000001.jsonl'))
+
+        replay = LogWriter(engine, spill_dir=spill, flush_interval_ms=20)
+        replay.close()
+        assert self.count(engine) == 1
+        assert os.listdir(spill) == []
+
+
+class TestMigrations:
+    """Test the versioned schema migration runner"""
+
+    @pytest.fixture
+    def engine(self, tmp_path):
+        from sqlalchemy import create_engine
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+        yield engine
+        engine.dispose()
+
+    def test_upgrade_applies_each_migration_once(self, engine):
+        import migrations
+
+        assert migrations.current_version(engine) == 0
+        assert migrations.migrate(engine) == [m.version for m in migrations.MIGRATIONS]
+        assert migrations.current_version(engine) == migrations.SCHEMA_VERSION
+        assert migrations.migrate(engine) == []
+        with engine.connect() as conn:
+            assert conn.execute(text('SELECT COUNT(*) FROM community_posts')).scalar() > 0
+            assert conn.execute(text('SELECT COUNT(*) FROM schema_version')).scalar() == len(migrations.MIGRATIONS)
+
+    def test_baseline_adopts_existing_schema(self, engine):
+        import migrations
+
+        # A database created by the old boot-time DDL, missing later columns
+        with engine.begin() as conn:
+            conn.execute(text('CREATE TABLE sessions (id VARCHAR(255) PRIMARY KEY, created_at TIMESTAMP, '
+                              'last_activity TIMESTAMP)'))
+            conn.execute(text("INSERT INTO sessions (id) VALUES ('kept')"))
+            conn.execute(text('CREATE TABLE conversation_logs (id INTEGER PRIMARY KEY, session_id TEXT, '
+                              'user_message TEXT, ai_response TEXT)'))
+        assert migrations.migrate(engine, target=1) == [1]
+        with engine.connect() as conn:
+            assert conn.execute(text('SELECT id FROM sessions')).scalar() == 'kept'
+            columns = {row[1] for row in conn.execute(text('PRAGMA table_info(conversation_logs)'))}
+        assert {'risk_level', 'risk_score', 'timestamp'} <= columns
+
+    def test_baseline_does_not_follow_the_models(self, engine):
+        import migrations
+
+        assert migrations.migrate(engine, target=1) == [1]
+        with engine.connect() as conn:
+            columns = {row[1]: row[2] for row in conn.execute(text('PRAGMA table_info(user_sessions)'))}
+            tables = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+        # models.py has since widened the id; the baseline keeps what it shipped
+        assert columns['id'] == 'VARCHAR(36)'
+        assert 'self_assessment_entries' not in tables
+
+    def test_cli_status_reports_pending(self, tmp_path, capsys):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+        from migrate import main
+
+        url = f"sqlite:///{tmp_path / 'cli.db'}"
+        assert main(['status', '--database-url', url]) == 1
+        assert 'pending' in capsys.readouterr().out
+        assert main(['upgrade', '--database-url', url]) == 0
+        assert main(['status', '--database-url', url]) == 0
+
+    def test_index_pack_created_and_used(self, engine):
+        import migrations
+        from sqlalchemy import inspect
+
+        migrations.migrate(engine)
+        indexes = {ix['name'] for ix in inspect(engine).get_indexes('conversation_logs')}
+        assert {'ix_conversation_logs_session_ts', 'ix_conversation_logs_ts'} <= indexes
+        with engine.connect() as conn:
+            # Partial index predicate matches the feed query, so the planner picks it
+            plan = ' '.join(str(row[-1]) for row in conn.execute(text(
+                'EXPLAIN QUERY PLAN SELECT id FROM community_posts '
+                'WHERE COALESCE(is_hidden, FALSE) = FALSE ORDER BY created_at DESC, id DESC LIMIT 20')))
+            assert 'ix_community_posts_feed' in plan
+            # Re-running the pack is a no-op
+            assert len(migrations.ensure_indexes(conn, 'sqlite')) == len(
+                [s for s in migrations.INDEX_PACK if inspect(conn).has_table(s.table)])
+
+    def test_index_advisor_requires_postgres(self, tmp_path, capsys):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+        from index_advisor import main
+
+        assert main(['--database-url', f"sqlite:///{tmp_path / 'advisor.db'}"]) == 0
+        assert 'need Postgres' in capsys.readouterr().out
+
+
+class TestPartitions:
+    """Test log table partition helpers and the SQLite retention fallback"""
+
+    def test_period_bounds_round_trip(self):
+        from partitions import _parse_bounds, next_period, partition_name, period_start
+
+        start = period_start(datetime(2025, 12, 17, 9, 30), 'month')
+        assert (start, next_period(start, 'month')) == (datetime(2025, 12, 1), datetime(2026, 1, 1))
+        name = partition_name('conversation_logs', start, 'month')
+        assert name == 'conversation_logs_p202512'
+        assert _parse_bounds('conversation_logs', name) == (datetime(2025, 12, 1), datetime(2026, 1, 1))
+        day = period_start(datetime(2026, 2, 28, 23, 59), 'day')
+        assert _parse_bounds('analytics_events', partition_name('analytics_events', day, 'day')) == (
+            datetime(2026, 2, 28), datetime(2026, 3, 1))
+        assert _parse_bounds('analytics_events', 'analytics_events_default') is None
+
+    def test_purge_falls_back_to_delete_on_sqlite(self, tmp_path):
+        import migrations
+        from partitions import is_partitioned, maintain_partitions, purge_before
+        from sqlalchemy import create_engine
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'purge.db'}")
+        try:
+            migrations.migrate(engine)
+            now = datetime.utcnow()
+            with engine.begin() as conn:
+                for days in (120, 1):
+                    conn.execute(text("INSERT INTO analytics_events (event_type, timestamp) VALUES ('x', :ts)"),
+                                 {'ts': now - timedelta(days=days)})
+            assert maintain_partitions(engine) == {}
+            with engine.begin() as conn:
+                assert not is_partitioned(conn, 'analytics_events')
+                assert purge_before(conn, 'analytics_events', now - timedelta(days=90)) == (1, [])
+                assert conn.execute(text('SELECT COUNT(*) FROM analytics_events')).scalar() == 1
+        finally:
+            engine.dispose()
+
+
+class TestRetention:
+    """Test the chunked, resumable retention purge engine"""
+
+    @pytest.fixture
+    def engine(self, tmp_path):
+        import migrations
+        from sqlalchemy import create_engine
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'retention.db'}")
+        migrations.migrate(engine)
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO analytics_events (event_type, timestamp) VALUES ('x', :ts)"),
+                         [{'ts': now - timedelta(days=100 + i)} for i in range(25)]
+                         + [{'ts': now - timedelta(days=1)} for _ in range(5)])
+        yield engine
+        engine.dispose()
+
+    def _tasks(self):
+        from retention import PurgeTask
+
+        return [PurgeTask('analytics_events', 'analytics_events', 'timestamp',
+                          datetime.utcnow() - timedelta(days=90))]
+
+    def _remaining(self, engine):
+        with engine.connect() as conn:
+            return conn.execute(text('SELECT COUNT(*) FROM analytics_events')).scalar()
+
+    def test_purge_deletes_in_batches(self, engine):
+        from retention import PurgeEngine, get_run, throughput
+
+        run_id, started = PurgeEngine(engine, batch_size=10, sleep_ms=0).start(self._tasks(), background=False)
+        assert started
+        run = get_run(engine, run_id)
+        assert run['status'] == 'completed'
+        assert run['tasks'][0]['deleted'] == 25
+        assert run['tasks'][0]['batches'] == 3
+        assert throughput(run)['analytics_events'] is not None
+        assert self._remaining(engine) == 5
+
+    def test_expired_sessions_still_referenced_are_kept(self, engine):
+        from retention import PurgeEngine, get_run, retention_tasks
+
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO user_sessions (id, last_active) VALUES "
+                              "('old-with-mood', '2020-01-01'), ('old-idle', '2020-01-01')"))
+            conn.execute(text("INSERT INTO mood_entries (session_id, mood_level) VALUES ('old-with-mood', 3)"))
+        tasks = [task for task in retention_tasks({}) if task.key == 'sessions']
+        run_id, _ = PurgeEngine(engine, sleep_ms=0).start(tasks, background=False)
+        assert get_run(engine, run_id)['tasks'][0]['deleted'] == 1
+        with engine.connect() as conn:
+            assert conn.execute(text('SELECT id FROM user_sessions')).scalars().all() == ['old-with-mood']
+
+    def test_interrupted_run_resumes_from_checkpoint(self, engine):
+        from retention import PurgeEngine, PurgeTask, get_run
+
+        purge = PurgeEngine(engine, batch_size=10, sleep_ms=1)
+
+        def killed(_):
+            raise SystemExit('worker killed')
+
+        purge._sleep = killed
+        with pytest.raises(SystemExit):
+            purge.start(self._tasks(), background=False)
+        run = get_run(engine, 1)
+        assert run['status'] == 'running'
+        assert run['tasks'][0]['deleted'] == 10
+        assert self._remaining(engine) == 20
+
+        # The next start finishes the orphaned run, then runs its own tasks
+        tasks = [PurgeTask('analytics_events', 'analytics_events', 'timestamp',
+                           datetime.utcnow() + timedelta(days=1))]
+        run_id, started = PurgeEngine(engine, batch_size=10, sleep_ms=0).start(tasks, background=False)
+        assert (run_id, started) == (2, True)
+        run = get_run(engine, 1)
+        assert run['status'] == 'completed'
+        assert run['tasks'][0]['deleted'] == 25
+        run = get_run(engine, 2)
+        assert run['status'] == 'completed'
+        assert run['tasks'][0]['deleted'] == 5
+        assert self._remaining(engine) == 0
+
+    def test_one_run_at_a_time(self, engine):
+        import threading
+        from retention import PurgeEngine
+
+        release = threading.Event()
+        first = PurgeEngine(engine, batch_size=10, sleep_ms=1)
+        first._sleep = lambda _: release.wait(5)
+        run_id, started = first.start(self._tasks())
+        assert started
+        try:
+            assert PurgeEngine(engine).start(self._tasks()) == (run_id, False)
+        finally:
+            release.set()
+            first.thread.join(5)
+        assert self._remaining(engine) == 5
+
+
+class TestReplicaRouting:
+    """Test read-replica routing for read-only endpoints"""
+
+    @pytest.fixture
+    def replica(self, app, tmp_path):
+        from db_routing import MemoryStickyStore, ReplicaPool, register_replica_pool, set_sticky_store
+
+        pool = ReplicaPool([f"sqlite:///{tmp_path / 'replica.db'}"], max_lag=5)
+        pool._measure = lambda index: 0.0
+        with pool.engines[0].begin() as conn:
+            conn.execute(text('CREATE TABLE mood_entries (id INTEGER PRIMARY KEY, session_id TEXT, '
+                              'mood_level INTEGER, note TEXT, timestamp TIMESTAMP)'))
+            conn.execute(text("INSERT INTO mood_entries (session_id, mood_level, note, timestamp) "
+                              "VALUES ('replica-session', 3, 'from replica', NULL)"))
+        set_sticky_store(MemoryStickyStore())
+        register_replica_pool(app, pool)
+        yield pool
+        set_sticky_store(None)
+        pool.dispose()
+
+    def _notes(self, client, session_id='replica-session'):
+        response = client.get('/api/mood_history', headers={'X-Session-ID': session_id})
+        assert response.status_code == 200
+        return [entry['note'] for entry in json.loads(response.data)]
+
+    def test_read_only_endpoint_uses_replica(self, client, replica):
+        assert self._notes(client) == ['from replica']
+        assert replica.reads == [1]
+
+    def test_lagging_replica_falls_back_to_primary(self, client, replica):
+        replica._measure = lambda index: 30.0
+        assert self._notes(client) == []
+        assert replica.fallbacks == 1
+
+    def test_session_reads_its_writes_from_primary(self, client, replica):
+        from db_routing import get_sticky_store
+
+        get_sticky_store().mark('replica-session', 10)
+        assert self._notes(client) == []
+        assert self._notes(client, 'other-session') == []
+        assert replica.reads == [1]
+
+    def test_writes_mark_session_sticky(self, client, replica):
+        from db_routing import get_sticky_store
+
+        client.post('/api/mood_entry', json={'mood_level': 4}, headers={'X-Session-ID': 'writer-session'})
+        assert get_sticky_store().is_sticky('writer-session')
+        assert not get_sticky_store().is_sticky('replica-session')
+
+
+class TestConnectionPool:
+    """Test connection-pool sizing and instrumentation"""
+
+    def test_auto_sizing_splits_budget_across_workers(self):
+        from db_pool import pool_sizing
+
+        # One request thread plus the log writer and a purge run
+        assert pool_sizing('auto', workers=4, threads=1, budget=20, reserve=4) == {
+            'pool_size': 3, 'max_overflow': 1}
+        # More threads than the worker's share: the share caps the pool
+        assert pool_sizing('auto', workers=4, threads=8, budget=23, reserve=3) == {
+            'pool_size': 5, 'max_overflow': 0}
+        assert pool_sizing('auto', workers=50, threads=1, budget=20, reserve=3) == {
+            'pool_size': 1, 'max_overflow': 0}
+
+    def test_asgi_sizing_counts_the_executor_threads(self, monkeypatch):
+        from db_pool import pool_sizing, request_threads
+
+        monkeypatch.setenv('GUNICORN_THREADS', '4')
+        monkeypatch.delenv('AI_HEDGING_ENABLED', raising=False)
+        assert request_threads() == 4
+        monkeypatch.setenv('SERVER_MODE', 'asgi')
+        monkeypatch.setenv('ASGI_WSGI_THREADS', '16')
+        executor = min(32, (os.cpu_count() or 1) + 4)
+        assert request_threads() == 16 + executor
+        monkeypatch.setenv('AI_HEDGING_ENABLED', 'true')
+        monkeypatch.setenv('AI_HEDGE_MAX_THREADS', '8')
+        assert request_threads() == 24 + executor
+        assert pool_sizing('auto', workers=1, budget=200, reserve=0)['pool_size'] == 24 + executor + 2
+
+    def test_checkouts_waits_and_timeouts_are_counted(self, tmp_path):
+        from flask import Flask
+        from sqlalchemy import create_engine
+        from sqlalchemy.exc import TimeoutError as PoolTimeout
+        from db_pool import InstrumentedQueuePool, instrument_engine, metrics_lines
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.05)
+        app = Flask(__name__)
+        metrics = instrument_engine(app, engine, 'primary')
+        with engine.connect():
+            with pytest.raises(PoolTimeout):
+                engine.connect()
+            assert metrics.snapshot()['checked_out'] == 1
+        snap = metrics.snapshot()
+        assert (snap['checkouts'], snap['connects'], snap['timeouts']) == (1, 1, 1)
+        assert snap['checked_out'] == 0 and snap['wait_count'] == 2
+        assert snap['wait_sum'] >= 0.05
+
+        lines = metrics_lines(app.extensions['db_pool_metrics'])
+        assert 'app_db_pool_timeouts_total{pool="primary"} 1' in lines
+        assert 'app_db_pool_wait_seconds_count{pool="primary"} 2' in lines
+        engine.dispose()
+
+    def test_metrics_endpoint_exports_pool(self, client):
+        client.get('/api/health')
+        metrics = client.get('/api/metrics').data.decode('utf-8')
+        assert 'app_db_pool_checkouts_total{pool="primary"}' in metrics
+        assert 'app_db_pool_wait_seconds_bucket{pool="primary",le="+Inf"}' in metrics
+
+
+class TestUnitOfWork:
+    """Test the request-scoped unit of work (one commit per write request)"""
+
+    @pytest.fixture(autouse=True)
+    def touch_cache(self):
+        import session_service
+
+        cache = session_service.MemoryTouchCache()
+        session_service.set_touch_cache(cache)
+        yield cache
+        session_service.set_touch_cache(None)
+
+    @pytest.fixture
+    def commits(self, app):
+        from sqlalchemy import event
+
+        counted = []
+        listener = lambda conn: counted.append(1)
+        event.listen(db.engine, 'commit', listener)
+        yield counted
+        event.remove(db.engine, 'commit', listener)
+
+    def test_self_assessment_commits_once(self, client, commits):
+        response = client.post('/api/self_assessment', headers={'X-Session-ID': 'uow-session'},
+                               json={'mood': 'good', 'energy': 'high', 'sleep': 'ok', 'stress': 'low'})
+        assert response.status_code == 201
+        assert len(commits) == 1
+        assert db.session.query(SelfAssessmentEntry).filter_by(session_id='uow-session').count() == 1
+        assert db.session.execute(text("SELECT COUNT(*) FROM sessions WHERE id = 'uow-session'")).scalar() == 1
+
+    def test_server_error_rolls_back_and_releases_session_touch(self, app, client, touch_cache):
+        from session_service import ensure_session
+        from unit_of_work import unit_of_work
+
+        @app.route('/test/uow-failure', methods=['POST'])
+        @unit_of_work
+        def uow_failure():
+            ensure_session(db.session, 'uow-failed')
+            return 'failed', 500
+
+        assert client.post('/test/uow-failure').status_code == 500
+        assert db.session.execute(text("SELECT COUNT(*) FROM sessions WHERE id = 'uow-failed'")).scalar() == 0
+        # The next request must write the session again
+        assert touch_cache.claim('uow-failed', 60)
+
+
+class TestLegacyViews:
+    """Test the legacy table backfill and the compatibility views"""
+
+    @pytest.fixture
+    def engine(self, tmp_path):
+        from sqlalchemy import create_engine
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+        yield engine
+        engine.dispose()
+
+    def test_backfill_then_views_serve_legacy_rows(self, engine):
+        import legacy_views
+        import migrations
+        from sqlalchemy import inspect
+
+        migrations.migrate(engine, target=6)
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO sessions (id, created_at, last_activity) VALUES "
+                              "('legacy-1', '2025-01-01 10:00:00', '2025-01-02 10:00:00')"))
+            conn.execute(text("INSERT INTO self_assessments (session_id, mood, sleep, notes, timestamp) "
+                              "VALUES ('legacy-1', 4, 3, 'ok', '2025-01-01 11:00:00')"))
+            conn.execute(text("INSERT INTO chat_messages (session_id, content, is_user, timestamp) VALUES "
+                              "('legacy-1', 'hi', 1, '2025-01-01 12:00:00'), "
+                              "('legacy-1', 'hello', 0, '2025-01-01 12:00:01')"))
+        assert migrations.migrate(engine, target=7) == [7]
+        with engine.begin() as conn:
+            # Re-running the backfill copies nothing twice
+            assert legacy_views.backfill(conn, 'sqlite', batch_size=1) == {
+                'sessions': 0, 'self_assessments': 0, 'chat_messages': 0}
+        assert migrations.migrate(engine) == [8, 9]
+
+        assert {'sessions', 'self_assessments', 'chat_messages'} <= set(inspect(engine).get_view_names())
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT last_activity FROM sessions WHERE id = 'legacy-1'")).scalar() \
+                == '2025-01-02 10:00:00'
+            row = conn.execute(text('SELECT mood, energy, sleep, notes FROM self_assessments')).one()
+            assert tuple(row) == (4, None, 3, 'ok')
+            messages = conn.execute(text(
+                "SELECT content, is_user FROM chat_messages WHERE session_id = 'legacy-1' "
+                'ORDER BY timestamp, id')).all()
+            assert [tuple(m) for m in messages] == [('hi', 1), ('hello', 0)]
+            assert conn.execute(text('SELECT COUNT(*) FROM conversation_logs')).scalar() == 2
+
+    def test_surviving_legacy_table_fails_the_migration(self, engine):
+        import migrations
+
+        migrations.migrate(engine, target=7)
+        with engine.begin() as conn:
+            # Without its base table, chat_messages cannot be swapped for a view
+            conn.execute(text('DROP TABLE conversation_logs'))
+        with pytest.raises(RuntimeError, match='chat_messages'):
+            migrations.migrate(engine)
+        assert migrations.current_version(engine) == 7
+
+    def test_chat_history_reads_conversation_logs(self, client):
+        from models import ConversationLog, UserSession
+
+        db.session.add(UserSession(id='legacy-view-session'))
+        db.session.commit()
+        db.session.add(ConversationLog(session_id='legacy-view-session', user_message='hi',
+                                       ai_response='hello there', risk_level='low'))
+        db.session.commit()
+        response = client.get('/api/chat_history', headers={'X-Session-ID': 'legacy-view-session'})
+        assert response.status_code == 200
+        assert [(m['content'], m['is_user']) for m in response.get_json()] == [
+            ('hi', True), ('hello there', False)]
+
+
 class TestMoodTracking:
     """Test mood tracking functionality"""
     
@@ -559,10 +2190,29 @@ class TestAdminEndpoints:
             headers={'X-Admin-Token': 'test-admin-token'}
         )
         
-        assert response.status_code == 200
+        assert response.status_code == 202
         data = json.loads(response.data)
         assert data['success'] is True
-        assert 'purged' in data
+        
+        # The purge runs in the background; poll its status until it finishes
+        for _ in range(100):
+            status = client.get(data['status_url'], headers={'X-Admin-Token': 'test-admin-token'})
+            assert status.status_code == 200
+            run = json.loads(status.data)
+            if run['status'] != 'running':
+                break
+            time.sleep(0.05)
+        assert run['status'] in ('completed', 'failed')
+        assert {task['key'] for task in run['tasks']} >= {'messages', 'conversation_logs', 'sessions'}
+        # Crisis detections are kept, as they always were
+        assert 'crisis_detections' not in {task['key'] for task in run['tasks']}
+        assert 'rows_per_second' in run
+        
+    def test_admin_purge_status_requires_token(self, app, client):
+        app.config['ADMIN_API_TOKEN'] = 'test-admin-token'
+        assert client.get('/api/admin/purge/1').status_code == 401
+        response = client.get('/api/admin/purge/999999', headers={'X-Admin-Token': 'test-admin-token'})
+        assert response.status_code == 404
         
     def test_retention_config(self, app, client):
         """Test retention configuration endpoint"""
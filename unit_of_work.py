@@ -0,0 +1,88 @@
+"""
+Request-scoped unit of work: one transaction, one commit per request.
+
+Views marked @unit_of_work do not commit. The session upsert and the main
+write call commit_or_defer(), which only flushes (so errors still surface
+inside the view), and an after_request hook commits once. A response with
+status 500 or above rolls the transaction back instead; so does a failed
+commit, which turns the response into a 500.
+
+Side effects that assume a commit (the session touch cache) register an
+on_rollback() callback to undo themselves when the transaction is dropped.
+"""
+
+import logging
+from functools import wraps
+
+from flask import g, has_request_context
+
+logger = logging.getLogger(__name__)
+
+
+def in_unit_of_work() -> bool:
+    return has_request_context() and bool(g.get("_uow"))
+
+
+def commit_or_defer(db_session):
+    """Commit, or inside a unit of work flush and leave the commit to the
+    end of the request."""
+    if in_unit_of_work():
+        db_session.flush()
+    else:
+        db_session.commit()
+
+
+def on_rollback(callback):
+    """Run callback if this request's unit of work is rolled back."""
+    if in_unit_of_work():
+        g.setdefault("_uow_rollback", []).append(callback)
+
+
+def unit_of_work(view):
+    """Collect the view's writes into one transaction committed after it returns."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g._uow = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def _rollback(db_session):
+    try:
+        db_session.rollback()
+    finally:
+        for callback in g.pop("_uow_rollback", []):
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Unit of work rollback hook failed: {e}")
+
+
+def init_unit_of_work(app, db):
+    """Commit (or roll back) each @unit_of_work request in after_request."""
+
+    @app.before_request
+    def _reset_unit_of_work():
+        # g outlives the request when an app context was already pushed
+        g.pop("_uow", None)
+        g.pop("_uow_rollback", None)
+
+    @app.after_request
+    def _finish_unit_of_work(response):
+        if not g.pop("_uow", False):
+            return response
+        if response.status_code >= 500:
+            _rollback(db.session)
+            return response
+        try:
+            db.session.commit()
+            g.pop("_uow_rollback", None)
+        except Exception as e:
+            app.logger.error(f"Unit of work commit failed: {e}")
+            _rollback(db.session)
+            response.set_data('{"error": "Failed to save changes"}')
+            response.mimetype = "application/json"
+            response.status_code = 500
+        return response